@@ -3,19 +3,22 @@ import pty
 import fcntl
 import struct
 import termios
-import select
 import subprocess
 import uuid
 import threading
 import signal
 import time
 import copy
+import gzip
+import json
 import logging
+import tempfile
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor, wait
-from flask import Flask, send_from_directory, request, jsonify, session
+from flask import Flask, Response, send_file, send_from_directory, request, jsonify, session
 from flask_socketio import SocketIO, emit, join_room, leave_room, disconnect
+from werkzeug.test import EnvironBuilder, run_wsgi_app
 from werkzeug.utils import secure_filename
-from collections import deque
 
 import tomllib
 import requests
@@ -23,6 +26,26 @@ import requests
 import app_state
 from utils import ensure_https, get_gateway_host
 from pat_rotator import PATRotator
+from pty_mux import PTYMultiplexer
+from output_ring import OutputRing
+from output_sender import OutputSender
+from terminal_screen import TerminalScreen
+from terminal_session import Session, SessionRegistry, RUNNING, DRAINING, EXITED
+from session_recorder import Recording, RecordingWriter, prune_recordings, recording_path
+from idle_deadlines import DeadlineHeap
+from session_reaper import SessionReaper
+from shell_pool import ShellPool
+from proc_tree import ProcessInspector
+from static_assets import AssetManifest
+from session_resources import (
+    CpuCgroups, ResourceMonitor, ThrottlePolicy, can_restore_priority, limit_memory,
+)
+from pty_host import PtyHostClient
+from worker_shards import (
+    ShardRouter, claim_shard, index_range, new_session_id, parse_session_id,
+    shard_of, shard_of_index,
+)
+import ws_frames
 
 # Sanitize DATABRICKS_TOKEN early — the platform sometimes injects trailing
 # newlines / whitespace which causes auth failures.  Cleaning it here prevents
@@ -41,9 +64,56 @@ except Exception:
 
 # Session timeout configuration
 SESSION_TIMEOUT_SECONDS = 86400      # No poll for 24 hours = dead session
-CLEANUP_INTERVAL_SECONDS = 900       # Check for stale sessions every 15 min
+TIMEOUT_WARNING_FRACTION = 0.8       # Warn clients once idle for this share of the timeout
 GRACEFUL_SHUTDOWN_WAIT = 3          # Seconds to wait after SIGHUP before SIGKILL
 MAX_CONCURRENT_SESSIONS = int(os.environ.get("MAX_CONCURRENT_SESSIONS", "5"))
+OUTPUT_BUFFER_BYTES = 1024 * 1024    # Per-session output ring (fixed memory footprint)
+FLOW_HIGH_WATERMARK = 512 * 1024     # Stop reading a PTY once this much output is unacknowledged
+FLOW_LOW_WATERMARK = 128 * 1024      # ...and resume once acks bring it back under this
+FLOW_ACK_TIMEOUT = 10                # Seconds paused without an ack before flow control is dropped
+MAX_SCREEN_RESIZES = 64              # Resizes kept for a screen model nobody has snapshotted yet
+GZIP_MIN_BYTES = 1024                # JSON responses at least this large are gzipped if the client accepts it
+LONG_POLL_MAX_WAIT = 25              # Max seconds /api/output-batch holds a poll open (under proxy timeouts)
+STREAM_KEEPALIVE = 15                # Seconds of silence before /api/stream sends a keepalive comment
+STREAM_MAX_DURATION = 300            # Seconds before /api/stream ends (the browser reconnects, resuming)
+MAX_STREAM_SESSIONS = 32
+# Requests held open waiting for output — /api/stream and long polls — at
+# once per worker. Keep it well under gunicorn's threads (gunicorn.conf.py)
+# so input, resizes and WebSockets always find one free
+MAX_HELD_REQUESTS = int(os.environ.get("MAX_HELD_REQUESTS", "8"))
+# Record each session's output to ~/.coda/recordings (see session_recorder);
+# a "record" flag on POST /api/session overrides this per session
+SESSION_RECORDING = os.environ.get("SESSION_RECORDING", "false").strip().lower() in ("true", "1", "yes")
+# Shells kept spawned and past their first prompt, ready for new tabs (0 disables)
+WARM_SHELL_POOL_SIZE = int(os.environ.get("WARM_SHELL_POOL_SIZE", "1"))
+# Unix socket of the PTY host daemon that owns the shells (see pty_host), so
+# they survive worker restarts; started on demand. Empty: shells are children
+# of this worker and die with it
+PTY_HOST_SOCKET = os.environ.get("PTY_HOST_SOCKET", "").strip()
+# Seconds between samples of each session's CPU and memory use (0 disables)
+SESSION_SAMPLE_INTERVAL = float(os.environ.get("SESSION_SAMPLE_INTERVAL", "5"))
+# Lower the CPU and I/O priority of sessions nobody is viewing — no WebSocket
+# viewer, and no HTTP read or keystrokes for BACKGROUND_AFTER_SECONDS — so
+# the panes on screen stay snappy next to unattended agents
+BACKGROUND_THROTTLE = os.environ.get("BACKGROUND_THROTTLE", "false").strip().lower() in ("true", "1", "yes")
+BACKGROUND_AFTER_SECONDS = 60
+# cpu.max quota for background sessions, in percent of one core, where cgroup v2 is writable (0: none)
+BACKGROUND_CPU_PERCENT = int(os.environ.get("BACKGROUND_CPU_PERCENT", "100"))
+# Opt-in for the quota above: worker 0 moves every process in the app's cgroup
+# into a "server" child so sessions can get cgroups of their own
+BACKGROUND_CPU_CGROUP = os.environ.get("BACKGROUND_CPU_CGROUP", "false").strip().lower() in ("true", "1", "yes")
+# Address-space cap (RLIMIT_AS) for each session's processes (0: none).
+# Node reserves a lot of virtual memory; leave room for it
+SESSION_MEMORY_LIMIT_MB = int(os.environ.get("SESSION_MEMORY_LIMIT_MB", "0"))
+# Gunicorn workers (gunicorn.conf.py reads the same variable). Above 1, each
+# worker owns a shard of the sessions and requests for the others are handed
+# to their owner (see worker_shards)
+WEB_WORKERS = max(1, int(os.environ.get("WEB_WORKERS", "1")))
+SHARD_SOCKET_DIR = os.path.join(tempfile.gettempdir(), f"coda-shards-{os.getuid()}")
+SHARD_FANOUT_TIMEOUT = 5             # Seconds to wait for other workers when merging their sessions
+FORWARDED_HEADER = "X-Coda-Forwarded"  # Marks a request another worker handed to its owner
+ASSET_MAX_AGE = 365 * 86400          # Cache lifetime of fingerprinted /assets/ responses (immutable)
+STARTUP_SAMPLES = 100                # Browser startup timings kept for the /health median
 
 # Logging setup
 logging.basicConfig(level=logging.INFO)
@@ -52,21 +122,30 @@ logger = logging.getLogger(__name__)
 # PAT auto-rotation — initialized after sessions dict is defined (see below)
 
 app = Flask(__name__, static_folder='static', static_url_path='/static')
+
+# Fingerprinted, precompressed copies of static/ under /assets/ (see static_assets);
+# /static/ keeps serving the plain files
+static_assets = AssetManifest(app.static_folder)
 app.secret_key = os.urandom(24)
 app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024  # 32 MB — aligned with Claude Code's 30 MB file limit
 
-# WebSocket support via Flask-SocketIO (simple-websocket transport, threading mode)
-socketio = SocketIO(app, async_mode='threading', cors_allowed_origins=[], logger=False, engineio_logger=False)
+# WebSocket support via Flask-SocketIO (simple-websocket transport, threading mode).
+# Engine.IO long-polling needs every request of a connection to reach the same
+# worker, which nothing guarantees with several workers; a WebSocket stays on
+# the worker that accepted it (clients fall back to HTTP polling instead)
+socketio = SocketIO(app, async_mode='threading', cors_allowed_origins=[], logger=False, engineio_logger=False,
+                    transports=['websocket'] if WEB_WORKERS > 1 else None)
 
-# Store sessions: {session_id: {"master_fd": fd, "pid": pid, "output_buffer": deque, "lock": Lock, ...}}
-# sessions_lock guards dict-level ops (add/remove/iterate); each session["lock"] guards per-session state
-sessions = {}
-sessions_lock = threading.Lock()
+# Live sessions: session_id -> Session (terminal_session). Lookups take no
+# lock; sessions_lock serializes adding/removing; each session.lock guards
+# per-session state
+sessions = SessionRegistry()
+sessions_lock = sessions.lock
 
 # PAT auto-rotation (short-lived tokens, background refresh)
 # Only rotates while active sessions exist — stops when all sessions are reaped
 pat_rotator = PATRotator(
-    session_count_fn=lambda: len(sessions),
+    session_count_fn=lambda: len(sessions) + _remote_session_count(),
 )
 
 # SIGTERM graceful shutdown: notify clients before gunicorn stops the worker
@@ -88,6 +167,8 @@ def handle_sigterm(signum, frame):
         socketio.emit('shutting_down', {})
     except Exception:
         pass
+    # Answer held long polls now; off the signal handler, which mustn't take session locks
+    threading.Thread(target=_wake_all_pollers, daemon=True).start()
 
 # NOTE: Do not register SIGTERM handler at module level.
 # It is installed in initialize_app() for gunicorn only.
@@ -398,6 +479,9 @@ def run_setup():
         setup_state["status"] = "error" if any_error else "complete"
         setup_state["completed_at"] = time.time()
 
+    # Shells warmed during setup predate the CLIs it installed — start fresh
+    shell_pool.recycle()
+
 
 def get_token_owner():
     """Get the owner email. Priority: Apps API (app.creator) > PAT (current_user.me).
@@ -528,22 +612,77 @@ def handle_ws_connect():
 
 @socketio.on('join_session')
 def handle_join_session(data):
-    """Client joins a session room to receive output (AC-4)."""
+    """Client joins a session room to receive output (AC-4).
+
+    With ``offset``, output the client missed since that offset is replayed
+    to it first, so switching HTTP→WS (or reconnecting) loses nothing.
+    With ``binary``, output arrives as ``terminal_output_bin`` frames of raw
+    bytes (see ws_frames) instead of JSON ``terminal_output`` events; adding
+    ``compress`` lets large frames arrive deflated.
+    """
     session_id = data.get('session_id')
     if not session_id:
         return {'status': 'error', 'message': 'session_id required'}
 
+    shard = _owner_shard(session_id)
+    if shard is not None:
+        # The owner pushes the replay and live output to us over the shard link
+        try:
+            reply, _ = shard_router.request(shard, {
+                "op": "join", "session_id": session_id, "client": request.sid,
+                "offset": data.get('offset'), "binary": bool(data.get('binary')),
+                "compress": bool(data.get('compress')),
+            })
+        except OSError as e:
+            return {'status': 'error', 'message': f'Session worker unavailable: {e}'}
+        if reply.get('status') == 'ok':
+            logger.info(f"WebSocket client joined session room {session_id} on worker {shard}")
+        return reply
+
     session = _get_session(session_id)
     if not session:
         return {'status': 'error', 'message': 'Session not found'}
 
-    with session["lock"]:
-        session["last_poll_time"] = time.time()
-        session["output_buffer"].clear()  # Prevent duplicate output on WS↔HTTP switch
+    try:
+        offset = _parse_offset(data.get('offset'))
+    except ValueError as e:
+        return {'status': 'error', 'message': str(e)}
+
+    index = session.index
+    binary = bool(data.get('binary')) and index is not None
+    compress = binary and bool(data.get('compress'))
+    fmt = "deflate" if compress else "bin" if binary else "text"
+
+    with session.send_lock, session.lock:
+        session.last_poll_time = time.time()
+        # Skip the legacy HTTP cursor past what WS will deliver — no duplicates on WS↔HTTP switch
+        session.http_cursor = session.output_buffer.end
+        # Join and replay under the send lock: live output is emitted under the
+        # same lock, so live room output always follows the replay seamlessly.
+        join_room(session_id)
+        join_room(_output_room(session_id, fmt))
+        live_offset = session.emit_cursor
+        replay = _replay_output(session, session_id, offset, live_offset, binary, compress)
+        if replay is not None:
+            emit(*replay)
 
-    join_room(session_id)
     logger.info(f"WebSocket client joined session room {session_id}")
-    return {'status': 'ok'}
+    return {'status': 'ok', 'next_offset': live_offset, 'index': index,
+            'binary': binary, 'compress': compress}
+
+
+def _replay_output(session, session_id, offset, live_offset, binary, compress):
+    """The ``(event, data)`` catching a joining client up from *offset* to
+    *live_offset*, or None if it is up to date. Caller holds session.lock."""
+    if offset is None:
+        return None
+    start, end, replay = session.output_buffer.read(offset, live_offset)
+    if not replay and start <= offset:
+        return None
+    if binary:
+        return 'terminal_output_bin', ws_frames.pack_output(session.index, start, replay,
+                                                            gap=start > offset, compress=compress)
+    return 'terminal_output', {'session_id': session_id, **_output_fields(offset, start, end, replay)}
 
 
 @socketio.on('leave_session')
@@ -552,27 +691,120 @@ def handle_leave_session(data):
     session_id = data.get('session_id')
     if session_id:
         leave_room(session_id)
+        for fmt in OUTPUT_FORMATS:
+            leave_room(_output_room(session_id, fmt))
         logger.info(f"WebSocket client left session room {session_id}")
+        shard = _owner_shard(session_id)
+        if shard is not None:
+            _forward_event(shard, {"op": "leave", "session_id": session_id, "client": request.sid})
+        else:
+            _leave_session(session_id, request.sid)
 
 
-@socketio.on('terminal_input')
-def handle_terminal_input(data):
-    """Receive keystrokes from client, write to PTY (AC-6)."""
+def _leave_session(session_id, subscriber):
+    """A viewer left: don't leave the PTY paused waiting for its acks."""
+    session = _get_session(session_id)
+    if session:
+        with session.lock:
+            resume = _drop_flow_subscriber(session, subscriber)
+        if resume:
+            pty_mux.resume(session_id)
+
+
+@socketio.on('output_ack')
+def handle_output_ack(data):
+    """Client has rendered a session's output up to ``offset``.
+
+    An ack subscribes the client to the session's flow control: its PTY is
+    no longer read while the slowest subscriber is more than
+    FLOW_HIGH_WATERMARK bytes behind, so a runaway producer blocks on the
+    kernel PTY buffer instead of flooding the browser. Clients that never
+    ack are unaffected. With ``hidden`` (the tab went to the background)
+    the client unsubscribes until its next ack, so a tab nobody looks at
+    never holds the agent back.
+    """
     session_id = data.get('session_id')
-    input_data = data.get('input', '')
+    hidden = bool(data.get('hidden'))
+    shard = _owner_shard(session_id)
+    if shard is not None:
+        _forward_event(shard, {"op": "ack", "session_id": session_id, "client": request.sid,
+                               "offset": data.get('offset'), "hidden": hidden})
+        return
+    _receive_ack(session_id, request.sid, data.get('offset'), hidden)
+
 
+def _receive_ack(session_id, subscriber, offset, hidden=False):
     session = _get_session(session_id)
     if not session:
         return
+    if hidden:
+        _leave_session(session_id, subscriber)
+        return
+    try:
+        offset = _parse_offset(offset)
+    except ValueError:
+        return
+    if offset is None:
+        return
+
+    with session.lock:
+        resume = _ack_output(session, subscriber, offset, subscribe=True)
+    if resume:
+        pty_mux.resume(session_id)
+
+
+@socketio.on('terminal_input')
+def handle_terminal_input(data):
+    """Receive keystrokes from client, write to PTY (AC-6).
 
-    with session["lock"]:
-        session["last_poll_time"] = time.time()
-    fd = session["master_fd"]
+    Accepts a JSON ``{session_id, input}`` object or a binary input frame
+    (ws_frames) carrying the session index and raw UTF-8 bytes.
+    """
+    if isinstance(data, (bytes, bytearray)):
+        try:
+            index, payload = ws_frames.unpack_input(data)
+        except ValueError:
+            return
+        if shard_router is not None:
+            shard = shard_of_index(index, shard_router.count)
+            if shard != shard_router.shard:
+                _forward_event(shard, {"op": "input", "index": index, "client": request.sid}, payload)
+                return
+        session = sessions.by_index(index)
+        if not session:
+            return
+        session_id = session.session_id
+    else:
+        session_id = data.get('session_id')
+        payload = data.get('input', '').encode()
+        shard = _owner_shard(session_id)
+        if shard is not None:
+            _forward_event(shard, {"op": "input", "session_id": session_id, "client": request.sid}, payload)
+            return
+        session = _get_session(session_id)
+        if not session:
+            return
+
+    rejected = _receive_input(session_id, session, payload)
+    if rejected is not None:
+        emit('input_rejected', rejected)
+
+
+def _receive_input(session_id, session, payload):
+    """Write keystrokes from a WebSocket client. Returns the ``input_rejected``
+    event data if the input queue is full, else None."""
+    with session.lock:
+        session.last_poll_time = time.time()
 
     try:
-        os.write(fd, input_data.encode())
+        queue = _write_input(session_id, session, payload)
     except OSError as e:
         logger.warning(f"WebSocket input write error for {session_id}: {e}")
+        return None
+    if queue is None:
+        return {'session_id': session_id, 'bytes': len(payload),
+                'queued': session.input_queue.queued}
+    return None
 
 
 @socketio.on('terminal_resize')
@@ -582,218 +814,647 @@ def handle_terminal_resize(data):
     cols = data.get('cols', 80)
     rows = data.get('rows', 24)
 
+    shard = _owner_shard(session_id)
+    if shard is not None:
+        _forward_event(shard, {"op": "resize", "session_id": session_id, "cols": cols, "rows": rows})
+        return
+    _receive_resize(session_id, cols, rows)
+
+
+def _receive_resize(session_id, cols, rows):
     session = _get_session(session_id)
     if not session:
         return
 
-    with session["lock"]:
-        session["last_poll_time"] = time.time()
-    fd = session["master_fd"]
+    with session.lock:
+        session.last_poll_time = time.time()
+    fd = session.master_fd
 
     try:
         winsize = struct.pack("HHHH", rows, cols, 0, 0)
         fcntl.ioctl(fd, termios.TIOCSWINSZ, winsize)
     except OSError as e:
         logger.warning(f"WebSocket resize error for {session_id}: {e}")
+        return
+    _resize_screen(session, cols, rows)
 
 
 @socketio.on('heartbeat')
 def handle_ws_heartbeat(data):
     """Periodic keepalive from WS client — prevents idle session reaping (AC-17)."""
     session_ids = data.get('session_ids', [])
+    remote = {}
+    for sid in session_ids:
+        shard = _owner_shard(sid)
+        if shard is not None:
+            remote.setdefault(shard, []).append(sid)
+    for shard, shard_ids in remote.items():
+        _forward_event(shard, {"op": "heartbeat", "session_ids": shard_ids})
+    _receive_heartbeat(session_ids)
+
+
+def _receive_heartbeat(session_ids):
     now = time.time()
     for sid in session_ids:
         session = _get_session(sid)
         if session:
-            with session["lock"]:
-                session["last_poll_time"] = now
+            with session.lock:
+                session.last_poll_time = now
 
 
 @socketio.on('disconnect')
 def handle_ws_disconnect():
     """Log WebSocket disconnections. Do NOT auto-close PTY — client may reconnect."""
     logger.info("WebSocket client disconnected")
+    for session_id, session in list(sessions.items()):
+        if request.sid in session.flow_acks:
+            _leave_session(session_id, request.sid)
 
 
 def _get_session(session_id):
-    """Get a session dict reference under the global lock. Returns None if not found."""
-    with sessions_lock:
-        return sessions.get(session_id)
+    """Look up a live session without locking. Returns None if not found."""
+    return sessions.get(session_id)
+
+
+# Wire formats for live output: JSON events, binary frames, binary frames
+# with large payloads deflated
+OUTPUT_FORMATS = ("text", "bin", "deflate")
+
+
+def _output_room(session_id, fmt):
+    """Socket.IO room receiving a session's output in one wire format.
+
+    The plain ``session_id`` room carries control events for every viewer;
+    output goes to a per-format room so each chunk is encoded only for the
+    formats someone is listening in.
+    """
+    return f"{session_id}:{fmt}"
+
+
+def _room_occupied(room):
+    return bool(socketio.server.manager.rooms.get('/', {}).get(room))
+
+
+def _parse_offset(value):
+    """Validate a client-supplied output offset. Returns None when absent."""
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError("offset must be a non-negative integer")
+    return value
+
+
+def _read_output(session, offset=None):
+    """Read a session's output since *offset* without consuming it.
+
+    Caller holds session.lock. Without an explicit offset the session's
+    legacy HTTP cursor is used and advanced (clients that predate offsets).
+    Returns (since, start, end, data).
+    """
+    since = session.http_cursor if offset is None else offset
+    start, end, data = session.output_buffer.read(since)
+    if offset is None:
+        session.http_cursor = end
+    return since, start, end, data
+
+
+def _output_fields(since, start, end, data):
+    """JSON fields shared by every output path.
+
+    ``offset``/``next_offset`` bound the returned bytes in the session's
+    output stream; the client sends ``next_offset`` back to continue.
+    ``gap`` is True when output between *since* and ``offset`` was evicted.
+    """
+    return {
+        "output": data.decode(errors="replace"),
+        "offset": start,
+        "next_offset": end,
+        "gap": start > since,
+    }
+
+
+def _wake_pollers(session):
+    """Release the long polls waiting on a session. Caller holds session.lock."""
+    for ready in session.output_waiters:
+        ready.set()
+
+
+def _wake_all_pollers():
+    for _, session in sessions.items():
+        with session.lock:
+            _wake_pollers(session)
+
+
+# Held long polls by client-chosen poll_id: a client's next poll releases its
+# previous one (e.g. abandoned when its tabs changed) instead of it holding a
+# request thread until LONG_POLL_MAX_WAIT
+_long_polls = {}
+_long_polls_lock = threading.Lock()
+# Slots for requests that hold a thread while waiting (MAX_HELD_REQUESTS).
+# Past that, streams are refused and long polls are answered at once
+held_requests = threading.BoundedSemaphore(MAX_HELD_REQUESTS)
+
+
+def _has_news(session, offset):
+    """Whether a poll from *offset* would return anything. Caller holds session.lock."""
+    since = session.http_cursor if offset is None else offset
+    return (since != session.output_buffer.end or session.timeout_warning
+            or not session.live or shutting_down)
+
+
+def _wait_for_output(resolved, offsets, timeout, poll_id=None):
+    """Block until one of *resolved* (session_id -> Session) has output past
+    its offset, exits or has a timeout warning — or *timeout* seconds pass.
+
+    One Event is registered with every session, so a single wait covers the
+    whole batch; read_pty_output sets it as soon as output lands.
+    """
+    ready = threading.Event()
+    if poll_id is not None:
+        _release_long_poll(poll_id, ready)
+    try:
+        for sid, session in resolved.items():
+            with session.lock:
+                session.output_waiters.add(ready)
+                if _has_news(session, offsets[sid]):
+                    ready.set()
+        ready.wait(timeout)
+    finally:
+        for session in resolved.values():
+            with session.lock:
+                session.output_waiters.discard(ready)
+        if poll_id is not None:
+            with _long_polls_lock:
+                if _long_polls.get(poll_id) is ready:
+                    del _long_polls[poll_id]
+
+
+def _release_long_poll(poll_id, successor=None):
+    """Answer the poll held under *poll_id*, if any, and register *successor*
+    (the Event of the poll replacing it) in its place."""
+    with _long_polls_lock:
+        if successor is None:
+            superseded = _long_polls.pop(poll_id, None)
+        else:
+            superseded = _long_polls.get(poll_id)
+            _long_polls[poll_id] = successor
+    if superseded is not None:
+        superseded.set()
+
+
+def _ack_output(session, subscriber, offset, subscribe=False):
+    """Record that *subscriber* has consumed output up to *offset*.
+
+    Caller holds session.lock. Without *subscribe* (HTTP pollers) the ack
+    only counts once some WebSocket client has opted the session into flow
+    control. Returns True if the paused PTY should now be resumed — the
+    caller does that after releasing the lock (the multiplexer takes its
+    own lock before session locks).
+    """
+    acks = session.flow_acks
+    if not (acks or subscribe):
+        return False
+    offset = min(offset, session.output_buffer.end)
+    previous = acks.get(subscriber)
+    if previous is not None:
+        offset = max(offset, previous[0])
+    acks[subscriber] = (offset, time.monotonic())
+    return _flow_may_resume(session)
+
+
+def _drop_flow_subscriber(session, subscriber):
+    """Stop holding the PTY back for *subscriber*. Caller holds session.lock.
+
+    Returns True if its PTY was paused and should be resumed.
+    """
+    session.flow_acks.pop(subscriber, None)
+    return _flow_may_resume(session)
+
+
+def _flow_lag(session):
+    """Bytes the slowest flow-control subscriber is behind, or None if the
+    session has none. Caller holds session.lock."""
+    acks = session.flow_acks
+    if not acks:
+        return None
+    return session.output_buffer.end - min(offset for offset, _ in acks.values())
+
+
+def _flow_may_resume(session):
+    """Unpause the session if its slowest subscriber has caught up (or none
+    is left). Caller holds session.lock. Returns True if the caller should
+    resume the PTY."""
+    if session.flow_paused_at is None:
+        return False
+    lag = _flow_lag(session)
+    if lag is not None and lag > FLOW_LOW_WATERMARK:
+        return False
+    session.flow_paused_at = None
+    return True
+
+
+def _expire_flow_subscribers(session, session_id, now):
+    """Drop subscribers that have not acked for FLOW_ACK_TIMEOUT while the
+    PTY was paused (tab closed, network gone). Caller holds session.lock.
+    Returns when the next remaining subscriber would expire, or None."""
+    paused_at = session.flow_paused_at
+    next_due = None
+    for subscriber, (_, acked_at) in list(session.flow_acks.items()):
+        due = max(acked_at, paused_at) + FLOW_ACK_TIMEOUT
+        if due <= now:
+            del session.flow_acks[subscriber]
+            logger.info(f"Session {session_id}: no output ack from {subscriber} for "
+                        f"{FLOW_ACK_TIMEOUT}s, no longer waiting for it")
+        elif next_due is None or due < next_due:
+            next_due = due
+    return next_due
 
 
 def read_pty_output(session_id, fd):
-    """Background thread to read PTY output into buffer and push via WebSocket."""
+    """Drain one readable event from a session's PTY into its buffer and push via WebSocket.
+
+    Runs on the PTY multiplexer thread. Returns False on EOF (process exited).
+    """
     session = _get_session(session_id)
     if not session:
-        return
-    pid = session["pid"]
-    session_lock = session["lock"]
+        return False
 
-    while True:
-        with sessions_lock:
-            if session_id not in sessions:
-                break
+    with session.lock:
+        # Buffer for HTTP polling fallback (AC-15) — read lands directly in the ring
+        ring = session.output_buffer
         try:
-            readable, _, errors = select.select([fd], [], [fd], 0.05)
-            if readable or errors:
-                output = os.read(fd, 65536)
-                if not output:
-                    # EOF — process exited
-                    break
-                decoded = output.decode(errors="replace")
-                with session_lock:
-                    # Buffer for HTTP polling fallback (AC-15)
-                    session["output_buffer"].append(decoded)
-                    session["last_poll_time"] = time.time()  # Keep session alive during WS output
-                # Push via WebSocket to the session room (AC-8)
-                try:
-                    socketio.emit('terminal_output',
-                                  {'session_id': session_id, 'output': decoded},
-                                  room=session_id)
-                except Exception:
-                    pass  # No WebSocket clients — HTTP polling handles it
-            else:
-                # select timed out — check if process is still alive
-                try:
-                    pid_result, _ = os.waitpid(pid, os.WNOHANG)
-                    if pid_result != 0:
-                        # Process exited
-                        break
-                except ChildProcessError:
-                    # Process already reaped
-                    break
-        except OSError:
-            break
+            nbytes = ring.fill_from(fd)
+        except BlockingIOError:
+            return True  # Spurious wakeup — the fd is non-blocking for input writes
+        if not nbytes:
+            return False  # EOF — process exited
+        cell = session.offset_cell
+        if cell is not None:
+            cell.value = ring.end  # Where pty_host picks up if this worker dies
+        recording = session.recording
+        if recording is not None:
+            recording_writer.notify(recording, ring, session.lock)  # Written off-loop
+        session.last_poll_time = time.time()  # Keep session alive during WS output
+        _wake_pollers(session)
+        # Batch bursts into fewer WS frames; echo after a pause goes out at once
+        now = time.monotonic()
+        flush_at = session.coalescer.add(nbytes, now)
+        if flush_at <= now:
+            _send_output(session_id, session)
+        # Backpressure: too far ahead of the slowest acking client — stop reading
+        # so the producer blocks on the full PTY buffer. Still on the multiplexer
+        # thread, so pausing here cannot race a resume from an ack.
+        lag = _flow_lag(session)
+        if lag is not None and lag > FLOW_HIGH_WATERMARK:
+            session.flow_paused_at = now
+            pty_mux.pause(session_id)
+            pty_mux.schedule(session_id, now + FLOW_ACK_TIMEOUT)
+    if flush_at > now:
+        pty_mux.schedule(session_id, flush_at)
+    return True
+
+
+def _write_input(session_id, session, data):
+    """Queue *data* for the session's PTY and write what it takes right away.
+
+    Never blocks: the rest is written by the I/O loop as the PTY drains (see
+    input_queue). Returns the session's InputQueue, or None if the input was
+    rejected because the queue is full. Raises OSError if the PTY is gone.
+    """
+    session.last_input_time = time.time()   # A plain store; read by the resource monitor
+    resource_monitor.foreground(session_id)     # Unthrottle before the keystrokes land
+    queue = session.input_queue
+    if not queue.push(data):
+        logger.warning(f"Input queue full for {session_id}: rejected {len(data)} bytes")
+        return None
+    if not queue.write_to(session.master_fd):
+        pty_mux.want_write(session_id)
+    return queue
+
 
-    # Process exited or fd closed — notify WebSocket clients (AC-9)
+def write_pty_input(session_id, fd):
+    """Continue writing a session's queued input. Runs on the PTY multiplexer
+    thread when the PTY is writable; returns True while input remains.
+    """
+    session = _get_session(session_id)
+    if not session:
+        return False
     try:
-        socketio.emit('session_exited', {'session_id': session_id}, room=session_id)
-    except Exception:
-        pass
+        return not session.input_queue.write_to(fd)
+    except OSError as e:
+        logger.warning(f"Input write error for {session_id}: {e}")
+        return False
+
+
+def _screen_snapshot(session):
+    """Bring the session's screen model up to date and snapshot it (for reattach).
+
+    The model is only fed when someone asks: parsing is far slower than
+    reading, and doing it on the PTY loop throttled every busy session to
+    the parser's speed. The output since the last snapshot is parsed here,
+    on the caller's thread, without session.lock. If the ring evicted part
+    of it, the model is rebuilt from what the ring still holds.
+
+    Returns the attach fields ``screen``, ``cols``, ``rows`` and
+    ``next_offset``, or None if the session keeps no screen model.
+    """
+    with session.screen_lock:
+        screen = session.screen
+        if screen is None:
+            return None
+        with session.lock:
+            since = session.screen_cursor
+            resizes, session.screen_resizes = session.screen_resizes, []
+            start, end, data = session.output_buffer.read(since)
+        if start > since:
+            screen = session.screen = TerminalScreen(screen.cols, screen.rows)
+        # Apply each resize where it happened in the stream
+        for offset, cols, rows in resizes:
+            offset = min(max(offset, start), end)
+            screen.feed(data[:offset - start].decode(errors="replace"))
+            data, start = data[offset - start:], offset
+            screen.resize(cols, rows)
+        screen.feed(data.decode(errors="replace"))
+        session.screen_cursor = end
+        # A half-received escape sequence isn't in the snapshot; resume the
+        # stream at its start so the client gets all of it
+        return {"screen": screen.snapshot(), "cols": screen.cols, "rows": screen.rows,
+                "next_offset": end - len(screen.pending.encode())}
+
+
+def _resize_screen(session, cols, rows):
+    """Keep the screen model at the size the PTY was just set to."""
+    if session.screen is not None:
+        with session.lock:
+            resizes = session.screen_resizes
+            if len(resizes) >= MAX_SCREEN_RESIZES:
+                del resizes[0]
+            resizes.append((session.output_buffer.end, cols, rows))
+    recording = session.recording
+    if recording is not None:
+        recording_writer.resize(recording, session.output_buffer, session.lock, cols, rows)
+
+
+def _send_output(session_id, session):
+    """Have an output sender thread push the session's new output to its
+    viewers; the PTY loop never waits on a socket. Safe under session.lock."""
+    if not output_sender.submit(session_id, lambda: _emit_pending_output(session_id, session), tag="output"):
+        # The ring keeps the bytes: the next output task or a reconnect sends them
+        logger.warning(f"Session {session_id}: output queue full, output send deferred")
+
+
+def _emit_pending_output(session_id, session):
+    """Push a session's not-yet-sent output to its WebSocket room (AC-8).
+
+    Runs on an output sender thread. Holds session.send_lock throughout —
+    join_session joins and replays under it too, so a replay and live
+    output never interleave — but session.lock only to read the ring.
+    Viewers connected to other workers get the same frames relayed over
+    the shard link.
+    """
+    with session.send_lock:
+        with session.lock:
+            since = session.emit_cursor
+            start, end, data = session.output_buffer.read(since)
+            session.emit_cursor = end
+            session.coalescer.flushed()
+            index = session.index
+            remote_viewers = list(session.remote_viewers.items())
+        if not data:
+            return  # Only a partial UTF-8 sequence so far
+        try:
+            for fmt in OUTPUT_FORMATS:
+                if fmt != "text" and index is None:
+                    continue
+                room = _output_room(session_id, fmt)
+                links = [link for link, fmts in remote_viewers if fmt in fmts]
+                local = _room_occupied(room)
+                if not (local or links):
+                    continue
+                if fmt == "text":
+                    event, frame = 'terminal_output', {'session_id': session_id,
+                                                       **_output_fields(since, start, end, data)}
+                else:
+                    # Raw bytes straight from the ring — no decode, no JSON escaping
+                    event, frame = 'terminal_output_bin', ws_frames.pack_output(
+                        index, start, data, gap=start > since, compress=fmt == "deflate")
+                if local:
+                    socketio.emit(event, frame, room=room)
+                for link in links:
+                    _push(link, event, frame, room=room, session_id=session_id, fmt=fmt)
+        except Exception:
+            pass  # No WebSocket clients — HTTP polling handles it
+
+
+def _flush_pty_output(session_id):
+    """Send output still waiting in a session's coalescing window."""
+    session = _get_session(session_id)
+    if session:
+        _send_output(session_id, session)
+
+
+def _on_pty_timer(session_id):
+    """Multiplexer timer: coalescing window elapsed or a paused PTY's ack timed out."""
+    session = _get_session(session_id)
+    if not session:
+        return
+    with session.lock:
+        _send_output(session_id, session)
+        if session.flow_paused_at is None:
+            return
+        # Subscribers that went quiet stop counting, so unattended agents keep
+        # running at full speed; a later ack subscribes them again
+        next_due = _expire_flow_subscribers(session, session_id, time.monotonic())
+        if not _flow_may_resume(session):
+            pty_mux.schedule(session_id, next_due)
+            return
+    pty_mux.resume(session_id)
+
+
+def _handle_pty_exit(session_id):
+    """Multiplexer callback: a session's shell exited or its PTY hit EOF."""
+    # Send any output still waiting in the coalescing window, then notify (AC-9)
+    _flush_pty_output(session_id)
+    session = _get_session(session_id)
+    _send_event(session_id, session, 'session_exited')
 
     logger.info(f"Session {session_id} process exited")
 
     # Clean up immediately — no zombie sessions in the picker
     if session:
-        terminate_session(session_id, session["pid"], session["master_fd"])
+        terminate_session(session_id, session.pid, session.master_fd)
+
+
+# Appends recorded session output to disk, off the PTY loop
+recording_writer = RecordingWriter()
+
+# Sends output and session events to viewers, off the PTY loop
+output_sender = OutputSender()
+
+# One I/O loop for every session's PTY (replaces a reader thread per session)
+pty_mux = PTYMultiplexer(on_readable=read_pty_output, on_exit=_handle_pty_exit,
+                         on_timer=_on_pty_timer, on_writable=write_pty_input)
 
 
 def terminate_session(session_id, pid, master_fd):
-    """Gracefully terminate a session: SIGHUP -> wait -> SIGKILL -> cleanup."""
-    logger.info(f"Terminating stale session {session_id} (pid={pid})")
+    """Start terminating a session: SIGHUP now, SIGKILL after GRACEFUL_SHUTDOWN_WAIT.
+
+    Returns immediately. The session leaves the registry at once and is
+    DRAINING; the reaper calls _finish_session to close its fd and notify
+    clients once the process is actually gone. Returns False if it was
+    already terminating.
+    """
+    session = sessions.pop(session_id)
+    if session is None or not session.advance(DRAINING):
+        return False
+    with session.lock:
+        _wake_pollers(session)  # Long polls report the exit now
+    logger.info(f"Terminating session {session_id} (pid={pid})")
+
+    # Stop watching the fd before it is closed (also suppresses the exit
+    # callback our own SIGHUP would otherwise trigger)
+    pty_mux.unregister(session_id)
+    idle_deadlines.discard(session_id)
+    resource_monitor.untrack(session_id)
+    _release_shell(session_id, pid, master_fd, session)
+    return True
+
+
+def _release_shell(key, pid, master_fd, session=None):
+    """Terminate a shell without blocking; _finish_session(key, ...) runs once
+    it is gone. The PTY host terminates the shells it owns; otherwise they are
+    our children and the local reaper does it."""
+    if pty_host is not None:
+        pty_host.close(pid, lambda: _finish_session(key, (master_fd, session)))
+    else:
+        session_reaper.reap(key, pid, (master_fd, session))
+
+
+def _finish_session(session_id, data):
+    """Reaper callback: a terminated session's process is gone."""
+    master_fd, session = data
+    try:
+        os.close(master_fd)
+    except OSError:
+        pass  # Already closed
+    if session is None:
+        return  # A discarded warm shell (shell_pool) — no clients, no recording
+    if session.recording is not None:
+        recording_writer.close(session.recording, session.output_buffer, session.lock)
+    session.advance(EXITED)
+    _send_event(session_id, session, 'session_closed')
+    logger.info(f"Session {session_id} terminated")
 
-    # Notify WebSocket clients that the session is closed
+
+def _send_event(session_id, session, event):
+    """_notify_viewers on an output sender thread, after the output queued before it."""
+    if not output_sender.submit(session_id, lambda: _notify_viewers(session_id, session, event)):
+        logger.warning(f"Session {session_id}: output queue full, {event} not sent")
+
+
+def _notify_viewers(session_id, session, event):
+    """Send a control event to a session's viewers on every worker."""
+    data = {'session_id': session_id}
     try:
-        socketio.emit('session_closed', {'session_id': session_id}, room=session_id)
+        socketio.emit(event, data, room=session_id)
     except Exception:
         pass
+    if session is None:
+        return
+    with session.lock:
+        links = list(session.remote_viewers)
+    for link in links:
+        _push(link, event, data, room=session_id)
 
-    try:
-        os.kill(pid, signal.SIGHUP)
-        time.sleep(GRACEFUL_SHUTDOWN_WAIT)
 
-        # Check if still alive, force kill if needed
-        try:
-            os.kill(pid, 0)  # Check if process exists
-            os.kill(pid, signal.SIGKILL)
-            logger.info(f"Force killed session {session_id} (pid={pid})")
-        except OSError:
-            pass  # Already dead
+# Escalates SIGHUP -> SIGKILL on timers instead of sleeping in request threads
+session_reaper = SessionReaper(_finish_session, grace=GRACEFUL_SHUTDOWN_WAIT)
 
-        os.close(master_fd)
-    except OSError:
-        pass  # Process or fd already gone
+# Connection to the PTY host when PTY_HOST_SOCKET is set (see initialize_app)
+pty_host = None
 
-    with sessions_lock:
-        sessions.pop(session_id, None)
+# Foreground-process names for the session picker, cached across requests
+process_inspector = ProcessInspector()
 
 
-def _get_session_process(pid):
-    """Return the name of the foreground child process for *pid*.
+def _get_session_process(pid, master_fd=None):
+    """Return the name of the program in the foreground of session *pid*.
 
-    Uses ``pgrep -P`` to find children (works on both macOS and Linux),
-    then ``ps -o comm=`` to resolve the process name.
+    Reads /proc (see proc_tree) — the PTY's foreground process group when
+    *master_fd* is given, else the newest child — through a short cache
+    shared by every endpoint.
 
     Returns:
         str: process name, or ``"unknown"`` on any error / dead PID.
     """
-    if not isinstance(pid, int) or pid <= 0:
-        return "unknown"
+    return process_inspector.foreground(pid, master_fd)
 
-    try:
-        # Step 1 — find child PIDs via pgrep (cross-platform)
-        child_result = subprocess.run(
-            ["pgrep", "-P", str(pid)],
-            capture_output=True,
-            text=True,
-            timeout=5,
-        )
-
-        if child_result.returncode == 0 and child_result.stdout.strip():
-            child_pids = child_result.stdout.strip().splitlines()
-            last_child_pid = child_pids[-1].strip()
-
-            # Step 2 — resolve child name
-            name_result = subprocess.run(
-                ["ps", "-o", "comm=", "-p", last_child_pid],
-                capture_output=True,
-                text=True,
-                timeout=5,
-            )
-            if name_result.returncode == 0 and name_result.stdout.strip():
-                name = name_result.stdout.strip().splitlines()[0].strip()
-                # ps may return the full path; take basename
-                return os.path.basename(name)
-
-        # Step 3 — no children: fall back to the process itself
-        self_result = subprocess.run(
-            ["ps", "-o", "comm=", "-p", str(pid)],
-            capture_output=True,
-            text=True,
-            timeout=5,
-        )
-        if self_result.returncode == 0 and self_result.stdout.strip():
-            name = self_result.stdout.strip().splitlines()[0].strip()
-            return os.path.basename(name)
-
-        return "unknown"
-    except Exception:
-        return "unknown"
 
+def _is_background(session_id):
+    """Nobody is viewing the session: an agent working on its own, unwatched.
 
-def cleanup_stale_sessions():
-    """Background thread that removes sessions with no recent polling."""
-    while True:
-        time.sleep(CLEANUP_INTERVAL_SECONDS)
+    A WebSocket viewer (here or on another worker) keeps it in the
+    foreground, however long since anyone typed — the user may be watching
+    an agent work. HTTP clients count while they have read its output or
+    typed in the last BACKGROUND_AFTER_SECONDS.
+    """
+    session = _get_session(session_id)
+    if session is None:
+        return False
+    if session.remote_viewers or any(_room_occupied(_output_room(session_id, fmt)) for fmt in OUTPUT_FORMATS):
+        return False
+    return time.time() - max(session.last_view_time, session.last_input_time) > BACKGROUND_AFTER_SECONDS
 
-        now = time.time()
-        stale_sessions = []
-        warning_threshold = SESSION_TIMEOUT_SECONDS * 0.8
 
-        with sessions_lock:
-            session_snapshot = list(sessions.items())
+def _session_resources(session_id):
+    """Latest CPU/memory sample of a session (session_resources), or None."""
+    usage = resource_monitor.usage(session_id)
+    return usage.as_dict() if usage is not None else None
 
-        for session_id, session in session_snapshot:
-            with session["lock"]:
-                idle = now - session["last_poll_time"]
-                if idle > SESSION_TIMEOUT_SECONDS:
-                    stale_sessions.append((session_id, session["pid"], session["master_fd"]))
-                elif idle > warning_threshold:
-                    session["timeout_warning"] = True
 
-        if stale_sessions:
-            logger.info(f"Found {len(stale_sessions)} stale session(s) to clean up")
+# CPU and memory of each session's processes; throttles background sessions
+# when BACKGROUND_THROTTLE is on (cgroup quotas are set up in initialize_app)
+resource_monitor = ResourceMonitor(
+    interval=SESSION_SAMPLE_INTERVAL,
+    policy=ThrottlePolicy() if BACKGROUND_THROTTLE else None,
+    is_background=_is_background,
+)
 
-        # Terminate each stale session (outside the lock)
-        for session_id, pid, master_fd in stale_sessions:
-            terminate_session(session_id, pid, master_fd)
+
+def _check_idle(session_id, now):
+    """Idle deadline handler: warn at 80% of the timeout, terminate at 100%.
+
+    Returns the session's next deadline, recomputed from its latest poll.
+    """
+    session = _get_session(session_id)
+    if session is None:
+        return None
+    with session.lock:
+        last_poll = session.last_poll_time
+        if now - last_poll < SESSION_TIMEOUT_SECONDS:
+            warn_at = last_poll + SESSION_TIMEOUT_SECONDS * TIMEOUT_WARNING_FRACTION
+            if now < warn_at:
+                return warn_at  # Polled since this deadline was set
+            session.timeout_warning = True
+            _wake_pollers(session)
+            return last_poll + SESSION_TIMEOUT_SECONDS
+        pid, master_fd = session.pid, session.master_fd
+    logger.info(f"Session {session_id} idle for {now - last_poll:.0f}s — cleaning up")
+    terminate_session(session_id, pid, master_fd)
+    return None
+
+
+# Fires each session's timeout warning and reap when due (no periodic scan)
+idle_deadlines = DeadlineHeap(_check_idle)
 
 
 @app.before_request
 def authorize_request():
     """Check authorization before processing any request."""
-    # Skip auth for health check, setup status, and Socket.IO (has own auth via connect event)
-    if request.path in ("/health", "/api/setup-status", "/api/pat-status", "/api/configure-pat", "/api/app-state") or request.path.startswith("/socket.io"):
+    # Skip auth for health check, setup status, Socket.IO (has own auth via connect event)
+    # and the fingerprinted third-party libraries (no user data). The app's own
+    # assets and pages stay behind it; their immutable caching spares the round trips
+    if request.path in ("/health", "/api/setup-status", "/api/pat-status", "/api/configure-pat", "/api/app-state") or request.path.startswith(("/socket.io", "/assets/lib/")):
         return None
 
     authorized, user = check_authorization()
@@ -830,9 +1491,61 @@ def set_security_headers(response):
     return response
 
 
+@app.after_request
+def compress_json_response(response):
+    """Gzip large JSON responses (output polls, attach snapshots) for clients
+    that send ``Accept-Encoding: gzip`` — browsers decode it transparently,
+    and terminal text shrinks several-fold on slow links."""
+    if (response.mimetype != "application/json"
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or request.accept_encodings.quality("gzip") <= 0):
+        return response
+    body = response.get_data()
+    if len(body) < GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(body, compresslevel=6))
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
+
+
 @app.route("/")
 def index():
-    return send_from_directory("static", "index.html")
+    try:
+        page = static_assets.page("index.html")
+    except OSError as e:
+        logger.warning(f"Serving unfingerprinted index.html: {e}")
+        page = None
+    if page is None:
+        return send_from_directory("static", "index.html")
+    return _send_asset(page, max_age=None)
+
+
+@app.route("/assets/<path:name>")
+def fingerprinted_asset(name):
+    """A static file under its content-hashed name: cached for good by browsers."""
+    asset = static_assets.get(name)
+    if asset is None:
+        return jsonify({"error": "Not found"}), 404
+    return _send_asset(asset, max_age=ASSET_MAX_AGE)
+
+
+def _send_asset(asset, max_age):
+    """Send *asset* in the best encoding the client accepts, as a file
+    (sendfile). Without *max_age* it is revalidated by ETag on every load."""
+    encoding = asset.negotiate(lambda name: request.accept_encodings.quality(name) > 0)
+    response = send_file(asset.files[encoding], mimetype=asset.mimetype, download_name=asset.name,
+                         etag=asset.etag(encoding), conditional=True, max_age=max_age)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    if len(asset.files) > 1:
+        response.vary.add("Accept-Encoding")
+    if max_age:
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
 
 
 @app.route("/api/setup-status")
@@ -849,52 +1562,110 @@ def get_app_state():
 @app.route("/api/sessions")
 def list_sessions():
     """Return a JSON array of active (non-exited) sessions with metadata."""
-    now = time.time()
-    with sessions_lock:
-        snapshot = list(sessions.items())
+    result = _session_summaries()
+    if shard_router is not None:
+        replies = shard_router.request_all({"op": "sessions"}, timeout=SHARD_FANOUT_TIMEOUT)
+        for reply, _ in replies.values():
+            result += reply["sessions"]
+        result.sort(key=lambda summary: summary["created_at"] or 0)
+    return jsonify(result)
+
 
+def _session_summaries():
+    """This worker's live sessions, as listed by /api/sessions."""
+    now = time.time()
     result = []
-    for session_id, sess in snapshot:
-        if sess.get("exited"):
+    for session_id, sess in sessions.items():
+        if not sess.live:
             continue
         result.append({
             "session_id": session_id,
-            "label": sess.get("label", ""),
-            "created_at": sess.get("created_at"),
-            "last_poll_time": sess.get("last_poll_time"),
+            "label": sess.label,
+            "created_at": sess.created_at,
+            "last_poll_time": sess.last_poll_time,
             "exited": False,
-            "process": _get_session_process(sess["pid"]),
-            "idle_seconds": round(now - sess.get("last_poll_time", now), 1),
+            "process": _get_session_process(sess.pid, sess.master_fd),
+            "idle_seconds": round(now - sess.last_poll_time, 1),
+            "resources": _session_resources(session_id),
         })
-    return jsonify(result)
+    return result
 
 
 @app.route("/api/session/attach", methods=["POST"])
 def attach_session():
-    """Reattach to an existing session — returns buffered output for replay."""
+    """Reattach to an existing session.
+
+    Without ``offset`` the response is a ``screen`` snapshot: escape-sequence
+    text that redraws the current screen and its scrollback on a reset
+    terminal, however much output happened while detached. ``next_offset``
+    is where the snapshot ends in the output stream. With ``offset``, the
+    raw output held since that offset is returned instead (``gap`` is True
+    if part of it was already evicted).
+    """
     data = request.get_json(silent=True) or {}
     session_id = data.get("session_id", "")
 
     sess = _get_session(session_id)
-    if not sess or sess.get("exited"):
+    if not sess or not sess.live:
         return jsonify({"error": "Session not found or exited"}), 404
 
-    # Reset idle clock so the 24h reaper starts fresh
-    sess["last_poll_time"] = time.time()
+    try:
+        offset = _parse_offset(data.get("offset"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    fields = _screen_snapshot(sess) if offset is None else None
+    with sess.lock:
+        # Reset idle clock so the 24h reaper starts fresh
+        sess.last_poll_time = sess.last_view_time = time.time()
+        if fields is None:
+            fields = _output_fields(*_read_output(sess, offset or 0))
 
     return jsonify({
         "session_id": session_id,
-        "label": sess.get("label", ""),
-        "output": list(sess["output_buffer"]),
-        "process": _get_session_process(sess["pid"]),
-        "created_at": sess.get("created_at"),
+        "index": sess.index,
+        "label": sess.label,
+        **fields,
+        "process": _get_session_process(sess.pid, sess.master_fd),
+        "created_at": sess.created_at,
     })
 
 
+@app.route("/api/session/recording")
+def session_recording():
+    """Stream a range of a session's recorded output as asciicast v2.
+
+    Query: ``session_id`` plus optional ``since``/``until`` (stream offsets)
+    and ``start``/``end`` (seconds since the recording began). Works for
+    live sessions and for recordings of sessions that have since ended. The
+    file is read through mmap slices, so any size streams in constant memory.
+    """
+    session_id = request.args.get("session_id", "")
+    try:
+        session_id = parse_session_id(session_id)  # Also keeps it a safe file name
+        since = _parse_offset(request.args.get("since", 0, type=int)) or 0
+        until = _parse_offset(request.args.get("until", type=int))
+        start = request.args.get("start", 0.0, type=float)
+        end = request.args.get("end", type=float)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    sess = _get_session(session_id)
+    recording = sess.recording if sess else None
+    if recording is None:
+        try:
+            recording = Recording.load(recording_path(session_id))
+        except (OSError, ValueError):
+            return jsonify({"error": "No recording for this session"}), 404
+
+    return Response(recording.iter_range(since, until, start, end),
+                    mimetype="application/x-asciicast",
+                    headers={"Content-Disposition": f'inline; filename="{session_id}.cast"'})
+
+
 @app.route("/health")
 def health():
-    with sessions_lock:
-        session_count = len(sessions)
+    session_count = len(sessions)
     with setup_lock:
         current_setup_status = setup_state["status"]
     return jsonify({
@@ -902,6 +1673,11 @@ def health():
         "version": APP_VERSION,
         "setup_status": current_setup_status,
         "active_sessions": session_count,
+        "warm_shells": len(shell_pool),
+        "pty_host": pty_host is not None and pty_host.connected,
+        "worker_shard": shard_router.shard if shard_router is not None else None,
+        "output_sender": output_sender.stats(),
+        "first_output_ms_p50": _startup_median(),
         "session_timeout_seconds": SESSION_TIMEOUT_SECONDS
     })
 
@@ -911,6 +1687,38 @@ def get_version():
     return jsonify({"version": APP_VERSION})
 
 
+# Milliseconds from navigation start to each step of a page load, as the browser measured them
+_STARTUP_FIELDS = ("script_ms", "terminal_ms", "session_ms", "first_output_ms", "response_ms")
+_startup_samples = deque(maxlen=STARTUP_SAMPLES)   # first_output_ms of unprompted loads
+
+
+@app.route("/api/client-metrics", methods=["POST"])
+def client_metrics():
+    """Record a page load's startup timings (sent once its first pane shows
+    output). Loads that waited on the user (``prompted``) are logged but
+    left out of the /health median."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "JSON object required"}), 400
+    timings = {name: round(data[name]) for name in _STARTUP_FIELDS
+               if isinstance(data.get(name), (int, float)) and not isinstance(data[name], bool)
+               and 0 <= data[name] < 3600 * 1000}
+    if "first_output_ms" not in timings:
+        return jsonify({"error": "first_output_ms required"}), 400
+    prompted = data.get("prompted") is True
+    transport = data.get("transport") if data.get("transport") in ("websocket", "http") else "unknown"
+    logger.info(f"Client startup ({transport}{', prompted' if prompted else ''}): "
+                + " ".join(f"{name}={value}" for name, value in timings.items()))
+    if not prompted:
+        _startup_samples.append(timings["first_output_ms"])
+    return "", 204
+
+
+def _startup_median():
+    samples = sorted(_startup_samples)
+    return samples[len(samples) // 2] if samples else None
+
+
 @app.route("/api/pat-status")
 def pat_status():
     """Check if a valid, usable PAT is configured."""
@@ -985,44 +1793,46 @@ def configure_pat():
     return jsonify({"status": "ok", "user": user, "message": "Token configured. Auto-rotation started."})
 
 
-@app.route("/api/session", methods=["POST"])
-def create_session():
-    """Create a new terminal session."""
-    # Quick reject before forking a PTY (approximate — authoritative check below)
-    with sessions_lock:
-        if len(sessions) >= MAX_CONCURRENT_SESSIONS:
-            return jsonify({"error": f"Maximum {MAX_CONCURRENT_SESSIONS} concurrent sessions reached. Close an existing session first."}), 429
-
-    data = request.get_json(silent=True) or {}
-    label = data.get("label", "")
+def _shell_env():
+    """Environment for a new terminal's shell."""
+    shell_env = os.environ.copy()
+    shell_env["TERM"] = "xterm-256color"
+    # Remove Claude Code env vars so the browser terminal isn't seen as nested
+    shell_env.pop("CLAUDECODE", None)
+    shell_env.pop("CLAUDE_CODE_SESSION", None)
+    # Remove DATABRICKS_TOKEN and DATABRICKS_HOST so CLI/SDK reads from
+    # ~/.databrickscfg (always current after rotation) instead of inheriting
+    # a stale env var snapshot. The SDK skips config file loading when
+    # DATABRICKS_HOST is set in env (even without credentials).
+    shell_env.pop("DATABRICKS_TOKEN", None)
+    shell_env.pop("DATABRICKS_HOST", None)
+    # Also strip CLI-specific API keys so they read from config files
+    # (always current after rotation) instead of stale env snapshots.
+    shell_env.pop("GEMINI_API_KEY", None)
+    # Ensure HOME is set correctly
+    if not shell_env.get("HOME") or shell_env["HOME"] == "/":
+        shell_env["HOME"] = "/app/python/source_code"
+    # Add ~/.local/bin to PATH for claude command
+    local_bin = f"{shell_env['HOME']}/.local/bin"
+    shell_env["PATH"] = f"{local_bin}:{shell_env.get('PATH', '')}"
+    return shell_env
+
+
+def _spawn_shell():
+    """Fork bash on a new PTY. Returns (master_fd, pid); the master is non-blocking."""
+    shell_env = _shell_env()
+
+    # Start shell in ~/projects/ directory
+    projects_dir = os.path.join(shell_env["HOME"], "projects")
+    os.makedirs(projects_dir, exist_ok=True)
+
+    if pty_host is not None:
+        # Spawned (and later reaped) by the host; non-blocking already, as the
+        # host shares the open file with us
+        return pty_host.spawn(["/bin/bash"], shell_env, projects_dir)
+
+    master_fd, slave_fd = pty.openpty()
     try:
-        master_fd, slave_fd = pty.openpty()
-        # Set up environment for the shell
-        shell_env = os.environ.copy()
-        shell_env["TERM"] = "xterm-256color"
-        # Remove Claude Code env vars so the browser terminal isn't seen as nested
-        shell_env.pop("CLAUDECODE", None)
-        shell_env.pop("CLAUDE_CODE_SESSION", None)
-        # Remove DATABRICKS_TOKEN and DATABRICKS_HOST so CLI/SDK reads from
-        # ~/.databrickscfg (always current after rotation) instead of inheriting
-        # a stale env var snapshot. The SDK skips config file loading when
-        # DATABRICKS_HOST is set in env (even without credentials).
-        shell_env.pop("DATABRICKS_TOKEN", None)
-        shell_env.pop("DATABRICKS_HOST", None)
-        # Also strip CLI-specific API keys so they read from config files
-        # (always current after rotation) instead of stale env snapshots.
-        shell_env.pop("GEMINI_API_KEY", None)
-        # Ensure HOME is set correctly
-        if not shell_env.get("HOME") or shell_env["HOME"] == "/":
-            shell_env["HOME"] = "/app/python/source_code"
-        # Add ~/.local/bin to PATH for claude command
-        local_bin = f"{shell_env['HOME']}/.local/bin"
-        shell_env["PATH"] = f"{local_bin}:{shell_env.get('PATH', '')}"
-
-        # Start shell in ~/projects/ directory
-        projects_dir = os.path.join(shell_env["HOME"], "projects")
-        os.makedirs(projects_dir, exist_ok=True)
-
         pid = subprocess.Popen(
             ["/bin/bash"],
             stdin=slave_fd,
@@ -1032,35 +1842,101 @@ def create_session():
             env=shell_env,
             cwd=projects_dir
         ).pid
+    except Exception:
+        os.close(master_fd)
+        raise
+    finally:
         os.close(slave_fd)  # Parent doesn't need the slave side; child inherited it
+    os.set_blocking(master_fd, False)  # Input is queued, never a blocking write
+    return master_fd, pid
+
+
+def _shell_fingerprint():
+    """What a shell spawned now would inherit — a pooled shell spawned under a
+    different environment or older rc files is discarded, not handed out."""
+    shell_env = _shell_env()
+    rc_mtimes = []
+    for name in (".bashrc", ".bash_profile", ".profile"):
+        try:
+            rc_mtimes.append(os.stat(os.path.join(shell_env["HOME"], name)).st_mtime_ns)
+        except OSError:
+            rc_mtimes.append(None)
+    return tuple(sorted(shell_env.items())), tuple(rc_mtimes)
 
-        session_id = str(uuid.uuid4())
+
+def _discard_warm_shell(master_fd, pid):
+    _release_shell(f"warm-{pid}", pid, master_fd)
+
+
+# Shells spawned ahead of time so a new tab gets its prompt on the first round trip
+shell_pool = ShellPool(_spawn_shell, size=WARM_SHELL_POOL_SIZE,
+                       fingerprint=_shell_fingerprint, discard=_discard_warm_shell)
+
+
+@app.route("/api/session", methods=["POST"])
+def create_session():
+    """Create a new terminal session."""
+    # Quick reject before forking a PTY (approximate — authoritative check below).
+    # Other workers' sessions count too, as of now: across workers the limit
+    # can be overshot by requests racing on different workers
+    remote_count = _remote_session_count()
+    if len(sessions) + remote_count >= MAX_CONCURRENT_SESSIONS:
+        return jsonify({"error": f"Maximum {MAX_CONCURRENT_SESSIONS} concurrent sessions reached. Close an existing session first."}), 429
+
+    data = request.get_json(silent=True) or {}
+    label = data.get("label", "")
+    try:
+        # A pre-spawned shell has already printed its prompt; otherwise fork one now
+        master_fd, pid = shell_pool.take() or _spawn_shell()
+        if SESSION_MEMORY_LIMIT_MB:
+            limit_memory(pid, SESSION_MEMORY_LIMIT_MB * 1024 * 1024)
+
+        session_id = new_session_id(shard_router.shard) if shard_router is not None else str(uuid.uuid4())
+        created_at = time.time()
+        if pty_host is not None:
+            # Lets a restarted worker adopt the shell as this session
+            pty_host.describe(pid, session_id=session_id, label=label, created_at=created_at,
+                              shard=_local_shard())
+        recording = None
+        if data.get("record", SESSION_RECORDING):
+            try:
+                prune_recordings()
+                recording = Recording(recording_path(session_id), title=label).open()
+            except OSError as e:
+                logger.warning(f"Could not start recording for {session_id}: {e}")
 
         with sessions_lock:
             # Authoritative check under the same lock as insertion — prevents
             # TOCTOU race where two concurrent requests both pass the early check.
-            if len(sessions) >= MAX_CONCURRENT_SESSIONS:
+            if len(sessions) + remote_count >= MAX_CONCURRENT_SESSIONS:
                 os.close(master_fd)
-                try:
-                    os.kill(pid, signal.SIGKILL)
-                except OSError:
-                    pass
+                if recording is not None:
+                    recording.close()
+                if pty_host is not None:
+                    pty_host.close(pid, lambda: None)
+                else:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except OSError:
+                        pass
                 return jsonify({"error": f"Maximum {MAX_CONCURRENT_SESSIONS} concurrent sessions reached. Close an existing session first."}), 429
-            sessions[session_id] = {
-                "master_fd": master_fd,
-                "pid": pid,
-                "output_buffer": deque(maxlen=1000),
-                "lock": threading.Lock(),
-                "last_poll_time": time.time(),
-                "created_at": time.time(),
-                "label": label,
-            }
-
-        # Start background reader thread
-        thread = threading.Thread(target=read_pty_output, args=(session_id, master_fd), daemon=True)
-        thread.start()
-
-        return jsonify({"session_id": session_id})
+            session = sessions.add(Session(
+                session_id, master_fd, pid,
+                label=label,
+                created_at=created_at,
+                output_buffer=OutputRing(OUTPUT_BUFFER_BYTES),
+                screen=TerminalScreen(),
+                recording=recording,
+                offset_cell=pty_host.offset_cell(pid) if pty_host is not None else None,
+            ))
+
+        # Hand the PTY to the shared I/O loop (output + child exit)
+        pty_mux.register(session_id, master_fd, pid)
+        resource_monitor.track(session_id, pid)
+        session.advance(RUNNING)
+        idle_deadlines.add(session_id, time.time() + SESSION_TIMEOUT_SECONDS * TIMEOUT_WARNING_FRACTION)
+
+        return jsonify({"session_id": session_id, "index": session.index})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -1076,13 +1952,14 @@ def send_input():
     if not session:
         return jsonify({"error": "Session not found"}), 404
 
-    fd = session["master_fd"]
-
     try:
-        os.write(fd, input_data.encode())
-        return jsonify({"status": "ok"})
+        queue = _write_input(session_id, session, input_data.encode())
     except OSError as e:
         return jsonify({"error": str(e)}), 500
+    if queue is None:
+        return jsonify({"error": "Input queue full — the terminal is still catching up",
+                        "queued": session.input_queue.queued}), 429
+    return jsonify({"status": "ok", "queued": queue.queued})
 
 
 @app.route("/api/upload", methods=["POST"])
@@ -1117,7 +1994,12 @@ def upload_file():
 
 @app.route("/api/output", methods=["POST"])
 def get_output():
-    """Get output from the terminal."""
+    """Get output from the terminal.
+
+    Accepts: {"session_id": "...", "offset": N} — returns output since offset N
+    (the ``next_offset`` of the previous call). Output is never consumed, so
+    multiple viewers can poll the same session independently.
+    """
     data = request.json
     session_id = data.get("session_id")
 
@@ -1125,25 +2007,43 @@ def get_output():
     if not session:
         return jsonify({"error": "Session not found"}), 404
 
-    with session["lock"]:
-        session["last_poll_time"] = time.time()
-        # Atomic buffer swap: replace buffer, then join outside the lock
-        old_buffer = session["output_buffer"]
-        session["output_buffer"] = deque(maxlen=1000)
-        exited = session.get("exited", False)
-        timeout_warning = session.pop("timeout_warning", False)
+    try:
+        offset = _parse_offset(data.get("offset"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    output = "".join(old_buffer)
+    with session.lock:
+        session.last_poll_time = session.last_view_time = time.time()
+        read = _read_output(session, offset)
+        resume = _ack_output(session, "http", read[2])  # A poller consuming output counts as an ack
+        exited = not session.live
+        timeout_warning, session.timeout_warning = session.timeout_warning, False
+    if resume:
+        pty_mux.resume(session_id)
 
-    return jsonify({"output": output, "exited": exited, "shutting_down": shutting_down, "timeout_warning": timeout_warning})
+    return jsonify({**_output_fields(*read), "exited": exited, "shutting_down": shutting_down, "timeout_warning": timeout_warning})
 
 
 @app.route("/api/output-batch", methods=["POST"])
 def get_output_batch():
     """Get output from multiple terminal sessions in one request.
 
-    Accepts: {"session_ids": ["id1", "id2", ...]}
-    Returns: {"outputs": {"id1": {"output": "...", "exited": false}, ...}}
+    Accepts: {"session_ids": ["id1", "id2", ...], "offsets": {"id1": N, ...}}
+    Returns: {"outputs": {"id1": {"output": "...", "offset": N, "next_offset": M,
+                                  "gap": false, "exited": false}, ...}}
+
+    With ``"wait": S`` the request is a long poll: when none of the sessions
+    has anything new it is held for up to S seconds (at most
+    LONG_POLL_MAX_WAIT) and answered as soon as output arrives, so a client
+    can poll back-to-back. A ``poll_id`` names the client's poll loop; its
+    next poll releases the previous one. Batches spanning several workers
+    are not held, nor are polls beyond MAX_HELD_REQUESTS: those are answered
+    at once, as if sent without ``wait``.
+
+    With ``"changed_only": true`` only sessions with something to report
+    are returned, and a batch where nothing changed is an empty 204. Every
+    session's ``last_poll_time`` is still refreshed: the poll is what keeps
+    an open tab's sessions from being reaped as abandoned.
     """
     data = request.json or {}
     session_ids = data.get("session_ids")
@@ -1151,36 +2051,174 @@ def get_output_batch():
     if session_ids is None:
         return jsonify({"error": "session_ids required"}), 400
 
+    offsets = data.get("offsets") or {}
+    try:
+        offsets = {sid: _parse_offset(offsets.get(sid)) for sid in session_ids}
+    except (ValueError, AttributeError) as e:
+        return jsonify({"error": f"invalid offsets: {e}"}), 400
+    try:
+        wait = min(max(float(data.get("wait") or 0), 0.0), LONG_POLL_MAX_WAIT)
+    except (TypeError, ValueError):
+        return jsonify({"error": "wait must be a number of seconds"}), 400
+    poll_id = data.get("poll_id")
+    if poll_id is not None and not (isinstance(poll_id, str) and len(poll_id) <= 64):
+        return jsonify({"error": "poll_id must be a short string"}), 400
+
+    # Sessions owned by other workers are read there, all at once
+    remote = {}
+    for sid in list(offsets):   # session_ids, deduplicated
+        shard = _owner_shard(sid)
+        if shard is not None:
+            remote.setdefault(shard, {"op": "output-batch", "offsets": {}})["offsets"][sid] = offsets.pop(sid)
+    calls = shard_router.request_all(None, shards=remote, timeout=SHARD_FANOUT_TIMEOUT) if remote else {}
+
+    held = bool(wait and offsets and not remote) and held_requests.acquire(blocking=False)
+    if not held and poll_id is not None:
+        _release_long_poll(poll_id)     # Not held either way now
+    try:
+        outputs = _read_output_batch(offsets, wait if held else 0, poll_id)
+    finally:
+        if held:
+            held_requests.release()
+    for reply, _ in calls.values():
+        outputs.update(reply["outputs"])
+    if data.get("changed_only"):
+        outputs = {sid: entry for sid, entry in outputs.items() if _is_news(entry)}
+        if not outputs and not shutting_down:
+            return Response(status=204)
+    return jsonify({"outputs": outputs, "shutting_down": shutting_down})
+
+
+def _is_news(entry):
+    """Whether an output entry has anything for the client."""
+    return bool(entry["output"] or entry["gap"] or entry["exited"] or entry["timeout_warning"])
+
+
+def _read_output_batch(offsets, wait=0, poll_id=None):
+    """Output of this worker's sessions among *offsets* (session_id -> offset
+    or None), keyed by session_id; unknown sessions are left out. With
+    *wait*, first wait up to that long for something to report."""
     outputs = {}
-    now = time.time()
 
-    # Step 1: Resolve session refs under global lock (fast dict lookups only)
+    # Step 1: Resolve session refs (lock-free registry lookups)
     resolved = {}
-    with sessions_lock:
-        for sid in session_ids:
-            if sid in sessions:
-                resolved[sid] = sessions[sid]
+    for sid in offsets:
+        session = sessions.get(sid)
+        if session is not None:
+            resolved[sid] = session
+    if wait and resolved:
+        _wait_for_output(resolved, offsets, wait, poll_id)
+    now = time.time()
 
-    # Step 2: Swap buffers under per-session locks (same pattern as get_output)
-    swapped = {}
+    # Step 2: Copy new bytes under per-session locks (same pattern as get_output)
+    subscriber = "http" if poll_id is None else f"poll:{poll_id}"    # Whose acks these are
+    drained = {}
     for sid, session in resolved.items():
-        with session["lock"]:
-            session["last_poll_time"] = now
-            old_buffer = session["output_buffer"]
-            session["output_buffer"] = deque(maxlen=1000)
-            exited = session.get("exited", False)
-            timeout_warning = session.pop("timeout_warning", False)
-        swapped[sid] = (old_buffer, exited, timeout_warning)
-
-    # Step 3: Join strings outside all locks
-    for sid, (old_buffer, exited, timeout_warning) in swapped.items():
+        with session.lock:
+            session.last_poll_time = session.last_view_time = now
+            read = _read_output(session, offsets[sid])
+            resume = _ack_output(session, subscriber, read[2])
+            exited = not session.live
+            timeout_warning, session.timeout_warning = session.timeout_warning, False
+        if resume:
+            pty_mux.resume(sid)
+        drained[sid] = (read, exited, timeout_warning)
+
+    # Step 3: Decode outside all locks
+    for sid, (read, exited, timeout_warning) in drained.items():
         outputs[sid] = {
-            "output": "".join(old_buffer),
+            **_output_fields(*read),
             "exited": exited,
             "timeout_warning": timeout_warning,
         }
+    return outputs
+
+
+@app.route("/api/stream")
+def stream_output():
+    """Stream sessions' output as Server-Sent Events, for networks that strip
+    the WebSocket upgrade.
+
+    Query: ``sessions=id1:offset1,id2:offset2`` (offsets optional). Each
+    ``terminal_output`` event carries one session's entry in the
+    /api/output-batch format, and its id is the offset of every streamed
+    session, so a reconnecting EventSource resumes from ``Last-Event-ID``.
+    A session that exits, or is already gone, gets a final event with
+    ``exited`` set. A ``ready`` event opens the stream (clients take its
+    absence as a buffering proxy), ``shutting_down`` ends it, and it closes
+    after STREAM_MAX_DURATION for the browser to reconnect. All sessions
+    must belong to one worker. Beyond MAX_HELD_REQUESTS open streams and
+    long polls, it is a 503 and the client polls instead.
+    """
+    try:
+        offsets = _parse_stream_cursor(request.args.get("sessions", ""))
+        resume = _parse_stream_cursor(request.headers.get("Last-Event-ID", ""))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not offsets or len(offsets) > MAX_STREAM_SESSIONS:
+        return jsonify({"error": f"sessions must name 1 to {MAX_STREAM_SESSIONS} sessions"}), 400
+    offsets.update((sid, offset) for sid, offset in resume.items() if sid in offsets)
+    owners = {_owner_shard(sid) for sid in offsets}
+    if len(owners) > 1:
+        return jsonify({"error": "a stream's sessions must belong to one worker"}), 400
+    shard = owners.pop()
+    if not held_requests.acquire(blocking=False):
+        return jsonify({"error": "too many open streams, poll instead"}), 503
+
+    def read(wait):
+        if shard is None:
+            return _read_output_batch(dict(offsets), wait)
+        reply, _ = shard_router.request(shard, {"op": "output-batch", "offsets": dict(offsets), "wait": wait})
+        return reply["outputs"]
+
+    def events():
+        yield "retry: 1000\nevent: ready\ndata: {}\n\n"
+        ends_at = time.monotonic() + STREAM_MAX_DURATION
+        while offsets and time.monotonic() < ends_at:
+            if shutting_down:
+                yield "event: shutting_down\ndata: {}\n\n"
+                return
+            try:
+                outputs = read(min(STREAM_KEEPALIVE, max(0.0, ends_at - time.monotonic())))
+            except OSError as e:
+                logger.warning(f"Output stream lost its session worker: {e}")
+                return
+            sent = False
+            for sid in offsets.keys() - outputs.keys():
+                # Closed and gone: report it as exited, as a live read would have
+                outputs[sid] = {"output": "", "gap": False, "exited": True, "timeout_warning": False}
+            for sid, data in outputs.items():
+                if not _is_news(data):
+                    continue
+                if data["exited"]:
+                    del offsets[sid]
+                else:
+                    offsets[sid] = data["next_offset"]
+                cursor = _format_stream_cursor(offsets)
+                yield f"id: {cursor}\nevent: terminal_output\ndata: {json.dumps({'session_id': sid, **data})}\n\n"
+                sent = True
+            if not sent:
+                yield ": keepalive\n\n"
+
+    response = Response(events(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.call_on_close(held_requests.release)   # Once the server is done with it, however it ended
+    return response
 
-    return jsonify({"outputs": outputs, "shutting_down": shutting_down})
+
+def _parse_stream_cursor(value):
+    """``id1:offset1,id2,...`` -> {session_id: offset or None}."""
+    cursor = {}
+    for item in filter(None, value.split(",")):
+        sid, _, offset = item.partition(":")
+        if offset and not offset.isdigit():
+            raise ValueError("offset must be a non-negative integer")
+        cursor[sid] = int(offset) if offset else None
+    return cursor
+
+
+def _format_stream_cursor(offsets):
+    return ",".join(sid if offset is None else f"{sid}:{offset}" for sid, offset in offsets.items())
 
 
 @app.route("/api/heartbeat", methods=["POST"])
@@ -1193,9 +2231,9 @@ def heartbeat():
     if not session:
         return jsonify({"error": "Session not found"}), 404
 
-    with session["lock"]:
-        session["last_poll_time"] = time.time()
-        timeout_warning = session.pop("timeout_warning", False)
+    with session.lock:
+        session.last_poll_time = time.time()
+        timeout_warning, session.timeout_warning = session.timeout_warning, False
     return jsonify({"status": "ok", "timeout_warning": timeout_warning})
 
 
@@ -1211,12 +2249,13 @@ def resize_terminal():
     if not session:
         return jsonify({"error": "Session not found"}), 404
 
-    fd = session["master_fd"]
+    fd = session.master_fd
 
     try:
         # Set terminal size using TIOCSWINSZ
         winsize = struct.pack("HHHH", rows, cols, 0, 0)
         fcntl.ioctl(fd, termios.TIOCSWINSZ, winsize)
+        _resize_screen(session, cols, rows)
         return jsonify({"status": "ok"})
     except OSError as e:
         return jsonify({"error": str(e)}), 500
@@ -1235,17 +2274,286 @@ def close_session():
     if not session:
         return jsonify({"status": "ok", "detail": "session not found"})
 
-    pid = session["pid"]
-    master_fd = session["master_fd"]
+    pid = session.pid
+    master_fd = session.master_fd
 
     terminate_session(session_id, pid, master_fd)
     logger.info(f"Session {session_id} closed by client")
     return jsonify({"status": "ok"})
 
 
+# ── Worker shards ─────────────────────────────────────────────────────────
+#
+# With WEB_WORKERS > 1 every session lives in one worker (the shard encoded
+# in its id). Whatever worker a request lands on hands it to the owner over
+# the shard links (worker_shards), and the owner relays live output back for
+# WebSockets connected elsewhere.
+
+# Connection to the other workers when WEB_WORKERS > 1 (see initialize_app)
+shard_router = None
+_shard_lock_fd = None
+
+# Endpoints served by the worker that owns the request's session_id
+_SESSION_ROUTES = frozenset((
+    "/api/session/attach", "/api/session/recording", "/api/input", "/api/output",
+    "/api/heartbeat", "/api/resize", "/api/session/close",
+))
+# Setup, PAT rotation and app state live in worker 0
+_GLOBAL_ROUTES = frozenset(("/api/setup-status", "/api/app-state", "/api/pat-status", "/api/configure-pat"))
+
+
+def _local_shard():
+    return shard_router.shard if shard_router is not None else None
+
+
+def _owner_shard(session_id):
+    """The other worker that owns *session_id*, or None if it is ours (or unknown)."""
+    if shard_router is None or not isinstance(session_id, str):
+        return None
+    shard = shard_of(session_id)
+    if shard is None or shard == shard_router.shard or shard >= shard_router.count:
+        return None
+    return shard
+
+
+def _remote_session_count():
+    """Sessions held by the other workers (0 unsharded); unreachable ones count as empty."""
+    if shard_router is None:
+        return 0
+    replies = shard_router.request_all({"op": "count"}, timeout=SHARD_FANOUT_TIMEOUT)
+    return sum(reply["count"] for reply, _ in replies.values())
+
+
+def _forward_event(shard, header, payload=b""):
+    """Hand a WebSocket event for a remote session to its owner (in order, no reply)."""
+    try:
+        shard_router.send(shard, header, payload)
+    except OSError as e:
+        logger.warning(f"Dropped {header['op']} for worker {shard}: {e}")
+
+
+def _push(link, event, data, room=None, to=None, join=(), **fields):
+    """Have the worker at the other end of *link* emit *event* to its own
+    clients: to a room (if anyone there still listens) or one client sid."""
+    binary = isinstance(data, bytes)
+    header = {"push": event, "room": room, "to": to, "join": list(join), "binary": binary, **fields}
+    try:
+        link.send(header, data if binary else json.dumps(data).encode())
+    except OSError:
+        pass  # Link gone — _drop_shard_link forgets its viewers
+
+
+@app.before_request
+def route_to_owner():
+    """Hand a request for another worker's session (or worker 0's global
+    state) to that worker and return its response."""
+    if shard_router is None or FORWARDED_HEADER in request.headers:
+        return None
+    if request.path in _GLOBAL_ROUTES:
+        shard = 0 if shard_router.shard != 0 else None
+    elif request.path in _SESSION_ROUTES:
+        body = request.get_json(silent=True) if request.method == "POST" else None
+        session_id = body.get("session_id") if isinstance(body, dict) else request.args.get("session_id")
+        shard = _owner_shard(session_id)
+    elif request.path == "/api/output-batch":
+        # A batch of one worker's sessions goes there whole, so it can be held as a long poll
+        body = request.get_json(silent=True)
+        session_ids = body.get("session_ids") if isinstance(body, dict) else None
+        owners = {_owner_shard(sid) for sid in session_ids} if isinstance(session_ids, list) else set()
+        shard = owners.pop() if len(owners) == 1 else None
+    else:
+        return None
+    if shard is None:
+        return None
+
+    headers = [[name, value] for name, value in request.headers.items()
+               if name.lower() not in ("host", "content-length")]
+    try:
+        reply, body = shard_router.request(shard, {
+            "op": "http", "method": request.method, "path": request.path,
+            "query": request.query_string.decode("latin-1"), "headers": headers,
+        }, request.get_data())
+    except OSError as e:
+        logger.warning(f"Worker {shard} unavailable for {request.path}: {e}")
+        return jsonify({"error": f"Session worker unavailable: {e}"}), 503
+    return Response(body, status=reply["status"], headers=reply["headers"])
+
+
+def _serve_http(link, header, payload):
+    """Run a request another worker handed over through this app, as if it had arrived here."""
+    builder = EnvironBuilder(method=header["method"], path=header["path"],
+                             query_string=header["query"], data=payload,
+                             headers=header["headers"] + [[FORWARDED_HEADER, "1"]])
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+    app_iter, status, headers = run_wsgi_app(app.wsgi_app, environ, buffered=True)
+    # Already buffered (and so complete): streams like recordings travel in one piece
+    body = b"".join(app_iter)
+    return {"status": int(status.split(None, 1)[0]),
+            "headers": [[name, value] for name, value in headers.items()
+                        if name.lower() != "content-length"]}, body
+
+
+def _serve_join(link, header, payload):
+    """join_session for a client of another worker: relay the replay and then
+    live output to it over *link* (see _emit_pending_output)."""
+    session_id = header["session_id"]
+    session = _get_session(session_id)
+    if not session:
+        return {'status': 'error', 'message': 'Session not found'}, b""
+    try:
+        offset = _parse_offset(header.get("offset"))
+    except ValueError as e:
+        return {'status': 'error', 'message': str(e)}, b""
+
+    index = session.index
+    binary = header["binary"] and index is not None
+    compress = binary and header["compress"]
+    fmt = "deflate" if compress else "bin" if binary else "text"
+    client = header["client"]
+
+    with session.send_lock, session.lock:
+        session.last_poll_time = time.time()
+        session.http_cursor = session.output_buffer.end
+        # Same ordering as a local join: the join and replay reach the other
+        # worker on this link before any live output can
+        live_offset = session.emit_cursor
+        replay = _replay_output(session, session_id, offset, live_offset, binary, compress)
+        event, data = replay if replay is not None else (None, None)
+        _push(link, event, data, to=client, join=(session_id, _output_room(session_id, fmt)))
+        session.remote_viewers.setdefault(link, set()).add(fmt)
+    return {'status': 'ok', 'next_offset': live_offset, 'index': index,
+            'binary': binary, 'compress': compress}, b""
+
+
+def _serve_input(link, header, payload):
+    if "index" in header:
+        session = sessions.by_index(header["index"])
+        session_id = session.session_id if session else None
+    else:
+        session_id = header["session_id"]
+        session = _get_session(session_id)
+    if not session:
+        return
+    rejected = _receive_input(session_id, session, payload)
+    if rejected is not None:
+        _push(link, 'input_rejected', rejected, to=header["client"])
+
+
+def _serve_unsubscribe(link, header, payload):
+    """The other worker has no viewers left in one of our sessions' output rooms."""
+    session = _get_session(header["session_id"])
+    if not session:
+        return
+    with session.lock:
+        fmts = session.remote_viewers.get(link)
+        if fmts is not None:
+            fmts.discard(header["fmt"])
+            if not fmts:
+                del session.remote_viewers[link]
+
+
+# Requests (answered) and events (in order, unanswered) from other workers
+_SHARD_OPS = {
+    "http": _serve_http,
+    "join": _serve_join,
+    "count": lambda link, header, payload: ({"count": len(sessions)}, b""),
+    "sessions": lambda link, header, payload: ({"sessions": _session_summaries()}, b""),
+    "output-batch": lambda link, header, payload: (
+        {"outputs": _read_output_batch(header["offsets"], header.get("wait", 0))}, b""),
+    "input": _serve_input,
+    "ack": lambda link, header, payload: _receive_ack(header["session_id"], header["client"],
+                                                      header["offset"], header["hidden"]),
+    "resize": lambda link, header, payload: _receive_resize(header["session_id"], header["cols"], header["rows"]),
+    "heartbeat": lambda link, header, payload: _receive_heartbeat(header["session_ids"]),
+    "leave": lambda link, header, payload: _leave_session(header["session_id"], header["client"]),
+    "unsubscribe": _serve_unsubscribe,
+}
+
+
+def _serve_shard(link, header, payload):
+    """ShardRouter handler: a frame from another worker."""
+    if "push" in header:
+        _receive_push(link, header, payload)
+        return None
+    handler = _SHARD_OPS.get(header.get("op"))
+    if handler is None:
+        raise ValueError(f"unknown worker op {header.get('op')!r}")
+    return handler(link, header, payload)
+
+
+def _receive_push(link, header, payload):
+    """Emit an event the owner of a session pushed for our WebSocket clients."""
+    to = header["to"]
+    for room in header["join"]:
+        socketio.server.enter_room(to, room, namespace='/')
+    event = header["push"]
+    if event is None:
+        return
+    data = payload if header["binary"] else json.loads(payload)
+    room = header["room"]
+    if to is not None:
+        socketio.emit(event, data, to=to)
+    elif _room_occupied(room):
+        socketio.emit(event, data, room=room)
+    elif "fmt" in header:
+        # Our viewers left (or disconnected): stop the owner relaying output.
+        # On this link, the one the owner keeps our subscription under
+        try:
+            link.send({"op": "unsubscribe", "session_id": header["session_id"], "fmt": header["fmt"]})
+        except OSError:
+            pass
+
+
+def _drop_shard_link(link):
+    """A worker went away: stop relaying output to its viewers."""
+    for _, session in sessions.items():
+        with session.lock:
+            session.remote_viewers.pop(link, None)
+
+
+def _start_shard():
+    """Claim this worker's shard and connect to the other workers."""
+    global shard_router, _shard_lock_fd
+    shard, _shard_lock_fd = claim_shard(SHARD_SOCKET_DIR, WEB_WORKERS)
+    sessions.set_index_range(*index_range(shard, WEB_WORKERS))
+    shard_router = ShardRouter(shard, WEB_WORKERS, SHARD_SOCKET_DIR, _serve_shard,
+                               on_link_closed=_drop_shard_link)
+    shard_router.start()
+
+
+def _adopt_sessions():
+    """Take over the sessions a previous worker left running in the PTY host.
+
+    Each keeps its id and label; its output continues at the offset the old
+    worker reached, starting with whatever the host buffered in between.
+    """
+    for shell in pty_host.adopt(shard=_local_shard()):
+        meta = shell.meta
+        session_id = meta["session_id"]
+        ring = OutputRing(OUTPUT_BUFFER_BYTES, start=shell.start)
+        ring.write(shell.output)
+        session = sessions.add(Session(
+            session_id, shell.master_fd, shell.pid,
+            label=meta.get("label", ""),
+            created_at=meta.get("created_at"),
+            output_buffer=ring,
+            screen=TerminalScreen(),
+            offset_cell=pty_host.offset_cell(shell.pid),
+        ))
+        pty_mux.register(session_id, shell.master_fd, shell.pid)
+        resource_monitor.track(session_id, shell.pid)
+        session.advance(RUNNING)
+        idle_deadlines.add(session_id, time.time() + SESSION_TIMEOUT_SECONDS * TIMEOUT_WARNING_FRACTION)
+        logger.info(f"Adopted session {session_id} (pid={shell.pid}, {len(shell.output)} bytes buffered)")
+
+
 def initialize_app(local_dev=False):
-    """One-time init: detect owner, start cleanup thread."""
-    global app_owner
+    """One-time init: detect owner, claim a worker shard, connect to the PTY
+    host, start resource sampling and the warm shell pool."""
+    global app_owner, pty_host
 
     # Install SIGTERM handler only for gunicorn (production).
     # For local dev, SIG_DFL is fine — the process just exits cleanly.
@@ -1269,10 +2577,52 @@ def initialize_app(local_dev=False):
     os.environ.pop("DATABRICKS_CLIENT_SECRET", None)
     logger.info("SP credentials stripped — PAT-only auth from this point")
 
-    # Start background cleanup thread
-    cleanup_thread = threading.Thread(target=cleanup_stale_sessions, daemon=True)
-    cleanup_thread.start()
-    logger.info(f"Started session cleanup thread (timeout={SESSION_TIMEOUT_SECONDS}s, interval={CLEANUP_INTERVAL_SECONDS}s)")
+    # Split sessions across gunicorn workers; before adopting, which only
+    # takes this shard's shells
+    if WEB_WORKERS > 1:
+        _start_shard()
+
+    # Shells outlive this worker in the PTY host; pick up any it left behind
+    if PTY_HOST_SOCKET:
+        try:
+            pty_host = PtyHostClient.connect(PTY_HOST_SOCKET)
+        except OSError as e:
+            logger.error(f"PTY host unavailable ({e}) — shells will die with this worker")
+        else:
+            try:
+                _adopt_sessions()
+            except Exception:
+                logger.exception("Adopting sessions from the PTY host failed")
+
+    # Sample (and maybe throttle) sessions' resource use
+    if BACKGROUND_THROTTLE and not can_restore_priority():
+        # A reniced session would stay slow after its next keystroke
+        resource_monitor.policy.renice = False
+        logger.info("Background sessions are not reniced: no CAP_SYS_NICE to restore their priority")
+    if BACKGROUND_THROTTLE and BACKGROUND_CPU_CGROUP and BACKGROUND_CPU_PERCENT:
+        resource_monitor.policy.cpu_percent = BACKGROUND_CPU_PERCENT
+        # The tree is reorganized once, by worker 0; the others use it as it is
+        resource_monitor.policy.cgroups = CpuCgroups.detect(setup=_local_shard() in (None, 0))
+        if resource_monitor.policy.cgroups is not None:
+            logger.info(f"Background sessions capped at {BACKGROUND_CPU_PERCENT}% CPU via cgroup v2")
+    resource_monitor.start()
+
+    # Drop recordings past their retention limits
+    try:
+        prune_recordings()
+    except OSError as e:
+        logger.warning(f"Could not prune session recordings: {e}")
+
+    # Fingerprint and precompress the UI's static files before the first page load
+    try:
+        logger.info(f"Prepared {static_assets.build()} static assets")
+    except OSError as e:
+        logger.warning(f"Could not prepare static assets: {e}")
+
+    # Pre-spawn shells for new tabs
+    shell_pool.start()
+    if WARM_SHELL_POOL_SIZE:
+        logger.info(f"Started warm shell pool (size={WARM_SHELL_POOL_SIZE})")
 
 
 if __name__ == "__main__":
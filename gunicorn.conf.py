@@ -1,8 +1,9 @@
 import os
 
 bind = f"0.0.0.0:{os.environ.get('DATABRICKS_APP_PORT', '8000')}"
-workers = 1          # PTY fds + sessions dict are process-local
-threads = 16         # Concurrent request handling (poll + input + resize + websocket)
+workers = max(1, int(os.environ.get("WEB_WORKERS", "1")))  # Each owns a shard of the sessions (worker_shards)
+threads = 16         # Concurrent request handling (poll + input + resize + websocket); at most
+                     # MAX_HELD_REQUESTS of them wait on output (streams, long polls)
 worker_class = "gthread"
 timeout = 60         # WebSocket connections are long-lived; balance between WS and hung-worker detection
 graceful_timeout = 10  # Databricks gives 15s after SIGTERM
@@ -0,0 +1,119 @@
+"""Per-session idle deadlines on a min-heap, for timeout warnings and reaping.
+
+Idle sessions used to be found by a thread that woke every 15 minutes,
+snapshotted every session and took each one's lock to compare
+``last_poll_time`` — so a timeout warning or reap could be up to 15
+minutes late, and every pass cost O(sessions). ``DeadlineHeap`` instead
+sleeps until the earliest deadline and handles only the sessions that are
+actually due:
+
+- Each key has one live deadline. ``add`` pushes a new heap entry
+  (O(log n)); the entry it replaces stays in the heap and is skipped when
+  popped, so nothing is ever searched for or removed from the middle.
+- Heartbeats don't touch the heap at all. When a deadline passes,
+  ``on_due(key, now)`` re-reads the session and returns its next deadline
+  (or None when it is done with the key); a session that was polled in the
+  meantime is simply pushed back. Keeping a busy session alive costs one
+  heap push per timeout period, not one per heartbeat.
+
+Deadlines are wall-clock (``time.time()``), matching ``last_poll_time``.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineHeap:
+    """Call ``on_due(key, now)`` when *key*'s deadline passes. Thread-safe.
+
+    ``on_due`` runs on the heap's own thread, outside its lock, and returns
+    the key's next deadline or None to drop it.
+    """
+
+    def __init__(self, on_due):
+        self._on_due = on_due
+        self._heap = []             # (when, seq, key); superseded entries are skipped
+        self._deadlines = {}        # key -> live deadline
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def __len__(self):
+        with self._cond:
+            return len(self._deadlines)
+
+    def __contains__(self, key):
+        with self._cond:
+            return key in self._deadlines
+
+    def deadline(self, key):
+        """The live deadline for *key*, or None."""
+        with self._cond:
+            return self._deadlines.get(key)
+
+    def add(self, key, when):
+        """Set *key*'s deadline to *when*, replacing any earlier one."""
+        with self._cond:
+            self._push(key, when)
+            if not (self._thread and self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, daemon=True, name="idle-deadlines")
+                self._thread.start()
+            if self._heap[0][2] == key:
+                self._cond.notify()  # New earliest deadline — shorten the wait
+
+    def discard(self, key):
+        """Forget *key* (its heap entry is skipped when it comes up)."""
+        with self._cond:
+            self._deadlines.pop(key, None)
+            self._compact()
+
+    # ── Loop internals ───────────────────────────────────────────────────
+
+    def _push(self, key, when):
+        self._deadlines[key] = when
+        heapq.heappush(self._heap, (when, next(self._seq), key))
+        self._compact()
+
+    def _compact(self):
+        # Superseded entries are normally popped in passing; rebuild only if
+        # they come to dominate the heap (e.g. many keys discarded early)
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [entry for entry in self._heap
+                          if self._deadlines.get(entry[2]) == entry[0]]
+            heapq.heapify(self._heap)
+
+    def _pop_due(self):
+        """Block until a live deadline passes; return ``(key, when)``."""
+        with self._cond:
+            while True:
+                while self._heap and self._deadlines.get(self._heap[0][2]) != self._heap[0][0]:
+                    heapq.heappop(self._heap)   # Superseded or discarded
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                when, _, key = self._heap[0]
+                delay = when - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                del self._deadlines[key]
+                return key, when
+
+    def _run(self):
+        while True:
+            key, _ = self._pop_due()
+            try:
+                next_when = self._on_due(key, time.time())
+            except Exception:
+                logger.exception(f"Idle deadline handler failed for {key}")
+                continue
+            if next_when is not None:
+                with self._cond:
+                    if key not in self._deadlines:  # Unless re-added meanwhile
+                        self._push(key, next_when)
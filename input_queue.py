@@ -0,0 +1,86 @@
+"""Bounded, non-blocking queue of input waiting to be written to a PTY.
+
+Writing keystrokes straight to a blocking PTY fd stalls the request thread
+whenever the child stops reading: the kernel's tty input buffer is only a few
+KB, so a large paste into a busy agent prompt would block a gunicorn thread
+(and ``os.write`` may return short, silently dropping the rest).
+
+Instead each session's input is appended here and written with non-blocking
+``os.write`` calls of at most ``CHUNK_BYTES``, keeping the unwritten tail of
+a partial write at the head of the queue. The submitting thread tries once
+straight away so ordinary typing has no extra hop; whatever the PTY can't
+take yet is finished by the I/O loop as the fd becomes writable. The queue
+holds at most ``MAX_QUEUED_BYTES``; input that doesn't fit is rejected whole
+so the client can be told, rather than blocking or truncating a paste.
+"""
+
+import collections
+import os
+import threading
+
+CHUNK_BYTES = 4096                  # Max bytes per os.write — lets output interleave with a paste
+WRITE_BUDGET = 64 * 1024            # Max bytes written per call to write_to
+MAX_QUEUED_BYTES = 4 * 1024 * 1024  # Input beyond this is rejected (backpressure)
+
+
+class InputQueue:
+    """FIFO of pending input bytes for one PTY. Thread-safe."""
+
+    __slots__ = ("limit", "_chunks", "_queued", "_lock")
+
+    def __init__(self, limit=MAX_QUEUED_BYTES):
+        self.limit = limit
+        self._chunks = collections.deque()
+        self._queued = 0
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self):
+        """Bytes accepted but not yet written."""
+        return self._queued
+
+    def push(self, data):
+        """Append *data*. Returns False, queueing nothing, if it doesn't fit."""
+        if not data:
+            return True
+        with self._lock:
+            if self._queued + len(data) > self.limit:
+                return False
+            view = memoryview(data)
+            for start in range(0, len(view), CHUNK_BYTES):
+                self._chunks.append(view[start:start + CHUNK_BYTES])
+            self._queued += len(data)
+            return True
+
+    def write_to(self, fd, budget=WRITE_BUDGET):
+        """Write queued input to non-blocking *fd* until it would block, the
+        queue is empty or *budget* bytes are written.
+
+        Returns True once the queue is empty. On a write error the queue is
+        discarded and the OSError raised.
+        """
+        with self._lock:
+            written = 0
+            while self._chunks and written < budget:
+                chunk = self._chunks[0]
+                try:
+                    n = os.write(fd, chunk)
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError:
+                    self._chunks.clear()
+                    self._queued = 0
+                    raise
+                written += n
+                self._queued -= n
+                if n < len(chunk):
+                    self._chunks[0] = chunk[n:]  # Partial write — keep the rest first
+                    break
+                self._chunks.popleft()
+            return not self._chunks
+
+    def clear(self):
+        """Drop anything not yet written."""
+        with self._lock:
+            self._chunks.clear()
+            self._queued = 0
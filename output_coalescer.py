@@ -0,0 +1,67 @@
+"""Adaptive batching of PTY output into fewer Socket.IO frames.
+
+Agent TUIs that redraw constantly, or ``cat bigfile``, produce thousands of
+small PTY reads per second. Emitting each one as its own JSON-framed
+WebSocket message costs more than the bytes themselves. The coalescer
+decides, per session, whether freshly read output goes out immediately or
+waits for a short window to collect more:
+
+- Output after a quiet period (keystroke echo, a prompt) flushes at once.
+- During a burst the window grows with the observed output rate, from
+  ``MIN_WINDOW`` up to ``MAX_WINDOW`` (about one display frame).
+- A batch never holds more than ``FLUSH_BYTES``; reaching it flushes early.
+"""
+
+import math
+
+MIN_WINDOW = 0.002          # Seconds — batching window at low output rates
+MAX_WINDOW = 0.016          # Seconds — cap (~one 60 Hz frame) during floods
+FLUSH_BYTES = 32 * 1024     # Flush as soon as a batch reaches this size
+IDLE_GAP = 0.05             # Output after this much silence is sent immediately
+RATE_TAU = 0.25             # Seconds — time constant of the output-rate estimate
+BURST_RATE = 256 * 1024     # Bytes/s at which the window reaches MAX_WINDOW
+
+
+class OutputCoalescer:
+    """Per-session flush policy. Not thread-safe: callers hold the session lock.
+
+    Times are ``time.monotonic()`` seconds.
+    """
+
+    __slots__ = ("window", "rate", "_last_data", "_pending_since", "_pending_bytes")
+
+    def __init__(self):
+        self.window = MIN_WINDOW
+        self.rate = 0.0                 # Time-decayed bytes/s estimate
+        self._last_data = None
+        self._pending_since = None
+        self._pending_bytes = 0
+
+    @property
+    def pending(self):
+        return self._pending_since is not None
+
+    def add(self, nbytes, now):
+        """Record *nbytes* of new output; return when the batch should be flushed.
+
+        A deadline ``<= now`` means flush immediately.
+        """
+        gap = IDLE_GAP if self._last_data is None else now - self._last_data
+        self._last_data = now
+        # Exponentially decayed rate: old traffic fades out over RATE_TAU
+        self.rate = self.rate * math.exp(-gap / RATE_TAU) + nbytes / RATE_TAU
+        self.window = MIN_WINDOW + (MAX_WINDOW - MIN_WINDOW) * min(1.0, self.rate / BURST_RATE)
+
+        self._pending_bytes += nbytes
+        if self._pending_since is None:
+            if gap >= IDLE_GAP:
+                return now  # First output after a pause — interactive, don't delay
+            self._pending_since = now
+        if self._pending_bytes >= FLUSH_BYTES:
+            return now
+        return self._pending_since + self.window
+
+    def flushed(self):
+        """Mark the pending batch as sent."""
+        self._pending_since = None
+        self._pending_bytes = 0
@@ -0,0 +1,141 @@
+"""Fixed-capacity byte ring for session output, addressed by absolute offsets.
+
+Each session gets one preallocated ``bytearray``; PTY reads land directly in
+it via ``os.readv`` (no per-read ``bytes`` allocation), and every byte ever
+written has a monotonically increasing stream offset. Consumers keep their
+own cursor and ask for "everything since offset N"; bytes older than
+``capacity`` are evicted and reported as a gap.
+
+Decoding happens once, at the consumer edge. ``read()`` only hands out ranges
+that end on a UTF-8 character boundary (a trailing partial sequence stays in
+the ring until the rest arrives), so any slice decodes cleanly on its own —
+the same guarantee an incremental decoder gives, but without per-consumer
+decoder state.
+"""
+
+import os
+
+DEFAULT_CAPACITY = 1024 * 1024   # 1 MiB of scrollback per session
+READ_CHUNK = 65536               # Max bytes pulled from the PTY per readiness event
+
+
+def utf8_incomplete_tail(data):
+    """Return how many trailing bytes of *data* form an incomplete UTF-8 sequence."""
+    n = len(data)
+    for i in range(1, min(3, n) + 1):
+        b = data[n - i]
+        if b & 0xC0 == 0x80:
+            continue  # Continuation byte — keep looking for the lead byte
+        if b < 0xC0:
+            return 0  # ASCII: sequence is complete
+        needed = 2 if b < 0xE0 else 3 if b < 0xF0 else 4
+        return i if needed > i else 0
+    return 0
+
+
+def utf8_continuation_head(data):
+    """Return how many leading bytes of *data* are orphaned continuation bytes."""
+    for i in range(min(3, len(data))):
+        if data[i] & 0xC0 != 0x80:
+            return i
+    return min(3, len(data))
+
+
+class OutputRing:
+    """Preallocated circular byte buffer with absolute stream offsets.
+
+    Not thread-safe: callers hold the owning session's lock.
+    """
+
+    __slots__ = ("_buf", "_view", "_capacity", "_base", "_end")
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, start=0):
+        """*start* is the offset of the first byte written (non-zero when
+        continuing a stream that began elsewhere, e.g. in pty_host)."""
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._capacity = capacity
+        self._base = start
+        self._end = start
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def start(self):
+        """Offset of the oldest byte still held."""
+        return max(self._base, self._end - self._capacity)
+
+    @property
+    def end(self):
+        """Offset one past the newest byte (total bytes ever written)."""
+        return self._end
+
+    def __len__(self):
+        return self._end - self.start
+
+    def _spans(self, size):
+        """Writable memoryviews covering the next *size* bytes (wraps once)."""
+        pos = self._end % self._capacity
+        first = self._view[pos:min(self._capacity, pos + size)]
+        if len(first) == size:
+            return [first]
+        return [first, self._view[:size - len(first)]]
+
+    def fill_from(self, fd, max_bytes=READ_CHUNK):
+        """Read up to *max_bytes* from *fd* straight into the ring.
+
+        Returns the byte count; 0 means EOF.
+        """
+        n = os.readv(fd, self._spans(min(max_bytes, self._capacity)))
+        self._end += n
+        return n
+
+    def write(self, data):
+        """Append *data*, evicting the oldest bytes if needed."""
+        data = memoryview(data)
+        total = len(data)
+        if total > self._capacity:
+            self._end += total - self._capacity  # Only the newest bytes survive
+            data = data[-self._capacity:]
+        offset = 0
+        for span in self._spans(len(data)):
+            span[:] = data[offset:offset + len(span)]
+            offset += len(span)
+        self._end += len(data)
+
+    def read(self, since=0, until=None):
+        """Return ``(start, end, data)`` for the held bytes in ``[since, until)``.
+
+        *start* is ``since`` clamped to the oldest held byte (``start > since``
+        means bytes were evicted). *end* is trimmed back to a UTF-8 character
+        boundary, so ``data`` decodes cleanly; pass *end* as the next cursor.
+        """
+        until = self._end if until is None else min(until, self._end)
+        start = max(since, self.start)
+        if start >= until:
+            return until, until, b""
+        data = self._copy(start, until)
+        if start > since:
+            # Gap: the evicted region may have cut a character in half
+            skip = utf8_continuation_head(data)
+            start += skip
+            data = data[skip:]
+        trim = utf8_incomplete_tail(data)
+        if trim:
+            until -= trim
+            data = data[:-trim]
+        return start, until, data
+
+    def dump(self):
+        """Return ``(start, data)``: every held byte, with no UTF-8 trimming."""
+        start = self.start
+        return start, self._copy(start, self._end)
+
+    def _copy(self, start, end):
+        a = start % self._capacity
+        b = a + (end - start)
+        if b <= self._capacity:
+            return bytes(self._view[a:b])
+        return bytes(self._view[a:]) + bytes(self._view[:b - self._capacity])
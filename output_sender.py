@@ -0,0 +1,125 @@
+"""Per-session outbound queues drained by a small pool of sender threads.
+
+``socketio.emit`` and shard-link pushes used to run on the PTY multiplexer
+thread, under the session lock. In threading mode an emit takes engine.io
+queue locks and a push writes to a Unix socket, so a slow viewer or a busy
+peer worker stalled reading *every* PTY — and a stalled PTY fills its
+kernel buffer and blocks the agent writing to it. Now the loop only
+``submit``\\s a task for the session, and sender threads run it:
+
+- Tasks for one key (a session id) run in submission order, one at a time,
+  so a session's output frames and its ``session_exited`` never overtake
+  each other. Different sessions are sent in parallel by up to ``workers``
+  threads, so one slow viewer holds up only its own session.
+- A task submitted with a ``tag`` is dropped while the key's last queued
+  task has the same tag: output tasks read everything new from the
+  session's ring when they run, so a backlog coalesces into one larger
+  frame instead of growing a queue of copies.
+- Each key's queue holds at most ``max_queued`` tasks; ``submit`` returns
+  False rather than waiting when it is full.
+
+``stats()`` reports queue depth and emit latency (submission to the end of
+the task) for /health.
+"""
+
+import collections
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+SENDER_WORKERS = 4          # Threads sending output; each serves one session at a time
+MAX_QUEUED = 64             # Tasks waiting per session before submit() refuses more
+LATENCY_WINDOW = 256        # Recent tasks the latency figures cover
+
+
+class OutputSender:
+    """Runs submitted tasks per key, in order, off the caller's thread. See module docstring."""
+
+    def __init__(self, workers=SENDER_WORKERS, max_queued=MAX_QUEUED):
+        self.workers = workers
+        self.max_queued = max_queued
+        self._cond = threading.Condition()
+        self._queues = {}           # key -> deque of (task, tag, submitted_at)
+        self._ready = collections.deque()   # Keys with tasks and no thread on them
+        self._busy = set()          # Keys a thread is running a task for
+        self._threads = []
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._sent = 0
+        self._refused = 0
+
+    def submit(self, key, task, tag=None):
+        """Queue ``task()`` to run after *key*'s earlier tasks. Never blocks.
+
+        Returns False if *key*'s queue is full and the task was refused.
+        """
+        with self._cond:
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = collections.deque()
+            elif tag is not None and queue and queue[-1][1] == tag:
+                return True     # The queued task will cover this one
+            if len(queue) >= self.max_queued:
+                self._refused += 1
+                return False
+            queue.append((task, tag, time.monotonic()))
+            if len(queue) == 1 and key not in self._busy:
+                self._ready.append(key)
+                self._ensure_started()
+                self._cond.notify()
+        return True
+
+    def drain(self, timeout=5.0):
+        """Wait until every task submitted so far has run (for tests/shutdown)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while (self._queues or self._busy) and time.monotonic() < deadline:
+                self._cond.wait(0.01)
+            return not (self._queues or self._busy)
+
+    def stats(self):
+        with self._cond:
+            depths = [len(queue) for queue in self._queues.values()]
+            latencies = sorted(self._latencies)
+            sent, refused = self._sent, self._refused
+        return {
+            "queued": sum(depths),
+            "max_session_depth": max(depths, default=0),
+            "sent": sent,
+            "refused": refused,
+            "latency_ms_p50": round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+            "latency_ms_max": round(latencies[-1] * 1000, 2) if latencies else None,
+        }
+
+    # ── Internals ────────────────────────────────────────────────────────
+
+    def _ensure_started(self):
+        """Caller holds _cond."""
+        self._threads = [t for t in self._threads if t.is_alive()]
+        if len(self._threads) < min(self.workers, len(self._ready) + len(self._busy)):
+            thread = threading.Thread(target=self._run, daemon=True, name="output-sender")
+            self._threads.append(thread)
+            thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._ready:
+                    self._cond.wait()
+                key = self._ready.popleft()
+                self._busy.add(key)
+                task, _, submitted_at = self._queues[key].popleft()
+            try:
+                task()
+            except Exception:
+                logger.exception(f"Output task for {key} failed")
+            with self._cond:
+                self._latencies.append(time.monotonic() - submitted_at)
+                self._sent += 1
+                self._busy.discard(key)
+                if self._queues[key]:
+                    self._ready.append(key)
+                else:
+                    del self._queues[key]
+                self._cond.notify_all()  # Wake drain() and idle threads
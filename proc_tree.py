@@ -0,0 +1,165 @@
+"""In-process lookup of what a session is running, for the session picker.
+
+``/api/sessions`` and ``/api/session/attach`` label each session with its
+foreground program. That used to fork ``pgrep -P`` plus one or two
+``ps -o comm=`` per session on every call; the picker polls, so five
+sessions meant up to fifteen subprocesses a poll. ``ProcessInspector``
+answers from ``/proc`` instead:
+
+- The foreground process group of the session's terminal, from
+  ``tcgetpgrp`` on the PTY master. That is the job the user is actually
+  looking at, even when the shell has several background children.
+- Failing that, the shell's newest child from
+  ``/proc/<pid>/task/*/children`` (or a ``/proc/*/stat`` scan where that
+  file isn't available), else the shell itself.
+
+Names come from ``/proc/<pid>/comm``. Results are cached for ``ttl``
+seconds and shared by every caller. Without ``/proc`` (macOS local dev) the
+old ``pgrep``/``ps`` commands are used.
+"""
+
+import os
+import subprocess
+import threading
+import time
+
+PROCESS_CACHE_TTL = 2.0     # Seconds a session's process name is reused
+MAX_CACHE_ENTRIES = 256
+
+_HAS_PROC = os.path.isdir("/proc/self/task")
+# Kernels without CONFIG_PROC_CHILDREN have no task/*/children files
+_HAS_PROC_CHILDREN = os.path.exists(f"/proc/self/task/{os.getpid()}/children")
+
+
+def _read_comm(pid):
+    """Name of *pid*, or None if it is gone."""
+    try:
+        # cmdline first: once it is there, exec has renamed the process
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            exec_done = bool(f.read(1))
+        with open(f"/proc/{pid}/comm") as f:
+            comm = f.read().strip() or None
+    except OSError:
+        return None
+    if exec_done:
+        return comm
+    # No cmdline: a zombie, a kernel thread, or a process mid-exec that still
+    # has its parent's name. The executable is already the new program's
+    try:
+        return os.path.basename(os.readlink(f"/proc/{pid}/exe")) or comm
+    except OSError:
+        return comm
+
+
+def _children(pid):
+    """Child pids of *pid*, oldest first."""
+    if not _HAS_PROC_CHILDREN:
+        return _children_by_scan(pid)
+    children = []
+    try:
+        tids = os.listdir(f"/proc/{pid}/task")
+    except OSError:
+        return children     # Process gone
+    for tid in tids:
+        try:
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                children.extend(int(c) for c in f.read().split())
+        except OSError:
+            continue    # Thread exited mid-listing
+    return sorted(children)
+
+
+def _children_by_scan(pid):
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # Field 4 (ppid) follows the parenthesised comm, which may contain spaces
+        fields = stat[stat.rfind(")") + 2:].split()
+        if len(fields) > 1 and int(fields[1]) == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def _ps_name(pid):
+    result = subprocess.run(["ps", "-o", "comm=", "-p", str(pid)],
+                            capture_output=True, text=True, timeout=5)
+    if result.returncode == 0 and result.stdout.strip():
+        # ps may return the full path; take basename
+        return os.path.basename(result.stdout.strip().splitlines()[0].strip())
+    return None
+
+
+def _ps_foreground(pid):
+    """Subprocess fallback for platforms without /proc."""
+    result = subprocess.run(["pgrep", "-P", str(pid)], capture_output=True, text=True, timeout=5)
+    if result.returncode == 0 and result.stdout.strip():
+        name = _ps_name(result.stdout.strip().splitlines()[-1].strip())
+        if name:
+            return name
+    return _ps_name(pid)
+
+
+class ProcessInspector:
+    """Cached foreground-process lookups. Thread-safe."""
+
+    def __init__(self, ttl=PROCESS_CACHE_TTL):
+        self.ttl = ttl
+        self._cache = {}    # (pid, fd) -> (expires_at, name)
+        self._lock = threading.Lock()
+
+    def foreground(self, pid, fd=None):
+        """Name of the program in the foreground of session *pid* (PTY master
+        *fd*), or ``"unknown"`` on any error / dead pid."""
+        if not isinstance(pid, int) or pid <= 0:
+            return "unknown"
+        key = (pid, fd)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] > now:
+                return cached[1]
+        try:
+            name = self._lookup(pid, fd) or "unknown"
+        except Exception:
+            name = "unknown"
+        with self._lock:
+            if len(self._cache) >= MAX_CACHE_ENTRIES:
+                self._cache = {k: v for k, v in self._cache.items() if v[0] > now}
+            self._cache[key] = (now + self.ttl, name)
+        return name
+
+    def invalidate(self, pid=None):
+        """Forget cached names (for *pid* only, if given)."""
+        with self._lock:
+            if pid is None:
+                self._cache.clear()
+            else:
+                for key in [k for k in self._cache if k[0] == pid]:
+                    del self._cache[key]
+
+    @staticmethod
+    def _lookup(pid, fd):
+        if not _HAS_PROC:
+            return _ps_foreground(pid)
+        if not os.path.exists(f"/proc/{pid}"):
+            return None
+        if fd is not None:
+            try:
+                pgrp = os.tcgetpgrp(fd)
+            except OSError:
+                pgrp = None
+            name = _read_comm(pgrp) if pgrp and pgrp > 0 else None
+            if name:
+                return name
+        children = _children(pid)
+        if children:
+            name = _read_comm(children[-1])
+            if name:
+                return name
+        return _read_comm(pid)
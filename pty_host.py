@@ -0,0 +1,638 @@
+"""PTY host: a daemon that owns the shells, so worker restarts don't kill them.
+
+Shells used to be children of the gunicorn worker, and their PTY masters
+lived only in its fd table: a worker restart, or the hung-worker kill after
+``timeout``, hung up every terminal and took long-running agents with it.
+With ``PTY_HOST_SOCKET`` set, shells are spawned by this separate process
+instead, and the worker becomes a front end that can come and go:
+
+- The worker asks the host to spawn a shell over a Unix socket
+  (``SOCK_SEQPACKET``, one JSON header + optional payload per message) and
+  receives the PTY master by SCM_RIGHTS fd passing. The shell's environment
+  can outgrow a message, so it travels the other way as an attached
+  anonymous file. It then reads, writes
+  and resizes that fd exactly as before — no extra hop per byte.
+- The host keeps its own copy of every master, so the shell never sees a
+  hangup when the worker dies. While a shell's owning connection is open
+  the host only watches for exit; once the connection drops, the host reads
+  the shell's output into its own ``OutputRing`` so a busy agent doesn't
+  block on a full PTY buffer.
+- A restarted worker ``adopt``\\s the orphaned shells: it gets their fds,
+  the metadata it attached with ``describe`` (session id, label, ...) and
+  the output buffered meanwhile. Output offsets carry on where the old
+  worker left off — the worker keeps its current offset in a shared 8-byte
+  cell (``OffsetCell``) that the host reads on detach — so reconnecting
+  browsers resume from their cursors.
+- The host is the shells' parent, so it also terminates them (``close``,
+  with the usual SIGHUP -> SIGKILL escalation) and reaps them. Orphaned
+  shells that were never described (warm shells) are killed on detach.
+
+``PtyHostClient.connect`` starts the host on first use if nothing is
+listening, so no extra process needs configuring. The socket is created
+mode 0600: whoever can connect gets a shell.
+"""
+
+import argparse
+import itertools
+import json
+import mmap
+import os
+import pty
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import logging
+from collections import namedtuple
+
+from output_ring import OutputRing
+from pty_mux import PTYMultiplexer
+from session_reaper import SessionReaper
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE = 65536         # Largest datagram either side sends or accepts
+MAX_FDS = 253               # SCM_MAX_FD
+CHUNK = 32 * 1024           # Buffered output per message when adopting
+DETACHED_BUFFER_BYTES = 1024 * 1024   # Output held per orphaned shell
+CONNECT_TIMEOUT = 10        # Seconds to wait for a freshly launched host
+REQUEST_TIMEOUT = 30        # Seconds to wait for a reply
+
+_OFFSET = struct.Struct("=Q")
+
+# A shell handed to a restarted worker, with the output buffered for it
+AdoptedShell = namedtuple("AdoptedShell", "master_fd pid meta start output")
+
+
+# ── Wire format ──────────────────────────────────────────────────────────
+
+def send_message(sock, header, payload=b"", fds=()):
+    """Send one message: JSON *header*, NUL, raw *payload*, *fds* attached."""
+    data = json.dumps(header).encode() + b"\0" + payload
+    if len(data) > MAX_MESSAGE:
+        raise ValueError(f"message of {len(data)} bytes exceeds {MAX_MESSAGE}")
+    if fds:
+        socket.send_fds(sock, [data], list(fds))
+    else:
+        sock.send(data)
+
+
+def recv_message(sock):
+    """Receive one message as ``(header, payload, fds)``; None at EOF."""
+    data, fds, flags, _ = socket.recv_fds(sock, MAX_MESSAGE, MAX_FDS)
+    if not data:
+        for fd in fds:
+            os.close(fd)
+        return None
+    if flags & (socket.MSG_TRUNC | socket.MSG_CTRUNC):
+        for fd in fds:
+            os.close(fd)
+        raise OSError("truncated PTY host message")
+    header, _, payload = data.partition(b"\0")
+    return json.loads(header), payload, fds
+
+
+class OffsetCell:
+    """An 8-byte counter in memory shared between the host and a worker.
+
+    The worker stores its output offset for one shell after every read; the
+    host reads it when the worker goes away, so buffered output continues
+    the same offset sequence. Surviving a crash is the point: no message
+    has to be sent on the way down.
+    """
+
+    def __init__(self, fd):
+        self._map = mmap.mmap(fd, _OFFSET.size)
+
+    @staticmethod
+    def new_fd():
+        """A fresh zeroed cell to map on both sides."""
+        fd = _anonymous_file("pty-host-offset")
+        os.ftruncate(fd, _OFFSET.size)
+        return fd
+
+    @property
+    def value(self):
+        return _OFFSET.unpack_from(self._map)[0]
+
+    @value.setter
+    def value(self, offset):
+        _OFFSET.pack_into(self._map, 0, offset)
+
+    def close(self):
+        self._map.close()
+
+
+def _anonymous_file(name):
+    """An fd for a file with no name on disk, to share by fd passing."""
+    if hasattr(os, "memfd_create"):
+        return os.memfd_create(name)
+    with tempfile.TemporaryFile() as f:
+        return os.dup(f.fileno())
+
+
+def _file_with(data):
+    """An anonymous file holding *data*: a payload too large for a message."""
+    fd = _anonymous_file("pty-host-payload")
+    try:
+        with os.fdopen(os.dup(fd), "wb") as f:
+            f.write(data)
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+def _read_file(fd):
+    """Everything in the file *fd* (from _file_with)."""
+    with os.fdopen(os.dup(fd), "rb") as f:
+        f.seek(0)
+        return f.read()
+
+
+def _spawn(argv, env, cwd):
+    """Fork *argv* on a new PTY as a session leader. Returns (master_fd, pid)."""
+    master_fd, slave_fd = pty.openpty()
+    try:
+        pid = subprocess.Popen(argv, stdin=slave_fd, stdout=slave_fd, stderr=slave_fd,
+                               preexec_fn=os.setsid, env=env, cwd=cwd).pid
+    except Exception:
+        os.close(master_fd)
+        raise
+    finally:
+        os.close(slave_fd)
+    os.set_blocking(master_fd, False)
+    return master_fd, pid
+
+
+# ── Host ─────────────────────────────────────────────────────────────────
+
+class _Shell:
+    __slots__ = ("pid", "master_fd", "cell_fd", "cell", "meta", "owner", "ring")
+
+    def __init__(self, pid, master_fd, cell_fd, owner):
+        self.pid = pid
+        self.master_fd = master_fd
+        self.cell_fd = cell_fd
+        self.cell = OffsetCell(cell_fd)
+        self.meta = None        # Set by describe(); None for warm shells
+        self.owner = owner      # _Connection reading the shell, or None if orphaned
+        self.ring = None        # Output buffered while orphaned
+
+
+class _Connection:
+    def __init__(self, sock):
+        self.sock = sock
+        self._send_lock = threading.Lock()
+
+    def send(self, header, payload=b"", fds=()):
+        """Send, ignoring a worker that has already gone."""
+        try:
+            with self._send_lock:
+                send_message(self.sock, header, payload, fds)
+        except OSError as e:
+            logger.info(f"PTY host: dropping message to closed worker connection: {e}")
+
+
+class PtyHost:
+    """Own shells on behalf of worker connections. See module docstring."""
+
+    def __init__(self, path, buffer_bytes=DETACHED_BUFFER_BYTES):
+        self.path = path
+        self._buffer_bytes = buffer_bytes
+        self._lock = threading.Lock()
+        self._shells = {}       # pid -> _Shell
+        self._mux = PTYMultiplexer(on_readable=self._read, on_exit=self._exited)
+        self._reaper = SessionReaper(self._gone)
+        self._listener = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._shells)
+
+    def listen(self):
+        """Bind the socket. Raises OSError if another host is already serving it."""
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            probe.connect(self.path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            pass  # Nothing listening — a stale socket file at most
+        else:
+            raise OSError(f"a PTY host is already listening on {self.path}")
+        finally:
+            probe.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        old_umask = os.umask(0o177)     # Socket file created 0600
+        try:
+            listener.bind(self.path)
+        finally:
+            os.umask(old_umask)
+        listener.listen()
+        self._listener = listener
+        logger.info(f"PTY host listening on {self.path}")
+
+    def serve_forever(self):
+        if self._listener is None:
+            self.listen()
+        listener = self._listener
+        while True:
+            try:
+                sock, _ = listener.accept()
+            except OSError:
+                if self._listener is None:
+                    return  # close()
+                raise
+            threading.Thread(target=self._serve, args=(_Connection(sock),),
+                             daemon=True, name="pty-host-conn").start()
+
+    def close(self):
+        """Stop accepting connections (shells are left running)."""
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            try:
+                listener.shutdown(socket.SHUT_RDWR)     # Wakes a blocked accept()
+            except OSError:
+                pass
+            listener.close()
+
+    # ── Requests ─────────────────────────────────────────────────────────
+
+    def _serve(self, conn):
+        try:
+            while True:
+                message = recv_message(conn.sock)
+                if message is None:
+                    break
+                header, _, fds = message
+                handler = getattr(self, f"_op_{header.get('op')}", None)
+                try:
+                    if handler is None:
+                        raise ValueError(f"unknown op {header.get('op')!r}")
+                    handler(conn, header, fds)
+                except Exception as e:
+                    logger.warning(f"PTY host request {header.get('op')} failed: {e}")
+                    conn.send({"id": header.get("id"), "error": str(e)})
+                finally:
+                    for fd in fds:
+                        os.close(fd)    # Request payloads; handlers dup what they keep
+        except OSError as e:
+            logger.warning(f"PTY host connection error: {e}")
+        finally:
+            conn.sock.close()
+            self._orphan(conn)
+
+    def _op_spawn(self, conn, header, fds):
+        if len(fds) != 1:
+            raise ValueError("spawn needs the environment file")
+        env = json.loads(_read_file(fds[0]))
+        master_fd, pid = _spawn(header["argv"], env, header.get("cwd"))
+        shell = _Shell(pid, master_fd, OffsetCell.new_fd(), conn)
+        with self._lock:
+            self._shells[pid] = shell
+        # The worker reads; we only watch for exit until it goes away
+        self._mux.register(pid, master_fd, pid, paused=True)
+        conn.send({"id": header["id"], "pid": pid}, fds=(master_fd, shell.cell_fd))
+        logger.info(f"PTY host spawned pid={pid}")
+
+    def _op_describe(self, conn, header, fds):
+        with self._lock:
+            shell = self._shells.get(header["pid"])
+            if shell is None or shell.owner is not conn:
+                raise ValueError(f"no shell pid={header['pid']} on this connection")
+            shell.meta = header["meta"]
+        conn.send({"id": header["id"]})
+
+    def _op_adopt(self, conn, header, fds):
+        where = header.get("where") or {}
+        taken = []
+        with self._lock:
+            for shell in self._shells.values():
+                if shell.owner is None and shell.meta is not None and shell.pid not in self._reaper \
+                        and all(shell.meta.get(key) == value for key, value in where.items()):
+                    shell.owner = conn
+                    self._mux.pause(shell.pid)  # Serialized with reads: the ring is ours now
+                    taken.append((shell, shell.ring))
+                    shell.ring = None
+        described = []
+        passed = []
+        for shell, ring in taken:
+            start, output = ring.dump() if ring is not None else (shell.cell.value, b"")
+            for i in range(0, len(output), CHUNK):
+                conn.send({"id": header["id"], "pid": shell.pid, "more": True}, output[i:i + CHUNK])
+            described.append({"pid": shell.pid, "meta": shell.meta, "start": start})
+            passed += [shell.master_fd, shell.cell_fd]
+        conn.send({"id": header["id"], "shells": described}, fds=passed)
+        if taken:
+            logger.info(f"PTY host handed {len(taken)} orphaned shell(s) to a worker")
+
+    def _op_close(self, conn, header, fds):
+        pid = header["pid"]
+        with self._lock:
+            shell = self._shells.get(pid)
+            owned = shell is not None and shell.owner is conn
+        if not owned:
+            conn.send({"id": header["id"]})  # Already gone
+            return
+        self._reaper.reap(pid, pid, (conn, header["id"]))
+
+    # ── Shell lifetime ───────────────────────────────────────────────────
+
+    def _orphan(self, conn):
+        """*conn* went away: buffer its shells' output until a worker adopts them."""
+        held, doomed = 0, []
+        with self._lock:
+            for shell in self._shells.values():
+                if shell.owner is not conn:
+                    continue
+                shell.owner = None
+                if shell.pid in self._reaper:
+                    continue    # Already being closed
+                if shell.meta is None or shell.pid not in self._mux:
+                    doomed.append(shell.pid)    # Warm shell, or exited
+                    continue
+                shell.ring = OutputRing(self._buffer_bytes, start=shell.cell.value)
+                self._mux.resume(shell.pid)
+                held += 1
+        for pid in doomed:
+            self._reaper.reap(pid, pid, None)
+        if held:
+            logger.info(f"PTY host: worker gone, holding {held} shell(s)")
+
+    def _read(self, pid, fd):
+        shell = self._shells.get(pid)
+        ring = shell.ring if shell is not None else None
+        if ring is None:
+            return False    # A worker's shell: only its exit drain gets here — leave the output
+        try:
+            return ring.fill_from(fd) > 0
+        except BlockingIOError:
+            return True
+
+    def _exited(self, pid):
+        with self._lock:
+            shell = self._shells.get(pid)
+            orphaned = shell is not None and shell.owner is None
+        if orphaned:
+            logger.info(f"PTY host: orphaned shell pid={pid} exited")
+            self._reaper.reap(pid, pid, None)
+        # An owned shell's worker sees the EOF too, and closes it
+
+    def _gone(self, pid, data):
+        self._mux.unregister(pid)
+        with self._lock:
+            shell = self._shells.pop(pid, None)
+        if shell is not None:
+            for fd in (shell.master_fd, shell.cell_fd):
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+            shell.cell.close()
+        if data is not None:
+            conn, request_id = data
+            conn.send({"id": request_id})
+
+
+# ── Worker side ──────────────────────────────────────────────────────────
+
+class _Call:
+    __slots__ = ("callback", "done", "reply", "fds", "parts")
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.done = threading.Event()
+        self.reply = None
+        self.fds = []
+        self.parts = []     # (header, payload) of "more" messages before the reply
+
+
+class PtyHostClient:
+    """A worker's connection to the PTY host. Thread-safe."""
+
+    def __init__(self, sock):
+        self._sock = sock
+        self._send_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._pending = {}      # request id -> _Call
+        self._cells = {}        # pid -> OffsetCell
+        self._closed = False
+        self._disconnecting = False
+        self._reader = threading.Thread(target=self._run, daemon=True, name="pty-host-client")
+        self._reader.start()
+
+    @classmethod
+    def connect(cls, path, launch=True, timeout=CONNECT_TIMEOUT):
+        """Connect to the host on *path*, starting one first if none is listening."""
+        try:
+            return cls(_connect(path))
+        except (FileNotFoundError, ConnectionRefusedError):
+            if not launch:
+                raise
+        _launch(path)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return cls(_connect(path))
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    @property
+    def connected(self):
+        return not self._closed
+
+    def spawn(self, argv, env, cwd=None):
+        """Spawn *argv* on a new PTY in the host. Returns (master_fd, pid)."""
+        env_fd = _file_with(json.dumps(env).encode())
+        try:
+            call = self._call({"op": "spawn", "argv": argv, "cwd": cwd}, fds=(env_fd,))
+        finally:
+            os.close(env_fd)
+        master_fd, cell_fd = call.fds
+        pid = call.reply["pid"]
+        with self._lock:
+            self._cells[pid] = OffsetCell(cell_fd)
+        os.close(cell_fd)
+        return master_fd, pid
+
+    def describe(self, pid, **meta):
+        """Attach *meta* to a shell: it survives this worker and is returned by ``adopt``."""
+        self._call({"op": "describe", "pid": pid, "meta": meta})
+
+    def offset_cell(self, pid):
+        """The shared cell this worker keeps *pid*'s output offset in, or None."""
+        with self._lock:
+            return self._cells.get(pid)
+
+    def adopt(self, **where):
+        """Take over the orphaned shells whose metadata matches *where*
+        (all of them by default). Returns a list of AdoptedShell."""
+        call = self._call({"op": "adopt", "where": where})
+        output = {}
+        for header, payload in call.parts:
+            output.setdefault(header["pid"], []).append(payload)
+        adopted = []
+        fds = iter(call.fds)
+        for shell in call.reply["shells"]:
+            pid = shell["pid"]
+            master_fd, cell_fd = next(fds), next(fds)
+            with self._lock:
+                self._cells[pid] = OffsetCell(cell_fd)
+            os.close(cell_fd)
+            adopted.append(AdoptedShell(master_fd, pid, shell["meta"], shell["start"],
+                                        b"".join(output.get(pid, ()))))
+        return adopted
+
+    def close(self, pid, on_gone):
+        """Terminate *pid* in the host; ``on_gone()`` runs once it has been reaped.
+
+        Returns immediately. If the host is unreachable the shell is killed
+        directly and ``on_gone`` runs at once.
+        """
+        def gone(call=None):
+            if call is not None and call.reply.get("error"):
+                _kill_group(pid)    # Host went away mid-close
+            with self._lock:
+                cell = self._cells.pop(pid, None)
+            if cell is not None:
+                cell.close()
+            on_gone()
+
+        try:
+            self._call({"op": "close", "pid": pid}, callback=gone)
+        except OSError as e:
+            logger.warning(f"PTY host unreachable closing pid={pid} ({e}) — killing it directly")
+            _kill_group(pid)
+            gone()
+
+    def disconnect(self):
+        self._disconnecting = True
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._reader.join(5)
+        self._sock.close()
+
+    # ── Internals ────────────────────────────────────────────────────────
+
+    def _call(self, header, callback=None, fds=()):
+        """Send a request (with *fds* attached); wait for and return its _Call
+        unless *callback* is given."""
+        call = _Call(callback)
+        with self._lock:
+            if self._closed:
+                raise ConnectionError("PTY host connection lost")
+            request_id = header["id"] = next(self._ids)
+            self._pending[request_id] = call
+        try:
+            with self._send_lock:
+                send_message(self._sock, header, fds=fds)
+        except OSError:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise
+        if callback is not None:
+            return call
+        if not call.done.wait(REQUEST_TIMEOUT):
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise TimeoutError(f"PTY host did not answer {header['op']}")
+        error = call.reply.get("error")
+        if error:
+            for fd in call.fds:
+                os.close(fd)
+            raise OSError(f"PTY host {header['op']} failed: {error}")
+        return call
+
+    def _run(self):
+        try:
+            while True:
+                message = recv_message(self._sock)
+                if message is None:
+                    break
+                header, payload, fds = message
+                with self._lock:
+                    call = self._pending.get(header.get("id"))
+                    if call is not None and not header.get("more"):
+                        del self._pending[header["id"]]
+                if call is None:
+                    for fd in fds:
+                        os.close(fd)    # Timed out meanwhile
+                elif header.get("more"):
+                    call.parts.append((header, payload))
+                else:
+                    self._complete(call, header, fds)
+        except OSError as e:
+            logger.warning(f"PTY host connection error: {e}")
+        finally:
+            with self._lock:
+                self._closed = True
+                pending, self._pending = self._pending, {}
+            if not self._disconnecting:
+                logger.error("Lost connection to PTY host")
+            for call in pending.values():
+                self._complete(call, {"error": "PTY host connection lost"}, [])
+
+    def _complete(self, call, reply, fds):
+        call.reply, call.fds = reply, fds
+        if call.callback is None:
+            call.done.set()
+            return
+        try:
+            call.callback(call)
+        except Exception:
+            logger.exception("PTY host reply callback failed")
+
+
+def _kill_group(pid):
+    try:
+        os.killpg(pid, signal.SIGKILL)     # Shells are session (and group) leaders
+    except OSError:
+        pass
+
+
+def _connect(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def _launch(path):
+    """Start a host daemon for *path* in its own session (outlives the worker)."""
+    logger.info(f"Starting PTY host on {path}")
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), "--socket", path],
+                     stdin=subprocess.DEVNULL, start_new_session=True,
+                     cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Own terminal shells across web worker restarts.")
+    parser.add_argument("--socket", required=True, help="Unix socket path to serve on")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="pty_host: %(levelname)s %(message)s")
+    host = PtyHost(args.socket)
+    try:
+        host.listen()
+    except OSError as e:
+        logger.info(f"{e} — exiting")   # Lost a start-up race to another worker's launch
+        return
+    host.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
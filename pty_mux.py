@@ -0,0 +1,355 @@
+"""Single-threaded I/O multiplexer for every session's PTY.
+
+One selector loop (epoll on Linux, kqueue on macOS for local dev) watches
+every session's ``master_fd`` plus a pidfd per shell process, replacing the
+old one-reader-thread-per-session model that woke every 50 ms to poll
+``waitpid``. Idle sessions cost nothing: the loop sleeps in the kernel until a
+PTY has output or a child exits.
+
+Child exit is learned from the pidfd becoming readable (Linux >= 5.3). Where
+pidfds are unavailable the loop falls back to a coarse ``waitpid(WNOHANG)``
+sweep, but only while such sessions exist.
+
+The loop also keeps one optional deadline per key (``schedule``), used to
+flush coalesced output without a timer thread per session, and can stop
+reading a PTY (``pause``/``resume``) so a slow consumer pushes back on the
+producer through the kernel's PTY buffer.
+
+Input goes the other way through ``want_write``: while a session has queued
+input the loop also watches its fd for writability and calls ``on_writable``
+until the queue is drained, so a child that stops reading never blocks the
+thread that submitted the input.
+"""
+
+import os
+import select
+import selectors
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+EXIT_SWEEP_INTERVAL = 1.0    # Seconds between waitpid sweeps when pidfds are unavailable
+EXIT_DRAIN_LIMIT = 64        # Max reads to flush trailing output after a child exits
+
+
+def _open_pidfd(pid):
+    """Return a pidfd for *pid*, or None if unsupported / process already gone."""
+    if not hasattr(os, "pidfd_open"):
+        return None
+    try:
+        return os.pidfd_open(pid)
+    except OSError:
+        return None
+
+
+def _exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _Entry:
+    __slots__ = ("fd", "pid", "pidfd", "paused", "writing", "events")
+
+    def __init__(self, fd, pid, pidfd):
+        self.fd = fd
+        self.pid = pid
+        self.pidfd = pidfd
+        self.paused = False
+        self.writing = False
+        self.events = 0    # Selector mask currently registered for fd
+
+
+class PTYMultiplexer:
+    """Dispatch PTY readiness and child exit for all sessions from one thread.
+
+    ``on_readable(key, fd)`` is called on the loop thread whenever *fd* has
+    data; it must return False on EOF. ``on_exit(key)`` is called once after
+    the child exits (or its PTY hits EOF) and the entry has been unregistered.
+    ``on_timer(key)`` is called when a deadline set with ``schedule`` passes.
+    ``on_writable(key, fd)`` is called while ``want_write`` is in effect and
+    *fd* can take more input; it returns True while input remains queued.
+    All run outside any caller lock; ``on_readable``, ``on_writable`` and
+    ``on_timer`` are serialized with ``unregister`` so callers may safely
+    close the fd once it returns.
+    """
+
+    def __init__(self, on_readable, on_exit, on_timer=None, on_writable=None,
+                 sweep_interval=EXIT_SWEEP_INTERVAL):
+        self._on_readable = on_readable
+        self._on_exit = on_exit
+        self._on_timer = on_timer
+        self._on_writable = on_writable
+        self._sweep_interval = sweep_interval
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._deadlines = {}   # key -> time.monotonic() deadline for on_timer
+        self._last_sweep = 0.0
+        self._thread = None
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, ("wake", None))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def register(self, key, fd, pid, paused=False):
+        """Start watching *fd* for output and *pid* for exit under *key*.
+
+        With *paused*, only exit is watched until ``resume``.
+        """
+        pidfd = _open_pidfd(pid)
+        with self._lock:
+            entry = self._entries[key] = _Entry(fd, pid, pidfd)
+            entry.paused = paused
+            self._update_events(key, entry)
+            if pidfd is not None:
+                self._selector.register(pidfd, selectors.EVENT_READ, ("exit", key))
+            self._ensure_started()
+        self._wake()
+
+    def schedule(self, key, when):
+        """Call ``on_timer(key)`` at monotonic time *when*.
+
+        One deadline per key; an earlier pending deadline is kept.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return
+            pending = self._deadlines.get(key)
+            if pending is not None and pending <= when:
+                return
+            self._deadlines[key] = when
+        if threading.current_thread() is not self._thread:
+            self._wake()  # Loop may be sleeping past the new deadline
+
+    def pause(self, key):
+        """Stop reading *key*'s PTY; child exit is still watched.
+
+        Returns True if the entry was being read.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.paused:
+                return False
+            entry.paused = True
+            self._update_events(key, entry)
+            return True
+
+    def resume(self, key):
+        """Undo ``pause``. Returns True if the entry was paused."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry.paused:
+                return False
+            entry.paused = False
+            self._update_events(key, entry)
+        self._wake()
+        return True
+
+    def want_write(self, key):
+        """Call ``on_writable(key, fd)`` whenever *key*'s PTY can take input,
+        until it reports nothing left to write. Safe to call repeatedly.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.writing:
+                return
+            entry.writing = True
+            self._update_events(key, entry)
+        if threading.current_thread() is not self._thread:
+            self._wake()
+
+    def unregister(self, key):
+        """Stop watching *key*. Safe to call for unknown keys.
+
+        Returns once any in-flight ``on_readable`` for the key has finished,
+        so the caller may close the fd immediately afterwards.
+        """
+        with self._lock:
+            return self._detach(key) is not None
+
+    # ── Loop internals ───────────────────────────────────────────────────
+
+    def _ensure_started(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True, name="pty-mux")
+        self._thread.start()
+        logger.info("PTY multiplexer started")
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b"\0")
+        except BlockingIOError:
+            pass  # Pipe already full — loop is awake anyway
+
+    def _update_events(self, key, entry):
+        """Register *entry*'s fd for the events it currently needs. Holds _lock."""
+        events = (0 if entry.paused else selectors.EVENT_READ) | \
+                 (selectors.EVENT_WRITE if entry.writing else 0)
+        if events == entry.events:
+            return
+        if not events:
+            self._selector.unregister(entry.fd)
+        elif not entry.events:
+            self._selector.register(entry.fd, events, ("pty", key))
+        else:
+            self._selector.modify(entry.fd, events, ("pty", key))
+        entry.events = events
+
+    def _detach(self, key):
+        self._deadlines.pop(key, None)
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        if entry.events:
+            try:
+                self._selector.unregister(entry.fd)
+            except (KeyError, ValueError):
+                pass
+        if entry.pidfd is not None:
+            try:
+                self._selector.unregister(entry.pidfd)
+            except (KeyError, ValueError):
+                pass
+            os.close(entry.pidfd)
+        return entry
+
+    def _next_timeout(self):
+        with self._lock:
+            timeout = self._sweep_interval if any(e.pidfd is None for e in self._entries.values()) else None
+            if self._deadlines:
+                until_due = max(0.0, min(self._deadlines.values()) - time.monotonic())
+                timeout = until_due if timeout is None else min(timeout, until_due)
+        return timeout
+
+    def _run(self):
+        while True:
+            timeout = self._next_timeout()
+            try:
+                events = self._selector.select(timeout)
+            except OSError as e:
+                logger.warning(f"PTY multiplexer select error: {e}")
+                continue
+
+            exited = []
+            for sel_key, mask in events:
+                kind, key = sel_key.data
+                if kind == "wake":
+                    self._drain_wake_pipe()
+                    continue
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if entry is None:
+                        continue  # Unregistered earlier in this batch
+                    if kind == "pty" and mask & selectors.EVENT_WRITE:
+                        self._write(key, entry)
+                    if kind == "pty" and not mask & selectors.EVENT_READ:
+                        continue
+                    if kind == "pty" and self._read(key, entry):
+                        continue
+                    if kind == "exit":
+                        self._flush(key, entry)
+                    self._detach(key)
+                exited.append((key, entry))
+
+            self._fire_timers()
+            if time.monotonic() - self._last_sweep >= self._sweep_interval:
+                exited.extend(self._sweep())
+
+            for key, entry in exited:
+                self._finish(key, entry)
+
+    def _read(self, key, entry):
+        """Dispatch one readable event. Returns False on EOF / fd error."""
+        try:
+            return self._on_readable(key, entry.fd)
+        except OSError:
+            return False
+        except Exception:
+            logger.exception(f"PTY output handler failed for {key}")
+            return True
+
+    def _write(self, key, entry):
+        """Dispatch one writable event; drop write interest once drained."""
+        try:
+            more = self._on_writable(key, entry.fd)
+        except Exception:
+            logger.exception(f"PTY input handler failed for {key}")
+            more = False
+        if not more:
+            entry.writing = False
+            self._update_events(key, entry)
+
+    def _flush(self, key, entry):
+        """Read any output the child left in the PTY before it exited."""
+        for _ in range(EXIT_DRAIN_LIMIT):
+            try:
+                readable, _, _ = select.select([entry.fd], [], [], 0)
+            except (OSError, ValueError):
+                return
+            if not readable or not self._read(key, entry):
+                return
+
+    def _fire_timers(self):
+        with self._lock:
+            if not self._deadlines:
+                return
+            now = time.monotonic()
+            for key in [k for k, when in self._deadlines.items() if when <= now]:
+                del self._deadlines[key]
+                try:
+                    self._on_timer(key)
+                except Exception:
+                    logger.exception(f"PTY timer handler failed for {key}")
+
+    def _sweep(self):
+        """waitpid fallback for entries without a pidfd (non-Linux local dev)."""
+        exited = []
+        self._last_sweep = time.monotonic()
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.pidfd is not None:
+                    continue
+                try:
+                    pid_result, _ = os.waitpid(entry.pid, os.WNOHANG)
+                except ChildProcessError:
+                    # Already reaped elsewhere, or not our child (a pty_host shell)
+                    pid_result = 0 if _exists(entry.pid) else entry.pid
+                if pid_result != 0:
+                    self._flush(key, entry)
+                    self._detach(key)
+                    exited.append((key, entry))
+        return exited
+
+    def _finish(self, key, entry):
+        # Reap the zombie so the pid doesn't linger; harmless if already reaped
+        try:
+            os.waitpid(entry.pid, os.WNOHANG)
+        except ChildProcessError:
+            pass
+        try:
+            self._on_exit(key)
+        except Exception:
+            logger.exception(f"PTY exit handler failed for {key}")
+
+    def _drain_wake_pipe(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
@@ -0,0 +1,191 @@
+"""Asynchronous termination of session processes.
+
+Closing a session used to SIGHUP the shell and then ``time.sleep`` through
+the grace period before deciding whether to SIGKILL, on whichever thread
+asked: a close request took 3 s, and the idle reaper took 3 s per stale
+session. ``SessionReaper`` takes termination jobs instead and runs them all
+from one thread:
+
+- SIGHUP is sent as soon as the job is queued.
+- The process's exit is learned from its pidfd becoming readable (Linux >=
+  5.3); elsewhere a short ``waitpid(WNOHANG)`` poll runs, only while jobs
+  are pending.
+- A process still alive after ``grace`` seconds gets SIGKILL; one that
+  survives even that for ``kill_timeout`` seconds (stuck in the kernel) is
+  given up on with a warning so its session's resources are still freed.
+- Once the process is gone (and reaped), ``on_gone(key, data)`` runs on the
+  reaper thread to close fds and tell clients.
+
+A pid that is no longer our child (already reaped, e.g. after its PTY hit
+EOF) is never signalled — it may have been recycled by then.
+"""
+
+import os
+import selectors
+import signal
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+GRACE_SECONDS = 3           # SIGHUP -> SIGKILL
+KILL_TIMEOUT = 5            # SIGKILL -> give up waiting
+POLL_INTERVAL = 0.05        # waitpid poll period for jobs without a pidfd
+
+
+def _open_pidfd(pid):
+    if not hasattr(os, "pidfd_open"):
+        return None
+    try:
+        return os.pidfd_open(pid)
+    except OSError:
+        return None
+
+
+def _reaped(pid):
+    """Reap *pid* if it has exited. True if it is gone (or not our child)."""
+    try:
+        reaped_pid, _ = os.waitpid(pid, os.WNOHANG)
+    except ChildProcessError:
+        return True
+    return reaped_pid != 0
+
+
+class _Job:
+    __slots__ = ("key", "pid", "data", "pidfd", "deadline", "killed")
+
+    def __init__(self, key, pid, data):
+        self.key = key
+        self.pid = pid
+        self.data = data
+        self.pidfd = None
+        self.deadline = None
+        self.killed = False
+
+
+class SessionReaper:
+    """Terminate processes without blocking callers. See module docstring."""
+
+    def __init__(self, on_gone, grace=GRACE_SECONDS, kill_timeout=KILL_TIMEOUT):
+        self._on_gone = on_gone
+        self._grace = grace
+        self._kill_timeout = kill_timeout
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._queued = []
+        self._jobs = {}     # key -> _Job being waited on
+        self._thread = None
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._jobs) + len(self._queued)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._jobs or any(job.key == key for job in self._queued)
+
+    def reap(self, key, pid, data=None):
+        """Terminate *pid*; ``on_gone(key, data)`` follows once it is gone.
+
+        Returns immediately. Reaping a key that is already pending is a no-op.
+        """
+        with self._lock:
+            if key in self._jobs or any(job.key == key for job in self._queued):
+                return
+            self._queued.append(_Job(key, pid, data))
+            if not (self._thread and self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, daemon=True, name="session-reaper")
+                self._thread.start()
+        try:
+            os.write(self._wake_w, b"\0")
+        except BlockingIOError:
+            pass  # Pipe already full — loop is awake anyway
+
+    # ── Loop internals ───────────────────────────────────────────────────
+
+    def _run(self):
+        while True:
+            with self._lock:
+                queued, self._queued = self._queued, []
+            for job in queued:
+                self._start(job)
+
+            ready = []
+            for sel_key, _ in self._selector.select(self._next_timeout()):
+                if sel_key.data is None:
+                    self._drain_wake_pipe()
+                else:
+                    ready.append(sel_key.data)
+            for job in ready:
+                if _reaped(job.pid):
+                    self._finish(job)
+
+            now = time.monotonic()
+            for job in [j for j in self._jobs.values() if j.pidfd is None]:
+                if _reaped(job.pid):
+                    self._finish(job)
+            for job in [j for j in self._jobs.values() if j.deadline <= now]:
+                self._escalate(job, now)
+
+    def _start(self, job):
+        if _reaped(job.pid):
+            self._finish(job)
+            return
+        job.pidfd = _open_pidfd(job.pid)
+        try:
+            os.kill(job.pid, signal.SIGHUP)
+        except ProcessLookupError:
+            pass
+        job.deadline = time.monotonic() + self._grace
+        with self._lock:
+            self._jobs[job.key] = job
+        if job.pidfd is not None:
+            self._selector.register(job.pidfd, selectors.EVENT_READ, job)
+
+    def _escalate(self, job, now):
+        if not job.killed:
+            try:
+                os.kill(job.pid, signal.SIGKILL)
+                logger.info(f"Force killed session {job.key} (pid={job.pid})")
+            except ProcessLookupError:
+                pass
+            job.killed = True
+            job.deadline = now + self._kill_timeout
+        else:
+            logger.warning(f"Session {job.key} (pid={job.pid}) survived SIGKILL — releasing it anyway")
+            self._finish(job)
+
+    def _next_timeout(self):
+        with self._lock:
+            if self._queued:
+                return 0
+            if not self._jobs:
+                return None
+            timeout = max(0.0, min(j.deadline for j in self._jobs.values()) - time.monotonic())
+            if any(j.pidfd is None for j in self._jobs.values()):
+                timeout = min(timeout, POLL_INTERVAL)
+        return timeout
+
+    def _finish(self, job):
+        with self._lock:
+            self._jobs.pop(job.key, None)
+        if job.pidfd is not None:
+            self._selector.unregister(job.pidfd)
+            os.close(job.pidfd)
+            job.pidfd = None
+        try:
+            self._on_gone(job.key, job.data)
+        except Exception:
+            logger.exception(f"Session reaper callback failed for {job.key}")
+
+    def _drain_wake_pipe(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
@@ -0,0 +1,433 @@
+"""Append-only on-disk recordings of session output.
+
+The in-memory output ring only holds the last ``OUTPUT_BUFFER_BYTES`` of a
+session, so a long agent run loses everything older than a few screens. With
+recording on, each session's output is also appended to
+``~/.coda/recordings/<session_id>.cast`` in asciicast v2 format: a JSON
+header line, then one ``[seconds, "o", text]`` line per chunk of output and
+``[seconds, "r", "COLSxROWS"]`` per resize. Any asciinema player can replay
+the file.
+
+Output bytes that aren't valid UTF-8 are kept byte-exact: they're written
+raw (``surrogateescape``) instead of being replaced, so summing the encoded
+lengths of ``"o"`` events reproduces the session's stream offsets. A
+``[seconds, "m", "gap N"]`` marker records N bytes that were evicted from
+the ring before the writer got to them.
+
+Writes happen on one ``RecordingWriter`` thread: the PTY loop only marks a
+recording dirty, and the writer copies the new bytes out of the ring and
+appends them. Reads (``Recording.iter_range``) go through an ``mmap`` of
+the file. A sparse in-memory index (one entry per ``INDEX_INTERVAL_BYTES``
+of file or ``INDEX_INTERVAL_SECONDS``) locates the ends of a time or offset
+range; only the lines near those ends are parsed, and everything between
+them is streamed as raw mmap slices, never loaded into the Python heap.
+
+Recordings outlive their sessions (so ended sessions can still be replayed)
+but not forever: ``prune_recordings`` deletes those older than
+``RECORDINGS_MAX_AGE`` and then the oldest until the directory holds at most
+``RECORDINGS_MAX_BYTES``. A recording still being written holds a shared
+``flock`` and is never deleted, whichever worker is writing it.
+"""
+
+import array
+import bisect
+import fcntl
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_home = os.environ.get("HOME", "/app/python/source_code")
+if not _home or _home == "/":
+    _home = "/app/python/source_code"
+RECORDINGS_DIR = os.path.join(_home, ".coda", "recordings")
+MAX_RECORDING_BYTES = 256 * 1024 * 1024   # Recording stops (with a marker) at this file size
+RECORDINGS_MAX_BYTES = 1024 * 1024 * 1024  # Finished recordings are pruned, oldest first, past this total...
+RECORDINGS_MAX_AGE = 7 * 86400            # ...and once last written this many seconds ago
+INDEX_INTERVAL_BYTES = 64 * 1024          # File bytes between sparse index entries...
+INDEX_INTERVAL_SECONDS = 1.0              # ...or seconds, whichever comes first
+STREAM_CHUNK = 64 * 1024                  # Max bytes per slice yielded by iter_range
+
+
+def recording_path(session_id, directory=None):
+    """Path of *session_id*'s recording. The id must already be validated."""
+    return os.path.join(directory or RECORDINGS_DIR, f"{session_id}.cast")
+
+
+def prune_recordings(directory=None, max_bytes=RECORDINGS_MAX_BYTES, max_age=RECORDINGS_MAX_AGE):
+    """Delete finished recordings last written more than *max_age* seconds
+    ago, then the oldest until all recordings total at most *max_bytes*.
+
+    Recordings still being written count towards the total but are kept.
+    Returns the number of files deleted.
+    """
+    directory = directory or RECORDINGS_DIR
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return 0
+    files = []
+    for name in names:
+        if not name.endswith(".cast"):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        files.append((st.st_mtime, st.st_size, path))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    cutoff = time.time() - max_age
+    deleted = 0
+    for mtime, size, path in files:     # Oldest first
+        if mtime >= cutoff and total <= max_bytes:
+            break
+        if _remove_finished(path):
+            total -= size
+            deleted += 1
+    if deleted:
+        logger.info(f"Pruned {deleted} old recordings from {directory}")
+    return deleted
+
+
+def _remove_finished(path):
+    """Delete the recording at *path* unless it is still being written.
+    Returns True if it was deleted."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.unlink(path)
+    except OSError:
+        return False    # Locked by its writer (or not ours to delete)
+    finally:
+        os.close(fd)
+    return True
+
+
+def _event_line(elapsed, kind, text):
+    line = json.dumps([round(elapsed, 6), kind, text], ensure_ascii=False)
+    return line.encode("utf-8", "surrogateescape") + b"\n"
+
+
+def _parse_line(line):
+    """Return ``(elapsed, kind, payload)``; ``"o"`` payloads are the raw bytes."""
+    elapsed, kind, payload = json.loads(line.decode("utf-8", "surrogateescape"))
+    if kind == "o":
+        payload = payload.encode("utf-8", "surrogateescape")
+    return elapsed, kind, payload
+
+
+def _pack_size(cols, rows):
+    return (cols << 16) | rows
+
+
+def _parse_size(payload):
+    cols, rows = payload.split("x")
+    return _pack_size(int(cols), int(rows))
+
+
+class Recording:
+    """One session's recording file plus its sparse index.
+
+    ``append``, ``resize`` and ``close`` are only called from the writer
+    thread (or, for ``load``, not at all); ``iter_range`` from any thread.
+    """
+
+    def __init__(self, path, cols=80, rows=24, title="", max_bytes=MAX_RECORDING_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.offset = 0       # Stream offset recorded up to (next byte to append)
+        self.truncated = False
+        self._lock = threading.Lock()
+        self._t0 = time.monotonic()
+        self._size = _pack_size(cols, rows)
+        self._times = array.array("d")
+        self._offsets = array.array("Q")
+        self._positions = array.array("Q")
+        self._sizes = array.array("L")
+        self._file = None
+        self._header = {
+            "version": 2, "width": cols, "height": rows,
+            "timestamp": int(time.time()), "title": title,
+            "env": {"TERM": "xterm-256color", "SHELL": "/bin/bash"},
+        }
+        self._length = 0      # Bytes written to the file (what readers may map)
+
+    def open(self):
+        """Create the file and write the header. Raises OSError on failure."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_SH)  # Held until close: keeps prune_recordings off it
+        self._file = os.fdopen(fd, "ab", buffering=0)
+        self._write(json.dumps(self._header).encode() + b"\n")
+        return self
+
+    @classmethod
+    def load(cls, path):
+        """Open a finished recording read-only, rebuilding its index from the file."""
+        rec = cls(path)
+        rec._length = os.path.getsize(path)
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header_end = mm.find(b"\n") + 1
+            if not header_end:
+                raise ValueError(f"{path}: missing asciicast header")
+            rec._header = json.loads(mm[:header_end])
+            rec._size = _pack_size(rec._header.get("width", 80), rec._header.get("height", 24))
+            offset = 0
+            for pos, _, elapsed, kind, payload in rec._scan(mm, header_end, rec._length):
+                rec._maybe_index(elapsed, offset, pos)
+                offset = rec._advance(offset, kind, payload)
+                if kind == "r":
+                    rec._size = _parse_size(payload)
+        rec.offset = offset
+        return rec
+
+    @property
+    def closed(self):
+        return self._file is None
+
+    # ── Writer side ──────────────────────────────────────────────────────
+
+    def append(self, start, data):
+        """Record *data*, which begins at stream offset *start*."""
+        if self._file is None or self.truncated:
+            return
+        elapsed = time.monotonic() - self._t0
+        lines = b""
+        if start > self.offset:
+            lines += _event_line(elapsed, "m", f"gap {start - self.offset}")
+        if data:
+            lines += _event_line(elapsed, "o", data.decode("utf-8", "surrogateescape"))
+        if not lines:
+            return
+        if self._length + len(lines) > self.max_bytes:
+            self.truncated = True
+            self._write(_event_line(elapsed, "m", "recording size limit reached"))
+            logger.warning(f"Recording {self.path} reached {self.max_bytes} bytes — stopped")
+            return
+        self._maybe_index(elapsed, self.offset, self._length)
+        self._write(lines)
+        self.offset = start + len(data)
+
+    def resize(self, cols, rows):
+        if self._file is None or self.truncated:
+            return
+        elapsed = time.monotonic() - self._t0
+        self._maybe_index(elapsed, self.offset, self._length)
+        self._size = _pack_size(cols, rows)
+        self._write(_event_line(elapsed, "r", f"{cols}x{rows}"))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, data):
+        self._file.write(data)
+        with self._lock:
+            self._length += len(data)
+
+    def _maybe_index(self, elapsed, offset, position):
+        """Add an index entry for an event about to be written at *position*."""
+        with self._lock:
+            if self._positions:
+                if (position - self._positions[-1] < INDEX_INTERVAL_BYTES
+                        and elapsed - self._times[-1] < INDEX_INTERVAL_SECONDS):
+                    return
+            self._times.append(elapsed)
+            self._offsets.append(offset)
+            self._positions.append(position)
+            self._sizes.append(self._size)
+
+    # ── Reader side ──────────────────────────────────────────────────────
+
+    @staticmethod
+    def _scan(mm, pos, limit):
+        """Yield ``(pos, next_pos, elapsed, kind, payload)`` for lines in [pos, limit)."""
+        while pos < limit:
+            nl = mm.find(b"\n", pos, limit)
+            if nl < 0:
+                return  # Partial trailing line
+            elapsed, kind, payload = _parse_line(mm[pos:nl])
+            yield pos, nl + 1, elapsed, kind, payload
+            pos = nl + 1
+
+    @staticmethod
+    def _advance(offset, kind, payload):
+        if kind == "o":
+            return offset + len(payload)
+        if kind == "m" and payload.startswith("gap "):
+            return offset + int(payload[4:])
+        return offset
+
+    def iter_range(self, since=0, until=None, start=0.0, end=None):
+        """Yield the recording as asciicast bytes, limited to output in stream
+        offsets ``[since, until)`` recorded between *start* and *end* seconds.
+
+        The header's size is the terminal size at the first included event.
+        Output straddling an offset bound is trimmed to it.
+        """
+        with self._lock:
+            length = self._length
+            n = len(self._positions)
+        if not n:
+            yield json.dumps(self._header).encode() + b"\n"
+            return
+
+        with open(self.path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ)
+        try:
+            yield from self._iter_range(mm, length, n, since, until, start, end)
+        finally:
+            mm.close()
+
+    def _iter_range(self, mm, length, n, since, until, start, end):
+        def excluded_after(elapsed, offset):
+            return (end is not None and elapsed >= end) or (until is not None and offset >= until)
+
+        def trimmed(elapsed, kind, payload, offset):
+            if kind == "o":
+                lo = max(0, since - offset)
+                hi = len(payload) if until is None else min(len(payload), until - offset)
+                if lo or hi < len(payload):
+                    return _event_line(elapsed, kind, payload[lo:hi].decode("utf-8", "surrogateescape"))
+            return None
+
+        # Find the first included event, scanning from the index entry before it
+        i = max(0, min(bisect.bisect_right(self._times, start, 0, n),
+                       bisect.bisect_right(self._offsets, since, 0, n)) - 1)
+        offset, size = self._offsets[i], self._sizes[i]
+        first = None
+        for pos, next_pos, elapsed, kind, payload in self._scan(mm, self._positions[i], length):
+            after = self._advance(offset, kind, payload)
+            if excluded_after(elapsed, offset):
+                break
+            if elapsed >= start and (after > since or (kind != "o" and offset >= since)):
+                first = (pos, next_pos, elapsed, kind, payload, offset)
+                break
+            if kind == "r":
+                size = _parse_size(payload)
+            offset = after
+
+        header = dict(self._header, width=size >> 16, height=size & 0xFFFF)
+        yield json.dumps(header).encode() + b"\n"
+        if first is None:
+            return
+        pos, raw_from, elapsed, kind, payload, offset = first
+        line = trimmed(elapsed, kind, payload, offset)
+        yield line if line is not None else mm[pos:raw_from]
+        offset = self._advance(offset, kind, payload)
+
+        # Find the first event that is excluded or needs trimming at the upper bound
+        j = min(bisect.bisect_left(self._times, end, 0, n) if end is not None else n,
+                bisect.bisect_left(self._offsets, until, 0, n) if until is not None else n)
+        scan_from = raw_from
+        if j > 0 and self._positions[j - 1] > raw_from:
+            scan_from, offset = self._positions[j - 1], self._offsets[j - 1]
+        raw_to, last = length, None
+        for pos, _, elapsed, kind, payload in self._scan(mm, scan_from, length):
+            if excluded_after(elapsed, offset):
+                raw_to = pos
+                break
+            after = self._advance(offset, kind, payload)
+            if until is not None and after > until:
+                raw_to, last = pos, trimmed(elapsed, kind, payload, offset)
+                break
+            offset = after
+        else:
+            raw_to = mm.rfind(b"\n", raw_from, length) + 1 or raw_from
+
+        for chunk_start in range(raw_from, raw_to, STREAM_CHUNK):
+            yield mm[chunk_start:min(chunk_start + STREAM_CHUNK, raw_to)]
+        if last is not None:
+            yield last
+
+
+class RecordingWriter:
+    """Background thread that copies new session output into recordings.
+
+    The PTY loop calls ``notify`` after output lands in a session's ring; the
+    writer then reads ``[recording.offset, ring.end)`` under the session lock
+    and appends it with no lock held, so disk latency never stalls the loop.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._dirty = {}      # Recording -> (ring, lock)
+        self._ops = []        # (Recording, "resize"/"close", args) in call order
+        self._busy = False    # Writing what it last took from _dirty/_ops
+        self._thread = None
+
+    def notify(self, recording, ring, lock):
+        with self._cond:
+            self._dirty[recording] = (ring, lock)
+            self._ensure_started()
+            self._cond.notify()
+
+    def resize(self, recording, ring, lock, cols, rows):
+        with self._cond:
+            self._dirty[recording] = (ring, lock)
+            self._ops.append((recording, "resize", (cols, rows)))
+            self._ensure_started()
+            self._cond.notify()
+
+    def close(self, recording, ring, lock):
+        """Record any remaining output, then close the file."""
+        with self._cond:
+            self._dirty[recording] = (ring, lock)
+            self._ops.append((recording, "close", ()))
+            self._ensure_started()
+            self._cond.notify()
+
+    def flush(self, timeout=5.0):
+        """Wait until everything notified so far is on disk (for tests/shutdown)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while (self._dirty or self._ops or self._busy) and time.monotonic() < deadline:
+                self._cond.wait(0.01)
+            return not (self._dirty or self._ops or self._busy)
+
+    def _ensure_started(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True, name="recording-writer")
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._dirty and not self._ops:
+                    self._cond.wait()
+                dirty, self._dirty = self._dirty, {}
+                ops, self._ops = self._ops, []
+                self._busy = True
+            for recording, (ring, lock) in dirty.items():
+                self._drain(recording, ring, lock)
+            for recording, op, args in ops:
+                try:
+                    getattr(recording, op)(*args)
+                except OSError as e:
+                    logger.warning(f"Recording {recording.path} {op} failed: {e}")
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()  # Wake flush()
+
+    @staticmethod
+    def _drain(recording, ring, lock):
+        if recording.closed or recording.truncated:
+            return
+        with lock:
+            start, end, data = ring.read(recording.offset)
+        try:
+            recording.append(start, data)
+        except OSError as e:
+            logger.warning(f"Recording {recording.path} write failed: {e} — closing")
+            recording.close()
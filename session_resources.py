@@ -0,0 +1,412 @@
+"""Per-session CPU and memory accounting, and throttling of background sessions.
+
+The agent CLIs (node for Claude/Codex/Gemini/OpenCode, Python for Hermes)
+spike CPU and RSS in the same container as the terminal server, and nothing
+said which tab was doing it — or kept it from slowing the tab being typed
+in. ``ResourceMonitor`` samples every tracked session on one thread, every
+``interval`` seconds:
+
+- One pass over ``/proc/*/stat`` groups every process by its session id
+  (field 6). Each shell is spawned with setsid, so its session is
+  everything started in that terminal: the foreground job, background
+  jobs and the agents' own subprocesses, whatever process group job
+  control put them in.
+- CPU is the growth of the summed utime+stime since the previous sample,
+  as a percentage of one core; memory is the summed RSS. ``usage(key)``
+  returns the latest ``SessionUsage``.
+- With a ``ThrottlePolicy``, sessions that ``is_background(key)`` are
+  reniced and moved to the idle I/O class, and — where this process may
+  manage its cgroup v2 subtree (``CpuCgroups``) — capped by a ``cpu.max``
+  quota. A session that becomes interactive again gets its priority back
+  at the next sample, or at once when the caller says so (``foreground``).
+  Lowering a nice value needs CAP_SYS_NICE, so where ``can_restore_priority``
+  says we couldn't, processes aren't reniced at all; a process whose
+  priority couldn't be restored stays reported as throttled.
+  Processes started since the last sample are caught by the next one.
+- ``limit_memory`` caps a shell's address space (RLIMIT_AS); everything it
+  starts inherits the cap.
+
+Without /proc (macOS local dev) nothing is sampled or throttled.
+"""
+
+import ctypes
+import os
+import platform
+import resource
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL = 5.0       # Seconds between samples
+BACKGROUND_NICE = 10        # Nice value for background sessions' processes
+CPU_PERIOD_US = 100000      # cgroup cpu.max period
+CAP_SYS_NICE = 23           # Capability bit (linux/capability.h)
+
+_HAS_PROC = os.path.isdir("/proc/self/task")
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# ioprio_set(2) has no libc wrapper (or Python binding)
+_IOPRIO_SET = {"x86_64": 251, "aarch64": 30, "i686": 289, "armv7l": 314}.get(platform.machine())
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_IDLE = 3 << 13      # IOPRIO_CLASS_IDLE; 0 restores the default (follows nice)
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+except OSError:
+    _libc = None
+
+
+def _scan():
+    """Every process, grouped by session id: {sid: [(pid, cpu_ticks, rss_pages)]}."""
+    by_session = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue  # Exited mid-scan
+        # Fields after the parenthesised comm (which may contain spaces):
+        # [3] session, [11] utime, [12] stime, [21] rss
+        fields = stat[stat.rfind(")") + 2:].split()
+        by_session.setdefault(int(fields[3]), []).append(
+            (int(entry), int(fields[11]) + int(fields[12]), int(fields[21])))
+    return by_session
+
+
+def _set_ioprio(pid, ioprio):
+    if _libc is None or _IOPRIO_SET is None:
+        return False
+    return _libc.syscall(_IOPRIO_SET, _IOPRIO_WHO_PROCESS, pid, ioprio) == 0
+
+
+def can_restore_priority(nice=0):
+    """Whether this process may set another's nice value back down to *nice*:
+    it has CAP_SYS_NICE, or RLIMIT_NICE reaches that far."""
+    try:
+        soft, _ = resource.getrlimit(resource.RLIMIT_NICE)
+    except (AttributeError, ValueError, OSError):
+        soft = 0
+    if soft == resource.RLIM_INFINITY or 20 - soft <= nice:
+        return True
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("CapEff:"):
+                    return bool(int(line.split()[1], 16) >> CAP_SYS_NICE & 1)
+    except (OSError, ValueError):
+        pass
+    return False
+
+
+def _own_cgroup():
+    """This process's cgroup v2 path, or None (cgroup v1, no /proc)."""
+    try:
+        with open("/proc/self/cgroup") as f:
+            paths = [line.split("::", 1)[1].strip() for line in f if line.startswith("0::")]
+    except OSError:
+        return None
+    return paths[0] if paths else None
+
+
+def limit_memory(pid, limit_bytes):
+    """Cap *pid*'s address space at *limit_bytes* (inherited by what it starts).
+
+    Returns False if the cap couldn't be set (process gone, or not ours).
+    """
+    try:
+        resource.prlimit(pid, resource.RLIMIT_AS, (limit_bytes, limit_bytes))
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not cap memory of pid {pid}: {e}")
+        return False
+    return True
+
+
+class SessionUsage:
+    """One sample of a session's resource use."""
+
+    __slots__ = ("cpu_percent", "rss_bytes", "processes", "throttled")
+
+    def __init__(self, cpu_percent, rss_bytes, processes, throttled=False):
+        self.cpu_percent = cpu_percent     # Of one core, since the previous sample
+        self.rss_bytes = rss_bytes
+        self.processes = processes
+        self.throttled = throttled
+
+    def as_dict(self):
+        return {"cpu_percent": round(self.cpu_percent, 1), "rss_bytes": self.rss_bytes,
+                "processes": self.processes, "throttled": self.throttled}
+
+
+class CpuCgroups:
+    """``cpu.max`` quotas for sessions, in cgroup v2 children of our own cgroup.
+
+    cgroup v2 only lets a cgroup hand controllers to its children while it
+    has no processes of its own, so ``setup`` first moves whatever is in
+    our cgroup (this server, its sibling workers, the PTY host) into a
+    ``server`` child, then enables the cpu controller. That reorganizes
+    the whole app's tree, so only one process should run it; the others
+    ``detect(setup=False)``. Each throttled session gets a
+    ``session-<pid>`` child holding its processes.
+    """
+
+    ROOT = "/sys/fs/cgroup"
+    SERVER = "server"
+
+    def __init__(self, base):
+        self.base = base
+
+    @classmethod
+    def detect(cls, setup=True):
+        """A CpuCgroups for this process's cgroup, or None where it can't be used
+        (cgroup v1, no cpu controller, read-only tree). Without *setup*, the
+        tree is left as it is: another process sets it up."""
+        path = _own_cgroup()
+        if path is None:
+            return None
+        base = os.path.join(cls.ROOT, path.lstrip("/"))
+        if os.path.basename(base) == cls.SERVER:
+            base = os.path.dirname(base)    # Already moved there by setup
+        cgroups = cls(base)
+        try:
+            if setup:
+                cgroups.setup()
+            else:
+                cgroups.check()
+        except OSError as e:
+            logger.info(f"cgroup v2 CPU quotas unavailable: {e}")
+            return None
+        return cgroups
+
+    def check(self):
+        with open(os.path.join(self.base, "cgroup.controllers")) as f:
+            if "cpu" not in f.read().split():
+                raise OSError(f"cpu controller not available in {self.base}")
+
+    def setup(self):
+        self.check()
+        server = os.path.join(self.base, self.SERVER)
+        os.makedirs(server, exist_ok=True)
+        with open(os.path.join(self.base, "cgroup.procs")) as f:
+            pids = f.read().split()
+        for pid in pids:
+            self._move(server, pid)
+        with open(os.path.join(self.base, "cgroup.subtree_control"), "w") as f:
+            f.write("+cpu")
+
+    def limit(self, key, pids, cpu_percent):
+        """Put *pids* in session *key*'s cgroup, capped at *cpu_percent* of a core."""
+        path = os.path.join(self.base, f"session-{key}")
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "cpu.max"), "w") as f:
+            f.write(f"{int(CPU_PERIOD_US * cpu_percent / 100)} {CPU_PERIOD_US}")
+        self.add(key, pids)
+
+    def add(self, key, pids):
+        path = os.path.join(self.base, f"session-{key}")
+        for pid in pids:
+            self._move(path, pid)
+
+    def release(self, key):
+        """Lift session *key*'s quota (its processes stay in its cgroup)."""
+        try:
+            with open(os.path.join(self.base, f"session-{key}", "cpu.max"), "w") as f:
+                f.write(f"max {CPU_PERIOD_US}")
+        except OSError:
+            pass
+
+    def remove(self, key):
+        try:
+            os.rmdir(os.path.join(self.base, f"session-{key}"))
+        except OSError:
+            pass  # Never throttled, or stray processes still in it
+
+    @staticmethod
+    def _move(path, pid):
+        try:
+            with open(os.path.join(path, "cgroup.procs"), "w") as f:
+                f.write(str(pid))
+        except ProcessLookupError:
+            pass  # Exited
+
+
+class ThrottlePolicy:
+    """What ``ResourceMonitor`` does to a background session's processes."""
+
+    def __init__(self, nice=BACKGROUND_NICE, idle_io=True, cpu_percent=None, cgroups=None, renice=True):
+        self.nice = nice
+        self.renice = renice            # False where priority couldn't be restored (can_restore_priority)
+        self.idle_io = idle_io
+        self.cpu_percent = cpu_percent  # cpu.max quota, if cgroups is set
+        self.cgroups = cgroups
+
+    def throttle(self, pid):
+        """Lower *pid*'s priority. Returns its previous nice value, or None if it's gone."""
+        try:
+            previous = os.getpriority(os.PRIO_PROCESS, pid)
+            if self.renice and previous < self.nice:
+                os.setpriority(os.PRIO_PROCESS, pid, self.nice)
+        except OSError:
+            return None
+        if self.idle_io:
+            _set_ioprio(pid, _IOPRIO_IDLE)
+        return previous
+
+    def restore(self, pid, previous):
+        """Undo ``throttle``. Returns False if *pid*'s priority couldn't be raised back."""
+        if self.idle_io:
+            _set_ioprio(pid, 0)
+        if not self.renice:
+            return True
+        try:
+            # Raising priority back needs CAP_SYS_NICE (or RLIMIT_NICE)
+            os.setpriority(os.PRIO_PROCESS, pid, previous)
+        except ProcessLookupError:
+            pass    # Exited
+        except OSError:
+            return False
+        return True
+
+
+class _Tracked:
+    __slots__ = ("pid", "ticks", "sampled_at", "usage", "background", "throttled_pids")
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.ticks = None
+        self.sampled_at = None
+        self.usage = None
+        self.background = False
+        self.throttled_pids = {}    # pid -> nice value before throttling
+
+
+class ResourceMonitor:
+    """Samples tracked sessions and applies a ThrottlePolicy. See module docstring.
+
+    Keys are the caller's (session ids); *pid* is the session's shell, the
+    leader of its session. ``is_background(key)`` is called on the sampling
+    thread.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, policy=None, is_background=None):
+        self.interval = interval
+        self.policy = policy
+        self._is_background = is_background or (lambda key: False)
+        self._lock = threading.Lock()
+        self._policy_lock = threading.Lock()   # Serializes throttling and restoring
+        self._tracked = {}      # key -> _Tracked
+        self._stop = threading.Event()
+        self._thread = None
+
+    def track(self, key, pid):
+        with self._lock:
+            self._tracked[key] = _Tracked(pid)
+
+    def untrack(self, key):
+        with self._lock:
+            tracked = self._tracked.pop(key, None)
+        policy = self.policy
+        if tracked is not None and policy is not None and policy.cgroups is not None:
+            policy.cgroups.remove(tracked.pid)
+
+    def foreground(self, key):
+        """The session's user is back (e.g. typing): restore its priority now
+        instead of at the next sample. Cheap when it isn't throttled."""
+        session = self._tracked.get(key)
+        if session is None or self.policy is None or not (session.background or session.throttled_pids):
+            return
+        with self._policy_lock:
+            self._restore(key, session)
+            session.background = False
+
+    def usage(self, key):
+        """The session's latest SessionUsage, or None before its first sample."""
+        tracked = self._tracked.get(key)
+        return tracked.usage if tracked is not None else None
+
+    def start(self):
+        if not _HAS_PROC or self.interval <= 0:
+            return
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True, name="session-resources")
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def sample(self):
+        """Take one sample of every tracked session now."""
+        by_session = _scan()
+        now = time.monotonic()
+        with self._lock:
+            tracked = list(self._tracked.items())
+        for key, session in tracked:
+            procs = by_session.get(session.pid, [])
+            ticks = sum(p[1] for p in procs)
+            cpu = 0.0
+            if session.ticks is not None and now > session.sampled_at:
+                # Exited processes take their ticks with them: never below zero
+                cpu = max(0, ticks - session.ticks) / _CLK_TCK / (now - session.sampled_at) * 100
+            session.ticks, session.sampled_at = ticks, now
+            if self.policy is not None:
+                with self._policy_lock:
+                    self._apply(key, session, [p[0] for p in procs])
+            session.usage = SessionUsage(cpu, sum(p[2] for p in procs) * _PAGE_SIZE, len(procs),
+                                         throttled=session.background or bool(session.throttled_pids))
+
+    # ── Internals ────────────────────────────────────────────────────────
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception:
+                logger.exception("Session resource sample failed")
+
+    def _apply(self, key, session, pids):
+        policy = self.policy
+        cgroups = policy.cgroups if policy.cpu_percent else None
+        background = bool(self._is_background(key))
+        throttled = session.throttled_pids
+        alive = set(pids)
+        if background:
+            new = [pid for pid in pids if pid not in throttled]
+            for pid in new:
+                previous = policy.throttle(pid)
+                if previous is not None:
+                    throttled[pid] = previous
+            if cgroups is not None:
+                try:
+                    if not session.background:
+                        cgroups.limit(session.pid, pids, policy.cpu_percent)
+                    elif new:
+                        cgroups.add(session.pid, new)
+                except OSError as e:
+                    logger.warning(f"Could not apply CPU quota to session {key}: {e}")
+            # Forget processes that have exited (pids get reused)
+            session.throttled_pids = {pid: n for pid, n in throttled.items() if pid in alive}
+            if not session.background:
+                logger.info(f"Session {key} is in the background: throttled {len(pids)} processes")
+        elif session.background or throttled:
+            self._restore(key, session, alive)
+        session.background = background
+
+    def _restore(self, key, session, alive=None):
+        """Give a throttled session's processes (those in *alive*, if given)
+        their priority back. Caller holds _policy_lock."""
+        policy = self.policy
+        # Processes whose priority the kernel won't give back stay throttled (retried each sample)
+        session.throttled_pids = {pid: previous for pid, previous in session.throttled_pids.items()
+                                  if (alive is None or pid in alive) and not policy.restore(pid, previous)}
+        if session.background:
+            if policy.cpu_percent and policy.cgroups is not None:
+                policy.cgroups.release(session.pid)
+            if session.throttled_pids:
+                logger.warning(f"Session {key} is interactive again, but the priority of "
+                               f"{len(session.throttled_pids)} processes could not be restored")
+            else:
+                logger.info(f"Session {key} is interactive again: priority restored")
@@ -0,0 +1,198 @@
+"""Pre-spawned shells for instant new tabs.
+
+A new session used to fork bash in the request, and the browser then waited
+for bash to source its rc files before the first prompt arrived — several
+hundred ms with the agent CLIs' PATH and completion setup. ``ShellPool``
+keeps ``size`` shells spawned ahead of time instead:
+
+- A shell counts as warm once its PTY master is readable, i.e. bash has
+  printed its first prompt. The prompt stays in the PTY buffer and is
+  read by the normal output path once the shell is handed out, so the new
+  tab paints it on its first round trip.
+- ``take()`` hands out the oldest warm shell and wakes the refill thread;
+  spawning never happens on the caller's thread. It returns None when the
+  pool is empty, and the caller spawns a shell itself as before.
+- Shells that died, or were spawned under a different ``fingerprint()``
+  (shell environment or rc files changed since, e.g. by setup), are
+  discarded rather than handed out.
+
+Warm shells are not sessions: they don't count against the session limit
+and are invisible to the API until handed out.
+"""
+
+import os
+import select
+import signal
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+READY_TIMEOUT = 5.0         # Max seconds to wait for a new shell's first prompt
+RETRY_INTERVAL = 5.0        # Seconds before retrying after a failed spawn
+
+
+def _kill(master_fd, pid):
+    """Default discard: close the PTY and kill the shell outright."""
+    try:
+        os.close(master_fd)
+    except OSError:
+        pass
+    try:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+    except (ProcessLookupError, ChildProcessError):
+        pass
+
+
+def _alive(pid):
+    try:
+        reaped_pid, _ = os.waitpid(pid, os.WNOHANG)
+    except ChildProcessError:
+        # Not our child: spawned by pty_host, which reaps it
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+    return reaped_pid == 0
+
+
+def _wait_readable(fd, timeout):
+    poller = select.poll()
+    poller.register(fd, select.POLLIN)
+    try:
+        return bool(poller.poll(timeout * 1000))
+    except OSError:
+        return False
+
+
+class _WarmShell:
+    __slots__ = ("master_fd", "pid", "fingerprint", "spawned_at")
+
+    def __init__(self, master_fd, pid, fingerprint):
+        self.master_fd = master_fd
+        self.pid = pid
+        self.fingerprint = fingerprint
+        self.spawned_at = time.time()
+
+
+class ShellPool:
+    """Keep *size* warm shells from ``spawn() -> (master_fd, pid)``. Thread-safe.
+
+    ``fingerprint()`` describes what a shell spawned now would look like;
+    ``discard(master_fd, pid)`` disposes of shells that won't be handed out.
+    """
+
+    def __init__(self, spawn, size=1, fingerprint=None, discard=_kill,
+                 ready_timeout=READY_TIMEOUT):
+        self.size = max(0, size)
+        self._spawn = spawn
+        self._fingerprint = fingerprint or (lambda: None)
+        self._discard = discard
+        self._ready_timeout = ready_timeout
+        self._shells = []       # Warm shells, oldest first
+        self._lock = threading.Lock()
+        self._wanted = threading.Event()
+        self._thread = None
+        self._stopped = False
+
+    def __len__(self):
+        with self._lock:
+            return len(self._shells)
+
+    def start(self):
+        """Start filling the pool in the background (no-op when size is 0)."""
+        if self.size == 0:
+            return
+        with self._lock:
+            self._stopped = False
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True, name="shell-pool")
+            self._thread.start()
+        self._wanted.set()
+
+    def take(self):
+        """A warm ``(master_fd, pid)``, or None if none is ready."""
+        fingerprint = self._fingerprint()
+        stale = []
+        taken = None
+        with self._lock:
+            while self._shells:
+                shell = self._shells.pop(0)
+                if shell.fingerprint == fingerprint and _alive(shell.pid):
+                    taken = shell
+                    break
+                stale.append(shell)
+        for shell in stale:
+            self._drop(shell, "stale" if shell.fingerprint != fingerprint else "dead")
+        if self._thread is not None:
+            self._wanted.set()
+        if taken is None:
+            return None
+        logger.info(f"Handing out warm shell pid={taken.pid} "
+                    f"(warmed {time.time() - taken.spawned_at:.1f}s ago)")
+        return taken.master_fd, taken.pid
+
+    def recycle(self):
+        """Discard every warm shell and refill — call after changing what
+        new shells should inherit (environment, rc files)."""
+        with self._lock:
+            shells, self._shells = self._shells, []
+        for shell in shells:
+            self._drop(shell, "recycled")
+        if self._thread is not None:
+            self._wanted.set()
+
+    def stop(self):
+        """Stop refilling and discard every warm shell."""
+        with self._lock:
+            self._stopped = True
+            shells, self._shells = self._shells, []
+        self._wanted.set()
+        for shell in shells:
+            self._drop(shell, "pool stopped")
+
+    # ── Refill thread ────────────────────────────────────────────────────
+
+    def _run(self):
+        while True:
+            self._wanted.wait()
+            self._wanted.clear()
+            while True:
+                with self._lock:
+                    if self._stopped:
+                        return
+                    if len(self._shells) >= self.size:
+                        break
+                try:
+                    shell = self._warm_one()
+                except Exception as e:
+                    logger.warning(f"Could not pre-spawn shell: {e}")
+                    self._wanted.wait(RETRY_INTERVAL)
+                    continue
+                with self._lock:
+                    if not self._stopped and len(self._shells) < self.size:
+                        self._shells.append(shell)
+                        shell = None
+                if shell is not None:
+                    self._drop(shell, "pool full")
+
+    def _warm_one(self):
+        fingerprint = self._fingerprint()
+        master_fd, pid = self._spawn()
+        if not _wait_readable(master_fd, self._ready_timeout):
+            logger.warning(f"Pre-spawned shell pid={pid} printed no prompt within "
+                           f"{self._ready_timeout}s — pooling it anyway")
+        return _WarmShell(master_fd, pid, fingerprint)
+
+    def _drop(self, shell, reason):
+        logger.info(f"Discarding warm shell pid={shell.pid} ({reason})")
+        try:
+            self._discard(shell.master_fd, shell.pid)
+        except Exception:
+            logger.exception(f"Discarding warm shell pid={shell.pid} failed")
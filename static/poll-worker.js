@@ -5,13 +5,32 @@
  * is in the background. Uses batch polling to fetch output for all panes
  * in a single HTTP request.
  *
+ * In the foreground, output is pushed over a Server-Sent Events stream
+ * (/api/stream) where the network allows it — WebSocket-stripping proxies
+ * usually pass plain HTTP responses. If a stream doesn't open within
+ * STREAM_READY_TIMEOUT (or the browser has no EventSource), the worker
+ * falls back to long polls: the server holds each one until output
+ * arrives (or LONG_POLL_WAIT passes), and the next is sent as soon as it
+ * returns. A server that answers at once instead is polled every
+ * POLL_INTERVAL_FG while output flows, backing off exponentially to
+ * POLL_INTERVAL_IDLE_MAX while it's idle, and snapping back on output or
+ * input. Polls ask for changed sessions only, so an idle batch is an empty
+ * 204. Panes are streamed or polled per server worker that owns their
+ * sessions (session ids start with "w<shard>-"), since a stream or held
+ * poll can only cover a single worker's sessions.
+ *
+ * Each pane tracks a byte offset into its session's output stream; polls ask
+ * for output since that offset, so nothing is lost or repeated when the main
+ * thread switches between WebSocket and polling.
+ *
  * Message protocol (main → worker):
- *   { type: 'start_poll',        paneId, sessionId }
+ *   { type: 'start_poll',        paneId, sessionId, offset }
  *   { type: 'stop_poll',         paneId }
  *   { type: 'visibility_change', hidden: bool }
+ *   { type: 'input_activity' }                    // Input sent over HTTP
  *
  * Message protocol (worker → main):
- *   { type: 'output',            paneId, data }
+ *   { type: 'output',            paneId, data }   // data: { output, offset, next_offset, gap, ... }
  *   { type: 'session_ended',     paneId, reason }
  *   { type: 'connection_status', paneId, status, attempt, maxAttempts }
  *   { type: 'session_dead',      paneId }
@@ -21,7 +40,10 @@
 "use strict";
 
 // ── Constants ─────────────────────────────────────────────────────────────
-const POLL_INTERVAL_FG = 100;        // ms — foreground batch poll
+const POLL_INTERVAL_FG = 100;        // ms — gap after a poll that returned nothing (servers that don't hold polls)...
+const POLL_INTERVAL_IDLE_MAX = 2000; // ms — ...doubling up to this while output stays idle
+const LONG_POLL_WAIT = 25;           // s — how long the server may hold a foreground poll
+const STREAM_READY_TIMEOUT = 5000;   // ms — a stream not open by then is treated as blocked
 const HEARTBEAT_INTERVAL_BG = 30000; // ms — background heartbeat
 const RETRY_BASE_MS = 500;
 const RETRY_MULTIPLIER = 2;
@@ -31,11 +53,18 @@ const SILENT_RETRY_THRESHOLD = 5;  // Don't show banner until this many consecut
 
 // ── Per-pane state ────────────────────────────────────────────────────────
 const panes = new Map();
-// Each entry: { sessionId }
+// Each entry: { sessionId, offset }  (offset null = server-side cursor)
 
 let globalHidden = false;
 let batchTimerId = null;
 let retryCount = 0;
+let pollGeneration = 0;              // Bumped to end the running poll loops
+const inflight = new Set();          // AbortControllers of outstanding long polls
+const pollClientId = Math.random().toString(36).slice(2);
+let idleDelay = POLL_INTERVAL_FG;     // Current gap after an empty poll
+let wakeSleepers = [];               // Resolvers of pollLoop sleeps, called on activity
+const streams = new Set();           // Open EventSources
+let streamsBlocked = typeof EventSource === "undefined";  // Set once a stream never opens
 
 // ── Retry helpers ─────────────────────────────────────────────────────────
 
@@ -47,21 +76,150 @@ function retryDelay(attempt) {
 
 // ── Batch polling logic ──────────────────────────────────────────────────
 
-async function batchPoll() {
-  if (panes.size === 0) return;
+function shardOf(sessionId) {
+  const match = /^w(\d+)-/.exec(sessionId);
+  return match ? match[0] : "";
+}
+
+// Sleeps *ms*, or until activity() cuts it short
+function sleep(ms) {
+  return new Promise((resolve) => {
+    const timer = setTimeout(resolve, ms);
+    wakeSleepers.push(() => { clearTimeout(timer); resolve(); });
+  });
+}
+
+// Output or input: poll at full speed again
+function activity() {
+  idleDelay = POLL_INTERVAL_FG;
+  const sleepers = wakeSleepers;
+  wakeSleepers = [];
+  for (const wake of sleepers) wake();
+}
+
+// Hands one session's output to its pane. Returns true if it was news
+function deliver(paneId, data) {
+  const state = panes.get(paneId);
+  if (!state) return false;
+  if (data.next_offset !== undefined && (state.offset === null || data.next_offset > state.offset)) {
+    state.offset = data.next_offset;
+  }
+
+  self.postMessage({ type: "output", paneId, data });
+  if (data.exited) {
+    self.postMessage({ type: "session_ended", paneId, reason: "exited" });
+    panes.delete(paneId);
+    return true;
+  }
+  return Boolean(data.output) || data.gap || data.timeout_warning;
+}
+
+// ── Output stream (Server-Sent Events) ───────────────────────────────────
+
+// Streams the panes of one shard, falling back to pollLoop if the stream
+// can't be opened. Once open, EventSource reconnects by itself and the
+// server resumes from the Last-Event-ID offsets
+function streamShard(generation, shard) {
+  const cursor = [];
+  const sidToPaneId = new Map();
+  for (const [paneId, state] of panes) {
+    if (shardOf(state.sessionId) !== shard) continue;
+    cursor.push(state.offset === null ? state.sessionId : `${state.sessionId}:${state.offset}`);
+    sidToPaneId.set(state.sessionId, paneId);
+  }
+  if (cursor.length === 0) return;
+
+  const source = new EventSource(`/api/stream?sessions=${encodeURIComponent(cursor.join(","))}`);
+  streams.add(source);
+  let opened = false;
+  let readyTimer = null;
+
+  const close = () => {
+    clearTimeout(readyTimer);
+    source.close();
+    streams.delete(source);
+  };
+  const fallBack = () => {
+    close();
+    if (generation !== pollGeneration) return;   // Closed by a restart, not a failure
+    if (!opened) streamsBlocked = true;
+    pollLoop(generation, shard);
+  };
+  const awaitReady = () => {
+    clearTimeout(readyTimer);
+    readyTimer = setTimeout(fallBack, STREAM_READY_TIMEOUT);
+  };
+
+  awaitReady();
+  source.addEventListener("ready", () => {
+    opened = true;
+    clearTimeout(readyTimer);
+    retryCount = 0;
+  });
+  source.addEventListener("terminal_output", (event) => {
+    const data = JSON.parse(event.data);
+    deliver(sidToPaneId.get(data.session_id), data);
+    if (![...sidToPaneId.values()].some((paneId) => panes.has(paneId))) close();
+  });
+  source.addEventListener("shutting_down", () => {
+    close();
+    for (const paneId of panes.keys()) {
+      self.postMessage({ type: "session_ended", paneId, reason: "shutting_down" });
+    }
+    handleRetry(new Error("Server shutting down"));
+  });
+  source.onerror = () => {
+    if (source.readyState === EventSource.CLOSED) {
+      fallBack();       // Refused (e.g. 403, 503): polling reports or retries it
+    } else {
+      awaitReady();     // Reconnecting
+    }
+  };
+}
+
+// ── Long polling ─────────────────────────────────────────────────────────
+
+// One long-poll loop per shard; ends when pollGeneration moves on or a poll fails
+async function pollLoop(generation, shard) {
+  while (generation === pollGeneration) {
+    const result = await batchPoll(shard);
+    if (result === null || generation !== pollGeneration) return;
+    if (result) {
+      activity();
+    } else {
+      // Returned empty-handed: don't spin, and slow down while it stays idle
+      const delay = idleDelay;
+      idleDelay = Math.min(idleDelay * 2, POLL_INTERVAL_IDLE_MAX);
+      await sleep(delay);
+    }
+  }
+}
 
+// Polls the panes of one shard. Returns true if any output arrived, false
+// if none, null if polling stopped (error, abort or shutdown)
+async function batchPoll(shard) {
   const sessionIds = [];
+  const offsets = {};
   const sidToPaneId = new Map();
   for (const [paneId, state] of panes) {
+    if (shardOf(state.sessionId) !== shard) continue;
     sessionIds.push(state.sessionId);
+    if (state.offset !== null) offsets[state.sessionId] = state.offset;
     sidToPaneId.set(state.sessionId, paneId);
   }
+  if (sessionIds.length === 0) return null;
 
+  const controller = new AbortController();
+  inflight.add(controller);
   try {
     const resp = await fetch("/api/output-batch", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ session_ids: sessionIds }),
+      body: JSON.stringify({
+        session_ids: sessionIds, offsets, changed_only: true,
+        wait: LONG_POLL_WAIT, poll_id: `${pollClientId}:${shard}`,
+      }),
+      signal: controller.signal,
     });
 
     if (!resp.ok) {
@@ -70,13 +228,15 @@ async function batchPoll() {
           self.postMessage({ type: "session_ended", paneId, reason: "auth_expired" });
         }
         stopAllPanes();
-        return;
+        return null;
       }
       throw new Error(`HTTP ${resp.status}`);
     }
 
     retryCount = 0;
+    if (resp.status === 204) return false;       // Nothing changed
     const result = await resp.json();
+    if (controller.signal.aborted) return null;  // Superseded while the body arrived
 
     if (result.shutting_down) {
       for (const paneId of panes.keys()) {
@@ -85,23 +245,21 @@ async function batchPoll() {
       // Don't stopAllPanes() — retry with backoff so we
       // auto-recover when the new server comes up.
       handleRetry(new Error("Server shutting down"));
-      return;
+      return null;
     }
 
     // Distribute outputs to each pane
+    let news = false;
     for (const [sid, data] of Object.entries(result.outputs || {})) {
-      const paneId = sidToPaneId.get(sid);
-      if (!paneId) continue;
-
-      self.postMessage({ type: "output", paneId, data });
-
-      if (data.exited) {
-        self.postMessage({ type: "session_ended", paneId, reason: "exited" });
-        panes.delete(paneId);
-      }
+      news = deliver(sidToPaneId.get(sid), data) || news;
     }
+    return news;
   } catch (err) {
+    if (err.name === "AbortError") return null;  // Loop restarted (panes changed, hidden, stopped)
     handleRetry(err);
+    return null;
+  } finally {
+    inflight.delete(controller);
   }
 }
 
@@ -117,7 +275,7 @@ async function batchHeartbeat() {
     const resp = await fetch("/api/output-batch", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ session_ids: sessionIds }),
+      body: JSON.stringify({ session_ids: sessionIds, changed_only: true }),
     });
 
     if (!resp.ok) {
@@ -132,6 +290,7 @@ async function batchHeartbeat() {
     }
 
     retryCount = 0;
+    if (resp.status === 204) return;
 
     const result = await resp.json();
     for (const [sid, data] of Object.entries(result.outputs || {})) {
@@ -203,6 +362,12 @@ function clearBatchTimer() {
     clearTimeout(batchTimerId);
     batchTimerId = null;
   }
+  pollGeneration++;
+  for (const controller of inflight) controller.abort();
+  inflight.clear();
+  for (const source of streams) source.close();
+  streams.clear();
+  activity();                        // Ends the loops' sleeps too
 }
 
 function startBatchTimer() {
@@ -213,8 +378,11 @@ function startBatchTimer() {
     batchHeartbeat();
     batchTimerId = setInterval(() => batchHeartbeat(), HEARTBEAT_INTERVAL_BG);
   } else {
-    batchPoll();
-    batchTimerId = setInterval(() => batchPoll(), POLL_INTERVAL_FG);
+    const shards = new Set([...panes.values()].map((state) => shardOf(state.sessionId)));
+    for (const shard of shards) {
+      if (streamsBlocked) pollLoop(pollGeneration, shard);
+      else streamShard(pollGeneration, shard);
+    }
   }
 }
 
@@ -230,7 +398,10 @@ self.onmessage = function (event) {
 
   switch (msg.type) {
     case "start_poll":
-      panes.set(msg.paneId, { sessionId: msg.sessionId });
+      panes.set(msg.paneId, {
+        sessionId: msg.sessionId,
+        offset: Number.isInteger(msg.offset) ? msg.offset : null,
+      });
       startBatchTimer();
       break;
 
@@ -239,6 +410,10 @@ self.onmessage = function (event) {
       if (panes.size === 0) clearBatchTimer();
       break;
 
+    case "input_activity":
+      activity();
+      break;
+
     case "visibility_change":
       globalHidden = msg.hidden;
       startBatchTimer();
@@ -0,0 +1,188 @@
+"""Fingerprinted, precompressed static assets, built at startup.
+
+The UI is one large ``index.html`` plus ~500 KB of xterm.js, its addons and
+socket.io, served uncompressed and revalidated on every load — slow on a
+first paint through the Databricks Apps proxy, and a round of requests on
+every reload. ``AssetManifest.build()`` walks the static directory once:
+
+- Every file is hashed (SHA-256 of its bytes) and published under a
+  content-addressed URL, ``/assets/lib/xterm.<hash>.js``. The URL changes
+  whenever the file does, so responses can be cached forever
+  (``immutable``) and reloads never ask again.
+- Compressible files of MIN_COMPRESS_BYTES or more get gzip and, with the
+  optional ``brotli`` package, brotli variants, each kept only where it is
+  smaller. Variants are written once to a content-addressed cache
+  directory, so sibling workers and restarts reuse them and every variant
+  is a plain file for ``send_file`` (``wsgi.file_wrapper`` / sendfile).
+- Entry pages (``index.html``) keep their URL. References in them to
+  ``/static/<file>`` are rewritten to the fingerprinted URLs; the rewritten
+  page is precompressed too and is revalidated by ETag rather than cached.
+
+Build-free: nothing is bundled or minified, and the files in ``static/``
+stay servable as they are.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+import threading
+import logging
+
+try:
+    import brotli
+except ImportError:     # Optional: without it only gzip variants are made
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+HASH_LENGTH = 12            # Hex digits of the content hash kept in URLs
+MIN_COMPRESS_BYTES = 512    # Smaller files aren't worth a variant
+COMPRESSIBLE = frozenset((".css", ".html", ".js", ".json", ".map", ".svg", ".txt"))
+# Content-Encoding -> cache file suffix, in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+_STATIC_REF = re.compile(r"/static/([\w./-]+\.\w+)")
+
+
+class Asset:
+    """One servable file: its variants by Content-Encoding ("" is identity)."""
+
+    __slots__ = ("name", "url", "digest", "mimetype", "files")
+
+    def __init__(self, name, url, digest, mimetype, files):
+        self.name = name
+        self.url = url
+        self.digest = digest
+        self.mimetype = mimetype
+        self.files = files
+
+    def negotiate(self, accepts):
+        """The best encoding of this asset that *accepts* (``encoding -> bool``) allows."""
+        for encoding, _ in ENCODINGS:
+            if encoding in self.files and accepts(encoding):
+                return encoding
+        return ""
+
+    def etag(self, encoding):
+        return f"{self.digest}-{encoding}" if encoding else self.digest
+
+
+class AssetManifest:
+    """The assets of *root*, fingerprinted under *url_prefix*. See module docstring.
+
+    Lookups build the manifest on first use if ``build()`` hasn't run.
+    """
+
+    def __init__(self, root, url_prefix="/assets", cache_dir=None, entry_points=("index.html",)):
+        self.root = root
+        self.url_prefix = url_prefix
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), f"coda-assets-{os.getuid()}")
+        self.entry_points = frozenset(entry_points)
+        self._lock = threading.Lock()
+        self._assets = None     # Fingerprinted path -> Asset
+        self._urls = {}         # Name under root -> fingerprinted URL
+        self._pages = {}        # Entry point name -> Asset
+
+    def build(self):
+        """(Re)scan *root*, writing compressed variants. Returns the number of assets."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        assets, urls, pages = {}, {}, {}
+        entries = []
+        for name in self._walk():
+            if name in self.entry_points:
+                entries.append(name)
+                continue
+            path = os.path.join(self.root, name)
+            with open(path, "rb") as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+            stem, ext = os.path.splitext(name)
+            fingerprinted = f"{stem}.{digest}{ext}"
+            asset = Asset(name, f"{self.url_prefix}/{fingerprinted}", digest,
+                          _mimetype(name), {"": path, **self._compress(name, digest, data)})
+            assets[fingerprinted] = asset
+            urls[name] = asset.url
+
+        # Entry pages last, once every URL they may reference is known
+        for name in entries:
+            with open(os.path.join(self.root, name), "rb") as f:
+                text = f.read().decode()
+            data = _STATIC_REF.sub(lambda m: urls.get(m.group(1), m.group(0)), text).encode()
+            digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+            path = self._write(digest, "", data)
+            pages[name] = Asset(name, None, digest, _mimetype(name),
+                                {"": path, **self._compress(name, digest, data)})
+
+        with self._lock:
+            self._assets, self._urls, self._pages = assets, urls, pages
+        return len(assets) + len(pages)
+
+    def get(self, fingerprinted):
+        """The Asset published as ``<url_prefix>/<fingerprinted>``, or None."""
+        return self._ensure().get(fingerprinted)
+
+    def page(self, name):
+        """Entry page *name*, with its asset references rewritten, or None."""
+        self._ensure()
+        return self._pages.get(name)
+
+    def url(self, name):
+        """The fingerprinted URL of *name* (relative to root)."""
+        self._ensure()
+        return self._urls[name]
+
+    # ── Internals ────────────────────────────────────────────────────────
+
+    def _ensure(self):
+        assets = self._assets
+        if assets is None:
+            with self._lock:
+                built = self._assets is not None
+            if not built:
+                self.build()
+            assets = self._assets
+        return assets
+
+    def _walk(self):
+        for directory, subdirs, files in os.walk(self.root):
+            subdirs[:] = sorted(d for d in subdirs if not d.startswith("."))
+            for file in sorted(files):
+                if not file.startswith("."):
+                    yield os.path.relpath(os.path.join(directory, file), self.root).replace(os.sep, "/")
+
+    def _compress(self, name, digest, data):
+        """Compressed variants of *data* that are worth serving: {encoding: path}."""
+        if os.path.splitext(name)[1] not in COMPRESSIBLE or len(data) < MIN_COMPRESS_BYTES:
+            return {}
+        variants = {}
+        for encoding, suffix in ENCODINGS:
+            path = os.path.join(self.cache_dir, digest + suffix)
+            if not os.path.exists(path):
+                if encoding == "br":
+                    if brotli is None:
+                        continue
+                    compressed = brotli.compress(data, quality=11)
+                else:
+                    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+                if len(compressed) >= len(data):
+                    continue
+                self._write(digest, suffix, compressed)
+            variants[encoding] = path
+        return variants
+
+    def _write(self, digest, suffix, data):
+        """Store *data* as ``<digest><suffix>`` in the cache, atomically (workers build at once)."""
+        path = os.path.join(self.cache_dir, digest + suffix)
+        if not os.path.exists(path):
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return path
+
+
+def _mimetype(name):
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
@@ -0,0 +1,811 @@
+"""Headless VT screen model: what each session's terminal is showing right now.
+
+Every byte of PTY output is fed through a small incremental VT parser that
+keeps a cell grid per session (main and alternate screen, cursor, pen,
+scroll region, the terminal modes a client has to know about). Reattaching
+then costs one ``snapshot()`` — escape-sequence text that redraws the screen
+and its scrollback on a freshly reset xterm.js — instead of replaying the raw
+stream (which garbles once the start has been evicted) or forcing the app to
+repaint via SIGWINCH (which plain shells ignore).
+
+Storage is compact: a live row is a list of one-character strings (shared,
+interned objects) plus an ``array('H')`` of style ids, where a style id
+indexes a per-screen table of distinct (flags, fg, bg) pens. Rows that
+scroll off the top shrink to their joined text (plus the style array when
+the row mixes styles) in a bounded deque, and are only turned into escape
+sequences when a snapshot is taken.
+
+The parser tokenizes with one regex so runs of printable text are copied
+into a row with slice assignment instead of cell by cell.
+"""
+
+import re
+import unicodedata
+from array import array
+from collections import deque
+
+DEFAULT_COLS = 80
+DEFAULT_ROWS = 24
+SCROLLBACK_LINES = 1000      # Serialized rows kept above the screen
+MAX_PENDING = 4096           # Longest partial escape sequence held between feeds
+MAX_STYLES = 4096            # Style-table size that triggers compaction (fits array "H")
+MAX_SGR_CACHE = 1024         # Memoized (pen, SGR params) -> pen transitions
+MAX_DIMENSION = 1000         # Upper bound for cols/rows from a client resize
+
+# Pen flag bits and the SGR code that sets each one
+BOLD, DIM, ITALIC, UNDERLINE, BLINK, INVERSE, HIDDEN, STRIKE = (1 << i for i in range(8))
+_FLAG_CODES = ((BOLD, "1"), (DIM, "2"), (ITALIC, "3"), (UNDERLINE, "4"),
+               (BLINK, "5"), (INVERSE, "7"), (HIDDEN, "8"), (STRIKE, "9"))
+_SGR_ON = {1: BOLD, 2: DIM, 3: ITALIC, 4: UNDERLINE, 5: BLINK, 6: BLINK,
+           7: INVERSE, 8: HIDDEN, 9: STRIKE, 21: UNDERLINE}
+_SGR_OFF = {22: BOLD | DIM, 23: ITALIC, 24: UNDERLINE, 25: BLINK,
+            27: INVERSE, 28: HIDDEN, 29: STRIKE}
+_DEFAULT_PEN = (0, None, None)
+
+# DEC private modes that change how the client behaves (keys, mouse, paste,
+# cursor), not what the grid holds — recorded and replayed on snapshot
+_CLIENT_MODES = frozenset((1, 12, 25, 1000, 1002, 1003, 1004, 1005, 1006, 1015, 1016, 2004))
+
+# DEC special graphics (ESC ( 0) — line drawing used by ncurses-style TUIs
+_DEC_GRAPHICS = str.maketrans(
+    "`abcdefghijklmnopqrstuvwxyz{|}~",
+    "◆▒␉␌␍␊°±␤␋┘┐┌└┼⎺⎻─⎼⎽├┤┴┬│≤≥π≠£·",
+)
+
+_TOKEN = re.compile(
+    r"(?P<text>[^\x00-\x1f\x7f-\x9f]+)"
+    r"|(?P<csi>\x1b\[[0-?]*[ -/]*[@-~])"
+    r"|(?P<string>\x1b[\]P_^X][^\x07\x1b]*(?:\x07|\x1b\\))"          # OSC/DCS/APC/PM/SOS
+    r"|(?P<partial>\x1b(?:\[[0-?]*[ -/]*|[\]P_^X][^\x07\x1b]*\x1b?|[ -/]*)\Z)"
+    r"|(?P<aborted>\x1b[\]P_^X][^\x07\x1b]*(?=\x1b))"                 # Cut short by a new ESC
+    r"|(?P<esc>\x1b[ -/]*[0-~])"
+    r"|(?P<ctl>[\x00-\x1a\x1c-\x1f])"
+)
+_INTERMEDIATES = " !\"#$%&'()*+,-./"
+
+
+def _char_width(ch):
+    """Columns *ch* occupies: 0 for combining marks, 2 for wide East Asian."""
+    if unicodedata.combining(ch) or unicodedata.category(ch) in ("Me", "Mn", "Cf"):
+        return 0
+    return 2 if unicodedata.east_asian_width(ch) in ("W", "F") else 1
+
+
+def _int_params(params):
+    """CSI parameter string -> list of ints (missing/odd values become 0)."""
+    out = []
+    for p in params.split(";"):
+        p = p.split(":", 1)[0]
+        out.append(int(p) if p.isdigit() else 0)
+    return out
+
+
+def _extended_color(base, parts):
+    """Parse the values after ``38``/``48`` (``5;n`` or ``2;r;g;b``).
+
+    Returns ``(fragment, consumed)``; *fragment* is None if malformed.
+    """
+    if not parts:
+        return None, 0
+    if parts[0] == "5" and len(parts) >= 2:
+        return f"{base};5;{parts[1] or 0}", 2
+    if parts[0] == "2" and len(parts) >= 4:
+        r, g, b = (int(v) if v.isdigit() else 0 for v in parts[1:4])
+        return f"{base};2;{r};{g};{b}", 4
+    return None, 1
+
+
+def _sgr_text(pen):
+    flags, fg, bg = pen
+    codes = ["0"]
+    codes.extend(code for bit, code in _FLAG_CODES if flags & bit)
+    if fg:
+        codes.append(fg)
+    if bg:
+        codes.append(bg)
+    return "\x1b[" + ";".join(codes) + "m"
+
+
+class _Line:
+    """One grid row. ``wrapped`` marks a row that continues the one above."""
+
+    __slots__ = ("chars", "styles", "wrapped")
+
+    def __init__(self, cols, style=0):
+        self.chars = [" "] * cols
+        self.styles = array("H", [style]) * cols
+        self.wrapped = False
+
+    def erase(self, start, end, style):
+        n = end - start
+        if n > 0:
+            self.chars[start:end] = [" "] * n
+            self.styles[start:end] = array("H", [style]) * n
+
+    def resize(self, cols):
+        have = len(self.chars)
+        if cols < have:
+            del self.chars[cols:]
+            del self.styles[cols:]
+        elif cols > have:
+            self.chars.extend([" "] * (cols - have))
+            self.styles.extend(array("H", [0]) * (cols - have))
+
+
+class TerminalScreen:
+    """Incremental VT parser and cell grid for one session.
+
+    Not thread-safe: callers hold the owning session's lock.
+    """
+
+    def __init__(self, cols=DEFAULT_COLS, rows=DEFAULT_ROWS, scrollback=SCROLLBACK_LINES):
+        self.cols = cols
+        self.rows = rows
+        self._scrollback = deque(maxlen=scrollback)
+        self._pending = ""
+        self._sgr_cache = {}
+        self._reset()
+
+    def _reset(self):
+        self._style_ids = {_DEFAULT_PEN: 0}
+        self._style_sgr = [_sgr_text(_DEFAULT_PEN)]
+        self._pen = _DEFAULT_PEN
+        self._pen_id = 0
+        self._erase_id = 0
+        self._main = [_Line(self.cols) for _ in range(self.rows)]
+        self._alt = None
+        self.lines = self._main
+        self.x = 0
+        self.y = 0
+        self._wrap_pending = False
+        self._top = 0
+        self._bottom = self.rows - 1
+        self._autowrap = True
+        self._origin = False
+        self._insert = False
+        self._modes = {}
+        self._keypad = False
+        self._charsets = [False, False]   # G0, G1: DEC graphics designated?
+        self._shift = 0                   # Which of G0/G1 is invoked (SI/SO)
+        self._cursor_style = ""
+        self._saved = [None, None]        # DECSC state for main / alt screen
+        self._last_char = " "
+
+    @property
+    def pending(self):
+        """Tail of the fed text that is an incomplete escape sequence."""
+        return self._pending
+
+    @property
+    def alternate(self):
+        return self._alt is not None
+
+    # ── Input ────────────────────────────────────────────────────────────
+
+    def feed(self, text):
+        """Apply decoded PTY output to the screen."""
+        if self._pending:
+            text = self._pending + text
+            self._pending = ""
+        for m in _TOKEN.finditer(text):
+            kind = m.lastgroup
+            tok = m.group()
+            if kind == "text":
+                self._print(tok)
+            elif kind == "csi":
+                self._csi(tok)
+            elif kind == "ctl":
+                self._control(tok)
+            elif kind == "esc":
+                self._esc(tok)
+            elif kind == "partial":
+                # Hold it for the next feed; a runaway string (OSC 52, sixel)
+                # keeps only its introducer so the rest is still swallowed.
+                self._pending = tok if len(tok) <= MAX_PENDING else tok[:2]
+            # "string" / "aborted": titles, hyperlinks, DCS — nothing on the grid
+
+    def resize(self, cols, rows):
+        """Follow a terminal resize (no reflow; rows leaving the top go to scrollback)."""
+        cols = max(1, min(int(cols), MAX_DIMENSION))
+        rows = max(1, min(int(rows), MAX_DIMENSION))
+        if (cols, rows) == (self.cols, self.rows):
+            return
+        for lines in (self._main, self._alt):
+            if lines is None:
+                continue
+            for line in lines:
+                line.resize(cols)
+        self.cols = cols
+        if rows < self.rows:
+            # Keep the cursor row on screen, like xterm: drop rows from the top
+            excess = self.rows - rows
+            from_top = min(excess, max(0, self.y - rows + 1))
+            for lines in (self._main, self._alt):
+                if lines is None:
+                    continue
+                for _ in range(from_top):
+                    line = lines.pop(0)
+                    if lines is self._main:
+                        self._push_scrollback(line, lines[0].wrapped)
+                del lines[rows:]
+            self.y -= from_top
+        else:
+            for lines in (self._main, self._alt):
+                if lines is not None:
+                    lines.extend(_Line(cols) for _ in range(rows - self.rows))
+        self.rows = rows
+        self._top, self._bottom = 0, rows - 1
+        self.x = min(self.x, cols - 1)
+        self.y = min(self.y, rows - 1)
+        self._wrap_pending = False
+
+    # ── Output ───────────────────────────────────────────────────────────
+
+    def snapshot(self):
+        """Escape-sequence text that redraws scrollback + screen on a reset terminal."""
+        parts = [entry if isinstance(entry, str) else self._line_text(*entry)
+                 for entry in self._scrollback]
+        parts.append(self._lines_text(self._main))
+        if self._alt is not None:
+            # ?1049h saves the main cursor and clears the alternate screen
+            saved = self._saved[0]
+            if saved:
+                parts.append(f"\x1b[{saved['y'] + 1};{saved['x'] + 1}H")
+            parts.append("\x1b[?1049h\x1b[H")
+            parts.append(self._lines_text(self._alt))
+        parts.append("\x1b[0m")
+        if (self._top, self._bottom) != (0, self.rows - 1):
+            parts.append(f"\x1b[{self._top + 1};{self._bottom + 1}r")
+        if not self._autowrap:
+            parts.append("\x1b[?7l")
+        if self._insert:
+            parts.append("\x1b[4h")
+        for mode, on in sorted(self._modes.items()):
+            parts.append(f"\x1b[?{mode}{'h' if on else 'l'}")
+        if self._keypad:
+            parts.append("\x1b=")
+        if self._charsets[0]:
+            parts.append("\x1b(0")
+        if self._charsets[1]:
+            parts.append("\x1b)0")
+        if self._shift:
+            parts.append("\x0e")
+        parts.append(self._cursor_style)
+        parts.append(f"\x1b[{self.y + 1};{self.x + 1}H")
+        if self._origin:
+            # Origin mode homes the cursor, so restore it relative to the region
+            parts.append(f"\x1b[?6h\x1b[{self.y - self._top + 1};{self.x + 1}H")
+        if self._pen_id:
+            parts.append(self._style_sgr[self._pen_id])
+        return "".join(parts)
+
+    def text(self):
+        """Plain text of the visible screen, one string per row (for tests/debugging)."""
+        return ["".join(line.chars).rstrip() for line in self.lines]
+
+    def _lines_text(self, lines):
+        out = []
+        last = len(lines) - 1
+        for i, line in enumerate(lines):
+            joined = i < last and lines[i + 1].wrapped
+            out.append(self._line_text(line.chars, line.styles, joined, newline=i < last))
+        return "".join(out)
+
+    def _push_scrollback(self, line, joined):
+        """Keep a row that scrolled off the top. Single-style rows are
+        serialized now (one join); mixed rows keep text + styles until a
+        snapshot needs them, so a flood of colored output stays cheap."""
+        styles = line.styles
+        if styles.count(styles[0]) == len(styles) or "" in line.chars:
+            self._scrollback.append(self._line_text(line.chars, styles, joined))
+        else:
+            self._scrollback.append(("".join(line.chars), styles, joined))
+
+    def _line_text(self, chars, styles, joined=False, newline=True):
+        """Serialize one row (*chars* is a list of cells or a str).
+
+        A *joined* row is kept full width so the client soft-wraps into the
+        next one exactly as the app did.
+        """
+        end = len(styles)
+        first = styles[0] if end else 0
+        if styles.count(first) == end:
+            text = "".join(chars)
+            if not joined and first == 0:
+                text = text.rstrip(" ")
+            if first:
+                text = self._style_sgr[first] + text + "\x1b[0m"
+        else:
+            if not joined:
+                while end and chars[end - 1] == " " and styles[end - 1] == 0:
+                    end -= 1
+            out = []
+            start = 0
+            while start < end:
+                sid = styles[start]
+                stop = start + 1
+                while stop < end and styles[stop] == sid:
+                    stop += 1
+                out.append(self._style_sgr[sid])
+                out.append("".join(chars[start:stop]))
+                start = stop
+            out.append("\x1b[0m")
+            text = "".join(out)
+        if newline and not joined:
+            text += "\r\n"
+        return text
+
+    # ── Printing ─────────────────────────────────────────────────────────
+
+    def _print(self, run):
+        if self._charsets[self._shift]:
+            run = run.translate(_DEC_GRAPHICS)
+        if run.isascii():
+            self._print_narrow(run)
+        else:
+            for ch in run:
+                self._print_char(ch)
+        self._last_char = run[-1]
+
+    def _print_narrow(self, run):
+        """Fast path: every character is one cell wide."""
+        cols = self.cols
+        if self._wrap_pending and not self._autowrap:
+            self._wrap_pending = False
+        if not self._autowrap and len(run) > cols - self.x:
+            run = run[:cols - self.x - 1] + run[-1]  # The rest overprints the last column
+        pos = 0
+        total = len(run)
+        while pos < total:
+            if self._wrap_pending:
+                self._wrap()
+            x = self.x
+            chunk = run[pos:pos + cols - x]
+            n = len(chunk)
+            line = self.lines[self.y]
+            if self._insert:
+                self._insert_cells(line, x, n)
+            line.chars[x:x + n] = chunk
+            line.styles[x:x + n] = array("H", [self._pen_id]) * n
+            pos += n
+            if x + n >= cols:
+                self.x = cols - 1
+                self._wrap_pending = True
+            else:
+                self.x = x + n
+
+    def _print_char(self, ch):
+        width = _char_width(ch)
+        if width == 0:
+            # Combining mark: attach to the character before the cursor
+            x = self.x if self._wrap_pending else self.x - 1
+            chars = self.lines[self.y].chars
+            if x > 0 and chars[x] == "":
+                x -= 1
+            if x >= 0:
+                chars[x] += ch
+            return
+        if self._wrap_pending:
+            if self._autowrap:
+                self._wrap()
+            else:
+                self._wrap_pending = False
+        if width == 2 and self.x == self.cols - 1:
+            if not self._autowrap or self.cols < 2:
+                return
+            self.lines[self.y].erase(self.x, self.cols, self._erase_id)
+            self._wrap()
+        line = self.lines[self.y]
+        x = self.x
+        if self._insert:
+            self._insert_cells(line, x, width)
+        line.chars[x] = ch
+        line.styles[x] = self._pen_id
+        if width == 2:
+            line.chars[x + 1] = ""   # Placeholder for the right half of a wide character
+            line.styles[x + 1] = self._pen_id
+        if x + width >= self.cols:
+            self.x = self.cols - 1
+            self._wrap_pending = True
+        else:
+            self.x = x + width
+
+    def _wrap(self):
+        self._wrap_pending = False
+        self.x = 0
+        self._linefeed()
+        self.lines[self.y].wrapped = True
+
+    # ── Cursor and scrolling ─────────────────────────────────────────────
+
+    def _linefeed(self):
+        self._wrap_pending = False
+        if self.y == self._bottom:
+            self._scroll_up(1)
+        elif self.y < self.rows - 1:
+            self.y += 1
+
+    def _reverse_index(self):
+        self._wrap_pending = False
+        if self.y == self._top:
+            self._scroll_down(1)
+        elif self.y > 0:
+            self.y -= 1
+
+    def _scroll_up(self, n, top=None):
+        top = self._top if top is None else top
+        bottom = self._bottom
+        lines = self.lines
+        to_scrollback = top == 0 and lines is self._main
+        for _ in range(min(n, bottom - top + 1)):
+            line = lines.pop(top)
+            if to_scrollback:
+                self._push_scrollback(line, top < bottom and lines[top].wrapped)
+            lines.insert(bottom, _Line(self.cols, self._erase_id))
+
+    def _scroll_down(self, n, top=None):
+        top = self._top if top is None else top
+        bottom = self._bottom
+        for _ in range(min(n, bottom - top + 1)):
+            del self.lines[bottom]
+            self.lines.insert(top, _Line(self.cols, self._erase_id))
+
+    def _move_to(self, x, y):
+        """Absolute move; *y* is relative to the scroll region in origin mode."""
+        if self._origin:
+            y = min(max(y + self._top, self._top), self._bottom)
+        self.x = min(max(x, 0), self.cols - 1)
+        self.y = min(max(y, 0), self.rows - 1)
+        self._wrap_pending = False
+
+    def _move_rows(self, delta):
+        """Relative vertical move that stops at the scroll region margins."""
+        y = self.y + delta
+        if delta < 0 and self.y >= self._top:
+            y = max(y, self._top)
+        elif delta > 0 and self.y <= self._bottom:
+            y = min(y, self._bottom)
+        self.y = min(max(y, 0), self.rows - 1)
+        self._wrap_pending = False
+
+    def _save_cursor(self):
+        self._saved[self._alt is not None] = {
+            "x": self.x, "y": self.y, "pen": self._pen, "origin": self._origin,
+            "wrap_pending": self._wrap_pending, "charsets": list(self._charsets),
+            "shift": self._shift,
+        }
+
+    def _restore_cursor(self):
+        saved = self._saved[self._alt is not None]
+        if saved is None:
+            self._move_to(0, 0)
+            self._set_pen(_DEFAULT_PEN)
+            return
+        self.x = min(saved["x"], self.cols - 1)
+        self.y = min(saved["y"], self.rows - 1)
+        self._origin = saved["origin"]
+        self._wrap_pending = saved["wrap_pending"] and self.x == self.cols - 1
+        self._charsets = list(saved["charsets"])
+        self._shift = saved["shift"]
+        self._set_pen(saved["pen"])
+
+    def _switch_screen(self, alt):
+        if alt == (self._alt is not None):
+            return
+        if alt:
+            self._alt = [_Line(self.cols) for _ in range(self.rows)]
+            self.lines = self._alt
+        else:
+            self._alt = None
+            self.lines = self._main
+        self._wrap_pending = False
+
+    # ── Editing ──────────────────────────────────────────────────────────
+
+    def _insert_cells(self, line, x, n):
+        n = min(n, self.cols - x)
+        line.chars[x:x] = [" "] * n
+        line.styles[x:x] = array("H", [self._erase_id]) * n
+        del line.chars[self.cols:]
+        del line.styles[self.cols:]
+
+    def _delete_cells(self, line, x, n):
+        n = min(n, self.cols - x)
+        del line.chars[x:x + n]
+        del line.styles[x:x + n]
+        line.chars.extend([" "] * n)
+        line.styles.extend(array("H", [self._erase_id]) * n)
+
+    def _erase_display(self, mode):
+        if mode == 3:
+            self._scrollback.clear()
+            return
+        line = self.lines[self.y]
+        if mode == 0:
+            line.erase(self.x, self.cols, self._erase_id)
+            rows = range(self.y + 1, self.rows)
+        elif mode == 1:
+            line.erase(0, self.x + 1, self._erase_id)
+            rows = range(self.y)
+        else:
+            rows = range(self.rows)
+        for y in rows:
+            self.lines[y] = _Line(self.cols, self._erase_id)
+
+    def _erase_line(self, mode):
+        line = self.lines[self.y]
+        if mode == 0:
+            line.erase(self.x, self.cols, self._erase_id)
+        elif mode == 1:
+            line.erase(0, self.x + 1, self._erase_id)
+        else:
+            line.erase(0, self.cols, self._erase_id)
+
+    # ── Styles ───────────────────────────────────────────────────────────
+
+    def _style_id(self, pen):
+        sid = self._style_ids.get(pen)
+        if sid is None:
+            if len(self._style_sgr) >= MAX_STYLES:
+                self._compact_styles()
+            sid = len(self._style_sgr)
+            self._style_ids[pen] = sid
+            self._style_sgr.append(_sgr_text(pen))
+        return sid
+
+    def _set_pen(self, pen):
+        self._pen = pen
+        self._pen_id = self._style_id(pen)
+        erase = (0, None, pen[2])
+        self._erase_id = self._pen_id if erase == pen else self._style_id(erase)
+
+    def _compact_styles(self):
+        """Drop style-table entries no live cell uses."""
+        self._scrollback = deque(
+            (entry if isinstance(entry, str) else self._line_text(*entry)
+             for entry in self._scrollback),
+            maxlen=self._scrollback.maxlen,
+        )
+        used = {0, self._pen_id, self._erase_id}
+        for lines in (self._main, self._alt):
+            for line in lines or ():
+                used.update(line.styles)
+        pens = {sid: pen for pen, sid in self._style_ids.items()}
+        remap = {}
+        self._style_ids = {}
+        self._style_sgr = []
+        for sid in sorted(used):   # 0 (the default pen) keeps id 0
+            remap[sid] = len(self._style_sgr)
+            self._style_ids[pens[sid]] = remap[sid]
+            self._style_sgr.append(_sgr_text(pens[sid]))
+        for lines in (self._main, self._alt):
+            for line in lines or ():
+                line.styles = array("H", (remap[s] for s in line.styles))
+        self._pen_id = remap[self._pen_id]
+        self._erase_id = remap[self._erase_id]
+
+    def _sgr(self, params):
+        """Pen after applying SGR *params* to the current one."""
+        flags, fg, bg = self._pen
+        parts = params.split(";") if params else ["0"]
+        i = 0
+        while i < len(parts):
+            part = parts[i]
+            i += 1
+            if ":" in part:
+                # ITU form: 38:2::r:g:b, 38:5:n, 4:3 (curly underline)
+                sub = part.split(":")
+                if sub[0] in ("38", "48"):
+                    values = ["2"] + sub[-3:] if sub[1] == "2" else sub[1:]
+                    color, _ = _extended_color(sub[0], values)
+                    if color and sub[0] == "38":
+                        fg = color
+                    elif color:
+                        bg = color
+                elif sub[0] == "4":
+                    flags = flags | UNDERLINE if sub[1] not in ("", "0") else flags & ~UNDERLINE
+                continue
+            code = int(part) if part.isdigit() else 0
+            if code == 0:
+                flags, fg, bg = _DEFAULT_PEN
+            elif code in _SGR_ON:
+                flags |= _SGR_ON[code]
+            elif code in _SGR_OFF:
+                flags &= ~_SGR_OFF[code]
+            elif 30 <= code <= 37 or 90 <= code <= 97:
+                fg = str(code)
+            elif 40 <= code <= 47 or 100 <= code <= 107:
+                bg = str(code)
+            elif code == 39:
+                fg = None
+            elif code == 49:
+                bg = None
+            elif code in (38, 48, 58):
+                color, used = _extended_color(str(code), parts[i:i + 4])
+                i += used
+                if color and code == 38:
+                    fg = color
+                elif color and code == 48:
+                    bg = color
+        return flags, fg, bg
+
+    # ── Sequence dispatch ────────────────────────────────────────────────
+
+    def _control(self, ch):
+        if ch == "\r":
+            self.x = 0
+            self._wrap_pending = False
+        elif ch in "\n\x0b\x0c":
+            self._linefeed()
+        elif ch == "\x08":
+            if self._wrap_pending:
+                self._wrap_pending = False
+            if self.x > 0:
+                self.x -= 1
+        elif ch == "\t":
+            self.x = min(self.cols - 1, (self.x // 8 + 1) * 8)
+            self._wrap_pending = False
+        elif ch == "\x0e":
+            self._shift = 1
+        elif ch == "\x0f":
+            self._shift = 0
+
+    def _esc(self, tok):
+        final = tok[-1]
+        inter = tok[1:-1]
+        if inter in ("(", ")"):
+            self._charsets[inter == ")"] = final == "0"
+        elif inter:
+            return
+        elif final == "7":
+            self._save_cursor()
+        elif final == "8":
+            self._restore_cursor()
+        elif final == "D":
+            self._linefeed()
+        elif final == "E":
+            self.x = 0
+            self._linefeed()
+        elif final == "M":
+            self._reverse_index()
+        elif final == "c":
+            self._scrollback.clear()
+            self._reset()
+        elif final == "=":
+            self._keypad = True
+        elif final == ">":
+            self._keypad = False
+
+    def _csi(self, tok):
+        body = tok[2:-1]
+        final = tok[-1]
+        params = body.rstrip(_INTERMEDIATES)
+        inter = body[len(params):]
+        private = params[:1] if params[:1] in ("<", "=", ">", "?") else ""
+        if private:
+            params = params[1:]
+        if inter:
+            if inter == " " and final == "q":
+                self._cursor_style = tok
+            elif inter == "!" and final == "p":
+                self._soft_reset()
+            return
+        if private == "?":
+            if final in "hl":
+                for mode in _int_params(params):
+                    self._set_private_mode(mode, final == "h")
+                return
+            if final not in "JK":
+                return
+        elif private:
+            return
+        if final == "m":
+            # Apps repeat the same few transitions; skip re-parsing them
+            key = (self._pen, params)
+            pen = self._sgr_cache.get(key)
+            if pen is None:
+                if len(self._sgr_cache) >= MAX_SGR_CACHE:
+                    self._sgr_cache.clear()
+                pen = self._sgr_cache[key] = self._sgr(params)
+            self._set_pen(pen)
+            return
+        args = _int_params(params)
+        arg = args[0] or 1                  # Count-style parameter (0 means 1)
+        raw = args[0]                       # Mode-style parameter (0 is meaningful)
+        if final == "A":
+            self._move_rows(-arg)
+        elif final in "Be":
+            self._move_rows(arg)
+        elif final in "Ca":
+            self.x = min(self.x + arg, self.cols - 1)
+            self._wrap_pending = False
+        elif final == "D":
+            self.x = max(self.x - arg, 0)
+            self._wrap_pending = False
+        elif final == "E":
+            self._move_rows(arg)
+            self.x = 0
+        elif final == "F":
+            self._move_rows(-arg)
+            self.x = 0
+        elif final in "G`":
+            self.x = min(arg, self.cols) - 1
+            self._wrap_pending = False
+        elif final in "Hf":
+            col = args[1] if len(args) > 1 and args[1] else 1
+            self._move_to(col - 1, arg - 1)
+        elif final == "d":
+            self._move_to(self.x, arg - 1)
+        elif final == "J":
+            self._erase_display(raw)
+        elif final == "K":
+            self._erase_line(raw)
+        elif final == "X":
+            self.lines[self.y].erase(self.x, min(self.x + arg, self.cols), self._erase_id)
+        elif final == "@":
+            self._insert_cells(self.lines[self.y], self.x, arg)
+        elif final == "P":
+            self._delete_cells(self.lines[self.y], self.x, arg)
+        elif final in "LM":
+            if self._top <= self.y <= self._bottom:
+                if final == "L":
+                    self._scroll_down(arg, top=self.y)
+                else:
+                    self._scroll_up(arg, top=self.y)
+                self.x = 0
+                self._wrap_pending = False
+        elif final == "S":
+            self._scroll_up(arg)
+        elif final == "T":
+            self._scroll_down(arg)
+        elif final == "b":
+            self._print(self._last_char * min(arg, self.cols * self.rows))
+        elif final == "r":
+            top = arg - 1
+            bottom = (args[1] if len(args) > 1 and args[1] else self.rows) - 1
+            bottom = min(bottom, self.rows - 1)
+            if top < bottom:
+                self._top, self._bottom = top, bottom
+                self._move_to(0, 0)
+        elif final == "s":
+            self._save_cursor()
+        elif final == "u":
+            self._restore_cursor()
+        elif final in "hl":
+            if 4 in args:
+                self._insert = final == "h"
+
+    def _set_private_mode(self, mode, on):
+        if mode in _CLIENT_MODES:
+            self._modes[mode] = on
+        elif mode == 7:
+            self._autowrap = on
+        elif mode == 6:
+            self._origin = on
+            self._move_to(0, 0)
+        elif mode in (47, 1047):
+            self._switch_screen(on)
+        elif mode == 1048:
+            self._save_cursor() if on else self._restore_cursor()
+        elif mode == 1049:
+            if on:
+                self._saved[0] = None
+                self._save_cursor()
+                self._switch_screen(True)
+            else:
+                self._switch_screen(False)
+                self._restore_cursor()
+
+    def _soft_reset(self):
+        """DECSTR: pen, margins and modes back to defaults; content stays."""
+        self._set_pen(_DEFAULT_PEN)
+        self._top, self._bottom = 0, self.rows - 1
+        self._autowrap = True
+        self._origin = False
+        self._insert = False
+        self._keypad = False
+        self._charsets = [False, False]
+        self._shift = 0
+        self._modes.pop(25, None)
+        self._modes.pop(1, None)
+        self._saved = [None, None]
@@ -0,0 +1,194 @@
+"""Terminal sessions and the registry that maps ids to them.
+
+Sessions used to be plain dicts in a dict guarded by one global lock, and
+every lookup — each PTY read on the I/O loop, each keystroke, each
+heartbeat — took that lock just to find the session. Now:
+
+- ``Session`` is a ``__slots__`` class: fixed fields instead of a per-session
+  hash table of string keys, and a typo'd field is an AttributeError rather
+  than a silent new key. Its own ``lock`` still guards the mutable output
+  and flow-control state.
+- Each session moves through an explicit lifecycle: ``STARTING`` (built,
+  not yet on the I/O loop) -> ``RUNNING`` -> ``DRAINING`` (terminated;
+  waiting for the process to go) -> ``EXITED`` (process reaped, fd
+  closed). ``closed`` is set on reaching ``EXITED``, so code can wait for a
+  session to be fully torn down.
+- ``SessionRegistry`` is copy-on-write: adding or removing a session
+  builds a new dict under ``lock`` and swaps it in, so lookups and
+  iteration read the current dict without taking any lock. Sessions are
+  created and closed rarely and number in the single digits; they are
+  looked up on every byte of I/O.
+"""
+
+import threading
+import time
+
+from input_queue import InputQueue
+from output_coalescer import OutputCoalescer
+from output_ring import OutputRing
+from ws_frames import MAX_SESSION_INDEX
+
+STARTING = "starting"
+RUNNING = "running"
+DRAINING = "draining"
+EXITED = "exited"
+
+_LIFECYCLE = (STARTING, RUNNING, DRAINING, EXITED)
+
+
+class Session:
+    """One terminal: its PTY, child process, output history and client state."""
+
+    __slots__ = (
+        "session_id", "master_fd", "pid", "index", "label", "created_at", "state", "closed",
+        "send_lock", "lock", "last_poll_time", "last_view_time", "last_input_time", "timeout_warning",
+        "output_buffer", "emit_cursor", "http_cursor", "coalescer", "input_queue",
+        "screen_lock", "screen", "screen_cursor", "screen_resizes", "recording", "flow_acks", "flow_paused_at", "offset_cell",
+        "remote_viewers", "output_waiters",
+    )
+
+    def __init__(self, session_id, master_fd, pid, *, index=None, label="",
+                 output_buffer=None, coalescer=None, input_queue=None, screen=None,
+                 recording=None, last_poll_time=None, created_at=None, state=STARTING,
+                 offset_cell=None):
+        now = time.time()
+        self.session_id = session_id
+        self.master_fd = master_fd
+        self.pid = pid
+        self.index = index              # Names the session in binary WebSocket frames
+        self.label = label
+        self.created_at = now if created_at is None else created_at
+        self.state = state
+        self.closed = threading.Event()  # Set once EXITED
+        self.send_lock = threading.Lock()  # Held while output is sent to viewers (taken before lock)
+        self.lock = threading.Lock()     # Guards everything below
+        self.last_poll_time = now if last_poll_time is None else last_poll_time
+        self.last_view_time = now        # Last HTTP read of its output (WS viewers are in rooms)
+        self.last_input_time = now       # Last keystrokes
+        self.timeout_warning = False     # Idle deadline passed 80%; cleared when reported
+        self.output_buffer = OutputRing() if output_buffer is None else output_buffer
+        start = self.output_buffer.start  # Non-zero for a session adopted from pty_host
+        self.emit_cursor = start         # WS room has been sent everything before this offset
+        self.http_cursor = start         # Legacy cursor for pollers that don't send offsets
+        self.coalescer = OutputCoalescer() if coalescer is None else coalescer
+        self.input_queue = InputQueue() if input_queue is None else input_queue
+        self.screen_resizes = []         # (offset, cols, rows) not yet applied to the screen
+        # Guards the screen model, which is brought up to date only when a
+        # snapshot is wanted (taken before lock)
+        self.screen_lock = threading.Lock()
+        self.screen = screen             # Parsed screen + scrollback for instant reattach, or None
+        self.screen_cursor = start       # Output fed into the screen up to this offset
+        self.recording = recording       # On-disk history (session_recorder), or None
+        self.flow_acks = {}              # Flow-control subscriber -> (acked offset, monotonic time)
+        self.flow_paused_at = None
+        self.offset_cell = offset_cell   # Shared with pty_host: output offset after each read
+        self.remote_viewers = {}         # worker_shards Link -> output formats it relays
+        self.output_waiters = set()      # Events of long polls blocked on this session
+        if state == EXITED:
+            self.closed.set()
+
+    def __repr__(self):
+        return f"<Session {self.session_id} pid={self.pid} {self.state}>"
+
+    @property
+    def live(self):
+        """True until the session starts terminating."""
+        return self.state in (STARTING, RUNNING)
+
+    def advance(self, state):
+        """Move forward to lifecycle *state*. Returns False, changing nothing,
+        if the session is already there or past it (e.g. terminated twice)."""
+        with self.lock:
+            if _LIFECYCLE.index(state) <= _LIFECYCLE.index(self.state):
+                return False
+            self.state = state
+        if state == EXITED:
+            self.closed.set()
+        return True
+
+
+class SessionRegistry:
+    """session_id -> Session, plus the binary-frame index of each.
+
+    Lookups (``get``, ``by_index``, ``in``, ``len``, iteration) take no lock.
+    Writers take ``lock`` (re-entrant, so a caller may hold it around a
+    check-then-``add``).
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._sessions = {}     # Replaced, never mutated, once published
+        self._indexes = {}      # index -> Session
+        self._index_range = None  # (first, last) when sharded (worker_shards); default all
+        self._next_index = 0
+
+    def get(self, session_id, default=None):
+        return self._sessions.get(session_id, default)
+
+    def by_index(self, index):
+        """The session a binary frame's *index* names, or None."""
+        return self._indexes.get(index)
+
+    def __getitem__(self, session_id):
+        return self._sessions[session_id]
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __iter__(self):
+        return iter(self._sessions)
+
+    def items(self):
+        return self._sessions.items()
+
+    def values(self):
+        return self._sessions.values()
+
+    def set_index_range(self, first, last):
+        """Allocate new indexes only from ``[first, last]`` (this worker's shard)."""
+        with self.lock:
+            self._index_range = (first, last)
+            self._next_index = first
+
+    def add(self, session):
+        """Publish *session*, first giving it a free index if it has none.
+
+        Indexes count up and wrap, so one isn't reused until the counter has
+        gone all the way round — a stale client can't type into a newer session.
+        """
+        with self.lock:
+            if session.index is None:
+                first, last = self._index_range or (0, MAX_SESSION_INDEX)
+                index = self._next_index
+                while index in self._indexes:
+                    index = first if index >= last else index + 1
+                self._next_index = first if index >= last else index + 1
+                session.index = index
+            sessions = dict(self._sessions)
+            sessions[session.session_id] = session
+            indexes = dict(self._indexes)
+            indexes[session.index] = session
+            self._sessions, self._indexes = sessions, indexes
+        return session
+
+    def pop(self, session_id, default=None):
+        """Unpublish and return the session, or *default* if it isn't registered."""
+        with self.lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return default
+            sessions = dict(self._sessions)
+            del sessions[session_id]
+            indexes = self._indexes
+            if indexes.get(session.index) is session:
+                indexes = dict(indexes)
+                del indexes[session.index]
+            self._sessions, self._indexes = sessions, indexes
+        return session
+
+    def clear(self):
+        with self.lock:
+            self._sessions, self._indexes = {}, {}
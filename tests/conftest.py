@@ -0,0 +1,81 @@
+"""Fixtures shared by the tests of app.py.
+
+- ``app_module``: app imported with initialize_app mocked out and no owner
+  (authorization off), with an empty session registry
+- ``add_session``: put a Session with a given output history in the registry
+- ``pty_write``: feed bytes to read_pty_output, as the multiplexer would, and
+  wait until they have been sent to viewers
+- ``pipe``: an ``(r, w)`` pipe to stand in for a session's PTY
+"""
+
+import os
+from unittest import mock
+
+import pytest
+
+from output_ring import OutputRing
+from terminal_session import Session
+
+
+@pytest.fixture(scope="session")
+def imported_app():
+    """Import app with initialize_app mocked out."""
+    with mock.patch("app.initialize_app"):
+        import app as app_module
+        app_module.app.config["TESTING"] = True
+        return app_module
+
+
+@pytest.fixture
+def app_module(imported_app):
+    app_module = imported_app
+    original_owner = app_module.app_owner
+    app_module.app_owner = None
+    with app_module.sessions_lock:
+        app_module.sessions.clear()     # Left behind by tests with fixtures of their own
+    yield app_module
+    app_module.app_owner = original_owner
+    with app_module.sessions_lock:
+        app_module.sessions.clear()
+
+
+@pytest.fixture
+def add_session(app_module):
+    """``add_session(session_id, output=b"", capacity=1024, **fields)``: a Session
+    whose ring holds *output*, all of it already sent to viewers. *fields* are
+    Session arguments (``master_fd`` and ``pid`` default to dummies)."""
+
+    def add(session_id, output=b"", capacity=1024, master_fd=999, pid=12345, **fields):
+        ring = OutputRing(capacity)
+        ring.write(output)
+        fields.setdefault("label", session_id)
+        session = Session(session_id, master_fd, pid, output_buffer=ring, **fields)
+        session.emit_cursor = ring.end
+        return app_module.sessions.add(session)
+
+    return add
+
+
+@pytest.fixture
+def pty_write(app_module):
+    """``pty_write(session_id, data)``: *data* read from the session's PTY."""
+
+    def write(session_id, data):
+        r, w = os.pipe()
+        try:
+            os.write(w, data)
+            assert app_module.read_pty_output(session_id, r) is True
+            app_module.output_sender.drain()    # Frames are sent off the PTY loop
+        finally:
+            os.close(r)
+            os.close(w)
+
+    return write
+
+
+@pytest.fixture
+def pipe():
+    r, w = os.pipe()
+    yield r, w
+    os.close(r)
+    os.close(w)
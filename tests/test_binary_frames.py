@@ -0,0 +1,155 @@
+"""Tests for binary WebSocket frames (ws_frames.py and their use in app.py).
+
+Verifies that:
+- Output and input frames round-trip through pack/unpack
+- join_session with binary replays missed output as a raw-bytes frame
+- Live output reaches binary viewers as frames and JSON viewers as events
+- Live output the ring evicted before it was sent is flagged as a gap in both formats
+- Output is not decoded for a room nobody is listening in
+- A binary input frame is written to the session's PTY; unknown indexes are ignored
+"""
+
+import os
+from unittest import mock
+
+import pytest
+
+import ws_frames
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+def _received(ws, name):
+    return [e["args"][0] for e in ws.get_received() if e["name"] == name]
+
+
+# ---------------------------------------------------------------------------
+# 1. Codec
+# ---------------------------------------------------------------------------
+
+class TestCodec:
+
+    def test_output_round_trip(self):
+        frame = ws_frames.pack_output(7, 2 ** 40 + 3, b"\x1b[31mhi", gap=True)
+        assert len(frame) == 12 + 7
+        assert ws_frames.unpack_output(frame) == (7, 2 ** 40 + 3, b"\x1b[31mhi", True)
+
+    def test_input_round_trip(self):
+        frame = ws_frames.pack_input(65535, "é".encode())
+        assert ws_frames.unpack_input(frame) == (65535, "é".encode())
+
+    @pytest.mark.parametrize("frame", [b"", b"\x02\x00", b"\x01\x00\x00\x01abc"])
+    def test_malformed_input_rejected(self, frame):
+        with pytest.raises(ValueError):
+            ws_frames.unpack_input(frame)
+
+
+# ---------------------------------------------------------------------------
+# 2. Output over Socket.IO
+# ---------------------------------------------------------------------------
+
+class TestBinaryOutput:
+
+    def test_join_binary_replays_frame(self, app_module, add_session):
+        add_session("bin-1", b"before-join", index=41)
+        ws = app_module.socketio.test_client(app_module.app)
+        try:
+            ack = ws.emit("join_session", {"session_id": "bin-1", "offset": 7, "binary": True},
+                          callback=True)
+            assert (ack["status"], ack["index"], ack["binary"]) == ("ok", 41, True)
+            frames = _received(ws, "terminal_output_bin")
+            assert len(frames) == 1
+            assert ws_frames.unpack_output(frames[0]) == (41, 7, b"join", False)
+        finally:
+            ws.disconnect()
+
+    def test_live_output_per_format(self, app_module, add_session, pty_write):
+        add_session("bin-2", index=42)
+        binary = app_module.socketio.test_client(app_module.app)
+        text = app_module.socketio.test_client(app_module.app)
+        try:
+            binary.emit("join_session", {"session_id": "bin-2", "binary": True}, callback=True)
+            text.emit("join_session", {"session_id": "bin-2"}, callback=True)
+            pty_write("bin-2", "ok \x1b[1m✓".encode())
+
+            received = binary.get_received()
+            assert [e["name"] for e in received] == ["terminal_output_bin"]
+            assert ws_frames.unpack_output(received[0]["args"][0])[2] == "ok \x1b[1m✓".encode()
+
+            events = _received(text, "terminal_output")
+            assert [e["output"] for e in events] == ["ok \x1b[1m✓"]
+        finally:
+            binary.disconnect()
+            text.disconnect()
+
+    def test_live_output_reports_gap(self, app_module, add_session):
+        session = add_session("bin-5", b"x" * 10, index=45)
+        binary = app_module.socketio.test_client(app_module.app)
+        text = app_module.socketio.test_client(app_module.app)
+        try:
+            binary.emit("join_session", {"session_id": "bin-5", "binary": True}, callback=True)
+            text.emit("join_session", {"session_id": "bin-5"}, callback=True)
+            with session.lock:  # Output outruns the sender and wraps the ring
+                session.output_buffer.write(b"y" * 2000)
+            app_module._emit_pending_output("bin-5", session)
+
+            _, offset, data, gap = ws_frames.unpack_output(_received(binary, "terminal_output_bin")[0])
+            assert (offset, len(data), gap) == (2010 - 1024, 1024, True)
+            [event] = _received(text, "terminal_output")
+            assert (event["offset"], event["gap"]) == (2010 - 1024, True)
+        finally:
+            binary.disconnect()
+            text.disconnect()
+
+    def test_no_decode_without_text_viewers(self, app_module, add_session, pty_write):
+        add_session("bin-3", index=43)
+        ws = app_module.socketio.test_client(app_module.app)
+        try:
+            ws.emit("join_session", {"session_id": "bin-3", "binary": True}, callback=True)
+            with mock.patch.object(app_module, "_output_fields") as fields:
+                pty_write("bin-3", b"data")
+            fields.assert_not_called()
+        finally:
+            ws.disconnect()
+
+    def test_session_without_index_falls_back_to_json(self, app_module, add_session):
+        add_session("bin-4", b"abc", index=44)
+        app_module.sessions["bin-4"].index = None
+        ws = app_module.socketio.test_client(app_module.app)
+        try:
+            ack = ws.emit("join_session", {"session_id": "bin-4", "offset": 0, "binary": True},
+                          callback=True)
+            assert ack["binary"] is False
+            assert [e["output"] for e in _received(ws, "terminal_output")] == ["abc"]
+        finally:
+            ws.disconnect()
+
+
+# ---------------------------------------------------------------------------
+# 3. Input over Socket.IO
+# ---------------------------------------------------------------------------
+
+class TestBinaryInput:
+
+    def test_input_frame_written_to_pty(self, app_module, add_session):
+        r, w = os.pipe()
+        add_session("bin-5", index=45, master_fd=w)
+        ws = app_module.socketio.test_client(app_module.app)
+        try:
+            ws.emit("terminal_input", ws_frames.pack_input(45, "ls ✓\r".encode()))
+            assert os.read(r, 100) == "ls ✓\r".encode()
+        finally:
+            ws.disconnect()
+            os.close(r)
+            os.close(w)
+
+    def test_unknown_index_ignored(self, app_module):
+        ws = app_module.socketio.test_client(app_module.app)
+        try:
+            with mock.patch("app.os.write") as write:
+                ws.emit("terminal_input", ws_frames.pack_input(60000, b"x"))
+            write.assert_not_called()
+        finally:
+            ws.disconnect()
@@ -58,11 +58,12 @@ class TestClipboardAddonIntegration:
         )
 
     def test_script_loaded_after_other_addons(self):
-        # addon-clipboard should be loaded after the core addons
-        image_pos = self.html.index("addon-image.js")
-        clipboard_pos = self.html.index("addon-clipboard.js")
-        assert clipboard_pos > image_pos, (
-            "addon-clipboard.js should be loaded after addon-image.js"
+        # addon-clipboard should be loaded (eagerly) after the core addons;
+        # image and search are loaded on first use
+        fit_pos = self.html.index('<script src="/static/lib/addon-fit.js">')
+        clipboard_pos = self.html.index('<script src="/static/lib/addon-clipboard.js">')
+        assert clipboard_pos > fit_pos, (
+            "addon-clipboard.js should be loaded after addon-fit.js"
         )
 
     def test_addon_initialized_in_create_pane(self):
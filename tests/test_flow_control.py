@@ -0,0 +1,266 @@
+"""Tests for output flow control / backpressure.
+
+Verifies that:
+- PTYMultiplexer.pause() stops output dispatch, resume() restarts it,
+  and child exit is still detected while paused
+- Sessions without acks are never throttled
+- An output_ack subscribes its client; the PTY is paused once the slowest
+  subscriber is more than FLOW_HIGH_WATERMARK behind
+- Acks (WebSocket or HTTP polling) below FLOW_LOW_WATERMARK resume it;
+  HTTP polls alone don't opt a session in
+- A subscriber that stops acking while paused is dropped after
+  FLOW_ACK_TIMEOUT; the others still count
+- leave_session, a disconnect or a ``hidden`` ack unsubscribe a client
+"""
+
+import os
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from output_ring import OutputRing
+from pty_mux import PTYMultiplexer
+from terminal_session import Session
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+
+class TestMultiplexerPause:
+
+    def test_pause_stops_dispatch_and_resume_restarts(self):
+        seen = []
+
+        def on_readable(key, fd):
+            seen.append(os.read(fd, 4096))
+            return True
+
+        mux = PTYMultiplexer(on_readable=on_readable, on_exit=lambda k: None)
+        r, w = os.pipe()
+        try:
+            mux.register("p1", r, os.getpid())
+            assert mux.pause("p1") is True
+            assert mux.pause("p1") is False  # Already paused
+            os.write(w, b"held")
+            time.sleep(0.2)
+            assert seen == []
+            assert mux.resume("p1") is True
+            assert _wait_for(lambda: seen == [b"held"])
+        finally:
+            mux.unregister("p1")
+            os.close(r)
+            os.close(w)
+
+    def test_unknown_key(self):
+        mux = PTYMultiplexer(on_readable=lambda k, fd: True, on_exit=lambda k: None)
+        assert mux.pause("missing") is False
+        assert mux.resume("missing") is False
+
+    def test_exit_detected_while_paused(self):
+        import pty
+        import subprocess
+        master_fd, slave_fd = pty.openpty()
+        proc = subprocess.Popen(["sleep", "0.2"], stdin=slave_fd, stdout=slave_fd,
+                                stderr=slave_fd, preexec_fn=os.setsid)
+        os.close(slave_fd)
+        exited = threading.Event()
+        mux = PTYMultiplexer(on_readable=lambda k, fd: bool(os.read(fd, 4096)),
+                             on_exit=lambda k: exited.set(), sweep_interval=0.1)
+        try:
+            mux.register("p2", master_fd, proc.pid)
+            mux.pause("p2")
+            assert exited.wait(5.0)
+            assert "p2" not in mux
+        finally:
+            proc.wait()
+            os.close(master_fd)
+
+
+class TestSessionFlowControl:
+
+    @pytest.fixture
+    def mux(self, app_module):
+        with mock.patch.object(app_module.pty_mux, "pause") as pause, \
+             mock.patch.object(app_module.pty_mux, "resume") as resume, \
+             mock.patch.object(app_module.pty_mux, "schedule"):
+            yield pause, resume
+
+    def _add_session(self, app_module, session_id):
+        return app_module.sessions.add(Session(
+            session_id, 999, 12345, output_buffer=OutputRing(app_module.OUTPUT_BUFFER_BYTES)))
+
+    def _produce(self, app_module, session_id, nbytes):
+        """Feed *nbytes* of output through read_pty_output via a pipe."""
+        r, w = os.pipe()
+        chunk = b"y\n" * 16384  # Fits the pipe; one read drains it
+        try:
+            for _ in range(nbytes // len(chunk) + 1):
+                os.write(w, chunk)
+                assert app_module.read_pty_output(session_id, r) is True
+        finally:
+            os.close(r)
+            os.close(w)
+
+    def test_no_acks_never_pauses(self, app_module, mux):
+        pause, _ = mux
+        self._add_session(app_module, "fc-1")
+        self._produce(app_module, "fc-1", app_module.FLOW_HIGH_WATERMARK * 2)
+        pause.assert_not_called()
+
+    def test_pauses_past_high_watermark_after_ack(self, app_module, mux):
+        pause, _ = mux
+        sess = self._add_session(app_module, "fc-2")
+        ws = app_module.socketio.test_client(app_module.app)
+        try:
+            ws.emit("output_ack", {"session_id": "fc-2", "offset": 0})
+            assert [offset for offset, _ in sess.flow_acks.values()] == [0]
+            self._produce(app_module, "fc-2", app_module.FLOW_HIGH_WATERMARK + 65536)
+            pause.assert_called_with("fc-2")
+            assert sess.flow_paused_at is not None
+        finally:
+            ws.disconnect()
+
+    def test_ack_below_low_watermark_resumes(self, app_module, mux):
+        _, resume = mux
+        sess = self._add_session(app_module, "fc-3")
+        sess.output_buffer.write(b"x" * (app_module.FLOW_HIGH_WATERMARK + 1))
+        sess.flow_paused_at = time.monotonic()
+        end = sess.output_buffer.end
+        ws = app_module.socketio.test_client(app_module.app)
+        try:
+            # Still above the low watermark — stays paused
+            ws.emit("output_ack", {"session_id": "fc-3", "offset": end // 2})
+            resume.assert_not_called()
+            ws.emit("output_ack", {"session_id": "fc-3", "offset": end})
+            resume.assert_called_once_with("fc-3")
+            assert sess.flow_paused_at is None
+        finally:
+            ws.disconnect()
+
+    def test_pauses_on_slowest_subscriber(self, app_module, mux):
+        _, resume = mux
+        sess = self._add_session(app_module, "fc-9")
+        sess.output_buffer.write(b"x" * (app_module.FLOW_HIGH_WATERMARK + 1))
+        sess.flow_paused_at = time.monotonic()
+        end = sess.output_buffer.end
+        fast = app_module.socketio.test_client(app_module.app)
+        slow = app_module.socketio.test_client(app_module.app)
+        try:
+            slow.emit("output_ack", {"session_id": "fc-9", "offset": 0})
+            fast.emit("output_ack", {"session_id": "fc-9", "offset": end})
+            resume.assert_not_called()     # The slow tab still has it all to render
+            slow.emit("output_ack", {"session_id": "fc-9", "offset": end})
+            resume.assert_called_once_with("fc-9")
+        finally:
+            fast.disconnect()
+            slow.disconnect()
+
+    def test_hidden_subscriber_stops_counting(self, app_module, mux):
+        _, resume = mux
+        sess = self._add_session(app_module, "fc-10")
+        sess.output_buffer.write(b"x" * (app_module.FLOW_HIGH_WATERMARK + 1))
+        sess.flow_paused_at = time.monotonic()
+        visible = app_module.socketio.test_client(app_module.app)
+        background = app_module.socketio.test_client(app_module.app)
+        try:
+            background.emit("output_ack", {"session_id": "fc-10", "offset": 0})
+            visible.emit("output_ack", {"session_id": "fc-10", "offset": sess.output_buffer.end})
+            resume.assert_not_called()
+            background.emit("output_ack", {"session_id": "fc-10", "offset": 0, "hidden": True})
+            resume.assert_called_once_with("fc-10")
+            assert len(sess.flow_acks) == 1
+        finally:
+            visible.disconnect()
+            background.disconnect()
+
+    def test_disconnect_unsubscribes(self, app_module, mux):
+        sess = self._add_session(app_module, "fc-11")
+        ws = app_module.socketio.test_client(app_module.app)
+        ws.emit("output_ack", {"session_id": "fc-11", "offset": 0})
+        assert sess.flow_acks
+        ws.disconnect()
+        assert sess.flow_acks == {}
+
+    def test_ack_ignores_invalid_offset(self, app_module, mux):
+        sess = self._add_session(app_module, "fc-4")
+        ws = app_module.socketio.test_client(app_module.app)
+        try:
+            ws.emit("output_ack", {"session_id": "fc-4", "offset": -1})
+            ws.emit("output_ack", {"session_id": "fc-4"})
+            assert sess.flow_acks == {}
+        finally:
+            ws.disconnect()
+
+    def test_http_poll_counts_as_ack(self, app_module, mux):
+        _, resume = mux
+        sess = self._add_session(app_module, "fc-5")
+        sess.output_buffer.write(b"x" * (app_module.FLOW_HIGH_WATERMARK + 1))
+        sess.flow_acks["ws"] = (0, time.monotonic())
+        sess.flow_paused_at = time.monotonic()
+        client = app_module.app.test_client()
+        poll = {"session_ids": ["fc-5"], "offsets": {"fc-5": 0}, "poll_id": "tab-1"}
+        assert client.post("/api/output-batch", json=poll).status_code == 200
+        assert sess.flow_acks["poll:tab-1"][0] == sess.output_buffer.end
+        resume.assert_not_called()      # The WebSocket viewer is still behind
+        app_module._leave_session("fc-5", "ws")
+        resume.assert_called_once_with("fc-5")
+
+    def test_http_poll_alone_does_not_opt_in(self, app_module, mux):
+        sess = self._add_session(app_module, "fc-12")
+        app_module.app.test_client().post("/api/output-batch", json={"session_ids": ["fc-12"]})
+        assert sess.flow_acks == {}
+
+    def test_ack_timeout_releases_flow_control(self, app_module, mux):
+        _, resume = mux
+        sess = self._add_session(app_module, "fc-6")
+        sess.flow_acks["ws"] = (0, time.monotonic() - app_module.FLOW_ACK_TIMEOUT - 2)
+        sess.flow_paused_at = time.monotonic() - app_module.FLOW_ACK_TIMEOUT - 1
+        app_module._on_pty_timer("fc-6")
+        resume.assert_called_once_with("fc-6")
+        assert sess.flow_acks == {}
+        assert sess.flow_paused_at is None
+
+    def test_quiet_subscriber_expires_alone(self, app_module, mux):
+        _, resume = mux
+        sess = self._add_session(app_module, "fc-13")
+        sess.output_buffer.write(b"x" * (app_module.FLOW_HIGH_WATERMARK + 1))
+        now = time.monotonic()
+        sess.flow_paused_at = now - app_module.FLOW_ACK_TIMEOUT - 1
+        sess.flow_acks["gone"] = (0, now - app_module.FLOW_ACK_TIMEOUT - 2)
+        sess.flow_acks["slow"] = (0, now)
+        app_module._on_pty_timer("fc-13")
+        resume.assert_not_called()      # Still waiting on the subscriber that acks
+        assert list(sess.flow_acks) == ["slow"]
+        app_module.pty_mux.schedule.assert_called_with("fc-13", now + app_module.FLOW_ACK_TIMEOUT)
+
+    def test_timer_before_timeout_keeps_paused(self, app_module, mux):
+        _, resume = mux
+        sess = self._add_session(app_module, "fc-7")
+        sess.output_buffer.write(b"x" * (app_module.FLOW_HIGH_WATERMARK + 1))
+        sess.flow_acks["ws"] = (0, time.monotonic())
+        sess.flow_paused_at = time.monotonic()
+        app_module._on_pty_timer("fc-7")
+        resume.assert_not_called()
+        app_module.pty_mux.schedule.assert_called()
+
+    def test_leave_session_releases_flow_control(self, app_module, mux):
+        _, resume = mux
+        sess = self._add_session(app_module, "fc-8")
+        sess.output_buffer.write(b"x" * (app_module.FLOW_HIGH_WATERMARK + 1))
+        sess.flow_paused_at = time.monotonic()
+        ws = app_module.socketio.test_client(app_module.app)
+        try:
+            ws.emit("output_ack", {"session_id": "fc-8", "offset": 0})
+            ws.emit("leave_session", {"session_id": "fc-8"})
+            resume.assert_called_once_with("fc-8")
+            assert sess.flow_acks == {}
+        finally:
+            ws.disconnect()
@@ -1,7 +1,8 @@
 """Tests for /api/heartbeat endpoint — lightweight keep-alive."""
 
 import time
-from collections import deque
+from output_ring import OutputRing
+from terminal_session import Session
 from unittest import mock
 
 import pytest
@@ -20,19 +21,12 @@ def _get_test_client():
 
 
 def _create_fake_session(app_module, session_id="test-session-123", **overrides):
-    """Insert a fake session into the sessions dict."""
-    session = {
-        "master_fd": 999,
-        "pid": 12345,
-        "output_buffer": deque(maxlen=1000),
-        "last_poll_time": time.time() - 60,  # 60s ago
-        "created_at": time.time(),
-        "lock": __import__("threading").Lock(),
-    }
-    session.update(overrides)
-    with app_module.sessions_lock:
-        app_module.sessions[session_id] = session
-    return session
+    """Insert a fake session into the session registry."""
+    session = Session(session_id, 999, 12345, output_buffer=OutputRing(),
+                      last_poll_time=time.time() - 60)  # 60s ago
+    for name, value in overrides.items():
+        setattr(session, name, value)
+    return app_module.sessions.add(session)
 
 
 def _cleanup_session(app_module, session_id="test-session-123"):
@@ -71,7 +65,7 @@ class TestHeartbeatValid:
             after = time.time()
 
             with app_module.sessions_lock:
-                new_poll_time = app_module.sessions["test-session-123"]["last_poll_time"]
+                new_poll_time = app_module.sessions["test-session-123"].last_poll_time
 
             assert new_poll_time >= before
             assert new_poll_time <= after
@@ -107,9 +101,9 @@ class TestHeartbeatPreservesBuffer:
         try:
             # Add some output to the buffer
             with app_module.sessions_lock:
-                buf = app_module.sessions["test-session-123"]["output_buffer"]
-                buf.append("line 1\r\n")
-                buf.append("line 2\r\n")
+                buf = app_module.sessions["test-session-123"].output_buffer
+                buf.write(b"line 1\r\n")
+                buf.write(b"line 2\r\n")
                 buf_len_before = len(buf)
 
             # Send heartbeat
@@ -119,9 +113,13 @@ class TestHeartbeatPreservesBuffer:
 
             # Buffer should be untouched
             with app_module.sessions_lock:
-                buf = app_module.sessions["test-session-123"]["output_buffer"]
+                buf = app_module.sessions["test-session-123"].output_buffer
                 assert len(buf) == buf_len_before
-                assert list(buf) == ["line 1\r\n", "line 2\r\n"]
+
+            # ...and the next poll still delivers everything
+            resp = client.post("/api/output",
+                               json={"session_id": "test-session-123"})
+            assert resp.get_json()["output"] == "line 1\r\nline 2\r\n"
         finally:
             _cleanup_session(app_module)
 
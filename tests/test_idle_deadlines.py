@@ -0,0 +1,212 @@
+"""Tests for event-driven idle deadlines (idle_deadlines.py and its use in app.py).
+
+Verifies that:
+- A deadline fires on time, and deadlines fire in order regardless of insertion order
+- add() replaces a key's deadline (earlier or later); the old entry never fires
+- discard() cancels a pending deadline
+- on_due's return value reschedules the key; None drops it
+- A failing handler doesn't stop the loop
+- Superseded entries are compacted instead of growing the heap without bound
+- app: a session's timeout warning is set at 80% of the timeout, without a scan
+- app: a session polled since its deadline was set is pushed back, not warned
+- app: an idle session is terminated at the timeout, and closing a session cancels its deadline
+"""
+
+import time
+from unittest import mock
+
+import pytest
+
+from idle_deadlines import DeadlineHeap
+
+
+class _Due:
+    def __init__(self, reschedule=None):
+        self.calls = []
+        self.reschedule = reschedule or (lambda key, now: None)
+
+    def __call__(self, key, now):
+        self.calls.append((key, now))
+        return self.reschedule(key, now)
+
+    def keys(self):
+        return [key for key, _ in self.calls]
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+# ---------------------------------------------------------------------------
+# 1. DeadlineHeap
+# ---------------------------------------------------------------------------
+
+class TestDeadlineHeap:
+
+    def test_fires_on_time(self):
+        due = _Due()
+        heap = DeadlineHeap(due)
+        when = time.time() + 0.1
+        heap.add("a", when)
+        assert _wait_for(lambda: due.calls)
+        key, fired_at = due.calls[0]
+        assert key == "a"
+        assert when <= fired_at < when + 0.1
+        assert "a" not in heap
+
+    def test_fires_in_deadline_order(self):
+        due = _Due()
+        heap = DeadlineHeap(due)
+        now = time.time()
+        heap.add("late", now + 0.3)
+        heap.add("early", now + 0.05)   # Must wake the loop sleeping on "late"
+        heap.add("middle", now + 0.15)
+        assert _wait_for(lambda: len(due.calls) == 3)
+        assert due.keys() == ["early", "middle", "late"]
+
+    def test_add_replaces_deadline(self):
+        due = _Due()
+        heap = DeadlineHeap(due)
+        now = time.time()
+        heap.add("a", now + 0.05)
+        heap.add("a", now + 0.3)    # Pushed back — the 0.05 entry is stale
+        heap.add("b", now + 0.5)
+        heap.add("b", now + 0.1)    # Pulled forward
+        time.sleep(0.2)
+        assert due.keys() == ["b"]
+        assert heap.deadline("a") == now + 0.3
+        assert _wait_for(lambda: len(due.calls) == 2)
+        assert due.keys() == ["b", "a"]
+
+    def test_discard_cancels(self):
+        due = _Due()
+        heap = DeadlineHeap(due)
+        heap.add("a", time.time() + 0.05)
+        heap.discard("a")
+        time.sleep(0.15)
+        assert due.calls == []
+        assert len(heap) == 0
+
+    def test_handler_return_reschedules(self):
+        fires = []
+
+        def reschedule(key, now):
+            fires.append(now)
+            return now + 0.05 if len(fires) < 3 else None
+
+        heap = DeadlineHeap(reschedule)
+        heap.add("a", time.time() + 0.05)
+        assert _wait_for(lambda: len(fires) == 3)
+        time.sleep(0.1)
+        assert len(fires) == 3
+        assert "a" not in heap
+
+    def test_failing_handler_does_not_stop_loop(self):
+        calls = []
+
+        def handler(key, now):
+            calls.append(key)
+            if key == "bad":
+                raise RuntimeError("boom")
+
+        heap = DeadlineHeap(handler)
+        now = time.time()
+        heap.add("bad", now + 0.02)
+        heap.add("good", now + 0.05)
+        assert _wait_for(lambda: calls == ["bad", "good"])
+
+    def test_superseded_entries_are_compacted(self):
+        heap = DeadlineHeap(_Due())
+        far = time.time() + 3600
+        for i in range(1000):
+            heap.add("a", far + i)
+        assert len(heap) == 1
+        assert len(heap._heap) <= 2 * len(heap) + 64 + 1
+
+    def test_many_keys_fire_once_each(self):
+        due = _Due()
+        heap = DeadlineHeap(due)
+        now = time.time()
+        for i in range(200):
+            heap.add(i, now + 0.05 + (i % 7) * 0.01)
+        assert _wait_for(lambda: len(due.calls) == 200)
+        assert sorted(due.keys()) == list(range(200))
+
+
+# ---------------------------------------------------------------------------
+# 2. app.py integration
+# ---------------------------------------------------------------------------
+
+def _cleanup(app_module, *session_ids):
+    for sid in session_ids:
+        app_module.sessions.pop(sid)
+        app_module.idle_deadlines.discard(sid)
+
+
+class TestAppIdleDeadlines:
+
+    def test_warning_set_at_80_percent(self, app_module, add_session):
+        with mock.patch.object(app_module, "SESSION_TIMEOUT_SECONDS", 1.0), \
+             mock.patch.object(app_module, "terminate_session"):
+            session = add_session("idle-warn")
+            try:
+                app_module.idle_deadlines.add("idle-warn", session.last_poll_time + 0.8)
+                time.sleep(0.6)
+                assert not session.timeout_warning
+                assert _wait_for(lambda: session.timeout_warning, timeout=1.0)
+                # Next deadline is the timeout itself
+                assert app_module.idle_deadlines.deadline("idle-warn") == \
+                    pytest.approx(session.last_poll_time + 1.0)
+            finally:
+                _cleanup(app_module, "idle-warn")
+
+    def test_polled_session_is_pushed_back(self, app_module, add_session):
+        with mock.patch.object(app_module, "SESSION_TIMEOUT_SECONDS", 1.0), \
+             mock.patch.object(app_module, "terminate_session"):
+            session = add_session("idle-polled")
+            try:
+                app_module.idle_deadlines.add("idle-polled", session.last_poll_time + 0.8)
+                time.sleep(0.5)
+                with session.lock:
+                    session.last_poll_time = time.time()   # Heartbeat: no heap work
+                polled_at = session.last_poll_time
+                assert _wait_for(lambda: app_module.idle_deadlines.deadline("idle-polled")
+                                 == pytest.approx(polled_at + 0.8), timeout=1.0)
+                assert not session.timeout_warning
+            finally:
+                _cleanup(app_module, "idle-polled")
+
+    def test_idle_session_is_terminated(self, app_module, add_session):
+        add_session("idle-stale", last_poll_time=time.time() - app_module.SESSION_TIMEOUT_SECONDS - 1)
+        with mock.patch.object(app_module, "terminate_session") as terminate:
+            try:
+                app_module.idle_deadlines.add("idle-stale", time.time())
+                assert _wait_for(lambda: terminate.called)
+                terminate.assert_called_once_with("idle-stale", 12345, 999)
+                assert "idle-stale" not in app_module.idle_deadlines
+            finally:
+                _cleanup(app_module, "idle-stale")
+
+    def test_check_idle_ignores_closed_session(self, app_module):
+        assert app_module._check_idle("no-such-session", time.time()) is None
+
+    def test_create_and_close_schedule_and_cancel(self, app_module):
+        client = app_module.app.test_client()
+        with mock.patch.object(app_module.shell_pool, "take", return_value=None), \
+             mock.patch.object(app_module, "_spawn_shell", return_value=(10, 99999)), \
+             mock.patch("os.close"), \
+             mock.patch.object(app_module.pty_mux, "register"), \
+             mock.patch.object(app_module.pty_mux, "unregister"), \
+             mock.patch.object(app_module.session_reaper, "reap"):
+            started = time.time()
+            session_id = client.post("/api/session", json={}).get_json()["session_id"]
+            when = app_module.idle_deadlines.deadline(session_id)
+            assert when == pytest.approx(
+                started + app_module.SESSION_TIMEOUT_SECONDS * app_module.TIMEOUT_WARNING_FRACTION, abs=5)
+
+            resp = client.post("/api/session/close", json={"session_id": session_id})
+            assert resp.status_code == 200
+            assert session_id not in app_module.idle_deadlines
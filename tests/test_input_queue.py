@@ -0,0 +1,200 @@
+"""Tests for non-blocking PTY input (input_queue.py and its use in app.py).
+
+Verifies that:
+- Input is written in CHUNK_BYTES pieces and a partial write keeps the remainder first
+- A full PTY makes write_to return instead of blocking; the rest follows once it drains
+- The queue is bounded: input that doesn't fit is rejected whole
+- The multiplexer calls on_writable until the queue drains, then stops watching
+- /api/input and terminal_input never block on a stalled PTY and report a full queue
+"""
+
+import os
+import time
+from unittest import mock
+
+import pytest
+
+import input_queue
+from input_queue import InputQueue
+from pty_mux import PTYMultiplexer
+
+
+def _pipe():
+    """A non-blocking pipe standing in for a PTY whose child isn't reading."""
+    r, w = os.pipe()
+    os.set_blocking(w, False)
+    return r, w
+
+
+def _drain(fd, n):
+    data = b""
+    while len(data) < n:
+        data += os.read(fd, n - len(data))
+    return data
+
+
+# ---------------------------------------------------------------------------
+# 1. InputQueue
+# ---------------------------------------------------------------------------
+
+class TestInputQueue:
+
+    def test_small_input_written_at_once(self):
+        r, w = _pipe()
+        try:
+            q = InputQueue()
+            assert q.push(b"ls\r")
+            assert q.write_to(w) is True
+            assert os.read(r, 100) == b"ls\r"
+            assert q.queued == 0
+        finally:
+            os.close(r)
+            os.close(w)
+
+    def test_writes_are_chunked(self):
+        q = InputQueue()
+        q.push(b"x" * (input_queue.CHUNK_BYTES * 2 + 10))
+        with mock.patch("input_queue.os.write", side_effect=lambda fd, b: len(b)) as write:
+            assert q.write_to(99) is True
+        assert [len(c.args[1]) for c in write.call_args_list] == \
+            [input_queue.CHUNK_BYTES, input_queue.CHUNK_BYTES, 10]
+
+    def test_partial_write_keeps_remainder_in_order(self):
+        q = InputQueue()
+        q.push(b"abcdef")
+        q.push(b"gh")
+        with mock.patch("input_queue.os.write", return_value=4):
+            assert q.write_to(99) is False
+        assert q.queued == 4
+        with mock.patch("input_queue.os.write", side_effect=lambda fd, b: len(b)) as write:
+            assert q.write_to(99) is True
+        assert [bytes(c.args[1]) for c in write.call_args_list] == [b"ef", b"gh"]
+
+    def test_full_pipe_returns_instead_of_blocking(self):
+        r, w = _pipe()
+        try:
+            paste = os.urandom(1024 * 1024)
+            q = InputQueue()
+            q.push(paste)
+            assert q.write_to(w) is False       # Pipe buffer is far smaller than the paste
+            assert 0 < q.queued < len(paste)
+
+            received = bytearray()
+            while q.queued:
+                received += os.read(r, 65536)
+                q.write_to(w)
+            received += _drain(r, len(paste) - len(received))
+            assert bytes(received) == paste
+        finally:
+            os.close(r)
+            os.close(w)
+
+    def test_bounded(self):
+        q = InputQueue(limit=10)
+        assert q.push(b"12345678")
+        assert q.push(b"abc") is False
+        assert q.queued == 8
+
+    def test_write_error_discards_queue(self):
+        r, w = _pipe()
+        os.close(r)
+        try:
+            q = InputQueue()
+            q.push(b"lost")
+            with pytest.raises(OSError):
+                q.write_to(w)
+            assert q.queued == 0
+        finally:
+            os.close(w)
+
+
+# ---------------------------------------------------------------------------
+# 2. Multiplexer write interest
+# ---------------------------------------------------------------------------
+
+class TestWantWrite:
+
+    def test_on_writable_until_drained(self):
+        r, w = _pipe()
+        q = InputQueue()
+        q.push(os.urandom(512 * 1024))
+        q.write_to(w)
+        calls = []
+
+        def on_writable(key, fd):
+            calls.append(key)
+            return not q.write_to(fd)
+
+        mux = PTYMultiplexer(lambda k, fd: True, lambda k: None, on_writable=on_writable)
+        try:
+            mux.register("w1", w, os.getpid())
+            mux.want_write("w1")
+            received = 0
+            deadline = time.time() + 5
+            while received < 512 * 1024 and time.time() < deadline:
+                received += len(os.read(r, 65536))
+            assert received == 512 * 1024
+            time.sleep(0.1)
+            count = len(calls)
+            time.sleep(0.1)         # Pipe stays writable, but nothing is queued
+            assert len(calls) == count  # Write interest dropped once drained
+        finally:
+            mux.unregister("w1")
+            os.close(r)
+            os.close(w)
+
+
+# ---------------------------------------------------------------------------
+# 3. App endpoints
+# ---------------------------------------------------------------------------
+
+class TestAppInput:
+
+    def test_large_paste_does_not_block_request(self, app_module, add_session):
+        r, w = _pipe()
+        try:
+            add_session("inq-1", master_fd=w)
+            paste = "y" * (1024 * 1024)
+            with mock.patch.object(app_module.pty_mux, "want_write") as want_write:
+                resp = app_module.app.test_client().post(
+                    "/api/input", json={"session_id": "inq-1", "input": paste})
+            assert resp.status_code == 200
+            assert resp.get_json()["queued"] > 0
+            want_write.assert_called_once_with("inq-1")
+
+            # The I/O loop finishes the paste as the child reads
+            received = b""
+            while len(received) < len(paste):
+                received += os.read(r, 65536)
+                app_module.write_pty_input("inq-1", w)
+            assert received == paste.encode()
+        finally:
+            os.close(r)
+            os.close(w)
+
+    def test_full_queue_rejected_over_http(self, app_module, add_session):
+        r, w = _pipe()
+        try:
+            sess = add_session("inq-2", master_fd=w, input_queue=InputQueue(8))
+            sess.input_queue.push(b"1234567")    # Still waiting for the PTY
+            resp = app_module.app.test_client().post(
+                "/api/input", json={"session_id": "inq-2", "input": "too much"})
+            assert resp.status_code == 429
+            assert resp.get_json()["queued"] == 7
+        finally:
+            os.close(r)
+            os.close(w)
+
+    def test_full_queue_reported_over_websocket(self, app_module, add_session):
+        r, w = _pipe()
+        sess = add_session("inq-3", master_fd=w, input_queue=InputQueue(8))
+        sess.input_queue.push(b"1234567")
+        ws = app_module.socketio.test_client(app_module.app)
+        try:
+            ws.emit("terminal_input", {"session_id": "inq-3", "input": "too much"})
+            events = [e["args"][0] for e in ws.get_received() if e["name"] == "input_rejected"]
+            assert events == [{"session_id": "inq-3", "bytes": 8, "queued": 7}]
+        finally:
+            ws.disconnect()
+            os.close(r)
+            os.close(w)
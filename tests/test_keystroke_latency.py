@@ -0,0 +1,280 @@
+"""Keystroke round-trip benchmark: keypress to echoed glyph, as a user feels it.
+
+Drives real sessions through the app's own entry points — a PTY running
+``cat`` in raw mode echoes every byte back, the way a shell's line editor
+does — and times:
+
+- websocket: ``terminal_input`` → PTY → read_pty_output → ``terminal_output``,
+  with a Socket.IO test client per session
+- http: ``/api/input`` followed by a ``/api/output-batch`` long poll, the
+  fallback transport, with an HTTP test client per session
+
+for 1 to KEYSTROKE_BENCH_SESSIONS concurrent sessions, each driven by its
+own thread. Per transport and session count it reports p50/p99 echo latency
+of single keystrokes and the echo throughput of back-to-back bursts.
+
+Numbers are compared against ``keystroke_baseline.json`` (next to this
+file): a p99 more than KEYSTROKE_BENCH_TOLERANCE times the baseline (plus
+BASELINE_SLACK_MS), or a throughput that many times lower, fails. After an
+intended change, or on a new reference machine, rerun with
+``KEYSTROKE_BENCH_UPDATE=1`` to rewrite the baseline, and commit it.
+
+    KEYSTROKE_BENCH_UPDATE=1 python -m pytest tests/test_keystroke_latency.py
+"""
+
+import json
+import os
+import pty
+import subprocess
+import threading
+import time
+import tty
+from unittest import mock
+
+import pytest
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "keystroke_baseline.json")
+MAX_SESSIONS = int(os.environ.get("KEYSTROKE_BENCH_SESSIONS", "4"))
+TOLERANCE = float(os.environ.get("KEYSTROKE_BENCH_TOLERANCE", "5"))
+UPDATE_BASELINE = os.environ.get("KEYSTROKE_BENCH_UPDATE", "") == "1"
+
+KEYSTROKES = 100            # Timed single keystrokes per session
+BURST = 200                 # Keystrokes sent back-to-back per session for throughput
+BASELINE_SLACK_MS = 20      # Added to the baseline p99 before comparing (timer noise)
+ECHO_TIMEOUT = 10           # Seconds to wait for an echo before failing
+SESSION_COUNTS = sorted({n for n in (1, 2, 4, 8, 16) if n < MAX_SESSIONS} | {MAX_SESSIONS})
+TRANSPORTS = ("websocket", "http")
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+def _spawn_echo():
+    """Stand-in for app._spawn_shell: ``cat`` on a raw PTY echoes every keystroke."""
+    master_fd, slave_fd = pty.openpty()
+    tty.setraw(slave_fd)    # No kernel echo or line buffering: cat does the echoing
+    try:
+        pid = subprocess.Popen(["cat"], stdin=slave_fd, stdout=slave_fd, stderr=slave_fd,
+                               preexec_fn=os.setsid).pid
+    finally:
+        os.close(slave_fd)
+    os.set_blocking(master_fd, False)
+    return master_fd, pid
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def _keys(count):
+    return [chr(ord("a") + i % 26) for i in range(count)]
+
+
+class _WebSocketDriver:
+    """One session typed into over a Socket.IO test client."""
+
+    def __init__(self, app_module, session_id):
+        self.session_id = session_id
+        self.ws = app_module.socketio.test_client(app_module.app)
+        ack = self.ws.emit("join_session", {"session_id": session_id}, callback=True)
+        assert ack["status"] == "ok"
+        self.echoed = 0
+
+    def send(self, key):
+        self.ws.emit("terminal_input", {"session_id": self.session_id, "input": key})
+
+    def wait_echo(self, total):
+        deadline = time.monotonic() + ECHO_TIMEOUT
+        while self.echoed < total:
+            for event in self.ws.get_received():
+                if event["name"] == "terminal_output":
+                    self.echoed += len(event["args"][0]["output"])
+            if self.echoed < total:
+                assert time.monotonic() < deadline, f"{self.echoed}/{total} keystrokes echoed"
+                time.sleep(0.0002)
+
+    def close(self):
+        self.ws.disconnect()
+
+
+class _HttpDriver:
+    """One session typed into over /api/input and read with /api/output-batch long polls."""
+
+    def __init__(self, app_module, session_id):
+        self.session_id = session_id
+        self.client = app_module.app.test_client()
+        self.offset = 0
+        self.echoed = 0
+
+    def send(self, key):
+        resp = self.client.post("/api/input", json={"session_id": self.session_id, "input": key})
+        assert resp.status_code == 200
+
+    def wait_echo(self, total):
+        deadline = time.monotonic() + ECHO_TIMEOUT
+        while self.echoed < total:
+            assert time.monotonic() < deadline, f"{self.echoed}/{total} keystrokes echoed"
+            resp = self.client.post("/api/output-batch", json={
+                "session_ids": [self.session_id], "offsets": {self.session_id: self.offset},
+                "wait": 1, "poll_id": self.session_id})
+            entry = resp.get_json()["outputs"][self.session_id]
+            self.offset = entry["next_offset"]
+            self.echoed += len(entry["output"])
+
+    def close(self):
+        pass
+
+
+DRIVERS = {"websocket": _WebSocketDriver, "http": _HttpDriver}
+
+
+def _drive(driver, start, latencies, bursts):
+    """Time KEYSTROKES single round trips, then one BURST of back-to-back keys."""
+    start.wait()
+    for key in _keys(KEYSTROKES):
+        sent = time.perf_counter()
+        driver.send(key)
+        driver.wait_echo(driver.echoed + 1)
+        latencies.append(time.perf_counter() - sent)
+
+    target = driver.echoed + BURST
+    sent = time.perf_counter()
+    for key in _keys(BURST):
+        driver.send(key)
+    driver.wait_echo(target)
+    bursts.append(BURST / (time.perf_counter() - sent))
+
+
+def _run(app_module, transport, count):
+    """Benchmark *count* concurrent sessions over *transport*. Returns the result entry."""
+    client = app_module.app.test_client()
+    session_ids = []
+    drivers = []
+    try:
+        for i in range(count):
+            resp = client.post("/api/session", json={"label": f"bench-{i}", "record": False})
+            assert resp.status_code == 200, resp.get_json()
+            session_ids.append(resp.get_json()["session_id"])
+            drivers.append(DRIVERS[transport](app_module, session_ids[-1]))
+
+        start = threading.Barrier(count)
+        latencies, bursts, errors = [], [], []
+
+        def run(driver):
+            try:
+                _drive(driver, start, latencies, bursts)
+            except BaseException as e:     # Re-raised on the test's thread
+                errors.append(e)
+                start.abort()
+
+        threads = [threading.Thread(target=run, args=(driver,), daemon=True) for driver in drivers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(ECHO_TIMEOUT * 4)
+        if errors:
+            raise errors[0]
+        assert len(latencies) == KEYSTROKES * count
+    finally:
+        for driver in drivers:
+            driver.close()
+        for session_id in session_ids:
+            client.post("/api/session/close", json={"session_id": session_id})
+
+    return {
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+        "burst_keys_per_s": round(sum(bursts)),     # All sessions' bursts together
+    }
+
+
+def _report(reporter, results):
+    reporter.write_line("")
+    reporter.write_line("Keystroke round trip   sessions   p50 ms   p99 ms   burst keys/s")
+    for (transport, count), entry in sorted(results.items()):
+        reporter.write_line(f"  {transport:<20} {count:>8} {entry['p50_ms']:>8} "
+                            f"{entry['p99_ms']:>8} {entry['burst_keys_per_s']:>14}")
+
+
+def _load_baseline():
+    try:
+        with open(BASELINE_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+@pytest.fixture(scope="module")
+def app_module(imported_app):
+    app_module = imported_app
+    original_owner = app_module.app_owner
+    app_module.app_owner = None
+    with app_module.sessions_lock:
+        app_module.sessions.clear()     # Every session slot is the benchmark's
+    with mock.patch.object(app_module, "_spawn_shell", _spawn_echo), \
+            mock.patch.object(app_module.shell_pool, "take", return_value=None), \
+            mock.patch.object(app_module, "MAX_CONCURRENT_SESSIONS", max(SESSION_COUNTS)):
+        yield app_module
+    app_module.app_owner = original_owner
+
+
+@pytest.fixture(scope="module")
+def results(request):
+    """Collects every run; reports them (and rewrites the baseline if asked) at the end."""
+    results = {}
+    yield results
+    reporter = request.config.pluginmanager.get_plugin("terminalreporter")
+    capture = request.config.pluginmanager.get_plugin("capturemanager")
+    if reporter is not None and capture is not None and results:
+        with capture.global_and_fixture_disabled():
+            _report(reporter, results)
+    if UPDATE_BASELINE and results:
+        baseline = _load_baseline()
+        baseline.setdefault("results", {})
+        baseline.update({"keystrokes": KEYSTROKES, "burst": BURST})
+        for (transport, count), entry in results.items():
+            baseline["results"].setdefault(transport, {})[str(count)] = entry
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+# ---------------------------------------------------------------------------
+# 1. Round-trip benchmark
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize("count", SESSION_COUNTS)
+@pytest.mark.parametrize("transport", TRANSPORTS)
+def test_keystroke_round_trip(app_module, results, transport, count):
+    entry = results[(transport, count)] = _run(app_module, transport, count)
+    assert 0 < entry["p50_ms"] <= entry["p99_ms"]
+
+    if UPDATE_BASELINE:
+        return
+    baseline = _load_baseline().get("results", {}).get(transport, {}).get(str(count))
+    if baseline is None:
+        pytest.skip(f"No baseline for {transport} x{count}; rerun with KEYSTROKE_BENCH_UPDATE=1")
+    assert entry["p99_ms"] <= baseline["p99_ms"] * TOLERANCE + BASELINE_SLACK_MS, (entry, baseline)
+    assert entry["burst_keys_per_s"] >= baseline["burst_keys_per_s"] / TOLERANCE, (entry, baseline)
+
+
+# ---------------------------------------------------------------------------
+# 2. Harness
+# ---------------------------------------------------------------------------
+
+class TestHarness:
+
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        assert (_percentile(samples, 50), _percentile(samples, 99)) == (51, 100)
+        assert _percentile([7], 99) == 7
+
+    @pytest.mark.skipif(UPDATE_BASELINE, reason="The baseline is being rewritten")
+    def test_baseline_covers_default_runs(self):
+        baseline = _load_baseline()
+        assert (baseline["keystrokes"], baseline["burst"]) == (KEYSTROKES, BURST)
+        for transport in TRANSPORTS:
+            assert {"1", "2", "4"} <= set(baseline["results"][transport])
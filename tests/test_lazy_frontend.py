@@ -0,0 +1,96 @@
+"""Tests for lazily loaded frontend modules and browser startup metrics.
+
+Verifies that:
+- index.html no longer loads the image and search addons eagerly, and loads them (and setup-flow.js) on demand
+- setup-flow.js carries the PAT prompt and setup wait, exported as CodaSetup
+- The served page points the lazy modules at fingerprinted URLs
+- /api/client-metrics logs a load's timings and feeds unprompted ones to the /health median
+- Malformed metrics are a 400
+"""
+
+import os
+import re
+from unittest import mock
+
+import pytest
+
+
+STATIC = os.path.join(os.path.dirname(__file__), "..", "static")
+
+
+@pytest.fixture
+def app_module(app_module):
+    app_module._startup_samples.clear()
+    yield app_module
+    app_module._startup_samples.clear()
+
+
+# ---------------------------------------------------------------------------
+# 1. Page structure
+# ---------------------------------------------------------------------------
+
+class TestLazyModules:
+
+    @pytest.fixture(autouse=True)
+    def _load_html(self):
+        with open(os.path.join(STATIC, "index.html")) as f:
+            self.html = f.read()
+
+    @pytest.mark.parametrize("name", ["addon-image.js", "addon-search.js"])
+    def test_addon_not_loaded_eagerly(self, name):
+        assert f'<script src="/static/lib/{name}">' not in self.html
+        assert f"'/static/lib/{name}'" in self.html     # In LAZY_MODULES instead
+
+    def test_setup_flow_loaded_on_demand(self):
+        assert "'/static/setup-flow.js'" in self.html
+        assert "loadModule('setupFlow')" in self.html
+        assert "Databricks CLI is not configured" not in self.html
+
+    def test_setup_flow_module(self):
+        with open(os.path.join(STATIC, "setup-flow.js")) as f:
+            js = f.read()
+        assert "window.CodaSetup = { promptForPat, waitForSetup }" in js
+        assert "/api/configure-pat" in js and "/api/setup-status" in js
+
+    def test_served_page_uses_fingerprinted_modules(self, app_module):
+        html = app_module.app.test_client().get("/").get_data(as_text=True)
+        assert not re.search(r"'/static/(lib/addon-image|lib/addon-search|setup-flow)\.js'", html)
+        assert re.search(r"'/assets/setup-flow\.[0-9a-f]+\.js'", html)
+
+
+# ---------------------------------------------------------------------------
+# 2. Startup metrics
+# ---------------------------------------------------------------------------
+
+class TestClientMetrics:
+
+    def _report(self, app_module, **data):
+        return app_module.app.test_client().post("/api/client-metrics", json=data)
+
+    def test_timings_feed_health_median(self, app_module):
+        for first_output in (900, 300, 600):
+            resp = self._report(app_module, script_ms=50, first_output_ms=first_output, transport="http")
+            assert resp.status_code == 204
+        self._report(app_module, first_output_ms=60000, prompted=True)   # Waited on the user
+        assert app_module.app.test_client().get("/health").get_json()["first_output_ms_p50"] == 600
+
+    def test_logged(self, app_module):
+        with mock.patch.object(app_module.logger, "info") as info:
+            self._report(app_module, script_ms=12.4, first_output_ms=480, transport="websocket", junk=1)
+        assert info.call_args.args[0] == "Client startup (websocket): script_ms=12 first_output_ms=480"
+
+    def test_no_samples(self, app_module):
+        assert app_module.app.test_client().get("/health").get_json()["first_output_ms_p50"] is None
+
+    @pytest.mark.parametrize("data", [
+        {"script_ms": 5},
+        {"first_output_ms": -1},
+        {"first_output_ms": True},
+        {"first_output_ms": "fast"},
+    ])
+    def test_bad_metrics(self, app_module, data):
+        assert self._report(app_module, **data).status_code == 400
+
+    def test_not_an_object(self, app_module):
+        resp = app_module.app.test_client().post("/api/client-metrics", json=[1, 2])
+        assert resp.status_code == 400
@@ -0,0 +1,170 @@
+"""Tests for long-polling /api/output-batch.
+
+Verifies that:
+- A poll with output already pending returns at once
+- A poll with nothing new is held, and released as soon as the PTY produces output
+- A held poll returns empty-handed after its wait, and leaves no waiter behind
+- A session exiting or reaching its timeout warning releases the poll
+- A client's next poll (same poll_id) releases its previous one
+- wait is capped at LONG_POLL_MAX_WAIT; a bad wait or poll_id is a 400
+- Beyond MAX_HELD_REQUESTS held requests, a poll is answered at once and
+  still releases its previous one
+- changed_only returns just the sessions with news, or a 204 when there is none,
+  and still refreshes every session's last_poll_time
+"""
+
+import os
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from terminal_session import RUNNING, Session
+
+
+@pytest.fixture
+def session(app_module, pipe):
+    """A session whose PTY is a pipe (see ``feed``)."""
+    session = app_module.sessions.add(Session("lp-1", pipe[1], 12345, state=RUNNING))
+    yield session
+    app_module.sessions.pop("lp-1")
+    app_module.idle_deadlines.discard("lp-1")
+
+
+@pytest.fixture
+def feed(app_module, pipe, session):
+    """Produce output on the session, as its shell would."""
+    def feed(data):
+        os.write(pipe[1], data)
+        app_module.read_pty_output("lp-1", pipe[0])
+    return feed
+
+
+def _poll(app_module, offset, wait=2, **extra):
+    client = app_module.app.test_client()
+    started = time.monotonic()
+    resp = client.post("/api/output-batch", json={
+        "session_ids": ["lp-1"], "offsets": {"lp-1": offset}, "wait": wait, **extra,
+    })
+    return resp, time.monotonic() - started
+
+
+def _later(delay, fn):
+    timer = threading.Timer(delay, fn)
+    timer.start()
+    return timer
+
+
+class TestLongPoll:
+
+    def test_pending_output_returns_at_once(self, app_module, session, feed):
+        feed(b"ready")
+        resp, elapsed = _poll(app_module, 0, wait=5)
+        assert resp.get_json()["outputs"]["lp-1"]["output"] == "ready"
+        assert elapsed < 1
+
+    def test_held_until_output_arrives(self, app_module, session, feed):
+        _later(0.3, lambda: feed(b"late"))
+        resp, elapsed = _poll(app_module, 0, wait=5)
+        assert resp.get_json()["outputs"]["lp-1"]["output"] == "late"
+        assert 0.25 < elapsed < 2
+
+    def test_times_out_empty(self, app_module, session, feed):
+        feed(b"seen")
+        resp, elapsed = _poll(app_module, 4, wait=0.3)
+        data = resp.get_json()["outputs"]["lp-1"]
+        assert data["output"] == "" and data["next_offset"] == 4
+        assert elapsed >= 0.3
+        assert session.output_waiters == set()
+
+    def test_exit_releases_poll(self, app_module, session):
+        with mock.patch.object(app_module, "_release_shell"), \
+             mock.patch.object(app_module.pty_mux, "unregister"):
+            _later(0.2, lambda: app_module.terminate_session("lp-1", 12345, session.master_fd))
+            resp, elapsed = _poll(app_module, 0, wait=5)
+        assert resp.get_json()["outputs"]["lp-1"]["exited"] is True
+        assert elapsed < 2
+        app_module.sessions.add(session)    # For the fixture's cleanup
+
+    def test_timeout_warning_releases_poll(self, app_module, session):
+        def warn():
+            with session.lock:
+                session.timeout_warning = True
+                app_module._wake_pollers(session)
+
+        _later(0.2, warn)
+        resp, elapsed = _poll(app_module, 0, wait=5)
+        assert resp.get_json()["outputs"]["lp-1"]["timeout_warning"] is True
+        assert elapsed < 2
+
+    def test_next_poll_releases_previous(self, app_module, session):
+        first = {}
+
+        def poll():
+            first["result"] = _poll(app_module, 0, wait=5, poll_id="tab-a")
+
+        thread = threading.Thread(target=poll)
+        thread.start()
+        time.sleep(0.2)
+        _poll(app_module, 0, wait=0.2, poll_id="tab-a")
+        thread.join(5)
+        assert first["result"][1] < 2
+        assert app_module._long_polls == {}
+
+    def test_wait_is_capped(self, app_module, session):
+        with mock.patch.object(app_module, "LONG_POLL_MAX_WAIT", 0.2):
+            resp, elapsed = _poll(app_module, 0, wait=3600)
+        assert resp.status_code == 200
+        assert elapsed < 1
+
+    def test_answered_at_once_beyond_held_request_limit(self, app_module, session):
+        slots = threading.BoundedSemaphore(1)
+        with mock.patch.object(app_module, "held_requests", slots):
+            first = {}
+            thread = threading.Thread(target=lambda: first.update(result=_poll(app_module, 0, wait=5, poll_id="tab-a")))
+            thread.start()
+            time.sleep(0.2)                 # Holds the only slot
+            resp, elapsed = _poll(app_module, 0, wait=5, poll_id="tab-b")
+            assert resp.status_code == 200 and elapsed < 1
+            _poll(app_module, 0, wait=5, poll_id="tab-a")  # Over the limit too, but still replaces tab-a's poll
+            thread.join(5)
+            assert first["result"][1] < 2
+            assert slots.acquire(blocking=False)    # Given back
+
+    @pytest.mark.parametrize("extra", [{"wait": "soon"}, {"poll_id": 7}, {"poll_id": "x" * 100}])
+    def test_bad_parameters(self, app_module, session, extra):
+        resp, _ = _poll(app_module, 0, **extra)
+        assert resp.status_code == 400
+
+
+class TestChangedOnly:
+
+    @pytest.fixture
+    def quiet(self, app_module):
+        session = app_module.sessions.add(Session("lp-2", -1, 12346, state=RUNNING))
+        yield session
+        app_module.sessions.pop("lp-2")
+
+    def _poll(self, app_module, offsets):
+        return app_module.app.test_client().post("/api/output-batch", json={
+            "session_ids": list(offsets), "offsets": offsets, "changed_only": True,
+        })
+
+    def test_only_changed_sessions(self, app_module, session, quiet, feed):
+        feed(b"news")
+        resp = self._poll(app_module, {"lp-1": 0, "lp-2": 0})
+        assert list(resp.get_json()["outputs"]) == ["lp-1"]
+
+    def test_nothing_changed_is_204(self, app_module, session, quiet):
+        quiet.last_poll_time -= 100
+        resp = self._poll(app_module, {"lp-1": 0, "lp-2": 0})
+        assert resp.status_code == 204
+        assert resp.data == b""
+        assert time.time() - quiet.last_poll_time < 5    # Still kept alive
+
+    def test_shutting_down_is_reported(self, app_module, session):
+        with mock.patch.object(app_module, "shutting_down", True):
+            resp = self._poll(app_module, {"lp-1": 0})
+        assert resp.status_code == 200
+        assert resp.get_json() == {"outputs": {}, "shutting_down": True}
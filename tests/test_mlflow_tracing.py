@@ -188,7 +188,6 @@ class TestAppOwnerExport:
     def test_app_owner_set_in_env(self):
         import app as app_module
         with mock.patch.object(app_module, "get_token_owner", return_value="owner@test.com"), \
-             mock.patch.object(app_module, "cleanup_stale_sessions"), \
              mock.patch.object(app_module, "run_setup"), \
              mock.patch("threading.Thread") as mock_thread:
             mock_thread.return_value.start = mock.MagicMock()
@@ -199,7 +198,6 @@ class TestAppOwnerExport:
         import app as app_module
         os.environ.pop("APP_OWNER", None)
         with mock.patch.object(app_module, "get_token_owner", return_value=None), \
-             mock.patch.object(app_module, "cleanup_stale_sessions"), \
              mock.patch.object(app_module, "run_setup"), \
              mock.patch("threading.Thread") as mock_thread:
             mock_thread.return_value.start = mock.MagicMock()
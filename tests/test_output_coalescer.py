@@ -0,0 +1,156 @@
+"""Tests for adaptive output coalescing (output_coalescer.py).
+
+Verifies that:
+- Output after a quiet period is flushed immediately (keystroke echo stays snappy)
+- Output during a burst waits for the coalescing window
+- A batch reaching FLUSH_BYTES is flushed early
+- The window widens with the output rate and never exceeds MAX_WINDOW
+- The multiplexer fires scheduled deadlines through on_timer
+- A burst read through read_pty_output reaches the room in fewer frames
+"""
+
+import os
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from output_coalescer import (
+    FLUSH_BYTES, IDLE_GAP, MAX_WINDOW, MIN_WINDOW, OutputCoalescer,
+)
+from output_ring import OutputRing
+from pty_mux import PTYMultiplexer
+from terminal_session import Session
+
+
+class TestOutputCoalescer:
+
+    def test_first_output_flushes_immediately(self):
+        c = OutputCoalescer()
+        assert c.add(10, 100.0) <= 100.0
+
+    def test_output_after_idle_gap_flushes_immediately(self):
+        c = OutputCoalescer()
+        c.add(10, 100.0)
+        c.flushed()
+        now = 100.0 + IDLE_GAP + 0.001
+        assert c.add(10, now) <= now
+
+    def test_burst_waits_for_window(self):
+        c = OutputCoalescer()
+        c.add(10, 100.0)
+        c.flushed()
+        due = c.add(10, 100.001)
+        assert due > 100.001
+        assert due <= 100.001 + MAX_WINDOW
+        assert c.pending
+
+    def test_deadline_is_anchored_to_first_pending_read(self):
+        c = OutputCoalescer()
+        c.add(10, 100.0)
+        c.flushed()
+        first = c.add(10, 100.001)
+        later = c.add(10, 100.002)
+        assert later - first < MAX_WINDOW  # Further reads don't push the flush out indefinitely
+        assert later >= 100.001
+
+    def test_flush_bytes_cuts_batch_short(self):
+        c = OutputCoalescer()
+        c.add(10, 100.0)
+        c.flushed()
+        c.add(10, 100.001)
+        now = 100.002
+        assert c.add(FLUSH_BYTES, now) <= now
+
+    def test_window_grows_with_rate_and_is_capped(self):
+        c = OutputCoalescer()
+        now = 100.0
+        for _ in range(200):
+            now += 0.001
+            c.add(4096, now)
+            c.flushed()
+        assert c.window == pytest.approx(MAX_WINDOW)
+
+    def test_window_relaxes_after_quiet_period(self):
+        c = OutputCoalescer()
+        now = 100.0
+        for _ in range(200):
+            now += 0.001
+            c.add(4096, now)
+            c.flushed()
+        c.add(1, now + 5.0)
+        assert c.window == pytest.approx(MIN_WINDOW, abs=1e-4)
+
+    def test_flushed_clears_pending(self):
+        c = OutputCoalescer()
+        c.add(10, 100.0)
+        c.add(10, 100.001)
+        assert c.pending
+        c.flushed()
+        assert not c.pending
+
+
+class TestMultiplexerTimers:
+
+    def test_schedule_fires_on_timer(self):
+        fired = threading.Event()
+        mux = PTYMultiplexer(on_readable=lambda k, fd: True, on_exit=lambda k: None,
+                             on_timer=lambda k: fired.set())
+        r, w = os.pipe()
+        try:
+            mux.register("t1", r, os.getpid())
+            mux.schedule("t1", time.monotonic() + 0.01)
+            assert fired.wait(2.0)
+        finally:
+            mux.unregister("t1")
+            os.close(r)
+            os.close(w)
+
+    def test_unregister_cancels_timer(self):
+        fired = threading.Event()
+        mux = PTYMultiplexer(on_readable=lambda k, fd: True, on_exit=lambda k: None,
+                             on_timer=lambda k: fired.set())
+        r, w = os.pipe()
+        try:
+            mux.register("t2", r, os.getpid())
+            mux.schedule("t2", time.monotonic() + 0.05)
+            mux.unregister("t2")
+            assert not fired.wait(0.2)
+        finally:
+            os.close(r)
+            os.close(w)
+
+    def test_schedule_unknown_key_is_ignored(self):
+        mux = PTYMultiplexer(on_readable=lambda k, fd: True, on_exit=lambda k: None,
+                             on_timer=lambda k: None)
+        mux.schedule("missing", time.monotonic())
+        assert "missing" not in mux
+
+
+class TestReadPtyOutputCoalescing:
+
+    def test_burst_is_batched_and_fully_delivered(self, app_module):
+        ring = OutputRing(4096)
+        app_module.sessions.add(Session("co-1", 999, 12345, output_buffer=ring))
+        ws = app_module.socketio.test_client(app_module.app)
+        r, w = os.pipe()
+        try:
+            ws.emit("join_session", {"session_id": "co-1"}, callback=True)
+            with mock.patch.object(app_module.pty_mux, "schedule") as schedule:
+                for chunk in (b"a", b"b", b"c", b"d"):
+                    os.write(w, chunk)
+                    app_module.read_pty_output("co-1", r)
+                    if chunk == b"a":
+                        app_module.output_sender.drain()  # Sent before the burst lands
+            frames = [e["args"][0] for e in ws.get_received() if e["name"] == "terminal_output"]
+            assert [f["output"] for f in frames] == ["a"]  # First read flushed at once
+            assert schedule.called
+            app_module._flush_pty_output("co-1")  # Deadline elapses
+            app_module.output_sender.drain()
+            frames = [e["args"][0] for e in ws.get_received() if e["name"] == "terminal_output"]
+            assert [f["output"] for f in frames] == ["bcd"]
+        finally:
+            ws.disconnect()
+            os.close(r)
+            os.close(w)
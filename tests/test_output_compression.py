@@ -0,0 +1,139 @@
+"""Tests for compressed terminal output over WebSocket frames and HTTP.
+
+Verifies that:
+- Large output frames are deflated only when compression is requested and pays off
+- Small frames (keystroke echo) are never compressed
+- join_session with compress replays and streams deflated frames; others stay raw
+- Large JSON responses are gzipped when the client accepts gzip (by quality, not substring), small ones are not
+"""
+
+import gzip
+import json
+import os
+
+import pytest
+
+import ws_frames
+
+
+LOG = b"".join(b"PASSED tests/test_app.py::test_case_%d\r\n" % i for i in range(200))
+RING_BYTES = 64 * 1024
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+def _frames(ws):
+    return [e["args"][0] for e in ws.get_received() if e["name"] == "terminal_output_bin"]
+
+
+def _is_deflated(frame):
+    return bool(frame[1] & ws_frames.FLAG_DEFLATE)
+
+
+# ---------------------------------------------------------------------------
+# 1. Frame codec
+# ---------------------------------------------------------------------------
+
+class TestFrameCompression:
+
+    def test_large_frame_deflated_and_restored(self):
+        frame = ws_frames.pack_output(3, 100, LOG, compress=True)
+        assert _is_deflated(frame)
+        assert len(frame) < len(LOG) // 4
+        assert ws_frames.unpack_output(frame) == (3, 100, LOG, False)
+
+    def test_small_frame_left_raw(self):
+        frame = ws_frames.pack_output(3, 0, b"l", compress=True)
+        assert not _is_deflated(frame)
+        assert frame[12:] == b"l"
+
+    def test_incompressible_frame_left_raw(self):
+        noise = os.urandom(4096)
+        frame = ws_frames.pack_output(3, 0, noise, compress=True)
+        assert not _is_deflated(frame)
+        assert ws_frames.unpack_output(frame)[2] == noise
+
+    def test_not_compressed_unless_asked(self):
+        assert not _is_deflated(ws_frames.pack_output(3, 0, LOG))
+
+
+# ---------------------------------------------------------------------------
+# 2. Socket.IO output
+# ---------------------------------------------------------------------------
+
+class TestCompressedStream:
+
+    def test_join_with_compress_replays_deflated(self, app_module, add_session):
+        add_session("cmp-1", LOG, capacity=RING_BYTES, index=51)
+        ws = app_module.socketio.test_client(app_module.app)
+        try:
+            ack = ws.emit("join_session", {"session_id": "cmp-1", "offset": 0,
+                                           "binary": True, "compress": True}, callback=True)
+            assert ack["compress"] is True
+            frames = _frames(ws)
+            assert len(frames) == 1 and _is_deflated(frames[0])
+            assert ws_frames.unpack_output(frames[0]) == (51, 0, LOG, False)
+        finally:
+            ws.disconnect()
+
+    def test_live_output_per_format(self, app_module, add_session, pty_write):
+        add_session("cmp-2", capacity=RING_BYTES, index=52)
+        compressed = app_module.socketio.test_client(app_module.app)
+        raw = app_module.socketio.test_client(app_module.app)
+        try:
+            compressed.emit("join_session", {"session_id": "cmp-2", "binary": True,
+                                             "compress": True}, callback=True)
+            raw.emit("join_session", {"session_id": "cmp-2", "binary": True}, callback=True)
+            pty_write("cmp-2", LOG[:4096])
+
+            frames = _frames(compressed)
+            assert len(frames) == 1 and _is_deflated(frames[0])
+            assert ws_frames.unpack_output(frames[0])[2] == LOG[:4096]
+            assert _frames(raw) == [ws_frames.pack_output(52, 0, LOG[:4096])]
+        finally:
+            compressed.disconnect()
+            raw.disconnect()
+
+    def test_compress_ignored_without_binary(self, app_module, add_session):
+        add_session("cmp-3", capacity=RING_BYTES, index=53)
+        ws = app_module.socketio.test_client(app_module.app)
+        try:
+            ack = ws.emit("join_session", {"session_id": "cmp-3", "compress": True}, callback=True)
+            assert (ack["binary"], ack["compress"]) == (False, False)
+        finally:
+            ws.disconnect()
+
+
+# ---------------------------------------------------------------------------
+# 3. HTTP responses
+# ---------------------------------------------------------------------------
+
+class TestGzipResponses:
+
+    def test_large_output_poll_gzipped(self, app_module, add_session):
+        add_session("cmp-4", LOG, capacity=RING_BYTES, index=54)
+        resp = app_module.app.test_client().post(
+            "/api/output", json={"session_id": "cmp-4", "offset": 0},
+            headers={"Accept-Encoding": "gzip, deflate, br"})
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in resp.headers["Vary"]
+        assert int(resp.headers["Content-Length"]) == len(resp.data) < len(LOG)
+        assert json.loads(gzip.decompress(resp.data))["output"] == LOG.decode()
+
+    @pytest.mark.parametrize("headers", [{}, {"Accept-Encoding": "gzip;q=0, br"},
+                                         {"Accept-Encoding": "x-gzip-not"}])
+    def test_not_gzipped_unless_accepted(self, app_module, add_session, headers):
+        add_session("cmp-5", LOG, capacity=RING_BYTES, index=55)
+        resp = app_module.app.test_client().post(
+            "/api/output", json={"session_id": "cmp-5", "offset": 0}, headers=headers)
+        assert "Content-Encoding" not in resp.headers
+        assert resp.get_json()["output"] == LOG.decode()
+
+    def test_small_response_not_gzipped(self, app_module, add_session):
+        add_session("cmp-6", b"$ ", capacity=RING_BYTES, index=56)
+        resp = app_module.app.test_client().post(
+            "/api/output", json={"session_id": "cmp-6", "offset": 0},
+            headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in resp.headers
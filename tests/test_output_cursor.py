@@ -0,0 +1,173 @@
+"""Tests for cursor-based, non-destructive output (issue: lossless WS/HTTP switching).
+
+Verifies that:
+- /api/output with an offset returns output since that offset without consuming it
+- next_offset continues the stream; gap is reported when bytes were evicted
+- Pollers that send no offset keep the old drain-once behaviour
+- /api/output-batch honours per-session offsets
+- /api/session/attach replays from an offset
+- join_session replays missed output over WebSocket before live output
+"""
+
+
+import pytest
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+# ---------------------------------------------------------------------------
+# 1. /api/output
+# ---------------------------------------------------------------------------
+
+class TestOutputOffsets:
+
+    def test_offset_read_is_non_destructive(self, app_module, add_session):
+        add_session("cur-1", b"hello world")
+        client = app_module.app.test_client()
+        first = client.post("/api/output", json={"session_id": "cur-1", "offset": 0}).get_json()
+        second = client.post("/api/output", json={"session_id": "cur-1", "offset": 0}).get_json()
+        assert first["output"] == second["output"] == "hello world"
+        assert first["offset"] == 0
+        assert first["next_offset"] == 11
+        assert first["gap"] is False
+
+    def test_next_offset_continues_stream(self, app_module, add_session):
+        sess = add_session("cur-2", b"abc")
+        client = app_module.app.test_client()
+        body = client.post("/api/output", json={"session_id": "cur-2", "offset": 0}).get_json()
+        sess.output_buffer.write(b"def")
+        body = client.post("/api/output",
+                           json={"session_id": "cur-2", "offset": body["next_offset"]}).get_json()
+        assert body["output"] == "def"
+        assert (body["offset"], body["next_offset"]) == (3, 6)
+
+    def test_gap_when_evicted(self, app_module, add_session):
+        add_session("cur-3", b"0123456789", capacity=4)
+        client = app_module.app.test_client()
+        body = client.post("/api/output", json={"session_id": "cur-3", "offset": 2}).get_json()
+        assert body["gap"] is True
+        assert body["offset"] == 6
+        assert body["output"] == "6789"
+
+    def test_legacy_poll_without_offset_drains_once(self, app_module, add_session):
+        add_session("cur-4", b"legacy")
+        client = app_module.app.test_client()
+        first = client.post("/api/output", json={"session_id": "cur-4"}).get_json()
+        second = client.post("/api/output", json={"session_id": "cur-4"}).get_json()
+        assert first["output"] == "legacy"
+        assert second["output"] == ""
+
+    @pytest.mark.parametrize("bad", [-1, "5", 1.5, True])
+    def test_invalid_offset_rejected(self, app_module, add_session, bad):
+        add_session("cur-5", b"x")
+        client = app_module.app.test_client()
+        resp = client.post("/api/output", json={"session_id": "cur-5", "offset": bad})
+        assert resp.status_code == 400
+
+    def test_two_viewers_do_not_steal_output(self, app_module, add_session):
+        add_session("cur-6", b"shared")
+        client = app_module.app.test_client()
+        a = client.post("/api/output", json={"session_id": "cur-6", "offset": 0}).get_json()
+        b = client.post("/api/output", json={"session_id": "cur-6", "offset": 0}).get_json()
+        assert a["output"] == b["output"] == "shared"
+
+
+# ---------------------------------------------------------------------------
+# 2. /api/output-batch
+# ---------------------------------------------------------------------------
+
+class TestBatchOffsets:
+
+    def test_per_session_offsets(self, app_module, add_session):
+        add_session("cur-a", b"aaaa")
+        add_session("cur-b", b"bbbb")
+        client = app_module.app.test_client()
+        body = client.post("/api/output-batch", json={
+            "session_ids": ["cur-a", "cur-b"],
+            "offsets": {"cur-a": 2, "cur-b": 0},
+        }).get_json()
+        assert body["outputs"]["cur-a"]["output"] == "aa"
+        assert body["outputs"]["cur-a"]["next_offset"] == 4
+        assert body["outputs"]["cur-b"]["output"] == "bbbb"
+
+    def test_invalid_offsets_rejected(self, app_module, add_session):
+        add_session("cur-c", b"c")
+        client = app_module.app.test_client()
+        resp = client.post("/api/output-batch", json={
+            "session_ids": ["cur-c"], "offsets": {"cur-c": -3},
+        })
+        assert resp.status_code == 400
+
+
+# ---------------------------------------------------------------------------
+# 3. /api/session/attach
+# ---------------------------------------------------------------------------
+
+class TestAttachOffsets:
+
+    def test_attach_from_offset(self, app_module, add_session):
+        add_session("cur-att", b"line1\r\nline2\r\n")
+        client = app_module.app.test_client()
+        body = client.post("/api/session/attach",
+                           json={"session_id": "cur-att", "offset": 7}).get_json()
+        assert body["output"] == "line2\r\n"
+        assert body["next_offset"] == 14
+        assert body["gap"] is False
+
+    def test_attach_reports_gap(self, app_module, add_session):
+        add_session("cur-att2", b"x" * 20, capacity=8)
+        client = app_module.app.test_client()
+        body = client.post("/api/session/attach", json={"session_id": "cur-att2"}).get_json()
+        assert body["gap"] is True
+        assert body["offset"] == 12
+
+
+# ---------------------------------------------------------------------------
+# 4. join_session replay over WebSocket
+# ---------------------------------------------------------------------------
+
+class TestJoinReplay:
+
+    def test_join_with_offset_replays_missed_output(self, app_module, add_session):
+        add_session("cur-ws", b"before-join")
+        ws = app_module.socketio.test_client(app_module.app)
+        try:
+            ack = ws.emit("join_session", {"session_id": "cur-ws", "offset": 7}, callback=True)
+            assert ack["status"] == "ok"
+            assert ack["next_offset"] == 11
+            events = [e for e in ws.get_received() if e["name"] == "terminal_output"]
+            assert len(events) == 1
+            payload = events[0]["args"][0]
+            assert payload["output"] == "join"
+            assert (payload["offset"], payload["next_offset"]) == (7, 11)
+        finally:
+            ws.disconnect()
+
+    def test_join_without_offset_sends_no_replay(self, app_module, add_session):
+        add_session("cur-ws2", b"old output")
+        ws = app_module.socketio.test_client(app_module.app)
+        try:
+            ws.emit("join_session", {"session_id": "cur-ws2"}, callback=True)
+            assert [e for e in ws.get_received() if e["name"] == "terminal_output"] == []
+        finally:
+            ws.disconnect()
+
+    def test_live_output_follows_replay(self, app_module, add_session):
+        import os
+        add_session("cur-ws3", b"abc")
+        ws = app_module.socketio.test_client(app_module.app)
+        r, w = os.pipe()
+        try:
+            ws.emit("join_session", {"session_id": "cur-ws3", "offset": 0}, callback=True)
+            os.write(w, b"def")
+            assert app_module.read_pty_output("cur-ws3", r) is True
+            app_module.output_sender.drain()
+            events = [e["args"][0] for e in ws.get_received() if e["name"] == "terminal_output"]
+            assert "".join(e["output"] for e in events) == "abcdef"
+            assert events[-1]["offset"] == events[0]["next_offset"]
+        finally:
+            ws.disconnect()
+            os.close(r)
+            os.close(w)
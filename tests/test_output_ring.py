@@ -0,0 +1,141 @@
+"""Tests for the per-session byte ring (output_ring.py).
+
+Verifies that:
+- Offsets grow monotonically and eviction is reported as a gap
+- PTY reads land directly in the ring via os.readv, including across the wrap
+- read() never splits a multi-byte UTF-8 character
+- Memory is fixed at the configured capacity
+"""
+
+import os
+
+import pytest
+
+from output_ring import OutputRing, utf8_incomplete_tail
+
+
+# ---------------------------------------------------------------------------
+# 1. Offsets and eviction
+# ---------------------------------------------------------------------------
+
+class TestOffsets:
+
+    def test_empty_ring(self):
+        ring = OutputRing(16)
+        assert (ring.start, ring.end, len(ring)) == (0, 0, 0)
+        assert ring.read(0) == (0, 0, b"")
+
+    def test_offsets_are_absolute(self):
+        ring = OutputRing(16)
+        ring.write(b"hello ")
+        ring.write(b"world")
+        assert ring.end == 11
+        assert ring.read(6) == (6, 11, b"world")
+
+    def test_eviction_reports_gap(self):
+        ring = OutputRing(8)
+        ring.write(b"0123456789")
+        start, end, data = ring.read(0)
+        assert start == 2  # start > since => bytes were dropped
+        assert (end, data) == (10, b"23456789")
+
+    def test_read_across_wrap(self):
+        ring = OutputRing(8)
+        ring.write(b"abcdef")
+        ring.write(b"ghij")
+        assert ring.read(4) == (4, 10, b"efghij")
+
+    def test_read_until_bound(self):
+        ring = OutputRing(16)
+        ring.write(b"abcdef")
+        assert ring.read(1, 4) == (1, 4, b"bcd")
+
+    def test_cursor_ahead_of_stream_returns_empty(self):
+        ring = OutputRing(16)
+        ring.write(b"abc")
+        assert ring.read(100) == (3, 3, b"")
+
+    def test_memory_footprint_is_fixed(self):
+        ring = OutputRing(1024)
+        for _ in range(100):
+            ring.write(b"x" * 500)
+        assert len(ring) == 1024
+        assert ring.end == 50000
+
+
+# ---------------------------------------------------------------------------
+# 2. Zero-copy fill from a file descriptor
+# ---------------------------------------------------------------------------
+
+class TestFillFrom:
+
+    def test_fill_from_pipe(self):
+        ring = OutputRing(32)
+        r, w = os.pipe()
+        try:
+            os.write(w, b"from the pty")
+            assert ring.fill_from(r) == 12
+            assert ring.read(0)[2] == b"from the pty"
+        finally:
+            os.close(r)
+            os.close(w)
+
+    def test_fill_from_wraps_with_readv(self):
+        ring = OutputRing(8)
+        ring.write(b"123456")
+        r, w = os.pipe()
+        try:
+            os.write(w, b"abcd")
+            assert ring.fill_from(r) == 4
+            assert ring.read(4) == (4, 10, b"56abcd")
+        finally:
+            os.close(r)
+            os.close(w)
+
+    def test_fill_from_eof_returns_zero(self):
+        ring = OutputRing(8)
+        r, w = os.pipe()
+        os.close(w)
+        try:
+            assert ring.fill_from(r) == 0
+            assert ring.end == 0
+        finally:
+            os.close(r)
+
+
+# ---------------------------------------------------------------------------
+# 3. UTF-8 boundaries
+# ---------------------------------------------------------------------------
+
+class TestUtf8Boundaries:
+
+    @pytest.mark.parametrize("data, expected", [
+        (b"abc", 0),
+        ("é".encode(), 0),
+        ("é".encode()[:1], 1),
+        ("€".encode()[:2], 2),
+        ("😀".encode()[:3], 3),
+        ("😀".encode(), 0),
+        (b"", 0),
+    ])
+    def test_incomplete_tail(self, data, expected):
+        assert utf8_incomplete_tail(data) == expected
+
+    def test_split_character_is_held_back(self):
+        ring = OutputRing(64)
+        euro = "€".encode()
+        ring.write(b"cost: " + euro[:1])
+        start, end, data = ring.read(0)
+        assert data == b"cost: "
+        ring.write(euro[1:])
+        _, end2, data2 = ring.read(end)
+        assert data2.decode() == "€"
+        assert end2 == ring.end
+
+    def test_gap_skips_orphaned_continuation_bytes(self):
+        ring = OutputRing(3)
+        ring.write("a€b".encode())  # 5 bytes: 'a' + 3-byte euro + 'b'
+        start, _, data = ring.read(0)
+        # Oldest held byte is mid-character; it is skipped, not mangled
+        assert data == b"b"
+        assert start == 4
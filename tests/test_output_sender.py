@@ -0,0 +1,186 @@
+"""Tests for sending output off the PTY loop (output_sender.py and its use in app.py).
+
+Verifies that:
+- A key's tasks run in submission order, one at a time; other keys aren't held up by a slow one
+- A tagged task is dropped while the key's last queued task has the same tag
+- A full queue refuses further tasks without blocking, and the refusal is counted
+- stats() reports depth, sent/refused counts and latency
+- Sender threads start on demand, up to ``workers``
+- A failing task is logged and later tasks still run
+- app: reading a PTY doesn't wait for viewers; a refused output send is logged
+"""
+
+import os
+import threading
+import time
+from unittest import mock
+
+from output_sender import OutputSender
+
+
+def _blocker(sender, key):
+    """Occupy *key* with a running task until the returned event is set."""
+    started, release = threading.Event(), threading.Event()
+
+    def task():
+        started.set()
+        release.wait(5)
+
+    sender.submit(key, task)
+    assert started.wait(5)
+    return release
+
+
+# ---------------------------------------------------------------------------
+# 1. OutputSender
+# ---------------------------------------------------------------------------
+
+class TestOutputSender:
+
+    def test_per_key_order(self):
+        sender = OutputSender(workers=4)
+        ran = []
+        for i in range(50):
+            sender.submit("s1", lambda i=i: ran.append(i))
+        assert sender.drain()
+        assert ran == list(range(50))
+
+    def test_one_task_per_key_at_a_time(self):
+        sender = OutputSender(workers=4)
+        running, overlaps = [], []
+
+        def task():
+            running.append(1)
+            overlaps.append(len(running) > 1)
+            time.sleep(0.002)
+            running.pop()
+
+        for _ in range(20):
+            sender.submit("s1", task)
+        assert sender.drain()
+        assert not any(overlaps)
+
+    def test_slow_key_does_not_hold_up_others(self):
+        sender = OutputSender(workers=2)
+        release = _blocker(sender, "slow")
+        done = threading.Event()
+        sender.submit("fast", done.set)
+        try:
+            assert done.wait(2)
+        finally:
+            release.set()
+        assert sender.drain()
+
+    def test_tagged_tasks_coalesce(self):
+        sender = OutputSender()
+        release = _blocker(sender, "s1")
+        ran = []
+        assert sender.submit("s1", lambda: ran.append("output-1"), tag="output")
+        assert sender.submit("s1", lambda: ran.append("output-2"), tag="output")   # Covered by output-1
+        sender.submit("s1", lambda: ran.append("exited"))
+        sender.submit("s1", lambda: ran.append("output-3"), tag="output")
+        assert sender.stats()["queued"] == 3
+        release.set()
+        assert sender.drain()
+        assert ran == ["output-1", "exited", "output-3"]
+
+    def test_full_queue_refuses(self):
+        sender = OutputSender(max_queued=2)
+        release = _blocker(sender, "s1")
+        try:
+            assert sender.submit("s1", lambda: None)
+            assert sender.submit("s1", lambda: None)
+            started = time.monotonic()
+            assert sender.submit("s1", lambda: None) is False
+            assert time.monotonic() - started < 0.05
+            assert sender.submit("s2", lambda: None)   # Other keys have their own queues
+            assert sender.stats()["refused"] == 1
+        finally:
+            release.set()
+        assert sender.drain()
+
+    def test_stats(self):
+        sender = OutputSender()
+        assert sender.stats() == {"queued": 0, "max_session_depth": 0, "sent": 0, "refused": 0,
+                                  "latency_ms_p50": None, "latency_ms_max": None}
+        release = _blocker(sender, "s1")
+        sender.submit("s1", lambda: None)
+        sender.submit("s1", lambda: None)
+        sender.submit("s2", lambda: None)
+        stats = sender.stats()
+        release.set()
+        assert sender.drain()
+        assert stats["max_session_depth"] == 2
+        stats = sender.stats()
+        assert (stats["queued"], stats["sent"]) == (0, 4)
+        assert 0 <= stats["latency_ms_p50"] <= stats["latency_ms_max"]
+
+    def test_threads_start_on_demand(self):
+        sender = OutputSender(workers=2)
+        assert sender._threads == []
+        releases = [_blocker(sender, "s1"), _blocker(sender, "s2")]
+        sender.submit("s3", lambda: None)
+        try:
+            assert len(sender._threads) == 2
+            assert sender.stats()["queued"] == 1    # Waits for a free thread
+        finally:
+            for release in releases:
+                release.set()
+        assert sender.drain()
+        assert len(sender._threads) == 2
+
+    def test_failing_task_is_logged(self):
+        sender = OutputSender()
+        ran = []
+        with mock.patch("output_sender.logger.exception") as log:
+            sender.submit("s1", lambda: 1 / 0)
+            sender.submit("s1", lambda: ran.append(1))
+            assert sender.drain()
+        log.assert_called_once()
+        assert ran == [1]
+
+
+# ---------------------------------------------------------------------------
+# 2. app.py
+# ---------------------------------------------------------------------------
+
+class TestAppSender:
+
+    def test_pty_read_does_not_wait_for_viewers(self, app_module, add_session):
+        add_session("snd-1")
+        ws = app_module.socketio.test_client(app_module.app)
+        release = threading.Event()
+        emit = app_module.socketio.emit
+
+        def slow_emit(*args, **kwargs):
+            release.wait(5)
+            emit(*args, **kwargs)
+
+        r, w = os.pipe()
+        try:
+            ws.emit("join_session", {"session_id": "snd-1"}, callback=True)
+            with mock.patch.object(app_module.socketio, "emit", slow_emit):
+                os.write(w, b"hello")
+                started = time.monotonic()
+                assert app_module.read_pty_output("snd-1", r) is True
+                assert time.monotonic() - started < 1
+                release.set()
+                assert app_module.output_sender.drain()
+            events = [e["args"][0] for e in ws.get_received() if e["name"] == "terminal_output"]
+            assert [e["output"] for e in events] == ["hello"]
+        finally:
+            release.set()
+            ws.disconnect()
+            os.close(r)
+            os.close(w)
+
+    def test_refused_output_is_logged(self, app_module, add_session):
+        session = add_session("snd-2")
+        with mock.patch.object(app_module.output_sender, "submit", return_value=False), \
+                mock.patch.object(app_module.logger, "warning") as warning:
+            app_module._send_output("snd-2", session)
+        assert "output queue full" in warning.call_args.args[0]
+
+    def test_health_reports_sender(self, app_module):
+        body = app_module.app.test_client().get("/health").get_json()
+        assert {"queued", "sent", "refused", "latency_ms_p50"} <= set(body["output_sender"])
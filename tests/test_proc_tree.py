@@ -0,0 +1,166 @@
+"""Tests for the /proc-based foreground process lookup (proc_tree.py).
+
+Verifies that:
+- The PTY's foreground process group wins over the newest child
+- Without a PTY fd, the newest child is reported, else the process itself
+- The /proc/*/stat scan finds the same children as /proc/<pid>/task/*/children,
+  and is only used where that file doesn't exist — not for exited tasks
+- Names are cached for the TTL and shared across callers; invalidate() forgets them
+- Dead and invalid pids are "unknown"; no subprocesses are forked when /proc exists
+"""
+
+import io
+import os
+import pty
+import subprocess
+import time
+from unittest import mock
+
+import pytest
+
+import proc_tree
+from proc_tree import ProcessInspector
+from terminal_session import Session
+
+
+pytestmark = pytest.mark.skipif(not proc_tree._HAS_PROC, reason="needs /proc")
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.fixture
+def shell_with_child():
+    """bash (not exec'ing) with one sleeping child."""
+    proc = subprocess.Popen(["bash", "-c", "sleep 30; true"])
+    assert _wait_for(lambda: [proc_tree._read_comm(c) for c in proc_tree._children(proc.pid)] == ["sleep"])
+    yield proc
+    proc.kill()
+    proc.wait()
+
+
+@pytest.fixture
+def interactive_shell():
+    """Interactive bash on a PTY (job control on). Yields (proc, master_fd)."""
+    master_fd, slave_fd = pty.openpty()
+    proc = subprocess.Popen(["bash", "--norc", "--noprofile", "-i"],
+                            stdin=slave_fd, stdout=slave_fd, stderr=slave_fd,
+                            preexec_fn=os.setsid, env={"PATH": os.environ["PATH"], "PS1": "$ "})
+    os.close(slave_fd)
+    yield proc, master_fd
+    proc.kill()
+    proc.wait()
+    os.close(master_fd)
+
+
+class TestForeground:
+
+    def test_foreground_group_from_pty(self, interactive_shell):
+        proc, master_fd = interactive_shell
+        assert _wait_for(lambda: os.tcgetpgrp(master_fd) == proc.pid)  # At the prompt
+        os.write(master_fd, b"cat\n")
+        assert _wait_for(lambda: proc_tree._read_comm(os.tcgetpgrp(master_fd)) == "cat")
+        # Even if the newest child were something else, the foreground job wins
+        with mock.patch("proc_tree._children", return_value=[os.getpid()]):
+            assert ProcessInspector().foreground(proc.pid, master_fd) == "cat"
+
+    def test_shell_at_prompt(self, interactive_shell):
+        proc, master_fd = interactive_shell
+        assert _wait_for(lambda: os.tcgetpgrp(master_fd) == proc.pid)
+        assert ProcessInspector().foreground(proc.pid, master_fd) == "bash"
+
+    def test_newest_child_without_fd(self, shell_with_child):
+        assert ProcessInspector().foreground(shell_with_child.pid) == "sleep"
+
+    def test_process_itself_without_children(self):
+        proc = subprocess.Popen(["cat"], stdin=subprocess.PIPE)
+        try:
+            assert ProcessInspector().foreground(proc.pid) == "cat"
+        finally:
+            proc.kill()
+            proc.wait()
+
+    def test_stat_scan_matches_children_file(self, shell_with_child):
+        assert proc_tree._children_by_scan(shell_with_child.pid) == \
+            proc_tree._children(shell_with_child.pid)
+
+    def test_exited_thread_is_not_a_scan(self, shell_with_child):
+        tids = os.listdir(f"/proc/{shell_with_child.pid}/task") + ["999999999"]
+        with mock.patch("proc_tree.os.listdir", return_value=tids), \
+                mock.patch("proc_tree._children_by_scan") as scan:
+            children = proc_tree._children(shell_with_child.pid)
+        scan.assert_not_called()
+        assert [proc_tree._read_comm(c) for c in children] == ["sleep"]
+
+    def test_exited_process_has_no_children(self):
+        with mock.patch("proc_tree._children_by_scan") as scan:
+            assert proc_tree._children(999999999) == []
+        scan.assert_not_called()
+
+    @staticmethod
+    def _proc_files(comm, cmdline):
+        def fake_open(path, mode="r"):
+            return io.StringIO(comm) if path.endswith("/comm") else io.BytesIO(cmdline)
+        return mock.patch("builtins.open", fake_open)
+
+    def test_missing_or_empty_comm_is_gone(self):
+        assert proc_tree._read_comm(999999999) is None
+        with self._proc_files("\n", b"bash\0"):
+            assert proc_tree._read_comm(os.getpid()) is None
+
+    def test_mid_exec_named_by_executable(self):
+        # Between fork and exec's rename: the parent's comm and no cmdline yet
+        with self._proc_files("python\n", b""), \
+                mock.patch("proc_tree.os.readlink", return_value="/usr/bin/cat"):
+            assert proc_tree._read_comm(os.getpid()) == "cat"
+
+    @pytest.mark.parametrize("pid", [999999999, 0, -1, None])
+    def test_unknown(self, pid):
+        assert ProcessInspector().foreground(pid) == "unknown"
+
+    def test_no_subprocesses(self, shell_with_child):
+        with mock.patch("proc_tree.subprocess.run") as run:
+            ProcessInspector().foreground(shell_with_child.pid)
+        run.assert_not_called()
+
+
+class TestCache:
+
+    def test_cached_within_ttl(self):
+        inspector = ProcessInspector(ttl=60)
+        with mock.patch.object(ProcessInspector, "_lookup", return_value="vim") as lookup:
+            assert inspector.foreground(123, 7) == "vim"
+            assert inspector.foreground(123, 7) == "vim"
+            assert lookup.call_count == 1
+            inspector.invalidate(123)
+            inspector.foreground(123, 7)
+            assert lookup.call_count == 2
+
+    def test_expires_after_ttl(self):
+        inspector = ProcessInspector(ttl=0.05)
+        with mock.patch.object(ProcessInspector, "_lookup", side_effect=["vim", "bash"]):
+            assert inspector.foreground(123) == "vim"
+            time.sleep(0.1)
+            assert inspector.foreground(123) == "bash"
+
+    def test_sessions_endpoint_shares_cache(self):
+        with mock.patch("app.initialize_app"):
+            import app as app_module
+        app_module.app_owner = None
+        app_module.process_inspector.invalidate()
+        app_module.sessions.add(Session("proc-1", -1, os.getpid()))
+        try:
+            client = app_module.app.test_client()
+            with mock.patch.object(ProcessInspector, "_lookup", return_value="claude") as lookup:
+                for _ in range(3):
+                    assert client.get("/api/sessions").get_json()[0]["process"] == "claude"
+            assert lookup.call_count == 1
+        finally:
+            with app_module.sessions_lock:
+                app_module.sessions.pop("proc-1")
@@ -0,0 +1,299 @@
+"""Tests for the out-of-process PTY host (pty_host.py and its use in app.py).
+
+Verifies that:
+- Messages round-trip with their payload and passed fds
+- An OffsetCell written through one mapping is read through another
+- OutputRing can continue a stream at a non-zero offset, and dump() returns held bytes untrimmed
+- spawn() hands back a working PTY; the host doesn't read it while the worker is connected
+- An environment larger than a message still reaches the shell
+- Shells outlive their worker: a new connection adopts them with their metadata,
+  the output buffered meanwhile, and offsets continuing from the worker's cell
+- Warm (undescribed) shells are killed when their worker goes away
+- close() terminates and reaps the shell, then calls back
+- An orphaned shell that exits is cleaned up
+- A second host refuses to serve a live socket; the socket is private to its user
+- app: sessions spawn through the host, and a restarted worker adopts them under their old ids
+"""
+
+import os
+import select
+import socket
+import stat
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from output_ring import OutputRing
+from pty_host import MAX_MESSAGE, OffsetCell, PtyHost, PtyHostClient, recv_message, send_message
+
+
+SHELL = ["bash", "-c", "printf 'ready$ '; read line; echo \"got $line\"; exec sleep 30"]
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def _read_until(fd, marker, timeout=5.0):
+    data = b""
+    deadline = time.time() + timeout
+    while marker not in data and time.time() < deadline:
+        if select.select([fd], [], [], 0.1)[0]:
+            data += os.read(fd, 4096)
+    return data
+
+
+@pytest.fixture
+def host(tmp_path):
+    host = PtyHost(str(tmp_path / "host.sock"))
+    host.listen()
+    thread = threading.Thread(target=host.serve_forever, daemon=True)
+    thread.start()
+    yield host
+    host.close()
+    thread.join(5)
+    for pid in list(host._shells):
+        try:
+            os.killpg(pid, 9)
+        except OSError:
+            pass
+
+
+@pytest.fixture
+def connect(host):
+    clients = []
+
+    def make():
+        client = PtyHostClient.connect(host.path, launch=False)
+        clients.append(client)
+        return client
+
+    yield make
+    for client in clients:
+        client.disconnect()
+
+
+# ---------------------------------------------------------------------------
+# 1. Building blocks
+# ---------------------------------------------------------------------------
+
+class TestWireFormat:
+
+    def test_round_trip_with_fds(self):
+        a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        r, w = os.pipe()
+        try:
+            send_message(a, {"op": "x", "n": 1}, b"\0raw\xff", fds=[r])
+            header, payload, fds = recv_message(b)
+            assert header == {"op": "x", "n": 1}
+            assert payload == b"\0raw\xff"
+            os.write(w, b"through")
+            assert os.read(fds[0], 100) == b"through"
+            os.close(fds[0])
+            a.close()
+            assert recv_message(b) is None
+        finally:
+            b.close()
+            os.close(r)
+            os.close(w)
+
+    def test_oversized_message_is_refused(self):
+        a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        with a, b, pytest.raises(ValueError):
+            send_message(a, {}, b"x" * 70000)
+
+    def test_offset_cell_is_shared(self):
+        fd = OffsetCell.new_fd()
+        try:
+            writer, reader = OffsetCell(fd), OffsetCell(fd)
+            assert reader.value == 0
+            writer.value = 123456789012
+            assert reader.value == 123456789012
+        finally:
+            os.close(fd)
+
+    def test_ring_continues_at_offset(self):
+        ring = OutputRing(8, start=100)
+        assert (ring.start, ring.end, len(ring)) == (100, 100, 0)
+        ring.write(b"abc")
+        assert ring.read(0) == (100, 103, b"abc")
+        ring.write(b"defghij")
+        assert ring.read(100) == (102, 110, b"cdefghij")
+
+    def test_ring_dump_keeps_partial_characters(self):
+        ring = OutputRing(16)
+        ring.write("a€".encode()[:-1])
+        assert ring.read(0)[2] == b"a"
+        assert ring.dump() == (0, "a€".encode()[:-1])
+
+
+# ---------------------------------------------------------------------------
+# 2. PtyHost + PtyHostClient
+# ---------------------------------------------------------------------------
+
+class TestPtyHost:
+
+    def test_spawn_returns_working_pty(self, host, connect):
+        client = connect()
+        master_fd, pid = client.spawn(SHELL, dict(os.environ))
+        try:
+            assert not os.get_blocking(master_fd)
+            assert _read_until(master_fd, b"ready$ ").endswith(b"ready$ ")
+            os.write(master_fd, b"hello\n")
+            assert b"got hello" in _read_until(master_fd, b"got hello")
+            assert len(host) == 1
+        finally:
+            os.close(master_fd)
+
+    def test_shell_survives_worker_and_is_adopted(self, host, connect):
+        client = connect()
+        master_fd, pid = client.spawn(SHELL, dict(os.environ))
+        client.describe(pid, session_id="s-1", label="agent", created_at=1.5)
+        _read_until(master_fd, b"ready$ ")
+        client.offset_cell(pid).value = 5000    # As read_pty_output keeps it
+        os.write(master_fd, b"while away\n")    # Answered after the worker is gone
+        client.disconnect()
+        os.close(master_fd)
+
+        assert _wait_for(lambda: host._shells[pid].ring is not None
+                         and b"got while away" in host._shells[pid].ring.dump()[1])
+        assert _alive(pid)
+
+        adopted = connect().adopt()
+        assert len(adopted) == 1
+        shell = adopted[0]
+        assert shell.pid == pid
+        assert shell.meta == {"session_id": "s-1", "label": "agent", "created_at": 1.5}
+        assert shell.start == 5000
+        assert b"got while away" in shell.output
+        os.close(shell.master_fd)
+
+    def test_adopted_shell_is_not_handed_out_twice(self, host, connect):
+        client = connect()
+        master_fd, pid = client.spawn(SHELL, dict(os.environ))
+        client.describe(pid, session_id="s-2")
+        client.disconnect()
+        os.close(master_fd)
+        assert _wait_for(lambda: host._shells[pid].owner is None)
+
+        first = connect().adopt()
+        assert [s.pid for s in first] == [pid]
+        assert connect().adopt() == []
+        os.close(first[0].master_fd)
+
+    def test_undescribed_shell_dies_with_worker(self, host, connect):
+        client = connect()
+        master_fd, pid = client.spawn(SHELL, dict(os.environ))
+        client.disconnect()
+        os.close(master_fd)
+        assert _wait_for(lambda: not _alive(pid))
+        assert _wait_for(lambda: len(host) == 0)
+
+    def test_close_terminates_and_calls_back(self, host, connect):
+        client = connect()
+        master_fd, pid = client.spawn(SHELL, dict(os.environ))
+        gone = threading.Event()
+        client.close(pid, gone.set)
+        assert gone.wait(10)
+        assert not _alive(pid)
+        assert len(host) == 0
+        assert client.offset_cell(pid) is None
+        os.close(master_fd)
+
+    def test_orphaned_shell_exit_is_cleaned_up(self, host, connect):
+        client = connect()
+        master_fd, pid = client.spawn(["bash", "-c", "read line; exit 0"], dict(os.environ))
+        client.describe(pid, session_id="s-3")
+        os.write(master_fd, b"\n")
+        client.disconnect()
+        os.close(master_fd)
+        assert _wait_for(lambda: len(host) == 0)
+        assert not _alive(pid)
+
+    def test_environment_larger_than_a_message(self, host, connect):
+        tokens = {f"BIG_TOKEN_{i}": "t" * (MAX_MESSAGE // 2) for i in range(4)}
+        script = 'echo "len=$(( ${#BIG_TOKEN_0} + ${#BIG_TOKEN_1} + ${#BIG_TOKEN_2} + ${#BIG_TOKEN_3} ))"'
+        master_fd, pid = connect().spawn(["bash", "-c", script], {**os.environ, **tokens})
+        expected = f"len={2 * MAX_MESSAGE}".encode()
+        try:
+            assert expected in _read_until(master_fd, expected)
+        finally:
+            os.close(master_fd)
+
+    def test_spawn_failure_is_raised(self, host, connect):
+        with pytest.raises(OSError, match="spawn failed"):
+            connect().spawn(["/no/such/shell"], dict(os.environ))
+
+    def test_second_host_refuses_live_socket(self, host):
+        assert stat.S_IMODE(os.stat(host.path).st_mode) == 0o600
+        with pytest.raises(OSError, match="already listening"):
+            PtyHost(host.path).listen()
+
+    def test_connect_without_host(self, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            PtyHostClient.connect(str(tmp_path / "none.sock"), launch=False)
+
+
+# ---------------------------------------------------------------------------
+# 3. app.py integration
+# ---------------------------------------------------------------------------
+
+class TestAppIntegration:
+
+    def test_session_spawns_through_host_and_is_adopted(self, app_module, host, connect, tmp_path):
+        worker = connect()
+        client = app_module.app.test_client()
+        with mock.patch.object(app_module, "pty_host", worker), \
+             mock.patch.object(app_module.shell_pool, "take", return_value=None), \
+             mock.patch.dict(os.environ, {"HOME": str(tmp_path)}):
+            resp = client.post("/api/session", json={"label": "agent"})
+            assert resp.status_code == 200
+            session_id = resp.get_json()["session_id"]
+            session = app_module.sessions[session_id]
+            assert session.pid in host._shells
+            assert host._shells[session.pid].meta["session_id"] == session_id
+
+            # Output read by this worker is mirrored into the shared cell
+            os.write(session.master_fd, b"echo marker\n")
+            assert _wait_for(lambda: b"marker" in session.output_buffer.read(0)[2])
+            assert _wait_for(lambda: session.offset_cell.value == session.output_buffer.end)
+            assert client.get("/health").get_json()["pty_host"] is True
+
+        # The worker dies: drop its session state and connection, keep the shell
+        pid, end = session.pid, session.output_buffer.end
+        app_module.pty_mux.unregister(session_id)
+        app_module.idle_deadlines.discard(session_id)
+        app_module.sessions.pop(session_id)
+        worker.disconnect()
+        os.close(session.master_fd)
+        assert _wait_for(lambda: host._shells[pid].owner is None)
+
+        restarted = connect()
+        with mock.patch.object(app_module, "pty_host", restarted):
+            app_module._adopt_sessions()
+            adopted = app_module.sessions[session_id]
+            try:
+                assert (adopted.pid, adopted.label) == (pid, "agent")
+                assert adopted.output_buffer.start == end
+                os.write(adopted.master_fd, b"echo again\n")
+                assert _wait_for(lambda: b"again" in adopted.output_buffer.read(end)[2])
+
+                assert app_module.terminate_session(session_id, pid, adopted.master_fd)
+                assert adopted.closed.wait(10)
+                assert not _alive(pid)
+            finally:
+                app_module.sessions.pop(session_id)
+                app_module.idle_deadlines.discard(session_id)
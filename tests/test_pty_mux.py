@@ -0,0 +1,179 @@
+"""Tests for the single-threaded PTY multiplexer (pty_mux.py).
+
+Verifies that:
+- Output from a registered PTY is dispatched to on_readable
+- Child exit is reported once via on_exit and the entry is unregistered
+- unregister() stops dispatch without triggering on_exit
+- Many sessions share one loop thread (no thread per session)
+"""
+
+import os
+import pty
+import subprocess
+import threading
+import time
+
+from pty_mux import PTYMultiplexer
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+def _spawn(command):
+    """Start *command* on a fresh PTY. Returns (proc, master_fd)."""
+    master_fd, slave_fd = pty.openpty()
+    proc = subprocess.Popen(
+        command,
+        stdin=slave_fd, stdout=slave_fd, stderr=slave_fd,
+        preexec_fn=os.setsid,
+    )
+    os.close(slave_fd)
+    return proc, master_fd
+
+
+class _Recorder:
+    """Collects multiplexer callbacks for assertions."""
+
+    def __init__(self):
+        self.output = {}
+        self.exited = []
+        self.exit_event = threading.Event()
+        self.output_event = threading.Event()
+
+    def on_readable(self, key, fd):
+        data = os.read(fd, 65536)
+        if not data:
+            return False
+        self.output[key] = self.output.get(key, b"") + data
+        self.output_event.set()
+        return True
+
+    def on_exit(self, key):
+        self.exited.append(key)
+        self.exit_event.set()
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+# ---------------------------------------------------------------------------
+# 1. Output dispatch
+# ---------------------------------------------------------------------------
+
+class TestOutputDispatch:
+
+    def test_output_reaches_on_readable(self):
+        rec = _Recorder()
+        mux = PTYMultiplexer(rec.on_readable, rec.on_exit)
+        proc, fd = _spawn(["bash", "-c", "echo hello-mux; sleep 5"])
+        try:
+            mux.register("s1", fd, proc.pid)
+            assert _wait_for(lambda: b"hello-mux" in rec.output.get("s1", b""))
+        finally:
+            mux.unregister("s1")
+            proc.kill()
+            proc.wait()
+            os.close(fd)
+
+
+# ---------------------------------------------------------------------------
+# 2. Exit detection
+# ---------------------------------------------------------------------------
+
+class TestExitDetection:
+
+    def test_exit_reported_once_and_unregistered(self):
+        rec = _Recorder()
+        mux = PTYMultiplexer(rec.on_readable, rec.on_exit)
+        proc, fd = _spawn(["bash", "-c", "echo bye; exit 0"])
+        try:
+            mux.register("s1", fd, proc.pid)
+            assert rec.exit_event.wait(5)
+            time.sleep(0.1)
+            assert rec.exited == ["s1"]
+            assert "s1" not in mux
+            assert b"bye" in rec.output.get("s1", b"")
+        finally:
+            os.close(fd)
+
+    def test_exit_detected_while_background_job_holds_pty(self):
+        """The shell exits but a background child keeps the PTY open (no EOF)."""
+        rec = _Recorder()
+        mux = PTYMultiplexer(rec.on_readable, rec.on_exit)
+        proc, fd = _spawn(["bash", "-c", "sleep 3 & exit 0"])
+        try:
+            mux.register("s1", fd, proc.pid)
+            assert rec.exit_event.wait(2.5)
+        finally:
+            os.close(fd)
+
+    def test_sweep_fallback_without_pidfd(self, monkeypatch):
+        import pty_mux
+        monkeypatch.setattr(pty_mux, "_open_pidfd", lambda pid: None)
+        rec = _Recorder()
+        mux = PTYMultiplexer(rec.on_readable, rec.on_exit, sweep_interval=0.1)
+        proc, fd = _spawn(["bash", "-c", "sleep 0.2 & exit 0"])
+        try:
+            mux.register("s1", fd, proc.pid)
+            assert rec.exit_event.wait(3)
+            assert rec.exited == ["s1"]
+        finally:
+            os.close(fd)
+
+
+# ---------------------------------------------------------------------------
+# 3. Unregister
+# ---------------------------------------------------------------------------
+
+class TestUnregister:
+
+    def test_unregister_suppresses_exit_callback(self):
+        rec = _Recorder()
+        mux = PTYMultiplexer(rec.on_readable, rec.on_exit)
+        proc, fd = _spawn(["bash", "-c", "sleep 5"])
+        mux.register("s1", fd, proc.pid)
+        assert mux.unregister("s1") is True
+        proc.kill()
+        proc.wait()
+        os.close(fd)
+        time.sleep(0.2)
+        assert rec.exited == []
+
+    def test_unregister_unknown_key_is_noop(self):
+        rec = _Recorder()
+        mux = PTYMultiplexer(rec.on_readable, rec.on_exit)
+        assert mux.unregister("nope") is False
+
+
+# ---------------------------------------------------------------------------
+# 4. One thread for all sessions
+# ---------------------------------------------------------------------------
+
+class TestSingleThread:
+
+    def test_many_sessions_share_one_thread(self):
+        rec = _Recorder()
+        mux = PTYMultiplexer(rec.on_readable, rec.on_exit)
+        spawned = [_spawn(["bash", "-c", f"echo out-{i}; sleep 5"]) for i in range(8)]
+        before = threading.active_count()
+        try:
+            for i, (proc, fd) in enumerate(spawned):
+                mux.register(f"s{i}", fd, proc.pid)
+            assert _wait_for(lambda: len(rec.output) == 8)
+            # At most the one loop thread was added
+            assert threading.active_count() <= before + 1
+            for i in range(8):
+                assert f"out-{i}".encode() in rec.output[f"s{i}"]
+        finally:
+            for i, (proc, fd) in enumerate(spawned):
+                mux.unregister(f"s{i}")
+                proc.kill()
+                proc.wait()
+                os.close(fd)
@@ -8,9 +8,9 @@ Covers:
 import os
 import subprocess
 import sys
-import threading
 import time
-from collections import deque
+from output_ring import OutputRing
+from terminal_session import Session, DRAINING
 from unittest import mock
 
 import pytest
@@ -28,6 +28,12 @@ def _get_app():
         return app_module
 
 
+def _ring(data=b""):
+    ring = OutputRing()
+    ring.write(data)
+    return ring
+
+
 # ---------------------------------------------------------------------------
 # Tests for _get_session_process
 # ---------------------------------------------------------------------------
@@ -119,15 +125,8 @@ class TestListSessions:
     def test_returns_session_with_metadata(self):
         # Add a session with our own PID (so ps works)
         now = time.time()
-        with self.app_module.sessions_lock:
-            self.app_module.sessions["sess-1"] = {
-                "pid": os.getpid(),
-                "master_fd": 0,
-                "output_buffer": deque(maxlen=1000),
-                "lock": threading.Lock(),
-                "last_poll_time": now - 120,
-                "created_at": now - 3600,
-            }
+        self.app_module.sessions.add(Session("sess-1", 0, os.getpid(),
+                                             last_poll_time=now - 120, created_at=now - 3600))
         resp = self.client.get("/api/sessions")
         data = resp.get_json()
         assert len(data) == 1
@@ -136,15 +135,7 @@ class TestListSessions:
         assert "idle_seconds" in data[0]
 
     def test_excludes_exited_sessions(self):
-        with self.app_module.sessions_lock:
-            self.app_module.sessions["dead"] = {
-                "pid": 1, "master_fd": 0,
-                "output_buffer": deque(maxlen=1000),
-                "lock": threading.Lock(),
-                "last_poll_time": time.time(),
-                "created_at": time.time(),
-                "exited": True,
-            }
+        self.app_module.sessions.add(Session("dead", 0, 1, state=DRAINING))
         resp = self.client.get("/api/sessions")
         assert resp.get_json() == []
 
@@ -167,53 +158,36 @@ class TestAttachSession:
 
     def test_returns_buffer_and_metadata(self):
         now = time.time()
-        with self.app_module.sessions_lock:
-            self.app_module.sessions["sess-a"] = {
-                "pid": os.getpid(), "master_fd": 0,
-                "output_buffer": deque(["line1\r\n", "line2\r\n"], maxlen=1000),
-                "lock": threading.Lock(),
-                "last_poll_time": now - 300,
-                "created_at": now - 7200,
-            }
+        self.app_module.sessions.add(Session("sess-a", 0, os.getpid(),
+                                             output_buffer=_ring(b"line1\r\nline2\r\n"),
+                                             last_poll_time=now - 300, created_at=now - 7200))
         resp = self.client.post("/api/session/attach", json={"session_id": "sess-a"})
         assert resp.status_code == 200
         data = resp.get_json()
         assert data["session_id"] == "sess-a"
-        assert data["output"] == ["line1\r\n", "line2\r\n"]
+        assert data["output"] == "line1\r\nline2\r\n"
         assert "process" in data
 
     def test_resets_last_poll_time(self):
         old = time.time() - 600
-        with self.app_module.sessions_lock:
-            self.app_module.sessions["sess-b"] = {
-                "pid": os.getpid(), "master_fd": 0,
-                "output_buffer": deque(maxlen=1000),
-                "lock": threading.Lock(),
-                "last_poll_time": old, "created_at": old,
-            }
+        self.app_module.sessions.add(Session("sess-b", 0, os.getpid(),
+                                             last_poll_time=old, created_at=old))
         self.client.post("/api/session/attach", json={"session_id": "sess-b"})
         sess = self.app_module.sessions["sess-b"]
-        assert sess["last_poll_time"] > old
+        assert sess.last_poll_time > old
 
     def test_404_missing(self):
         resp = self.client.post("/api/session/attach", json={"session_id": "nope"})
         assert resp.status_code == 404
 
     def test_404_exited(self):
-        with self.app_module.sessions_lock:
-            self.app_module.sessions["sess-x"] = {
-                "pid": 1, "master_fd": 0,
-                "output_buffer": deque(maxlen=1000),
-                "lock": threading.Lock(),
-                "last_poll_time": time.time(), "created_at": time.time(),
-                "exited": True,
-            }
+        self.app_module.sessions.add(Session("sess-x", 0, 1, state=DRAINING))
         resp = self.client.post("/api/session/attach", json={"session_id": "sess-x"})
         assert resp.status_code == 404
 
 
 # ---------------------------------------------------------------------------
-# Tests for EOF cleanup in read_pty_output
+# Tests for EOF cleanup via the PTY multiplexer
 # ---------------------------------------------------------------------------
 
 
@@ -237,18 +211,18 @@ class TestEOFCleanup:
         os.close(slave_fd)
 
         session_id = "sess-eof-test"
-        with self.app_module.sessions_lock:
-            self.app_module.sessions[session_id] = {
-                "pid": proc.pid,
-                "master_fd": master_fd,
-                "output_buffer": deque(maxlen=1000),
-                "lock": threading.Lock(),
-                "last_poll_time": time.time(),
-                "created_at": time.time(),
-            }
-
-        # read_pty_output should detect EOF and call terminate_session
-        self.app_module.read_pty_output(session_id, master_fd)
+        self.app_module.sessions.add(Session(session_id, master_fd, proc.pid))
+
+        # The multiplexer should detect the exit and call terminate_session
+        self.app_module.pty_mux.register(session_id, master_fd, proc.pid)
+
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            with self.app_module.sessions_lock:
+                if session_id not in self.app_module.sessions:
+                    break
+            time.sleep(0.1)
 
         with self.app_module.sessions_lock:
             assert session_id not in self.app_module.sessions
+        assert session_id not in self.app_module.pty_mux
@@ -8,13 +8,12 @@ Verifies that:
 - The 429 response includes an informative error message
 """
 
-import threading
-import time
-from collections import deque
 from unittest import mock
 
 import pytest
 
+from terminal_session import Session, RUNNING, DRAINING
+
 
 # ---------------------------------------------------------------------------
 # Helpers
@@ -29,21 +28,9 @@ def _get_app():
 
 
 def _add_session(app_module, session_id, exited=False):
-    """Insert a fake session into the sessions dict."""
-    session = {
-        "master_fd": 999,
-        "pid": 12345,
-        "output_buffer": deque(maxlen=1000),
-        "lock": threading.Lock(),
-        "last_poll_time": time.time(),
-        "created_at": time.time(),
-        "label": session_id,
-    }
-    if exited:
-        session["exited"] = True
-    with app_module.sessions_lock:
-        app_module.sessions[session_id] = session
-    return session
+    """Insert a fake session into the session registry."""
+    return app_module.sessions.add(Session(session_id, 999, 12345, label=session_id,
+                                           state=DRAINING if exited else RUNNING))
 
 
 def _cleanup(app_module, *session_ids):
@@ -82,14 +69,13 @@ class TestSessionCreationUnderLimit:
     def test_create_session_with_zero_active(self):
         app_module = _get_app()
         client = app_module.app.test_client()
-        # Mock out pty, subprocess, and threading to avoid real PTY creation
+        # Mock out pty, subprocess, and the PTY multiplexer to avoid real PTY creation
         with mock.patch.object(app_module, "check_authorization", return_value=(True, "test-user")), \
              mock.patch("pty.openpty", return_value=(10, 11)), \
              mock.patch("subprocess.Popen") as mock_popen, \
              mock.patch("os.close"), \
-             mock.patch("threading.Thread") as mock_thread:
+             mock.patch.object(app_module.pty_mux, "register"):
             mock_popen.return_value.pid = 99999
-            mock_thread.return_value.start = mock.Mock()
             resp = client.post("/api/session", json={"label": "test"})
         assert resp.status_code == 200
         data = resp.get_json()
@@ -109,9 +95,8 @@ class TestSessionCreationUnderLimit:
                  mock.patch("pty.openpty", return_value=(10, 11)), \
                  mock.patch("subprocess.Popen") as mock_popen, \
                  mock.patch("os.close"), \
-                 mock.patch("threading.Thread") as mock_thread:
+                 mock.patch.object(app_module.pty_mux, "register"):
                 mock_popen.return_value.pid = 99999
-                mock_thread.return_value.start = mock.Mock()
                 resp = client.post("/api/session", json={"label": "test"})
             assert resp.status_code == 200
             data = resp.get_json()
@@ -188,9 +173,8 @@ class TestRemovedSessionsFreeSlots:
                  mock.patch("pty.openpty", return_value=(10, 11)), \
                  mock.patch("subprocess.Popen") as mock_popen, \
                  mock.patch("os.close"), \
-                 mock.patch("threading.Thread") as mock_thread:
+                 mock.patch.object(app_module.pty_mux, "register"):
                 mock_popen.return_value.pid = 99999
-                mock_thread.return_value.start = mock.Mock()
                 resp = client.post("/api/session", json={"label": "after-removal"})
             assert resp.status_code == 200
             data = resp.get_json()
@@ -212,9 +196,8 @@ class TestRemovedSessionsFreeSlots:
                  mock.patch("pty.openpty", return_value=(10, 11)), \
                  mock.patch("subprocess.Popen") as mock_popen, \
                  mock.patch("os.close"), \
-                 mock.patch("threading.Thread") as mock_thread:
+                 mock.patch.object(app_module.pty_mux, "register"):
                 mock_popen.return_value.pid = 99999
-                mock_thread.return_value.start = mock.Mock()
                 resp = client.post("/api/session", json={"label": "last-slot"})
             assert resp.status_code == 200
             data = resp.get_json()
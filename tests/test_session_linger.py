@@ -2,7 +2,6 @@
 
 Verifies that:
 - SESSION_TIMEOUT_SECONDS is 86400 (24 hours)
-- CLEANUP_INTERVAL_SECONDS is 900 (15 minutes)
 - Sessions idle < 24h survive cleanup
 - Sessions idle > 24h are reaped
 - Warning fires at 80% of 24h (~19.2h)
@@ -10,7 +9,7 @@ Verifies that:
 """
 
 import time
-from collections import deque
+from terminal_session import Session
 from unittest import mock
 
 import pytest
@@ -30,16 +29,9 @@ def _get_app():
 
 def _add_session(app_module, session_id, idle_seconds):
     """Insert a fake session that has been idle for `idle_seconds`."""
-    session = {
-        "master_fd": 999,
-        "pid": 12345,
-        "output_buffer": deque(maxlen=1000),
-        "last_poll_time": time.time() - idle_seconds,
-        "created_at": time.time() - idle_seconds - 60,
-    }
-    with app_module.sessions_lock:
-        app_module.sessions[session_id] = session
-    return session
+    return app_module.sessions.add(Session(session_id, 999, 12345,
+                                           last_poll_time=time.time() - idle_seconds,
+                                           created_at=time.time() - idle_seconds - 60))
 
 
 def _cleanup(app_module, *session_ids):
@@ -58,9 +50,9 @@ class TestTimeoutConstants:
         app_module = _get_app()
         assert app_module.SESSION_TIMEOUT_SECONDS == 86400
 
-    def test_cleanup_interval_is_15_minutes(self):
+    def test_warning_fraction_is_80_percent(self):
         app_module = _get_app()
-        assert app_module.CLEANUP_INTERVAL_SECONDS == 900
+        assert app_module.TIMEOUT_WARNING_FRACTION == 0.8
 
 
 # ---------------------------------------------------------------------------
@@ -75,7 +67,7 @@ class TestSessionSurvival:
         try:
             now = time.time()
             with app_module.sessions_lock:
-                idle = now - app_module.sessions["alive-1h"]["last_poll_time"]
+                idle = now - app_module.sessions["alive-1h"].last_poll_time
                 assert idle <= app_module.SESSION_TIMEOUT_SECONDS
             assert "alive-1h" in app_module.sessions
         finally:
@@ -87,7 +79,7 @@ class TestSessionSurvival:
         try:
             now = time.time()
             with app_module.sessions_lock:
-                idle = now - app_module.sessions["alive-12h"]["last_poll_time"]
+                idle = now - app_module.sessions["alive-12h"].last_poll_time
                 assert idle <= app_module.SESSION_TIMEOUT_SECONDS
             assert "alive-12h" in app_module.sessions
         finally:
@@ -99,7 +91,7 @@ class TestSessionSurvival:
         try:
             now = time.time()
             with app_module.sessions_lock:
-                idle = now - app_module.sessions["alive-23h"]["last_poll_time"]
+                idle = now - app_module.sessions["alive-23h"].last_poll_time
                 assert idle <= app_module.SESSION_TIMEOUT_SECONDS
             assert "alive-23h" in app_module.sessions
         finally:
@@ -122,7 +114,7 @@ class TestSessionReaping:
                 for sid, s in app_module.sessions.items():
                     if sid != "stale-25h":
                         continue
-                    idle = now - s["last_poll_time"]
+                    idle = now - s.last_poll_time
                     if idle > app_module.SESSION_TIMEOUT_SECONDS:
                         stale.append(sid)
             assert "stale-25h" in stale
@@ -135,7 +127,7 @@ class TestSessionReaping:
         try:
             now = time.time()
             with app_module.sessions_lock:
-                idle = now - app_module.sessions["stale-boundary"]["last_poll_time"]
+                idle = now - app_module.sessions["stale-boundary"].last_poll_time
                 assert idle > app_module.SESSION_TIMEOUT_SECONDS
         finally:
             _cleanup(app_module, "stale-boundary")
@@ -154,7 +146,7 @@ class TestTimeoutWarning:
             warning_threshold = app_module.SESSION_TIMEOUT_SECONDS * 0.8
             now = time.time()
             with app_module.sessions_lock:
-                idle = now - app_module.sessions["warn-18h"]["last_poll_time"]
+                idle = now - app_module.sessions["warn-18h"].last_poll_time
                 assert idle < warning_threshold
         finally:
             _cleanup(app_module, "warn-18h")
@@ -167,7 +159,7 @@ class TestTimeoutWarning:
             now = time.time()
             with app_module.sessions_lock:
                 s = app_module.sessions["warn-20h"]
-                idle = now - s["last_poll_time"]
+                idle = now - s.last_poll_time
                 assert idle > warning_threshold
                 assert idle <= app_module.SESSION_TIMEOUT_SECONDS
         finally:
@@ -0,0 +1,164 @@
+"""Tests for asynchronous session termination (session_reaper.py and its use in app.py).
+
+Verifies that:
+- reap() returns immediately; on_gone follows as soon as the process exits on SIGHUP
+- A process ignoring SIGHUP is SIGKILLed after the grace period and reaped
+- Many sessions are terminated in parallel, not one grace period after another
+- A pid that is already reaped is never signalled
+- The waitpid polling fallback works without pidfds
+- /api/session/close returns at once and session_closed is emitted once the process is gone
+"""
+
+import os
+import pty
+import subprocess
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+import session_reaper
+from session_reaper import SessionReaper
+from terminal_session import Session
+
+
+IGNORES_HUP = ["bash", "-c", "trap '' HUP; sleep 30"]
+
+
+class _Gone:
+    def __init__(self):
+        self.calls = []
+        self.event = threading.Event()
+
+    def __call__(self, key, data):
+        self.calls.append((key, data, time.monotonic()))
+        self.event.set()
+
+    def wait(self, count=1, timeout=10.0):
+        deadline = time.time() + timeout
+        while len(self.calls) < count and time.time() < deadline:
+            time.sleep(0.01)
+        return len(self.calls) >= count
+
+
+def _spawn(command=("sleep", "30")):
+    return subprocess.Popen(list(command), preexec_fn=os.setsid)
+
+
+def _is_reaped(pid):
+    try:
+        os.waitpid(pid, os.WNOHANG)
+    except ChildProcessError:
+        return True
+    return False
+
+
+# ---------------------------------------------------------------------------
+# 1. SessionReaper
+# ---------------------------------------------------------------------------
+
+class TestSessionReaper:
+
+    def test_sighup_exit_is_prompt(self):
+        gone = _Gone()
+        reaper = SessionReaper(gone, grace=5)
+        proc = _spawn()
+        started = time.monotonic()
+        reaper.reap("s1", proc.pid, "payload")
+        assert time.monotonic() - started < 0.05
+        assert gone.wait()
+        key, data, finished = gone.calls[0]
+        assert (key, data) == ("s1", "payload")
+        assert finished - started < 1
+        assert _is_reaped(proc.pid)
+
+    def test_sigkill_after_grace(self):
+        gone = _Gone()
+        reaper = SessionReaper(gone, grace=0.3)
+        proc = _spawn(IGNORES_HUP)
+        time.sleep(0.2)             # Let bash install the trap
+        started = time.monotonic()
+        reaper.reap("s2", proc.pid)
+        assert gone.wait()
+        assert 0.25 < gone.calls[0][2] - started < 2
+        assert _is_reaped(proc.pid)
+
+    def test_sessions_terminated_in_parallel(self):
+        gone = _Gone()
+        reaper = SessionReaper(gone, grace=0.5)
+        procs = [_spawn(IGNORES_HUP) for _ in range(5)]
+        time.sleep(0.2)
+        started = time.monotonic()
+        for i, proc in enumerate(procs):
+            reaper.reap(f"p{i}", proc.pid)
+        assert gone.wait(5)
+        assert max(t for _, _, t in gone.calls) - started < 1.5
+        assert len(reaper) == 0
+
+    def test_already_reaped_pid_not_signalled(self):
+        proc = _spawn(["true"])
+        proc.wait()
+        gone = _Gone()
+        reaper = SessionReaper(gone)
+        with mock.patch("session_reaper.os.kill") as kill:
+            reaper.reap("s3", proc.pid)
+            assert gone.wait()
+        kill.assert_not_called()
+
+    def test_duplicate_reap_is_noop(self):
+        gone = _Gone()
+        reaper = SessionReaper(gone, grace=5)
+        proc = _spawn()
+        reaper.reap("s4", proc.pid)
+        reaper.reap("s4", proc.pid)
+        assert gone.wait()
+        time.sleep(0.1)
+        assert len(gone.calls) == 1
+
+    def test_polling_fallback_without_pidfd(self, monkeypatch):
+        monkeypatch.setattr(session_reaper, "_open_pidfd", lambda pid: None)
+        gone = _Gone()
+        reaper = SessionReaper(gone, grace=5)
+        proc = _spawn()
+        reaper.reap("s5", proc.pid)
+        assert gone.wait()
+        assert _is_reaped(proc.pid)
+
+
+# ---------------------------------------------------------------------------
+# 2. /api/session/close
+# ---------------------------------------------------------------------------
+
+class TestCloseEndpoint:
+
+    def test_close_returns_immediately(self, app_module):
+        master_fd, slave_fd = pty.openpty()
+        proc = subprocess.Popen(IGNORES_HUP, stdin=slave_fd, stdout=slave_fd, stderr=slave_fd,
+                                preexec_fn=os.setsid)
+        os.close(slave_fd)
+        app_module.sessions.add(Session("reap-1", master_fd, proc.pid))
+        time.sleep(0.2)
+        ws = app_module.socketio.test_client(app_module.app)
+        try:
+            ws.emit("join_session", {"session_id": "reap-1"}, callback=True)
+            with mock.patch.object(app_module.session_reaper, "_grace", 0.3):
+                started = time.monotonic()
+                resp = app_module.app.test_client().post(
+                    "/api/session/close", json={"session_id": "reap-1"})
+                assert time.monotonic() - started < 0.25
+                assert resp.get_json()["status"] == "ok"
+                assert "reap-1" not in app_module.sessions
+                assert not any(e["name"] == "session_closed" for e in ws.get_received())
+
+                received = []
+                deadline = time.time() + 5
+                while not received and time.time() < deadline:
+                    received = ws.get_received()
+                    time.sleep(0.02)
+            assert [e["name"] for e in received] == ["session_closed"]
+            assert _is_reaped(proc.pid)
+            with pytest.raises(OSError):
+                os.fstat(master_fd)
+        finally:
+            ws.disconnect()
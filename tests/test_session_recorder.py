@@ -0,0 +1,308 @@
+"""Tests for on-disk session recordings (session_recorder.py) and their endpoint.
+
+Verifies that:
+- A recording is an asciicast v2 file: header line, then output and resize events
+- Output bytes round-trip exactly, including invalid UTF-8; evicted bytes leave a gap marker
+- Offset and time ranges return exactly the requested output, trimmed at the bounds
+- Ranges use the sparse index and stream the middle as raw file slices
+- A finished recording can be reloaded from disk and read the same way
+- The writer thread copies output from the ring; recording stops at the size limit
+- Old recordings are pruned by age and total size, never while still being written
+- GET /api/session/recording streams live and ended sessions' history
+"""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+import session_recorder
+from output_ring import OutputRing
+from session_recorder import Recording, RecordingWriter
+
+
+def _events(cast):
+    lines = cast.split(b"\n")
+    assert lines[-1] == b""
+    return json.loads(lines[0]), [session_recorder._parse_line(line) for line in lines[1:-1]]
+
+
+def _output(cast):
+    return b"".join(p for _, kind, p in _events(cast)[1] if kind == "o")
+
+
+def _read(rec, *args, **kwargs):
+    return b"".join(rec.iter_range(*args, **kwargs))
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    clock = _Clock()
+    with mock.patch("session_recorder.time.monotonic", clock):
+        yield clock
+
+
+def _recording(tmp_path, **kwargs):
+    return Recording(str(tmp_path / "s.cast"), **kwargs).open()
+
+
+# ---------------------------------------------------------------------------
+# 1. File format
+# ---------------------------------------------------------------------------
+
+class TestFormat:
+
+    def test_header_and_events(self, tmp_path, clock):
+        rec = _recording(tmp_path, cols=100, rows=30, title="agent")
+        clock.now += 1.5
+        rec.append(0, b"$ ls\r\n")
+        rec.resize(120, 40)
+        rec.close()
+        header, events = _events((tmp_path / "s.cast").read_bytes())
+        assert (header["version"], header["width"], header["height"], header["title"]) == \
+            (2, 100, 30, "agent")
+        assert events == [(1.5, "o", b"$ ls\r\n"), (1.5, "r", "120x40")]
+
+    def test_invalid_utf8_is_byte_exact(self, tmp_path):
+        rec = _recording(tmp_path)
+        rec.append(0, b"ok \xff\xfe \x1b[31m\xe2\x9c\x93")
+        assert _output(_read(rec)) == b"ok \xff\xfe \x1b[31m\xe2\x9c\x93"
+
+    def test_gap_marker(self, tmp_path):
+        rec = _recording(tmp_path)
+        rec.append(0, b"abc")
+        rec.append(10, b"xyz")
+        _, events = _events(_read(rec))
+        assert [(k, p) for _, k, p in events] == [("o", b"abc"), ("m", "gap 7"), ("o", b"xyz")]
+        assert rec.offset == 13
+        assert _output(_read(rec, since=11)) == b"yz"
+
+    def test_size_limit_stops_recording(self, tmp_path):
+        rec = _recording(tmp_path, max_bytes=400)
+        for i in range(20):
+            rec.append(i * 10, b"0123456789")
+        assert rec.truncated
+        assert os.path.getsize(rec.path) < 500
+        _, events = _events(_read(rec))
+        assert events[-1][1:] == ("m", "recording size limit reached")
+
+
+# ---------------------------------------------------------------------------
+# 2. Range reads
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def long_recording(tmp_path, clock, monkeypatch):
+    """200 chunks "chunk NNN\\n" a quarter second apart, indexed every few events."""
+    monkeypatch.setattr(session_recorder, "INDEX_INTERVAL_BYTES", 100)
+    monkeypatch.setattr(session_recorder, "STREAM_CHUNK", 64)
+    rec = _recording(tmp_path)
+    for i in range(200):
+        clock.now += 0.25
+        if i == 100:
+            rec.resize(132, 50)
+        rec.append(i * 10, b"chunk %03d\n" % i)
+    return rec
+
+
+EVERYTHING = b"".join(b"chunk %03d\n" % i for i in range(200))
+
+
+class TestRanges:
+
+    def test_full_range(self, long_recording):
+        assert _output(_read(long_recording)) == EVERYTHING
+        assert len(long_recording._positions) < 200  # Sparse index
+
+    @pytest.mark.parametrize("since,until", [(0, 10), (5, 15), (333, 1777), (1995, None), (0, 2000)])
+    def test_offset_range(self, long_recording, since, until):
+        assert _output(_read(long_recording, since, until)) == EVERYTHING[since:until]
+
+    def test_time_range(self, long_recording):
+        # Chunk i was recorded (i + 1) / 4 seconds in
+        assert _output(_read(long_recording, start=12.75, end=13.5)) == \
+            b"chunk 050\nchunk 051\nchunk 052\n"
+
+    def test_header_has_size_at_range_start(self, long_recording):
+        assert _events(_read(long_recording, since=50))[0]["width"] == 80
+        assert _events(_read(long_recording, since=1500))[0]["width"] == 132
+
+    def test_empty_range(self, long_recording):
+        header, events = _events(_read(long_recording, since=5000))
+        assert events == []
+
+    def test_middle_is_streamed_in_bounded_slices(self, long_recording):
+        pieces = list(long_recording.iter_range(100, 1900))
+        assert max(len(p) for p in pieces[1:]) <= 64 + 40
+        assert _output(b"".join(pieces)) == EVERYTHING[100:1900]
+
+    def test_reload_from_disk(self, long_recording):
+        long_recording.close()
+        loaded = Recording.load(long_recording.path)
+        assert loaded.offset == 2000
+        assert list(loaded._positions) == list(long_recording._positions)
+        assert _read(loaded, 333, 1777) == _read(long_recording, 333, 1777)
+        assert _events(_read(loaded, since=1500))[0]["width"] == 132
+
+
+# ---------------------------------------------------------------------------
+# 3. Writer thread
+# ---------------------------------------------------------------------------
+
+class TestWriter:
+
+    def test_copies_output_from_ring(self, tmp_path):
+        ring = OutputRing(64)
+        lock = threading.Lock()
+        rec = _recording(tmp_path)
+        writer = RecordingWriter()
+        ring.write(b"hello ")
+        writer.notify(rec, ring, lock)
+        assert writer.flush()
+        ring.write(b"world")
+        writer.resize(rec, ring, lock, 90, 20)
+        writer.close(rec, ring, lock)
+        assert writer.flush()
+        assert rec.closed
+        _, events = _events((tmp_path / "s.cast").read_bytes())
+        assert [(k, p) for _, k, p in events] == [("o", b"hello "), ("o", b"world"), ("r", "90x20")]
+
+    def test_flush_waits_for_write_in_progress(self, tmp_path):
+        ring = OutputRing(64)
+        rec = _recording(tmp_path)
+        writer = RecordingWriter()
+        ring.write(b"slow disk")
+        writing, release = threading.Event(), threading.Event()
+        append = rec.append
+
+        def slow_append(*args):
+            writing.set()
+            release.wait(5)
+            append(*args)
+
+        with mock.patch.object(rec, "append", slow_append):
+            writer.notify(rec, ring, threading.Lock())
+            assert writing.wait(5)
+            assert writer.flush(timeout=0.1) is False   # Taken off the queue, not yet written
+            release.set()
+            assert writer.flush()
+        assert rec.offset == 9
+
+    def test_evicted_output_becomes_gap(self, tmp_path):
+        ring = OutputRing(16)
+        rec = _recording(tmp_path)
+        ring.write(b"x" * 40)
+        writer = RecordingWriter()
+        writer.notify(rec, ring, threading.Lock())
+        assert writer.flush()
+        assert rec.offset == 40
+        assert _output(_read(rec)) == b"x" * 16
+
+
+# ---------------------------------------------------------------------------
+# 4. Retention
+# ---------------------------------------------------------------------------
+
+def _finished(tmp_path, name, size, age):
+    path = tmp_path / f"{name}.cast"
+    path.write_bytes(b"x" * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+class TestRetention:
+
+    def test_old_recordings_deleted(self, tmp_path):
+        old = _finished(tmp_path, "old", 10, age=8 * 86400)
+        new = _finished(tmp_path, "new", 10, age=60)
+        assert session_recorder.prune_recordings(str(tmp_path), max_age=7 * 86400) == 1
+        assert not old.exists() and new.exists()
+
+    def test_oldest_deleted_past_total_size(self, tmp_path):
+        paths = [_finished(tmp_path, f"r{i}", 100, age=300 - i) for i in range(5)]
+        assert session_recorder.prune_recordings(str(tmp_path), max_bytes=250) == 3
+        assert [p.exists() for p in paths] == [False, False, False, True, True]
+
+    def test_recording_in_progress_kept(self, tmp_path):
+        live = Recording(str(tmp_path / "live.cast")).open()
+        try:
+            os.utime(live.path, (0, 0))     # Oldest of all, and past the age limit
+            newer = _finished(tmp_path, "newer", 100, age=60)
+            assert session_recorder.prune_recordings(str(tmp_path), max_bytes=50) == 1
+            assert os.path.exists(live.path) and not newer.exists()
+        finally:
+            live.close()
+        assert session_recorder.prune_recordings(str(tmp_path), max_bytes=50) == 1
+
+    def test_missing_directory(self, tmp_path):
+        assert session_recorder.prune_recordings(str(tmp_path / "none")) == 0
+
+    def test_root_home_falls_back(self):
+        script = "import session_recorder; print(session_recorder.RECORDINGS_DIR)"
+        out = subprocess.run([sys.executable, "-c", script], env={**os.environ, "HOME": "/"},
+                             cwd=os.path.dirname(session_recorder.__file__),
+                             capture_output=True, text=True, check=True).stdout
+        assert out.strip() == "/app/python/source_code/.coda/recordings"
+
+
+# ---------------------------------------------------------------------------
+# 5. /api/session/recording
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def app_module(app_module, tmp_path, monkeypatch):
+    monkeypatch.setattr(session_recorder, "RECORDINGS_DIR", str(tmp_path))
+    return app_module
+
+
+SID = "00000000-0000-4000-8000-000000000001"
+
+
+def _add_recorded_session(add_session):
+    recording = Recording(session_recorder.recording_path(SID)).open()
+    return add_session(SID, pid=os.getpid(), label="rec", recording=recording)
+
+
+class TestRecordingEndpoint:
+
+    def test_live_session(self, app_module, add_session, pty_write):
+        _add_recorded_session(add_session)
+        pty_write(SID, b"first ")
+        pty_write(SID, b"second")
+        assert app_module.recording_writer.flush()
+        client = app_module.app.test_client()
+        resp = client.get(f"/api/session/recording?session_id={SID}")
+        assert resp.mimetype == "application/x-asciicast"
+        assert _output(resp.data) == b"first second"
+        resp = client.get(f"/api/session/recording?session_id={SID}&since=3&until=9")
+        assert _output(resp.data) == b"st sec"
+
+    def test_ended_session_read_from_disk(self, app_module, add_session, pty_write):
+        sess = _add_recorded_session(add_session)
+        pty_write(SID, b"history")
+        app_module.recording_writer.close(sess.recording, sess.output_buffer, sess.lock)
+        assert app_module.recording_writer.flush()
+        with app_module.sessions_lock:
+            app_module.sessions.pop(SID)
+        resp = app_module.app.test_client().get(f"/api/session/recording?session_id={SID}")
+        assert _output(resp.data) == b"history"
+
+    def test_unknown_and_invalid_ids(self, app_module):
+        client = app_module.app.test_client()
+        missing = "00000000-0000-4000-8000-0000000000ff"
+        assert client.get(f"/api/session/recording?session_id={missing}").status_code == 404
+        assert client.get("/api/session/recording?session_id=../../etc/passwd").status_code == 400
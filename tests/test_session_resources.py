@@ -0,0 +1,319 @@
+"""Tests for per-session resource accounting and throttling (session_resources.py and its use in app.py).
+
+Verifies that:
+- A sample counts every process in the shell's session, with its CPU and RSS
+- A busy session reports CPU; an idle one reports (almost) none
+- Background sessions are reniced, including processes started later; interactive ones get it back
+- Priority the kernel won't give back stays reported as throttled; without a way to restore it
+  (CAP_SYS_NICE / RLIMIT_NICE) nothing is reniced
+- CPU quotas go through cgroup v2 files: setup empties our cgroup, sessions get cpu.max
+- detect(setup=False) uses the tree as another process set it up, without moving anything
+- limit_memory sets RLIMIT_AS, and a dead pid is reported rather than raised
+- app: keystrokes mark a session interactive; /api/sessions reports usage; closing untracks
+"""
+
+import os
+import resource
+import subprocess
+import time
+from unittest import mock
+
+import pytest
+
+import session_resources
+from session_resources import (
+    CpuCgroups, ResourceMonitor, ThrottlePolicy, can_restore_priority, limit_memory,
+)
+from terminal_session import RUNNING, Session
+
+
+pytestmark = pytest.mark.skipif(not session_resources._HAS_PROC, reason="needs /proc")
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.05)
+    return predicate()
+
+
+def _session_procs(leader):
+    return sorted(pid for pid, _, _ in session_resources._scan().get(leader, []))
+
+
+@pytest.fixture
+def spawn():
+    """Start ``bash -c script`` as a session leader, like a terminal's shell."""
+    procs = []
+
+    def make(script):
+        proc = subprocess.Popen(["bash", "-c", script], start_new_session=True)
+        procs.append(proc)
+        return proc
+
+    yield make
+    for proc in procs:
+        try:
+            os.killpg(proc.pid, 9)
+        except OSError:
+            pass
+        proc.wait()
+
+
+# ---------------------------------------------------------------------------
+# 1. Sampling
+# ---------------------------------------------------------------------------
+
+class TestSampling:
+
+    def test_counts_whole_session(self, spawn):
+        proc = spawn("sleep 30 & sleep 30 & wait")
+        assert _wait_for(lambda: len(_session_procs(proc.pid)) == 3)
+        monitor = ResourceMonitor()
+        monitor.track("s", proc.pid)
+        assert monitor.usage("s") is None
+        monitor.sample()
+        usage = monitor.usage("s")
+        assert usage.processes == 3
+        assert usage.rss_bytes > 0
+        assert usage.throttled is False
+
+    def test_cpu_of_busy_and_idle_sessions(self, spawn):
+        busy = spawn("while :; do :; done")
+        idle = spawn("sleep 30")
+        monitor = ResourceMonitor()
+        monitor.track("busy", busy.pid)
+        monitor.track("idle", idle.pid)
+        monitor.sample()
+        time.sleep(0.5)
+        monitor.sample()
+        assert monitor.usage("busy").cpu_percent > 30
+        assert monitor.usage("idle").cpu_percent < 5
+        assert set(monitor.usage("busy").as_dict()) == {"cpu_percent", "rss_bytes", "processes", "throttled"}
+
+    def test_untracked_session_is_forgotten(self, spawn):
+        monitor = ResourceMonitor()
+        monitor.track("s", spawn("sleep 30").pid)
+        monitor.sample()
+        monitor.untrack("s")
+        assert monitor.usage("s") is None
+        monitor.sample()    # Nothing tracked: still fine
+
+
+# ---------------------------------------------------------------------------
+# 2. Throttling
+# ---------------------------------------------------------------------------
+
+class TestThrottling:
+
+    def test_background_session_is_reniced_and_restored(self, spawn):
+        proc = spawn("sleep 30 & wait")
+        assert _wait_for(lambda: len(_session_procs(proc.pid)) == 2)
+        background = {"s": True}
+        monitor = ResourceMonitor(policy=ThrottlePolicy(nice=7), is_background=background.get)
+        monitor.track("s", proc.pid)
+
+        monitor.sample()
+        pids = _session_procs(proc.pid)
+        assert [os.getpriority(os.PRIO_PROCESS, pid) for pid in pids] == [7, 7]
+        assert monitor.usage("s").throttled
+
+        background["s"] = False
+        monitor.sample()
+        assert not monitor.usage("s").throttled
+        if os.geteuid() == 0:   # Raising priority back needs CAP_SYS_NICE
+            assert [os.getpriority(os.PRIO_PROCESS, pid) for pid in pids] == [0, 0]
+
+    def test_foreground_restores_before_next_sample(self, spawn):
+        proc = spawn("sleep 30")
+        cgroups = mock.Mock()
+        policy = ThrottlePolicy(nice=7, cpu_percent=25, cgroups=cgroups)
+        monitor = ResourceMonitor(policy=policy, is_background=lambda key: True)
+        monitor.track("s", proc.pid)
+        monitor.sample()
+        with mock.patch.object(policy, "restore", return_value=True) as restore:
+            monitor.foreground("s")
+            restore.assert_called_once_with(proc.pid, 0)
+            cgroups.release.assert_called_once_with(proc.pid)
+            monitor.foreground("s")     # Nothing left to restore
+            restore.assert_called_once()
+        monitor.foreground("untracked")
+
+    def test_unrestorable_priority_stays_throttled(self, spawn):
+        proc = spawn("sleep 30")
+        background = {"s": True}
+        monitor = ResourceMonitor(policy=ThrottlePolicy(nice=7), is_background=background.get)
+        monitor.track("s", proc.pid)
+        monitor.sample()
+
+        background["s"] = False
+        with mock.patch("session_resources.os.setpriority", side_effect=PermissionError):
+            monitor.sample()
+        assert monitor.usage("s").throttled
+        assert os.getpriority(os.PRIO_PROCESS, proc.pid) == 7
+
+        monitor.sample()    # Retried; succeeds as far as this process may
+        if os.geteuid() == 0:
+            assert not monitor.usage("s").throttled
+            assert os.getpriority(os.PRIO_PROCESS, proc.pid) == 0
+
+    def test_no_renice_when_it_cannot_be_undone(self, spawn):
+        proc = spawn("sleep 30")
+        background = {"s": True}
+        monitor = ResourceMonitor(policy=ThrottlePolicy(nice=7, renice=False), is_background=background.get)
+        monitor.track("s", proc.pid)
+        monitor.sample()
+        assert monitor.usage("s").throttled
+        assert os.getpriority(os.PRIO_PROCESS, proc.pid) == 0
+        background["s"] = False
+        monitor.sample()
+        assert not monitor.usage("s").throttled
+
+    @pytest.mark.parametrize("rlimit, cap_eff, expected", [
+        (20, "0000000000000000", True),     # RLIMIT_NICE reaches nice 0
+        (0, "0000000000800000", True),      # CAP_SYS_NICE
+        (0, "00000000a80425fb", False),     # Docker's default set: no CAP_SYS_NICE
+    ])
+    def test_can_restore_priority(self, rlimit, cap_eff, expected):
+        status = mock.mock_open(read_data=f"Name:\tpython\nCapEff:\t{cap_eff}\n")
+        with mock.patch("session_resources.resource.getrlimit", return_value=(rlimit, rlimit)), \
+                mock.patch("builtins.open", status):
+            assert can_restore_priority() is expected
+
+    def test_processes_started_later_are_caught(self, spawn, tmp_path):
+        fifo = str(tmp_path / "go")
+        os.mkfifo(fifo)
+        proc = spawn(f"read line < {fifo}; sleep 30 & wait")
+        monitor = ResourceMonitor(policy=ThrottlePolicy(nice=5), is_background=lambda key: True)
+        monitor.track("s", proc.pid)
+        monitor.sample()
+        assert os.getpriority(os.PRIO_PROCESS, proc.pid) == 5
+        with mock.patch.object(ThrottlePolicy, "throttle", autospec=True, return_value=0) as throttle:
+            monitor.sample()
+        assert throttle.call_count == 0     # Already throttled: no syscalls again
+
+        with open(fifo, "w") as f:
+            f.write("\n")
+        assert _wait_for(lambda: len(_session_procs(proc.pid)) == 2)
+        monitor.sample()
+        child = [pid for pid in _session_procs(proc.pid) if pid != proc.pid][0]
+        assert os.getpriority(os.PRIO_PROCESS, child) == 5   # Started at the shell's nice, and kept there
+        assert set(monitor._tracked["s"].throttled_pids) == {proc.pid, child}
+
+    def test_cgroup_quota(self, tmp_path):
+        base = tmp_path / "cg"
+        base.mkdir()
+        (base / "cgroup.controllers").write_text("cpuset cpu io memory\n")
+        (base / "cgroup.procs").write_text("11\n")
+        (base / "cgroup.subtree_control").write_text("")
+        cgroups = CpuCgroups(str(base))
+        cgroups.setup()
+        assert (base / "server" / "cgroup.procs").read_text() == "11"
+        assert (base / "cgroup.subtree_control").read_text() == "+cpu"
+
+        cgroups.limit(42, [42], 50)
+        assert (base / "session-42" / "cpu.max").read_text() == "50000 100000"
+        assert (base / "session-42" / "cgroup.procs").read_text() == "42"
+        cgroups.release(42)
+        assert (base / "session-42" / "cpu.max").read_text() == "max 100000"
+
+    def test_cgroup_without_cpu_controller(self, tmp_path):
+        (tmp_path / "cgroup.controllers").write_text("memory pids\n")
+        with pytest.raises(OSError):
+            CpuCgroups(str(tmp_path)).setup()
+
+    @pytest.mark.parametrize("own", ["/app", "/app/server"])
+    def test_detect_without_setup(self, tmp_path, own):
+        base = tmp_path / "app"
+        base.mkdir()
+        (base / "cgroup.controllers").write_text("cpu memory\n")
+        (base / "cgroup.procs").write_text("11\n")
+        with mock.patch.object(CpuCgroups, "ROOT", str(tmp_path)), \
+                mock.patch("session_resources._own_cgroup", return_value=own):
+            cgroups = CpuCgroups.detect(setup=False)
+            assert cgroups.base == str(base)
+            assert not (base / "server").exists()
+            (base / "cgroup.subtree_control").write_text("")
+            assert CpuCgroups.detect().base == str(base)
+        assert (base / "server" / "cgroup.procs").read_text() == "11"
+
+    def test_monitor_applies_cgroup_quota_once(self, spawn):
+        proc = spawn("sleep 30")
+        cgroups = mock.Mock()
+        monitor = ResourceMonitor(policy=ThrottlePolicy(cpu_percent=25, cgroups=cgroups),
+                                  is_background=lambda key: True)
+        monitor.track("s", proc.pid)
+        monitor.sample()
+        monitor.sample()
+        cgroups.limit.assert_called_once_with(proc.pid, [proc.pid], 25)
+        monitor.untrack("s")
+        cgroups.remove.assert_called_once_with(proc.pid)
+
+    def test_limit_memory(self, spawn):
+        proc = spawn("sleep 30")
+        assert limit_memory(proc.pid, 1 << 30)
+        assert resource.prlimit(proc.pid, resource.RLIMIT_AS) == (1 << 30, 1 << 30)
+        assert not limit_memory(2 ** 22 + 12345, 1 << 30)
+
+
+# ---------------------------------------------------------------------------
+# 3. app.py integration
+# ---------------------------------------------------------------------------
+
+class TestAppResources:
+
+    def _unviewed(self, app_module, session_id, w):
+        session = app_module.sessions.add(Session(session_id, w, 12345, state=RUNNING))
+        session.last_input_time -= app_module.BACKGROUND_AFTER_SECONDS + 1
+        session.last_view_time -= app_module.BACKGROUND_AFTER_SECONDS + 1
+        return session
+
+    def test_input_marks_session_interactive(self, app_module, pipe):
+        _, w = pipe
+        session = self._unviewed(app_module, "res-1", w)
+        assert app_module._is_background("res-1")
+        with mock.patch.object(app_module.resource_monitor, "foreground") as foreground:
+            app_module._write_input("res-1", session, b"x")
+        foreground.assert_called_once_with("res-1")     # Not left to the next sample
+        assert not app_module._is_background("res-1")
+        assert not app_module._is_background("no-such-session")
+
+    def test_websocket_viewer_keeps_session_foreground(self, app_module, pipe):
+        _, w = pipe
+        self._unviewed(app_module, "res-3", w)
+        ws = app_module.socketio.test_client(app_module.app)
+        try:
+            ws.emit("join_session", {"session_id": "res-3"}, callback=True)
+            assert not app_module._is_background("res-3")  # Watched, though nobody types
+            ws.emit("leave_session", {"session_id": "res-3"})
+            assert app_module._is_background("res-3")
+        finally:
+            ws.disconnect()
+
+    def test_http_poll_keeps_session_foreground(self, app_module, pipe):
+        _, w = pipe
+        self._unviewed(app_module, "res-4", w)
+        assert app_module._is_background("res-4")
+        app_module.app.test_client().post("/api/output-batch", json={"session_ids": ["res-4"]})
+        assert not app_module._is_background("res-4")
+
+    def test_sessions_report_usage_and_close_untracks(self, app_module, spawn):
+        proc = spawn("sleep 30")
+        r, w = os.pipe()
+        app_module.sessions.add(Session("res-2", w, proc.pid, state=RUNNING))
+        app_module.resource_monitor.track("res-2", proc.pid)
+        client = app_module.app.test_client()
+        try:
+            listed = {s["session_id"]: s for s in client.get("/api/sessions").get_json()}
+            assert listed["res-2"]["resources"] is None     # Not sampled yet
+            app_module.resource_monitor.sample()
+            resources = {s["session_id"]: s for s in client.get("/api/sessions").get_json()}["res-2"]["resources"]
+            assert resources["processes"] == 1 and resources["rss_bytes"] > 0
+
+            with mock.patch.object(app_module, "_release_shell"):
+                assert app_module.terminate_session("res-2", proc.pid, w)
+            assert app_module.resource_monitor.usage("res-2") is None
+        finally:
+            app_module.sessions.pop("res-2")
+            os.close(r)
+            os.close(w)
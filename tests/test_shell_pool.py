@@ -0,0 +1,281 @@
+"""Tests for pre-spawned warm shells (shell_pool.py and its use in app.py).
+
+Verifies that:
+- take() returns None without spawning when the pool is empty
+- start() fills the pool in the background, only with shells past their first prompt
+- take() hands out the oldest shell and the pool refills itself
+- Dead shells and shells spawned under a different fingerprint are discarded, not handed out
+- recycle() and stop() discard every warm shell
+- A pool of size 0 never spawns
+- POST /api/session hands out a warm shell whose prompt is already waiting
+- Discarded warm shells go through the session reaper without a session
+"""
+
+import os
+import pty
+import select
+import subprocess
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from shell_pool import ShellPool
+
+
+PROMPT_SHELL = ["bash", "-c", "sleep 0.1; printf 'ready$ '; exec sleep 30"]
+
+
+class _Spawner:
+    """spawn() for ShellPool: a PTY child that prints a prompt after 100 ms."""
+
+    def __init__(self, command=PROMPT_SHELL):
+        self.command = command
+        self.spawned = []
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        master_fd, slave_fd = pty.openpty()
+        proc = subprocess.Popen(self.command, stdin=slave_fd, stdout=slave_fd,
+                                stderr=slave_fd, preexec_fn=os.setsid)
+        os.close(slave_fd)
+        with self.lock:
+            self.spawned.append((master_fd, proc.pid))
+        return master_fd, proc.pid
+
+
+class _Discards:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, master_fd, pid):
+        self.calls.append((master_fd, pid))
+        try:
+            os.close(master_fd)
+        except OSError:
+            pass
+        try:
+            os.kill(pid, 9)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+
+
+def _wait_for(predicate, timeout=10.0):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def _readable(fd):
+    return bool(select.select([fd], [], [], 0)[0])
+
+
+@pytest.fixture
+def pool_factory():
+    pools = []
+
+    def make(size=1, **kwargs):
+        spawner = kwargs.pop("spawn", None) or _Spawner()
+        discards = kwargs.pop("discard", None) or _Discards()
+        pool = ShellPool(spawner, size=size, discard=discards, **kwargs)
+        pools.append(pool)
+        return pool, spawner, discards
+
+    yield make
+    for pool in pools:
+        pool.stop()
+
+
+def _release(shell):
+    master_fd, pid = shell
+    os.close(master_fd)
+    try:
+        os.kill(pid, 9)
+        os.waitpid(pid, 0)
+    except (ProcessLookupError, ChildProcessError):
+        pass  # Already reaped by subprocess's own cleanup of dropped Popen objects
+
+
+# ---------------------------------------------------------------------------
+# 1. ShellPool
+# ---------------------------------------------------------------------------
+
+class TestShellPool:
+
+    def test_take_from_empty_pool_returns_none(self, pool_factory):
+        pool, spawner, _ = pool_factory(size=2)
+        assert pool.take() is None
+        assert spawner.spawned == []
+
+    def test_start_fills_with_warm_shells(self, pool_factory):
+        pool, spawner, _ = pool_factory(size=2)
+        pool.start()
+        assert _wait_for(lambda: len(pool) == 2)
+        assert len(spawner.spawned) == 2
+        for master_fd, _ in spawner.spawned:
+            assert _readable(master_fd)  # Prompt printed, still unread
+
+    def test_take_hands_out_oldest_and_refills(self, pool_factory):
+        pool, spawner, _ = pool_factory(size=1)
+        pool.start()
+        assert _wait_for(lambda: len(pool) == 1)
+
+        shell = pool.take()
+        try:
+            assert shell == spawner.spawned[0]
+            assert os.read(shell[0], 100).endswith(b"ready$ ")
+            assert _wait_for(lambda: len(pool) == 1)
+            assert len(spawner.spawned) == 2
+        finally:
+            _release(shell)
+
+    def test_dead_shell_is_discarded(self, pool_factory):
+        pool, spawner, discards = pool_factory(size=1)
+        pool.start()
+        assert _wait_for(lambda: len(pool) == 1)
+        dead_fd, dead_pid = spawner.spawned[0]
+        os.kill(dead_pid, 9)
+        time.sleep(0.1)
+
+        assert pool.take() is None
+        assert discards.calls == [(dead_fd, dead_pid)]
+        # ...and a replacement is warmed
+        assert _wait_for(lambda: len(pool) == 1)
+
+    def test_fingerprint_change_discards(self, pool_factory):
+        version = ["v1"]
+        pool, spawner, discards = pool_factory(size=1, fingerprint=lambda: version[0])
+        pool.start()
+        assert _wait_for(lambda: len(pool) == 1)
+
+        version[0] = "v2"
+        assert pool.take() is None
+        assert discards.calls == [spawner.spawned[0]]
+
+        assert _wait_for(lambda: len(pool) == 1)
+        shell = pool.take()
+        try:
+            assert shell == spawner.spawned[1]
+        finally:
+            _release(shell)
+
+    def test_recycle_and_stop_discard_everything(self, pool_factory):
+        pool, spawner, discards = pool_factory(size=2)
+        pool.start()
+        assert _wait_for(lambda: len(pool) == 2)
+
+        pool.recycle()
+        assert len(discards.calls) == 2
+        assert _wait_for(lambda: len(pool) == 2)
+        assert len(spawner.spawned) == 4
+
+        pool.stop()
+        assert len(pool) == 0
+        assert len(discards.calls) == 4
+        time.sleep(0.2)
+        assert len(spawner.spawned) == 4  # No refill after stop
+
+    def test_size_zero_never_spawns(self, pool_factory):
+        pool, spawner, _ = pool_factory(size=0)
+        pool.start()
+        assert pool.take() is None
+        time.sleep(0.1)
+        assert spawner.spawned == []
+
+    def test_shell_without_prompt_is_pooled_after_timeout(self, pool_factory):
+        pool, spawner, _ = pool_factory(size=1, spawn=_Spawner(["sleep", "30"]),
+                                        ready_timeout=0.2)
+        pool.start()
+        assert _wait_for(lambda: len(pool) == 1)
+        shell = pool.take()
+        try:
+            assert shell == spawner.spawned[0]
+        finally:
+            _release(shell)
+
+    def test_spawn_failure_is_retried(self, pool_factory):
+        spawner = _Spawner()
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) == 1:
+                raise OSError("out of ptys")
+            return spawner()
+
+        with mock.patch("shell_pool.RETRY_INTERVAL", 0.05):
+            pool, _, _ = pool_factory(size=1, spawn=flaky)
+            pool.start()
+            assert _wait_for(lambda: len(pool) == 1)
+        assert len(calls) == 2
+
+
+# ---------------------------------------------------------------------------
+# 2. app.py integration
+# ---------------------------------------------------------------------------
+
+class TestAppIntegration:
+
+    def test_create_session_uses_warm_shell(self, app_module, pool_factory):
+        pool, spawner, _ = pool_factory(size=1)
+        pool.start()
+        assert _wait_for(lambda: len(pool) == 1)
+        warm_fd, warm_pid = spawner.spawned[0]
+
+        client = app_module.app.test_client()
+        with mock.patch.object(app_module, "shell_pool", pool), \
+             mock.patch.object(app_module, "_spawn_shell") as spawn_now:
+            resp = client.post("/api/session", json={"label": "warm"})
+            assert resp.status_code == 200
+            session_id = resp.get_json()["session_id"]
+            spawn_now.assert_not_called()
+            session = app_module.sessions[session_id]
+            assert (session.master_fd, session.pid) == (warm_fd, warm_pid)
+
+            # The prompt printed while warming is delivered like any other output
+            assert _wait_for(lambda: b"ready$ " in session.output_buffer.read(0)[2])
+            assert app_module.terminate_session(session_id, warm_pid, warm_fd)
+            assert _wait_for(lambda: _gone(warm_pid))
+
+    def test_create_session_falls_back_when_pool_empty(self, app_module):
+        client = app_module.app.test_client()
+        with mock.patch.object(app_module.shell_pool, "take", return_value=None), \
+             mock.patch.object(app_module, "_spawn_shell", return_value=(10, 99999)) as spawn_now, \
+             mock.patch("os.close"), \
+             mock.patch.object(app_module.pty_mux, "register"):
+            resp = client.post("/api/session", json={})
+        assert resp.status_code == 200
+        spawn_now.assert_called_once()
+        session_id = resp.get_json()["session_id"]
+        app_module.sessions.pop(session_id)
+        app_module.idle_deadlines.discard(session_id)
+
+    def test_discarded_warm_shell_is_reaped_without_session(self, app_module):
+        master_fd, pid = _Spawner()()
+        app_module._discard_warm_shell(master_fd, pid)
+        assert _wait_for(lambda: _gone(pid))
+        assert _wait_for(lambda: f"warm-{pid}" not in app_module.session_reaper)
+        with pytest.raises(OSError):
+            os.fstat(master_fd)
+
+    def test_fingerprint_tracks_rc_files(self, app_module, tmp_path):
+        with mock.patch.dict(os.environ, {"HOME": str(tmp_path)}):
+            before = app_module._shell_fingerprint()
+            assert app_module._shell_fingerprint() == before
+            (tmp_path / ".bashrc").write_text("alias ll='ls -l'\n")
+            assert app_module._shell_fingerprint() != before
+
+    def test_health_reports_warm_shells(self, app_module):
+        resp = app_module.app.test_client().get("/health")
+        assert resp.get_json()["warm_shells"] == 0
+
+
+def _gone(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    return False
@@ -0,0 +1,196 @@
+"""Tests for the Server-Sent Events output stream (/api/stream).
+
+Verifies that:
+- A stream opens with a ready event, then sends pending output at once
+- Output arriving later is pushed without the client asking again
+- Each event's id holds every session's offset; Last-Event-ID resumes from it
+- A quiet stream sends keepalive comments
+- A session exiting is reported and dropped; the stream ends with its last session
+- The stream ends after STREAM_MAX_DURATION, and on shutdown with shutting_down
+- Another worker's sessions are streamed through it; mixing workers is a 400
+- Beyond MAX_HELD_REQUESTS open streams, a stream is a 503 until one closes
+- Bad session lists and offsets are a 400
+"""
+
+import json
+import os
+import threading
+from unittest import mock
+
+import pytest
+
+from terminal_session import RUNNING, Session
+
+
+@pytest.fixture
+def session(app_module, pipe):
+    """A session whose PTY is a pipe (see ``feed``)."""
+    session = app_module.sessions.add(Session("sse-1", pipe[1], 12345, state=RUNNING))
+    yield session
+    app_module.sessions.pop("sse-1")
+    app_module.idle_deadlines.discard("sse-1")
+
+
+@pytest.fixture
+def feed(app_module, pipe, session):
+    """Produce output on the session, as its shell would."""
+    def feed(data):
+        os.write(pipe[1], data)
+        app_module.read_pty_output("sse-1", pipe[0])
+    return feed
+
+
+@pytest.fixture(autouse=True)
+def short_keepalive(app_module):
+    # Streams left open by a test would hold their slots: each test gets its own
+    with mock.patch.object(app_module, "STREAM_KEEPALIVE", 0.2), \
+         mock.patch.object(app_module, "held_requests", threading.BoundedSemaphore(2)):
+        yield
+
+
+def _open(app_module, sessions="sse-1:0", **headers):
+    resp = app_module.app.test_client().get(f"/api/stream?sessions={sessions}", headers=headers)
+    return resp, iter(resp.response)
+
+
+def _event(chunk):
+    """Parse one SSE chunk into {field: value}."""
+    if isinstance(chunk, bytes):
+        chunk = chunk.decode()
+    fields = {}
+    for line in chunk.strip("\n").split("\n"):
+        name, _, value = line.partition(":")
+        fields[name] = value.strip()
+    if "data" in fields:
+        fields["data"] = json.loads(fields["data"])
+    return fields
+
+
+# ---------------------------------------------------------------------------
+# 1. Pushing output
+# ---------------------------------------------------------------------------
+
+class TestStream:
+
+    def test_ready_then_pending_output(self, app_module, session, feed):
+        feed(b"hello")
+        resp, events = _open(app_module)
+        assert resp.status_code == 200
+        assert resp.mimetype == "text/event-stream"
+        assert resp.headers["Cache-Control"] == "no-cache"
+        assert _event(next(events))["event"] == "ready"
+
+        event = _event(next(events))
+        assert event["event"] == "terminal_output"
+        assert event["id"] == "sse-1:5"
+        assert event["data"]["session_id"] == "sse-1"
+        assert event["data"]["output"] == "hello"
+        assert event["data"]["next_offset"] == 5
+
+    def test_later_output_is_pushed(self, app_module, session, feed):
+        resp, events = _open(app_module)
+        next(events)
+        threading.Timer(0.05, lambda: feed(b"late")).start()
+        chunk = next(events)
+        while chunk.startswith(b":"):   # Keepalives until the output lands
+            chunk = next(events)
+        assert _event(chunk)["data"]["output"] == "late"
+
+    def test_quiet_stream_sends_keepalive(self, app_module, session):
+        resp, events = _open(app_module)
+        next(events)
+        assert next(events) == b": keepalive\n\n"
+
+    def test_resumes_from_last_event_id(self, app_module, session, feed):
+        feed(b"abcdef")
+        resp, events = _open(app_module, "sse-1:0", **{"Last-Event-ID": "sse-1:4,gone:9"})
+        next(events)
+        event = _event(next(events))
+        assert event["data"]["output"] == "ef"
+        assert event["id"] == "sse-1:6"     # Sessions outside the query are ignored
+
+    def test_exit_ends_stream(self, app_module, session):
+        with mock.patch.object(app_module, "_release_shell"), \
+             mock.patch.object(app_module.pty_mux, "unregister"):
+            app_module.terminate_session("sse-1", 12345, session.master_fd)
+        resp, events = _open(app_module)
+        next(events)
+        event = _event(next(events))
+        assert event["data"]["exited"] is True
+        assert event["id"] == ""
+        with pytest.raises(StopIteration):
+            next(events)
+        app_module.sessions.add(session)    # For the fixture's cleanup
+
+    def test_ends_after_max_duration(self, app_module, session):
+        with mock.patch.object(app_module, "STREAM_MAX_DURATION", 0.3):
+            resp, events = _open(app_module)
+            chunks = list(events)
+        assert _event(chunks[0])["event"] == "ready"
+        assert all(chunk == b": keepalive\n\n" for chunk in chunks[1:])
+
+    def test_refused_beyond_held_request_limit(self, app_module, session):
+        first, _ = _open(app_module)
+        second, _ = _open(app_module)
+        refused, _ = _open(app_module)
+        assert (first.status_code, second.status_code, refused.status_code) == (200, 200, 503)
+        first.close()
+        again, events = _open(app_module)
+        assert again.status_code == 200
+        assert _event(next(events))["event"] == "ready"
+
+    def test_shutdown(self, app_module, session):
+        resp, events = _open(app_module)
+        next(events)
+        with mock.patch.object(app_module, "shutting_down", True):
+            assert _event(next(events))["event"] == "shutting_down"
+            with pytest.raises(StopIteration):
+                next(events)
+
+
+# ---------------------------------------------------------------------------
+# 2. Worker shards
+# ---------------------------------------------------------------------------
+
+class TestShardedStream:
+
+    def test_remote_sessions_stream_through_owner(self, app_module):
+        router = mock.Mock()
+        router.request.return_value = ({"outputs": {"w1-s": {
+            "output": "hi", "offset": 3, "next_offset": 5, "gap": False,
+            "exited": True, "timeout_warning": False,
+        }}}, b"")
+        with mock.patch.object(app_module, "shard_router", router), \
+             mock.patch.object(app_module, "_owner_shard", return_value=1):
+            resp, events = _open(app_module, "w1-s:3")
+            chunks = list(events)
+        header = router.request.call_args.args[1]
+        assert header["op"] == "output-batch" and header["offsets"] == {"w1-s": 3}
+        assert 0 < header["wait"] <= 0.2
+        assert _event(chunks[1])["data"]["output"] == "hi"
+
+    def test_mixed_workers_rejected(self, app_module):
+        with mock.patch.object(app_module, "_owner_shard", side_effect=lambda sid: int(sid[1])):
+            resp, _ = _open(app_module, "w1-a,w2-b")
+        assert resp.status_code == 400
+
+
+# ---------------------------------------------------------------------------
+# 3. Validation
+# ---------------------------------------------------------------------------
+
+class TestValidation:
+
+    @pytest.mark.parametrize("sessions", ["", "sse-1:-1", "sse-1:x", ",".join(f"s{i}" for i in range(33))])
+    def test_bad_sessions(self, app_module, sessions):
+        resp, _ = _open(app_module, sessions)
+        assert resp.status_code == 400
+
+    def test_bad_last_event_id(self, app_module):
+        resp, _ = _open(app_module, "sse-1", **{"Last-Event-ID": "sse-1:oops"})
+        assert resp.status_code == 400
+
+    def test_cursor_round_trip(self, app_module):
+        cursor = {"a": 3, "b": None}
+        assert app_module._format_stream_cursor(cursor) == "a:3,b"
+        assert app_module._parse_stream_cursor("a:3,b") == cursor
@@ -0,0 +1,162 @@
+"""Tests for fingerprinted, precompressed static assets (static_assets.py and its routes in app.py).
+
+Verifies that:
+- Every file gets a content-hashed URL that changes with its content
+- Large compressible files get a gzip variant (and brotli, if installed); small or binary ones don't
+- Variants are content-addressed files in the cache, reused by the next build
+- Entry pages have /static/ references rewritten to the fingerprinted URLs
+- Encoding negotiation prefers brotli, then gzip, and honours q=0
+- app: /assets/ responses are immutable and compressed per Accept-Encoding; only
+  /assets/lib/ skips authorization
+- app: / serves the rewritten page with an ETag and answers a matching If-None-Match with 304
+"""
+
+import gzip
+import os
+from unittest import mock
+
+import pytest
+
+import static_assets
+from static_assets import AssetManifest
+
+
+@pytest.fixture
+def root(tmp_path):
+    root = tmp_path / "static"
+    (root / "lib").mkdir(parents=True)
+    (root / "lib" / "big.js").write_text("console.log('terminal');\n" * 200)
+    (root / "tiny.css").write_text("a{}")
+    (root / "logo.png").write_bytes(os.urandom(2048))
+    (root / ".hidden").write_text("secret")
+    (root / "index.html").write_text(
+        '<link href="/static/tiny.css"><script src="/static/lib/big.js"></script>'
+        "<script>new Worker('/static/lib/big.js'); fetch('/static/missing.js');</script>"
+        + "<!-- padding -->" * 100)
+    return root
+
+
+@pytest.fixture
+def manifest(root, tmp_path):
+    return AssetManifest(str(root), cache_dir=str(tmp_path / "cache"))
+
+
+# ---------------------------------------------------------------------------
+# 1. Manifest
+# ---------------------------------------------------------------------------
+
+class TestManifest:
+
+    def test_fingerprinted_urls(self, manifest, root):
+        assert manifest.build() == 4     # Three files and one entry page; dotfiles skipped
+        url = manifest.url("lib/big.js")
+        assert url.startswith("/assets/lib/big.") and url.endswith(".js")
+        asset = manifest.get(url[len("/assets/"):])
+        assert asset.name == "lib/big.js"
+        assert asset.mimetype in ("application/javascript", "text/javascript")
+        assert asset.files[""] == str(root / "lib" / "big.js")
+
+        (root / "lib" / "big.js").write_text("changed")
+        manifest.build()
+        assert manifest.url("lib/big.js") != url
+        assert manifest.get(url[len("/assets/"):]) is None
+
+    def test_compressed_variants(self, manifest, tmp_path):
+        manifest.build()
+        big = manifest.get(manifest.url("lib/big.js")[len("/assets/"):])
+        assert gzip.decompress(open(big.files["gzip"], "rb").read()) == open(big.files[""], "rb").read()
+        assert os.path.dirname(big.files["gzip"]) == str(tmp_path / "cache")
+        assert ("br" in big.files) == (static_assets.brotli is not None)
+        for name in ("tiny.css", "logo.png"):
+            assert set(manifest.get(manifest.url(name)[len("/assets/"):]).files) == {""}
+
+    def test_variants_are_reused(self, manifest, root, tmp_path):
+        manifest.build()
+        with mock.patch.object(static_assets.gzip, "compress") as compress:
+            AssetManifest(str(root), cache_dir=str(tmp_path / "cache")).build()
+        compress.assert_not_called()
+
+    def test_entry_page_rewritten(self, manifest):
+        page = manifest.page("index.html")
+        html = open(page.files[""]).read()
+        assert f'href="{manifest.url("tiny.css")}"' in html
+        assert html.count(manifest.url("lib/big.js")) == 2
+        assert "/static/missing.js" in html     # Unknown files are left alone
+        assert page.url is None and "gzip" in page.files
+
+    def test_lookups_build_on_first_use(self, manifest):
+        assert manifest.get("nope.js") is None
+        assert manifest.page("index.html") is not None
+
+
+class TestNegotiation:
+
+    @pytest.fixture
+    def asset(self):
+        return static_assets.Asset("a.js", "/assets/a.1.js", "1", "text/javascript",
+                                   {"": "a", "gzip": "a.gz", "br": "a.br"})
+
+    @pytest.mark.parametrize("accepted, expected", [
+        ({"gzip", "br"}, "br"),
+        ({"gzip"}, "gzip"),
+        (set(), ""),
+    ])
+    def test_preference(self, asset, accepted, expected):
+        assert asset.negotiate(accepted.__contains__) == expected
+        assert asset.etag(expected) == ("1" if not expected else f"1-{expected}")
+
+
+# ---------------------------------------------------------------------------
+# 2. app.py routes
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def app_module(app_module, manifest):
+    with mock.patch.object(app_module, "static_assets", manifest):
+        yield app_module
+
+
+class TestRoutes:
+
+    def test_asset_is_immutable_and_compressed(self, app_module, manifest):
+        client = app_module.app.test_client()
+        url = manifest.url("lib/big.js")
+        resp = client.get(url, headers={"Accept-Encoding": "gzip"})
+        assert resp.status_code == 200
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert "immutable" in resp.headers["Cache-Control"]
+        assert resp.cache_control.max_age == app_module.ASSET_MAX_AGE
+        assert "Accept-Encoding" in resp.headers["Vary"]
+        assert gzip.decompress(resp.data).startswith(b"console.log")
+
+        plain = client.get(url, headers={"Accept-Encoding": "gzip;q=0"})
+        assert "Content-Encoding" not in plain.headers
+        assert plain.data.startswith(b"console.log")
+
+    def test_library_skips_authorization(self, app_module, manifest):
+        with mock.patch.object(app_module, "check_authorization", return_value=(False, "x")) as check:
+            resp = app_module.app.test_client().get(manifest.url("lib/big.js"))
+        assert resp.status_code == 200
+        check.assert_not_called()
+
+    def test_app_asset_needs_authorization(self, app_module, manifest):
+        client = app_module.app.test_client()
+        with mock.patch.object(app_module, "check_authorization", return_value=(False, "x")):
+            assert client.get(manifest.url("tiny.css")).status_code == 403
+            # Not even a guess at the rewritten page gets past authorization
+            assert client.get(f"/assets/index.{manifest.page('index.html').digest}.html").status_code == 403
+        with mock.patch.object(app_module, "check_authorization", return_value=(True, "owner")):
+            assert client.get(manifest.url("tiny.css")).status_code == 200
+
+    def test_unknown_asset(self, app_module):
+        assert app_module.app.test_client().get("/assets/lib/big.0000.js").status_code == 404
+
+    def test_index_revalidates(self, app_module, manifest):
+        client = app_module.app.test_client()
+        with mock.patch.object(app_module, "app_owner", None):
+            resp = client.get("/", headers={"Accept-Encoding": "gzip"})
+            assert resp.status_code == 200
+            assert resp.cache_control.no_cache
+            assert manifest.url("lib/big.js").encode() in gzip.decompress(resp.data)
+            again = client.get("/", headers={"Accept-Encoding": "gzip", "If-None-Match": resp.headers["ETag"]})
+        assert again.status_code == 304
@@ -0,0 +1,257 @@
+"""Tests for the headless screen model (terminal_screen.py) and snapshot reattach.
+
+Verifies that:
+- Printable runs, wrapping, cursor movement and erasing land on the grid
+- Escape sequences split across feeds are held until complete
+- Rows scrolling off the top become bounded scrollback
+- The alternate screen, client modes and pen are restored by snapshot()
+- Feeding a snapshot into a fresh model reproduces the original screen
+- /api/session/attach returns a snapshot and the offset it ends at; the
+  model is fed then, not as output is read, and resizes apply where they
+  happened in the stream
+"""
+
+import os
+from unittest import mock
+
+import terminal_screen
+from terminal_screen import TerminalScreen
+
+
+def _replayed(screen):
+    """Feed screen's snapshot into a fresh model of the same size."""
+    copy = TerminalScreen(screen.cols, screen.rows)
+    copy.feed(screen.snapshot())
+    return copy
+
+
+# ---------------------------------------------------------------------------
+# 1. Grid updates
+# ---------------------------------------------------------------------------
+
+class TestGrid:
+
+    def test_print_and_newline(self):
+        s = TerminalScreen(10, 3)
+        s.feed("ab\r\ncd")
+        assert s.text() == ["ab", "cd", ""]
+        assert (s.x, s.y) == (2, 1)
+
+    def test_autowrap(self):
+        s = TerminalScreen(4, 3)
+        s.feed("abcdef")
+        assert s.text() == ["abcd", "ef", ""]
+
+    def test_cursor_position_and_erase_line(self):
+        s = TerminalScreen(10, 3)
+        s.feed("0123456789\x1b[1;4H\x1b[K")
+        assert s.text()[0] == "012"
+
+    def test_erase_display(self):
+        s = TerminalScreen(5, 2)
+        s.feed("abc\r\ndef\x1b[2J")
+        assert s.text() == ["", ""]
+
+    def test_insert_and_delete_chars(self):
+        s = TerminalScreen(10, 1)
+        s.feed("abcdef\x1b[1;2H\x1b[2P")
+        assert s.text() == ["adef"]
+        s.feed("\x1b[2@")
+        assert s.text() == ["a  def"]
+
+    def test_wide_and_combining_characters(self):
+        s = TerminalScreen(10, 1)
+        s.feed("日本é")
+        assert s.x == 5
+        assert s.text() == ["日本é"]
+
+    def test_dec_line_drawing(self):
+        s = TerminalScreen(5, 1)
+        s.feed("\x1b(0lqk\x1b(B")
+        assert s.text() == ["┌─┐"]
+
+    def test_split_escape_sequence(self):
+        s = TerminalScreen(10, 2)
+        s.feed("a\x1b[3")
+        assert s.pending == "\x1b[3"
+        s.feed("1mb")
+        assert s.pending == ""
+        assert s.text()[0] == "ab"
+
+    def test_osc_is_not_printed(self):
+        s = TerminalScreen(20, 1)
+        s.feed("\x1b]0;my title")
+        s.feed("\x07prompt$ ")
+        assert s.text() == ["prompt$"]
+
+    def test_resize_keeps_cursor_row(self):
+        s = TerminalScreen(10, 4)
+        s.feed("1\r\n2\r\n3\r\n4")
+        s.resize(5, 2)
+        assert s.text() == ["3", "4"]
+        assert (s.cols, s.rows, s.y) == (5, 2, 1)
+
+
+# ---------------------------------------------------------------------------
+# 2. Scrollback
+# ---------------------------------------------------------------------------
+
+class TestScrollback:
+
+    def test_scrolled_rows_in_snapshot(self):
+        s = TerminalScreen(10, 2)
+        s.feed("one\r\ntwo\r\nthree")
+        assert s.text() == ["two", "three"]
+        assert s.snapshot().startswith("one\r\ntwo\r\nthree")
+
+    def test_scrollback_is_bounded(self):
+        s = TerminalScreen(10, 2, scrollback=3)
+        s.feed("\r\n".join(str(i) for i in range(100)))
+        copy = TerminalScreen(10, 5)
+        copy.feed(s.snapshot())
+        assert copy.text() == ["95", "96", "97", "98", "99"]
+
+    def test_scroll_region_does_not_feed_scrollback(self):
+        s = TerminalScreen(10, 3)
+        s.feed("top\x1b[2;3r\x1b[3;1Ha\r\nb\r\nc")
+        assert s.text() == ["top", "b", "c"]
+        assert "a" not in s.snapshot().split("top")[0]
+
+    def test_clear_scrollback(self):
+        s = TerminalScreen(10, 1)
+        s.feed("old\r\nnew\x1b[3J")
+        assert "old" not in s.snapshot()
+
+
+# ---------------------------------------------------------------------------
+# 3. Snapshot round-trip
+# ---------------------------------------------------------------------------
+
+class TestSnapshot:
+
+    def test_round_trip_text_and_cursor(self):
+        s = TerminalScreen(20, 4)
+        s.feed("$ ls\r\nfile1  file2\r\n$ \x1b[1;31mred\x1b[0m")
+        copy = _replayed(s)
+        assert copy.text() == s.text()
+        assert (copy.x, copy.y) == (s.x, s.y)
+
+    def test_colors_survive(self):
+        s = TerminalScreen(20, 2)
+        s.feed("\x1b[38;2;1;2;3mrgb\x1b[0m plain \x1b[44mblue")
+        snap = s.snapshot()
+        assert _replayed(s).snapshot() == snap
+        assert "\x1b[0;38;2;1;2;3mrgb" in snap
+        assert "\x1b[0;44mblue" in snap
+        assert snap.endswith("\x1b[0;44m")  # Pen restored for the next output
+
+    def test_soft_wrap_is_preserved(self):
+        s = TerminalScreen(4, 3)
+        s.feed("abcdefg")
+        assert s.snapshot().startswith("abcdefg\r\n")
+
+    def test_alternate_screen(self):
+        s = TerminalScreen(10, 3)
+        s.feed("shell$ vim\r\n\x1b[?1049h\x1b[H~ editing")
+        snap = s.snapshot()
+        assert snap.index("shell$ vim") < snap.index("\x1b[?1049h") < snap.index("~ editing")
+        copy = _replayed(s)
+        assert copy.alternate
+        assert copy.text()[0] == "~ editing"
+        copy.feed("\x1b[?1049l")
+        assert copy.text()[0] == "shell$ vim"
+
+    def test_client_modes_restored(self):
+        s = TerminalScreen(10, 2)
+        s.feed("\x1b[?2004h\x1b[?1000h\x1b[?1006h\x1b[?25l\x1b=")
+        snap = s.snapshot()
+        for seq in ("\x1b[?2004h", "\x1b[?1000h", "\x1b[?1006h", "\x1b[?25l", "\x1b="):
+            assert seq in snap
+
+    def test_full_reset(self):
+        s = TerminalScreen(10, 2)
+        s.feed("x\r\ny\r\nz\x1bc")
+        assert s.text() == ["", ""]
+        assert s.snapshot().startswith("\r\n")
+
+    def test_style_table_compaction(self, monkeypatch):
+        monkeypatch.setattr(terminal_screen, "MAX_STYLES", 8)
+        s = TerminalScreen(10, 2)
+        for i in range(40):
+            s.feed(f"\x1b[38;5;{i}m\r#")
+        assert len(s._style_sgr) <= 8
+        assert s.snapshot().startswith("\x1b[0;38;5;39m#")
+
+
+# ---------------------------------------------------------------------------
+# 4. /api/session/attach
+# ---------------------------------------------------------------------------
+
+class TestAttachSnapshot:
+
+    def test_attach_returns_snapshot(self, app_module, add_session, pty_write):
+        add_session("scr-1", pid=os.getpid(), screen=TerminalScreen(20, 3))
+        pty_write("scr-1", b"$ echo hi\r\nhi\r\n$ ")
+        client = app_module.app.test_client()
+        body = client.post("/api/session/attach", json={"session_id": "scr-1"}).get_json()
+        assert body["screen"].startswith("$ echo hi\r\nhi\r\n$")
+        assert (body["cols"], body["rows"]) == (20, 3)
+        assert body["next_offset"] == 17
+
+    def test_not_parsed_on_read(self, app_module, add_session, pty_write):
+        sess = add_session("scr-6", pid=os.getpid(), screen=TerminalScreen(20, 3))
+        with mock.patch.object(sess.screen, "feed") as feed:
+            pty_write("scr-6", b"output nobody reattaches for\r\n")
+        feed.assert_not_called()
+        assert sess.screen_cursor == 0
+
+    def test_snapshot_catches_up_incrementally(self, app_module, add_session, pty_write):
+        add_session("scr-7", pid=os.getpid(), screen=TerminalScreen(20, 3))
+        client = app_module.app.test_client()
+        pty_write("scr-7", b"one\r\n")
+        client.post("/api/session/attach", json={"session_id": "scr-7"})
+        pty_write("scr-7", b"two\r\n")
+        body = client.post("/api/session/attach", json={"session_id": "scr-7"}).get_json()
+        assert body["screen"].startswith("one\r\ntwo\r\n")
+        assert body["next_offset"] == 10
+
+    def test_snapshot_rebuilt_after_eviction(self, app_module, add_session, pty_write):
+        add_session("scr-2", capacity=64, pid=os.getpid(), screen=TerminalScreen(20, 3))
+        for i in range(50):
+            pty_write("scr-2", b"line %d\r\n" % i)
+        client = app_module.app.test_client()
+        body = client.post("/api/session/attach", json={"session_id": "scr-2"}).get_json()
+        assert "line 49" in body["screen"]
+        assert "line 0\r\n" not in body["screen"]    # Evicted before it was parsed
+        assert (body["cols"], body["rows"]) == (20, 3)
+
+    def test_partial_escape_resumes_at_its_start(self, app_module, add_session, pty_write):
+        add_session("scr-3", pid=os.getpid(), screen=TerminalScreen(20, 3))
+        pty_write("scr-3", b"ok\x1b[3")
+        client = app_module.app.test_client()
+        body = client.post("/api/session/attach", json={"session_id": "scr-3"}).get_json()
+        assert body["next_offset"] == 2
+
+    def test_offset_still_replays_raw_output(self, app_module, add_session, pty_write):
+        add_session("scr-4", pid=os.getpid(), screen=TerminalScreen(20, 3))
+        pty_write("scr-4", b"abcdef")
+        client = app_module.app.test_client()
+        body = client.post("/api/session/attach",
+                           json={"session_id": "scr-4", "offset": 3}).get_json()
+        assert body["output"] == "def"
+        assert "screen" not in body
+
+    def test_resize_follows_pty(self, app_module, add_session, pty_write):
+        add_session("scr-5", pid=os.getpid(), screen=TerminalScreen(10, 3))
+        client = app_module.app.test_client()
+        pty_write("scr-5", b"a" * 15)
+        with mock.patch("app.fcntl.ioctl"):
+            client.post("/api/resize", json={"session_id": "scr-5", "cols": 20, "rows": 4})
+        pty_write("scr-5", b"b" * 15)
+        body = client.post("/api/session/attach", json={"session_id": "scr-5"}).get_json()
+        expected = TerminalScreen(10, 3)    # Resized between the two writes, as the PTY was
+        expected.feed("a" * 15)
+        expected.resize(20, 4)
+        expected.feed("b" * 15)
+        assert (body["cols"], body["rows"]) == (20, 4)
+        assert body["screen"] == expected.snapshot()
@@ -0,0 +1,202 @@
+"""Tests for Session objects and the lock-free session registry (terminal_session.py).
+
+Verifies that:
+- Session has fixed slots: unknown fields raise instead of being stored
+- The lifecycle only moves forward, and closed is set on reaching EXITED
+- The registry hands out wrapping, non-colliding indexes and frees them on pop
+- Lookups, by-index lookups and iteration work while another thread holds the registry lock
+- app: the PTY read, input and heartbeat paths never take sessions_lock
+- app: terminating a session moves it to DRAINING, then EXITED with closed set
+"""
+
+import os
+import pty
+import subprocess
+import threading
+from unittest import mock
+
+import pytest
+
+import terminal_session
+from terminal_session import (
+    DRAINING, EXITED, RUNNING, STARTING, Session, SessionRegistry,
+)
+
+
+# ---------------------------------------------------------------------------
+# 1. Session
+# ---------------------------------------------------------------------------
+
+class TestSession:
+
+    def test_slots(self):
+        session = Session("s1", 10, 123)
+        assert not hasattr(session, "__dict__")
+        with pytest.raises(AttributeError):
+            session.output_bufer = None  # Typo is an error, not a new field
+
+    def test_defaults(self):
+        session = Session("s1", 10, 123, label="tab")
+        assert (session.state, session.index, session.label) == (STARTING, None, "tab")
+        assert session.output_buffer.end == 0
+        assert session.input_queue.queued == 0
+        assert session.screen is None and session.recording is None
+        assert session.timeout_warning is False
+        assert not session.closed.is_set()
+
+    def test_lifecycle_moves_forward_only(self):
+        session = Session("s1", 10, 123)
+        assert session.live
+        assert session.advance(RUNNING)
+        assert session.advance(DRAINING)
+        assert not session.live
+        assert not session.advance(DRAINING)    # Terminated twice
+        assert not session.advance(RUNNING)     # No way back
+        assert session.state == DRAINING
+        assert not session.closed.is_set()
+        assert session.advance(EXITED)
+        assert session.closed.is_set()
+
+    def test_starting_session_can_drain_directly(self):
+        session = Session("s1", 10, 123)
+        assert session.advance(DRAINING)
+        assert not session.advance(RUNNING)     # Registration finished too late
+
+    def test_built_exited_is_closed(self):
+        assert Session("s1", 10, 123, state=EXITED).closed.is_set()
+
+
+# ---------------------------------------------------------------------------
+# 2. SessionRegistry
+# ---------------------------------------------------------------------------
+
+class TestSessionRegistry:
+
+    def test_add_get_pop(self):
+        registry = SessionRegistry()
+        session = registry.add(Session("a", 10, 1))
+        assert registry.get("a") is session and registry["a"] is session
+        assert "a" in registry and len(registry) == 1
+        assert list(registry) == ["a"]
+        assert registry.by_index(session.index) is session
+        assert registry.pop("a") is session
+        assert registry.get("a") is None
+        assert registry.by_index(session.index) is None
+        assert registry.pop("a") is None
+
+    def test_indexes_count_up_and_skip_used(self):
+        registry = SessionRegistry()
+        a = registry.add(Session("a", 10, 1))
+        b = registry.add(Session("b", 11, 2))
+        assert (a.index, b.index) == (0, 1)
+        registry.pop("a")
+        c = registry.add(Session("c", 12, 3))
+        assert c.index == 2  # 0 is free again, but not reused until the counter wraps
+
+    def test_indexes_wrap(self):
+        registry = SessionRegistry()
+        with mock.patch.object(terminal_session, "MAX_SESSION_INDEX", 2):
+            sessions = [registry.add(Session(str(i), 10, i)) for i in range(3)]
+            registry.pop("1")
+            again = registry.add(Session("again", 10, 9))
+        assert [s.index for s in sessions] == [0, 1, 2]
+        assert again.index == 1  # Wrapped past the still-used 0
+
+    def test_explicit_index_is_kept(self):
+        registry = SessionRegistry()
+        session = registry.add(Session("a", 10, 1, index=41))
+        assert session.index == 41 and registry.by_index(41) is session
+
+    def test_reads_do_not_wait_for_writers(self):
+        registry = SessionRegistry()
+        session = registry.add(Session("a", 10, 1))
+        held, release = threading.Event(), threading.Event()
+
+        def writer():
+            with registry.lock:
+                held.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            assert held.wait(5)
+            assert registry.get("a") is session
+            assert registry.by_index(session.index) is session
+            assert [sid for sid, _ in registry.items()] == ["a"]
+            assert len(registry) == 1
+        finally:
+            release.set()
+            thread.join()
+
+    def test_iteration_is_a_stable_snapshot(self):
+        registry = SessionRegistry()
+        for sid in "abc":
+            registry.add(Session(sid, 10, 1))
+        seen = []
+        for sid, _ in registry.items():
+            seen.append(sid)
+            registry.pop(sid)           # Mutating while iterating is safe
+            registry.add(Session(sid + "2", 10, 1))
+        assert seen == ["a", "b", "c"]
+        assert sorted(registry) == ["a2", "b2", "c2"]
+
+
+# ---------------------------------------------------------------------------
+# 3. app.py integration
+# ---------------------------------------------------------------------------
+
+class TestAppHotPaths:
+
+    def test_io_paths_do_not_take_sessions_lock(self, app_module):
+        r, w = os.pipe()
+        session = app_module.sessions.add(Session("ts-1", w, 12345, state=RUNNING))
+        held, release = threading.Event(), threading.Event()
+
+        def writer():
+            with app_module.sessions_lock:
+                held.set()
+                release.wait(10)
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        out_r, out_w = os.pipe()
+        try:
+            assert held.wait(5)
+            done = threading.Event()
+
+            def hot_paths():
+                os.write(out_w, b"output")
+                assert app_module.read_pty_output("ts-1", out_r) is True
+                assert app_module._write_input("ts-1", session, b"keys") is not None
+                client = app_module.app.test_client()
+                assert client.post("/api/heartbeat", json={"session_id": "ts-1"}).status_code == 200
+                done.set()
+
+            worker = threading.Thread(target=hot_paths, daemon=True)
+            worker.start()
+            assert done.wait(5), "an I/O path blocked on sessions_lock"
+            assert session.output_buffer.read(0)[2] == b"output"
+            assert os.read(r, 100) == b"keys"
+        finally:
+            release.set()
+            thread.join()
+            for fd in (r, w, out_r, out_w):
+                os.close(fd)
+
+    def test_terminate_drains_then_exits(self, app_module):
+        master_fd, slave_fd = pty.openpty()
+        proc = subprocess.Popen(["sleep", "30"], stdin=slave_fd, stdout=slave_fd,
+                                stderr=slave_fd, preexec_fn=os.setsid)
+        os.close(slave_fd)
+        session = app_module.sessions.add(Session("ts-2", master_fd, proc.pid, state=RUNNING))
+
+        assert app_module.terminate_session("ts-2", proc.pid, master_fd)
+        assert session.state in (DRAINING, EXITED)
+        assert "ts-2" not in app_module.sessions
+        assert not app_module.terminate_session("ts-2", proc.pid, master_fd)
+
+        assert session.closed.wait(10)
+        assert session.state == EXITED
+        with pytest.raises(OSError):
+            os.fstat(master_fd)
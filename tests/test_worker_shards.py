@@ -0,0 +1,423 @@
+"""Tests for session sharding across gunicorn workers (worker_shards.py and its use in app.py).
+
+Verifies that:
+- Each claim_shard caller gets a different slot, and a released slot is reclaimed
+- Session ids and binary-frame indexes map back to the shard that issued them
+- Sharded and plain session ids are normalized; anything else is rejected
+- The registry allocates indexes within its shard's range
+- Routers answer requests, deliver events in order, fan out, and push back over the same link
+- Calls to an unreachable or vanished worker fail instead of hanging
+- Sends are queued: a stalled peer never blocks the sender, only fills its bounded queue,
+  and handlers answering on their own link can't deadlock with the peer doing the same
+- app: HTTP calls for another worker's session are served by that worker
+- app: /api/sessions and /api/output-batch merge every worker's sessions
+- app: remote WebSocket viewers get output relayed, and input is forwarded to the owner
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from unittest import mock
+
+import pytest
+
+import terminal_session
+from terminal_session import RUNNING, Session, SessionRegistry
+from worker_shards import (
+    ShardRouter, claim_shard, index_range, new_session_id, parse_session_id,
+    shard_of, shard_of_index,
+)
+from ws_frames import MAX_SESSION_INDEX
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+# ---------------------------------------------------------------------------
+# 1. Shard slots, ids and indexes
+# ---------------------------------------------------------------------------
+
+class TestShardIdentity:
+
+    def test_claims_are_exclusive(self, tmp_path):
+        a, fd_a = claim_shard(str(tmp_path), 2)
+        b, fd_b = claim_shard(str(tmp_path), 2)
+        try:
+            assert {a, b} == {0, 1}
+            with pytest.raises(RuntimeError):
+                claim_shard(str(tmp_path), 2, timeout=0.2)
+            os.close(fd_a)      # The worker holding it exited
+            again, fd_again = claim_shard(str(tmp_path), 2, timeout=0.2)
+            assert again == a
+            os.close(fd_again)
+        finally:
+            os.close(fd_b)
+
+    def test_session_id_carries_shard(self):
+        session_id = new_session_id(3)
+        assert session_id.startswith("w3-")
+        assert shard_of(session_id) == 3
+        assert shard_of(str(uuid.uuid4())) is None
+        assert shard_of(None) is None
+
+    def test_parse_session_id(self):
+        plain = str(uuid.uuid4())
+        assert parse_session_id(plain) == plain
+        sharded = new_session_id(1)
+        assert parse_session_id(sharded) == sharded
+        for bad in ("w1-../../etc", "../x", "w1-"):
+            with pytest.raises(ValueError):
+                parse_session_id(bad)
+
+    def test_index_ranges_partition_the_index_space(self):
+        ranges = [index_range(shard, 3) for shard in range(3)]
+        assert ranges[0][0] == 0
+        assert ranges[2][1] <= MAX_SESSION_INDEX
+        for (_, last), (first, _) in zip(ranges, ranges[1:]):
+            assert first == last + 1
+        for shard, (first, last) in enumerate(ranges):
+            assert shard_of_index(first, 3) == shard_of_index(last, 3) == shard
+
+    def test_registry_allocates_in_range(self):
+        registry = SessionRegistry()
+        registry.set_index_range(10, 11)
+        a = registry.add(Session("a", 10, 1))
+        b = registry.add(Session("b", 10, 2))
+        registry.pop("a")
+        c = registry.add(Session("c", 10, 3))
+        assert (a.index, b.index, c.index) == (10, 11, 10)
+
+    def test_registry_default_range_follows_max_index(self):
+        registry = SessionRegistry()
+        with mock.patch.object(terminal_session, "MAX_SESSION_INDEX", 1):
+            indexes = [registry.add(Session(str(i), 10, i)).index for i in range(2)]
+            registry.pop("0")
+            assert registry.add(Session("x", 10, 9)).index == 0
+        assert indexes == [0, 1]
+
+
+# ---------------------------------------------------------------------------
+# 2. ShardRouter
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def routers(tmp_path):
+    """Two routers (shards 0 and 1) with handlers set per test."""
+    handlers = {}
+    made = []
+    for shard in range(2):
+        router = ShardRouter(shard, 2, str(tmp_path),
+                             lambda link, header, payload, shard=shard: handlers[shard](link, header, payload))
+        router.start()
+        made.append(router)
+    yield made, handlers
+    for router in made:
+        router.stop()
+
+
+class TestShardRouter:
+
+    def test_request_reply(self, routers):
+        (a, b), handlers = routers
+        handlers[1] = lambda link, header, payload: ({"echo": header["op"]}, payload[::-1])
+        assert a.request(1, {"op": "ping"}, b"abc") == ({"echo": "ping", "re": 1}, b"cba")
+
+    def test_events_arrive_in_order(self, routers):
+        (a, b), handlers = routers
+        seen = []
+        handlers[1] = lambda link, header, payload: seen.append(payload)
+        for i in range(200):
+            a.send(1, {"op": "input"}, b"%d" % i)
+        assert _wait_for(lambda: len(seen) == 200)
+        assert seen == [b"%d" % i for i in range(200)]
+
+    def test_request_all_fans_out(self, tmp_path):
+        made = []
+        for shard in range(3):
+            router = ShardRouter(shard, 3, str(tmp_path),
+                                 lambda link, header, payload, shard=shard: ({"shard": shard}, b""))
+            router.start()
+            made.append(router)
+        try:
+            replies = made[0].request_all({"op": "count"})
+            assert sorted(replies) == [1, 2]
+            assert replies[2][0]["shard"] == 2
+            only = made[0].request_all(None, shards={2: {"op": "count"}})
+            assert list(only) == [2]
+        finally:
+            for router in made:
+                router.stop()
+
+    def test_push_back_over_request_link(self, routers):
+        (a, b), handlers = routers
+        pushed = threading.Event()
+
+        def owner(link, header, payload):
+            link.send({"push": "hello"}, b"to you")
+            return {"ok": True}, b""
+
+        handlers[1] = owner
+        handlers[0] = lambda link, header, payload: pushed.set() if header.get("push") == "hello" else None
+        assert a.request(1, {"op": "join"})[0]["ok"]
+        assert pushed.wait(5)
+
+    def test_send_does_not_wait_for_stalled_peer(self, routers):
+        (a, b), handlers = routers
+        release = threading.Event()
+        handlers[1] = lambda link, header, payload: release.wait(10)    # Stops reading the link
+        chunk = b"x" * 65536
+        started = time.monotonic()
+        try:
+            with mock.patch("worker_shards.LINK_QUEUE_BYTES", 1 << 20):
+                with pytest.raises(ConnectionError, match="queue full"):
+                    for _ in range(1000):
+                        a.send(1, {"op": "output"}, chunk)
+            assert time.monotonic() - started < 2
+        finally:
+            release.set()
+        assert _wait_for(lambda: not a.link(1)._outbox)
+        a.send(1, {"op": "output"}, chunk)      # Drained: accepted again
+
+    def test_answering_on_own_link_does_not_deadlock(self, routers):
+        (a, b), handlers = routers
+        chunk = b"x" * 65536
+        acks = []
+
+        def owner(link, header, payload):       # Answers every ping on the link it came in on
+            if header["op"] == "ping":
+                link.send({"op": "pong"}, chunk)
+            else:
+                acks.append(1)
+
+        handlers[1] = owner
+        handlers[0] = lambda link, header, payload: link.send({"op": "ack"}, chunk)
+        for _ in range(60):
+            a.send(1, {"op": "ping"}, chunk)
+        assert _wait_for(lambda: len(acks) == 60, timeout=10)
+
+    def test_handler_error_is_raised_to_caller(self, routers):
+        (a, b), handlers = routers
+
+        def fail(link, header, payload):
+            raise KeyError("boom")
+
+        handlers[1] = fail
+        with pytest.raises(ConnectionError, match="boom"):
+            a.request(1, {"op": "x"})
+
+    def test_unreachable_worker(self, tmp_path):
+        router = ShardRouter(0, 2, str(tmp_path), lambda *args: None)
+        router.start()
+        try:
+            with pytest.raises(ConnectionError):
+                router.request(1, {"op": "x"})
+            assert router.request_all({"op": "x"}) == {}
+        finally:
+            router.stop()
+
+    def test_pending_call_fails_when_worker_goes(self, routers):
+        (a, b), handlers = routers
+        started = threading.Event()
+
+        def stuck(link, header, payload):
+            started.set()
+            link.close()        # The worker dies mid-request
+            return None
+
+        handlers[1] = stuck
+        with pytest.raises(ConnectionError):
+            a.request(1, {"op": "x"}, timeout=5)
+        assert started.is_set()
+
+
+# ---------------------------------------------------------------------------
+# 3. app.py integration
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def sharded(app_module, tmp_path):
+    """Make this process worker 0 of 2, with a fake worker 1 whose requests
+    are served by *remote* — the same app, under its own forwarded header."""
+    remote = {}
+    local = ShardRouter(0, 2, str(tmp_path), app_module._serve_shard,
+                        on_link_closed=app_module._drop_shard_link)
+    peer = ShardRouter(1, 2, str(tmp_path), lambda link, header, payload: remote["handle"](link, header, payload))
+    local.start()
+    peer.start()
+    with mock.patch.object(app_module, "shard_router", local):
+        yield local, peer, remote
+    local.stop()
+    peer.stop()
+
+
+def _add_session(app_module, session_id, output=b""):
+    r, w = os.pipe()
+    session = app_module.sessions.add(Session(session_id, w, 12345, state=RUNNING))
+    session.output_buffer.write(output)
+    return session, (r, w)
+
+
+class TestAppRouting:
+
+    def test_http_for_remote_session_is_forwarded(self, app_module, sharded):
+        local, peer, remote = sharded
+        remote_id = new_session_id(1)
+        seen = []
+
+        def handle(link, header, payload):
+            seen.append(header)
+            assert header["op"] == "http"
+            return {"status": 200, "headers": [["Content-Type", "application/json"]]}, \
+                json.dumps({"output": "from worker 1", "body": json.loads(payload)}).encode()
+
+        remote["handle"] = handle
+        client = app_module.app.test_client()
+        resp = client.post("/api/output", json={"session_id": remote_id, "offset": 0})
+        assert resp.status_code == 200
+        assert resp.get_json()["output"] == "from worker 1"
+        assert resp.get_json()["body"] == {"session_id": remote_id, "offset": 0}
+        assert seen[0]["path"] == "/api/output" and seen[0]["method"] == "POST"
+
+    def test_forwarded_request_runs_locally(self, app_module, sharded):
+        local, peer, remote = sharded
+        session_id = new_session_id(0)
+        session, fds = _add_session(app_module, session_id, b"owned here")
+        try:
+            # What worker 1 would send for a client polling our session
+            reply, body = peer.request(0, {
+                "op": "http", "method": "POST", "path": "/api/output", "query": "",
+                "headers": [["Content-Type", "application/json"]],
+            }, json.dumps({"session_id": session_id, "offset": 0}).encode())
+            assert reply["status"] == 200
+            assert json.loads(body)["output"] == "owned here"
+        finally:
+            app_module.sessions.pop(session_id)
+            for fd in fds:
+                os.close(fd)
+
+    def test_unreachable_owner_is_503(self, app_module, sharded):
+        local, peer, remote = sharded
+        peer.stop()
+        client = app_module.app.test_client()
+        resp = client.post("/api/heartbeat", json={"session_id": new_session_id(1)})
+        assert resp.status_code == 503
+
+    def test_sessions_and_batch_merge_workers(self, app_module, sharded):
+        local, peer, remote = sharded
+        session_id = new_session_id(0)
+        remote_id = new_session_id(1)
+        session, fds = _add_session(app_module, session_id, b"local")
+
+        def handle(link, header, payload):
+            if header["op"] == "sessions":
+                return {"sessions": [{"session_id": remote_id, "created_at": 0}]}, b""
+            assert header["op"] == "output-batch"
+            assert list(header["offsets"]) == [remote_id]
+            return {"outputs": {remote_id: {"output": "remote"}}}, b""
+
+        remote["handle"] = handle
+        client = app_module.app.test_client()
+        try:
+            listed = [s["session_id"] for s in client.get("/api/sessions").get_json()]
+            assert listed[0] == remote_id and session_id in listed
+            outputs = client.post("/api/output-batch", json={
+                "session_ids": [session_id, remote_id, remote_id], "offsets": {session_id: 0},
+            }).get_json()["outputs"]
+            assert outputs[session_id]["output"] == "local"
+            assert outputs[remote_id]["output"] == "remote"
+        finally:
+            app_module.sessions.pop(session_id)
+            for fd in fds:
+                os.close(fd)
+
+
+class TestAppRemoteViewers:
+
+    def test_output_is_relayed_and_input_forwarded(self, app_module, sharded):
+        local, peer, remote = sharded
+        session_id = new_session_id(0)
+        session, (r, w) = _add_session(app_module, session_id, b"earlier")
+        session.emit_cursor = session.output_buffer.end     # Already sent live
+        pushes = []
+        remote["handle"] = lambda link, header, payload: pushes.append((header, payload))
+        try:
+            # Worker 1's client joins our session from offset 0
+            reply, _ = peer.request(0, {"op": "join", "session_id": session_id, "client": "sid-1",
+                                        "offset": 0, "binary": False, "compress": False})
+            assert reply["status"] == "ok" and reply["next_offset"] == 7
+            assert _wait_for(lambda: pushes)
+            join, payload = pushes[0]
+            assert join["to"] == "sid-1" and join["join"] == [session_id, f"{session_id}:text"]
+            assert json.loads(payload)["output"] == "earlier"
+
+            # Live output is relayed to worker 1's text room
+            with session.lock:
+                session.output_buffer.write(b" live")
+            app_module._emit_pending_output(session_id, session)
+            assert _wait_for(lambda: len(pushes) == 2)
+            live, payload = pushes[1]
+            assert (live["push"], live["room"]) == ("terminal_output", f"{session_id}:text")
+            assert json.loads(payload)["output"] == " live"
+
+            # Keystrokes typed on worker 1 reach the PTY, in order
+            peer.send(0, {"op": "input", "session_id": session_id, "client": "sid-1"}, b"ls")
+            peer.send(0, {"op": "input", "index": session.index, "client": "sid-1"}, b" -l")
+            typed = b""
+            deadline = time.time() + 5
+            while len(typed) < 5 and time.time() < deadline:
+                typed += os.read(r, 100)
+            assert typed == b"ls -l"
+
+            # Worker 1's viewers left: relaying stops
+            peer.send(0, {"op": "unsubscribe", "session_id": session_id, "fmt": "text"})
+            assert _wait_for(lambda: not session.remote_viewers)
+        finally:
+            app_module.sessions.pop(session_id)
+            os.close(r)
+            os.close(w)
+
+    def test_closed_link_drops_viewers(self, app_module, sharded):
+        local, peer, remote = sharded
+        session_id = new_session_id(0)
+        session, fds = _add_session(app_module, session_id)
+        remote["handle"] = lambda link, header, payload: None
+        try:
+            peer.request(0, {"op": "join", "session_id": session_id, "client": "sid-1",
+                             "offset": None, "binary": False, "compress": False})
+            assert session.remote_viewers
+            peer.stop()
+            assert _wait_for(lambda: not session.remote_viewers)
+        finally:
+            app_module.sessions.pop(session_id)
+            for fd in fds:
+                os.close(fd)
+
+    def test_push_to_empty_room_unsubscribes(self, app_module):
+        link = mock.Mock()
+        session_id = new_session_id(1)
+        app_module._receive_push(link, {
+            "push": "terminal_output", "room": f"{session_id}:text", "to": None, "join": [],
+            "binary": False, "session_id": session_id, "fmt": "text",
+        }, b'{"output": "x"}')
+        link.send.assert_called_once_with({"op": "unsubscribe", "session_id": session_id, "fmt": "text"})
+
+    def test_single_worker_batch_is_forwarded_whole(self, app_module, sharded):
+        local, peer, remote = sharded
+        remote_ids = [new_session_id(1), new_session_id(1)]
+        seen = []
+
+        def handle(link, header, payload):
+            seen.append((header, json.loads(payload)))
+            return {"status": 200, "headers": [["Content-Type", "application/json"]]}, b'{"outputs": {}}'
+
+        remote["handle"] = handle
+        client = app_module.app.test_client()
+        body = {"session_ids": remote_ids, "offsets": {}, "wait": 5, "poll_id": "p"}
+        assert client.post("/api/output-batch", json=body).status_code == 200
+        assert seen[0][0]["op"] == "http" and seen[0][1] == body
@@ -0,0 +1,380 @@
+"""Session-affinity routing between gunicorn workers.
+
+One gthread worker used to serve everything: every open WebSocket pinned
+one of its 16 threads, and all PTY I/O, JSON encoding and compression ran
+under a single GIL. With ``WEB_WORKERS`` > 1 each worker owns a *shard* of
+the sessions instead, and requests reach the owner wherever they land:
+
+- Each worker claims a shard slot with ``claim_shard`` (an flock, so a
+  replacement worker inherits the slot — and, with pty_host, the shells —
+  of the one it replaces).
+- Session ids encode their shard (``w<shard>-<uuid>``), and so do binary
+  frame indexes (each shard allocates from its own slice of the index
+  space), so any worker can tell who owns a session without asking.
+- Workers talk over one Unix socket each (``ShardRouter``): length-prefixed
+  JSON header + raw payload frames, multiplexed both ways over a single
+  connection per pair of workers. A frame is a *request* (has an ``id``,
+  gets a reply, handled on a thread pool), an *event* (no ``id``, handled
+  in order on the connection's reader thread — keystrokes stay ordered) or
+  a *reply* (``re``). The owner also pushes events back over the
+  connection a request arrived on, e.g. live output for a WebSocket that
+  is connected to another worker.
+- Frames are sent by a sender thread per connection, from a bounded
+  queue: ``send`` never waits on the socket, so the PTY loop and a reader
+  thread answering its own link (an event handler pushing back) can't
+  stall on a busy peer — or deadlock with one doing the same.
+
+What is forwarded, and how it is merged, is up to app.py.
+"""
+
+import collections
+import fcntl
+import itertools
+import json
+import os
+import re
+import socket
+import struct
+import threading
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from ws_frames import MAX_SESSION_INDEX
+
+logger = logging.getLogger(__name__)
+
+REQUEST_TIMEOUT = 30        # Seconds to wait for another worker's reply
+CLAIM_TIMEOUT = 30          # Seconds to wait for a shard slot during a rolling restart
+HANDLER_THREADS = 16        # Concurrent requests served for other workers
+LINK_QUEUE_BYTES = 8 << 20  # Frames waiting to be sent on a link before send() refuses more
+
+_FRAME = struct.Struct("!II")    # header length, payload length
+_SESSION_ID = re.compile(r"w(\d+)-")
+
+
+def claim_shard(directory, count, timeout=CLAIM_TIMEOUT):
+    """Lock the lowest free shard slot in *directory*. Returns (shard, lock_fd).
+
+    The lock lives as long as the process (keep *lock_fd* open). During a
+    rolling restart every slot may still be held by an outgoing worker, so
+    this waits up to *timeout* seconds for one to free up.
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    deadline = time.monotonic() + timeout
+    while True:
+        for shard in range(count):
+            fd = os.open(os.path.join(directory, f"shard-{shard}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            return shard, fd
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"all {count} worker shards are taken")
+        time.sleep(0.1)
+
+
+def new_session_id(shard):
+    return f"w{shard}-{uuid.uuid4()}"
+
+
+def parse_session_id(session_id):
+    """Normalize a client-supplied session id, sharded or not (it also names
+    files, e.g. recordings). Raises ValueError if it isn't one of ours."""
+    match = _SESSION_ID.match(session_id)
+    prefix = match.group(0) if match else ""
+    return prefix + str(uuid.UUID(session_id[len(prefix):]))
+
+
+def shard_of(session_id):
+    """The shard encoded in *session_id*, or None (unsharded id)."""
+    match = _SESSION_ID.match(session_id or "")
+    return int(match.group(1)) if match else None
+
+
+def index_range(shard, count):
+    """``(first, last)`` binary-frame session indexes owned by *shard*."""
+    span = (MAX_SESSION_INDEX + 1) // count
+    return shard * span, shard * span + span - 1
+
+
+def shard_of_index(index, count):
+    return min(index // ((MAX_SESSION_INDEX + 1) // count), count - 1)
+
+
+class _Call:
+    __slots__ = ("done", "reply", "payload")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.reply = None
+        self.payload = b""
+
+    def wait(self, timeout):
+        if not self.done.wait(timeout):
+            raise TimeoutError("worker did not answer in time")
+        if "error" in self.reply:
+            raise ConnectionError(self.reply["error"])
+        return self.reply, self.payload
+
+
+class Link:
+    """One connection to another worker; usable in both directions."""
+
+    def __init__(self, sock, router, peer=None):
+        self.peer = peer        # Shard we dialled, or None for an accepted connection
+        self._sock = sock
+        self._router = router
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._pending = {}      # request id -> _Call
+        self._outbox = collections.deque()  # Encoded frames for the sender thread
+        self._outbox_bytes = 0
+        self._outbox_ready = threading.Condition(self._lock)
+        self.closed = False
+        threading.Thread(target=self._run, daemon=True, name="shard-link").start()
+        threading.Thread(target=self._send_loop, daemon=True, name="shard-link-send").start()
+
+    def send(self, header, payload=b""):
+        """Queue one frame (an event, reply or push); frames go out in order.
+
+        Never blocks on the socket. Raises ConnectionError if the link is
+        closed or LINK_QUEUE_BYTES are already waiting to be sent.
+        """
+        data = json.dumps(header).encode()
+        frame = _FRAME.pack(len(data), len(payload)) + data + payload
+        with self._lock:
+            if self.closed:
+                raise ConnectionError("worker link closed")
+            if self._outbox and self._outbox_bytes + len(frame) > LINK_QUEUE_BYTES:
+                raise ConnectionError("worker link send queue full")
+            self._outbox.append(frame)
+            self._outbox_bytes += len(frame)
+            self._outbox_ready.notify()
+
+    def start_call(self, header, payload=b""):
+        """Send a request; returns a _Call to ``wait`` on."""
+        call = _Call()
+        with self._lock:
+            if self.closed:
+                raise ConnectionError("worker link closed")
+            request_id = header["id"] = next(self._ids)
+            self._pending[request_id] = call
+        try:
+            self.send(header, payload)
+        except OSError:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise
+        return call
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _send_loop(self):
+        while True:
+            with self._lock:
+                while not self._outbox and not self.closed:
+                    self._outbox_ready.wait()
+                if self.closed:
+                    return
+                frame = self._outbox.popleft()
+                self._outbox_bytes -= len(frame)
+            try:
+                self._sock.sendall(frame)
+            except OSError as e:
+                if not self.closed:
+                    logger.warning(f"Worker link send failed: {e}")
+                self.close()    # The reader sees EOF and cleans up
+                return
+
+    def _recv_exact(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self._sock.recv(size - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return bytes(data)
+
+    def _run(self):
+        try:
+            while True:
+                header_len, payload_len = _FRAME.unpack(self._recv_exact(_FRAME.size))
+                header = json.loads(self._recv_exact(header_len))
+                payload = self._recv_exact(payload_len) if payload_len else b""
+                if "re" in header:
+                    with self._lock:
+                        call = self._pending.pop(header["re"], None)
+                    if call is not None:
+                        call.reply, call.payload = header, payload
+                        call.done.set()
+                else:
+                    self._router._dispatch(self, header, payload)
+        except (OSError, EOFError, ValueError) as e:
+            if not isinstance(e, EOFError):
+                logger.warning(f"Worker link error: {e}")
+        finally:
+            with self._lock:
+                self.closed = True
+                pending, self._pending = self._pending, {}
+                self._outbox.clear()
+                self._outbox_ready.notify()
+            for call in pending.values():
+                call.reply = {"error": "worker link closed"}
+                call.done.set()
+            self._sock.close()
+            self._router._link_closed(self)
+
+
+class ShardRouter:
+    """This worker's end of the worker-to-worker links. See module docstring.
+
+    ``handle(link, header, payload)`` serves frames from other workers: for
+    requests it returns ``(reply_header, reply_payload)``; events return
+    None. ``on_link_closed(link)`` lets the app drop per-link state (e.g.
+    remote output subscriptions).
+    """
+
+    def __init__(self, shard, count, directory, handle, on_link_closed=None):
+        self.shard = shard
+        self.count = count
+        self._directory = directory
+        self._handle = handle
+        self._on_link_closed = on_link_closed
+        self._lock = threading.Lock()
+        self._links = {}        # peer shard -> Link we dialled
+        self._executor = ThreadPoolExecutor(max_workers=HANDLER_THREADS, thread_name_prefix="shard-req")
+        self._listener = None
+
+    def socket_path(self, shard):
+        return os.path.join(self._directory, f"shard-{shard}.sock")
+
+    def start(self):
+        path = self.socket_path(self.shard)
+        try:
+            os.unlink(path)     # Left by the worker whose slot we claimed
+        except FileNotFoundError:
+            pass
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            listener.bind(path)
+        finally:
+            os.umask(old_umask)
+        listener.listen()
+        self._listener = listener
+        threading.Thread(target=self._accept, args=(listener,), daemon=True, name="shard-accept").start()
+        logger.info(f"Worker shard {self.shard}/{self.count} listening on {path}")
+
+    def stop(self):
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            try:
+                listener.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            listener.close()
+        with self._lock:
+            links, self._links = list(self._links.values()), {}
+        for link in links:
+            link.close()
+
+    def peers(self):
+        return [shard for shard in range(self.count) if shard != self.shard]
+
+    def request(self, shard, header, payload=b"", timeout=REQUEST_TIMEOUT):
+        """Ask *shard* and wait. Returns ``(reply_header, reply_payload)``.
+
+        Raises ConnectionError if the worker is unreachable (e.g. restarting)
+        and TimeoutError if it doesn't answer.
+        """
+        return self.link(shard).start_call(header, payload).wait(timeout)
+
+    def request_all(self, header, payload=b"", timeout=REQUEST_TIMEOUT, shards=None):
+        """Send *header* to every other worker (or *shards*, a dict of shard ->
+        header) at once. Returns {shard: (reply_header, reply_payload)} for
+        those that answered."""
+        targets = shards if shards is not None else {shard: header for shard in self.peers()}
+        calls = {}
+        for shard, shard_header in targets.items():
+            try:
+                calls[shard] = self.link(shard).start_call(dict(shard_header), payload)
+            except OSError as e:
+                logger.debug(f"Worker shard {shard} unreachable: {e}")
+        deadline = time.monotonic() + timeout
+        replies = {}
+        for shard, call in calls.items():
+            try:
+                replies[shard] = call.wait(max(0.0, deadline - time.monotonic()))
+            except OSError as e:
+                logger.warning(f"Worker shard {shard} failed to answer: {e}")
+        return replies
+
+    def send(self, shard, header, payload=b""):
+        """Send an event to *shard*: no reply, handled in order with earlier events."""
+        self.link(shard).send(header, payload)
+
+    def link(self, shard):
+        """The connection to *shard*, dialling it if needed."""
+        with self._lock:
+            link = self._links.get(shard)
+            if link is not None and not link.closed:
+                return link
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.socket_path(shard))
+            except OSError as e:
+                sock.close()
+                raise ConnectionError(f"worker shard {shard} unreachable: {e}") from e
+            link = self._links[shard] = Link(sock, self, peer=shard)
+            return link
+
+    # ── Internals ────────────────────────────────────────────────────────
+
+    def _accept(self, listener):
+        while True:
+            try:
+                sock, _ = listener.accept()
+            except OSError:
+                if self._listener is not listener:
+                    return  # stop()
+                raise
+            Link(sock, self)
+
+    def _dispatch(self, link, header, payload):
+        if "id" not in header:
+            self._serve(link, header, payload)  # Event: in order, on the reader thread
+        else:
+            self._executor.submit(self._serve, link, header, payload)
+
+    def _serve(self, link, header, payload):
+        request_id = header.get("id")
+        try:
+            result = self._handle(link, header, payload)
+        except Exception as e:
+            logger.exception(f"Worker request {header.get('op')} failed")
+            result = ({"error": str(e)}, b"")
+        if request_id is None:
+            return
+        reply, reply_payload = result if result is not None else ({}, b"")
+        try:
+            link.send({**reply, "re": request_id}, reply_payload)
+        except OSError as e:
+            logger.info(f"Could not answer worker request {header.get('op')}: {e}")
+
+    def _link_closed(self, link):
+        with self._lock:
+            if link.peer is not None and self._links.get(link.peer) is link:
+                del self._links[link.peer]
+        if self._on_link_closed is not None:
+            try:
+                self._on_link_closed(link)
+            except Exception:
+                logger.exception("Worker link cleanup failed")
@@ -0,0 +1,87 @@
+"""Binary Socket.IO frames for terminal I/O.
+
+The JSON events carry output as a decoded ``str``, which costs a UTF-8
+decode, JSON escaping (heavy for control-laden TUI output) and a re-encode
+per chunk. Binary frames carry raw PTY bytes behind a fixed header instead;
+xterm.js consumes the ``Uint8Array`` directly.
+
+Output (``terminal_output_bin``, server -> client), 12-byte header::
+
+    u8 type=OUTPUT | u8 flags | u16 session index | u64 offset | raw bytes
+
+``offset`` is the stream position of the first byte (``next_offset`` is
+``offset`` plus the uncompressed payload length); ``FLAG_GAP`` means output
+before it was evicted. With ``FLAG_DEFLATE`` the payload is raw deflate
+(what the browser's ``DecompressionStream('deflate-raw')`` reads); only
+payloads of at least ``COMPRESS_MIN_BYTES`` that actually shrink are sent
+that way, so keystroke echo is never delayed by compression.
+
+Input (``terminal_input``, client -> server), 4-byte header::
+
+    u8 type=INPUT | u8 flags (0) | u16 session index | UTF-8 bytes
+
+All integers are big-endian. The session index is a small per-process
+number handed out with the session, so frames don't repeat the UUID.
+"""
+
+import struct
+import zlib
+
+OUTPUT = 1
+INPUT = 2
+FLAG_GAP = 0x01
+FLAG_DEFLATE = 0x02
+COMPRESS_MIN_BYTES = 1024   # Smaller payloads aren't worth a compressor round-trip
+COMPRESS_LEVEL = 6
+MAX_SESSION_INDEX = 0xFFFF
+
+_OUTPUT_HEADER = struct.Struct(">BBHQ")
+_INPUT_HEADER = struct.Struct(">BBH")
+
+
+def deflate(data):
+    """Raw deflate (no zlib header), as DecompressionStream('deflate-raw') expects."""
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def pack_output(index, offset, data, gap=False, compress=False):
+    """Frame *data* (bytes) starting at stream *offset* for session *index*.
+
+    With *compress*, large payloads are deflated when that makes them smaller.
+    """
+    flags = FLAG_GAP if gap else 0
+    if compress and len(data) >= COMPRESS_MIN_BYTES:
+        packed = deflate(data)
+        if len(packed) < len(data):
+            flags |= FLAG_DEFLATE
+            data = packed
+    return _OUTPUT_HEADER.pack(OUTPUT, flags, index, offset) + data
+
+
+def unpack_output(frame):
+    """Inverse of ``pack_output``: ``(index, offset, data, gap)``."""
+    if len(frame) < _OUTPUT_HEADER.size:
+        raise ValueError("output frame too short")
+    kind, flags, index, offset = _OUTPUT_HEADER.unpack_from(frame)
+    if kind != OUTPUT:
+        raise ValueError(f"not an output frame (type {kind})")
+    data = bytes(frame[_OUTPUT_HEADER.size:])
+    if flags & FLAG_DEFLATE:
+        data = zlib.decompress(data, -zlib.MAX_WBITS)
+    return index, offset, data, bool(flags & FLAG_GAP)
+
+
+def pack_input(index, data):
+    """Frame keystroke bytes for session *index* (the client does this in JS)."""
+    return _INPUT_HEADER.pack(INPUT, 0, index) + data
+
+
+def unpack_input(frame):
+    """Parse a client input frame: ``(index, data)``. Raises ValueError if malformed."""
+    if len(frame) < _INPUT_HEADER.size:
+        raise ValueError("input frame too short")
+    kind, _, index = _INPUT_HEADER.unpack_from(frame)
+    if kind != INPUT:
+        raise ValueError(f"not an input frame (type {kind})")
+    return index, bytes(frame[_INPUT_HEADER.size:])